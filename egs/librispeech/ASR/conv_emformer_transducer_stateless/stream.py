@@ -52,6 +52,10 @@ class Stream(object):
             Tuple[List[List[torch.Tensor]], List[torch.Tensor]]
         ] = None
 
+        # The slot in the StreamingStatePool holding the states of this
+        # stream. It is used only when the states are kept in a pool.
+        self.slot: int = -1
+
         # It uses different attributes for different decoding methods.
         self.context_size = params.context_size
         self.decoding_method = params.decoding_method
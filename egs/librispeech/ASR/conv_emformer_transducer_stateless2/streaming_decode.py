@@ -80,7 +80,7 @@ import torch
 import torch.nn as nn
 from asr_datamodule import LibriSpeechAsrDataModule
 from beam_search import Hypothesis, HypothesisList, get_hyps_shape
-from emformer import LOG_EPSILON, stack_states, unstack_states
+from emformer import LOG_EPSILON, stack_states
 from kaldifeat import Fbank, FbankOptions
 from lhotse import CutSet
 from stream import Stream
@@ -94,6 +94,7 @@ from icefall.checkpoint import (
     load_checkpoint,
 )
 from icefall.decode import one_best_decoding
+from icefall.streaming_state_pool import StreamingStatePool
 from icefall.utils import (
     AttributeDict,
     get_texts,
@@ -240,6 +241,52 @@ def get_parser():
     return parser
 
 
+def get_init_states(
+    model: nn.Module,
+    batch_size: int = 1,
+    device: torch.device = torch.device("cpu"),
+) -> List[torch.Tensor]:
+    """Return the initial emformer states of a batch of utterances as a flat
+    list of tensors, which can be kept in a StreamingStatePool.
+    See :func:`flatten_states`.
+    """
+    states = stack_states([model.encoder.init_states(device)] * batch_size)
+    return flatten_states(states)
+
+
+def flatten_states(
+    states: Tuple[List[List[torch.Tensor]], List[torch.Tensor]]
+) -> List[torch.Tensor]:
+    """Flatten the emformer states of a batch of utterances.
+
+    Args:
+      states:
+        A tuple of 2 elements. See the input argument of :func:`unstack_states`
+        for its meaning.
+    Returns:
+      A list of tensors. The attention caches of all layers come first,
+      followed by the convolution caches of all layers.
+
+    Note:
+      It is the inverse of :func:`unflatten_states`.
+    """
+    attn_caches, conv_caches = states
+    return [s for layer in attn_caches for s in layer] + list(conv_caches)
+
+
+def unflatten_states(
+    states: List[torch.Tensor], num_layers: int
+) -> Tuple[List[List[torch.Tensor]], List[torch.Tensor]]:
+    """The inverse of :func:`flatten_states`."""
+    num_attn_caches = (len(states) - num_layers) // num_layers
+    attn_caches = [
+        states[i * num_attn_caches : (i + 1) * num_attn_caches]
+        for i in range(num_layers)
+    ]
+    conv_caches = states[num_layers * num_attn_caches :]
+    return [attn_caches, conv_caches]
+
+
 def greedy_search(
     model: nn.Module,
     encoder_out: torch.Tensor,
@@ -507,6 +554,7 @@ def decode_one_chunk(
     model: nn.Module,
     streams: List[Stream],
     params: AttributeDict,
+    state_pool: StreamingStatePool,
     decoding_graph: Optional[k2.Fsa] = None,
 ) -> List[int]:
     """
@@ -517,6 +565,9 @@ def decode_one_chunk(
         A list of Stream objects.
       params:
         It is returned by :func:`get_params`.
+      state_pool:
+        The pool keeping the flattened emformer states. streams[i].slot is
+        the slot of the i-th stream in it.
       decoding_graph:
         The decoding graph. Can be either a `k2.trivial_graph` or HLG, Used
         only when --decoding_method is fast_beam_search.
@@ -528,7 +579,7 @@ def decode_one_chunk(
 
     feature_list = []
     feature_len_list = []
-    state_list = []
+    slot_list = []
     num_processed_frames_list = []
 
     for stream in streams:
@@ -540,7 +591,7 @@ def decode_one_chunk(
         feature_len = feature.size(0)
         feature_list.append(feature)
         feature_len_list.append(feature_len)
-        state_list.append(stream.states)
+        slot_list.append(stream.slot)
 
     features = pad_sequence(
         feature_list, batch_first=True, padding_value=LOG_EPSILON
@@ -560,8 +611,11 @@ def decode_one_chunk(
             value=LOG_EPSILON,
         )
 
-    # Stack states of all streams
-    states = stack_states(state_list)
+    # Gather states of all streams
+    slots = torch.tensor(slot_list, device=device)
+    states = unflatten_states(
+        state_pool.gather(slots), num_layers=params.num_encoder_layers
+    )
 
     encoder_out, encoder_out_lens, states = model.encoder.infer(
         x=features,
@@ -599,9 +653,7 @@ def decode_one_chunk(
         raise ValueError(f"Unsupported decoding method: {params.decoding_method}")
 
     # Update cached states of each stream
-    state_list = unstack_states(states)
-    for i, s in enumerate(state_list):
-        streams[i].states = s
+    state_pool.scatter(slots, flatten_states(states))
 
     finished_streams = [i for i, stream in enumerate(streams) if stream.done]
     return finished_streams
@@ -662,6 +714,15 @@ def decode_dataset(
 
     fbank = create_streaming_feature_extractor()
 
+    # The states of all running streams are kept in preallocated tensors.
+    # A stream joining or leaving the batch only allocates or frees a slot.
+    state_pool = StreamingStatePool.from_init_states_func(
+        lambda batch_size: get_init_states(
+            model=model, batch_size=batch_size, device=device
+        ),
+        max_streams=params.num_decode_streams,
+    )
+
     decode_results = []
     streams = []
     for num, cut in enumerate(cuts):
@@ -674,7 +735,7 @@ def decode_dataset(
             LOG_EPS=LOG_EPSILON,
         )
 
-        stream.set_states(model.encoder.init_states(device))
+        stream.slot = state_pool.allocate()
 
         audio: np.ndarray = cut.load_audio()
         # audio.shape: (1, num_samples)
@@ -702,6 +763,7 @@ def decode_dataset(
                 model=model,
                 streams=streams,
                 params=params,
+                state_pool=state_pool,
                 decoding_graph=decoding_graph,
             )
 
@@ -713,6 +775,7 @@ def decode_dataset(
                         sp.decode(streams[i].decoding_result()).split(),
                     )
                 )
+                state_pool.free(streams[i].slot)
                 del streams[i]
 
         if num % log_interval == 0:
@@ -723,6 +786,7 @@ def decode_dataset(
             model=model,
             streams=streams,
             params=params,
+            state_pool=state_pool,
             decoding_graph=decoding_graph,
         )
 
@@ -734,6 +798,7 @@ def decode_dataset(
                     sp.decode(streams[i].decoding_result()).split(),
                 )
             )
+            state_pool.free(streams[i].slot)
             del streams[i]
 
     if params.decoding_method == "greedy_search":
@@ -11,6 +11,9 @@ set -eou pipefail
 # 1) Split long audios into chunks with overlaps.
 # 2) Perform speech recognition on chunks, getting tokens and timestamps.
 # 3) Merge the overlapped chunks into utterances acording to the timestamps.
+#
+# Alternatively, ./long_file_recog/recognize_long_file.py does stages 2-4 in
+# a single pass without writing the chunks to disk.
 
 # Each chunk (except the first and the last) is padded with extra left side and right side.
 # The chunk length is: left_side + chunk_size + right_side.
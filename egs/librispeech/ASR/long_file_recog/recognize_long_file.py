@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+# Copyright    2024  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script recognizes long recordings in a single pass. It replaces
+stages 2-4 of ../long_file_recog.sh, i.e., ./split_into_chunks.py,
+./recognize.py and ./merge_chunks.py, which write the chunks and their
+recognition results to disk before merging them.
+
+Each recording is read sequentially, only once, and split into chunks
+of --chunk seconds. Consecutive chunks overlap by 2 * --extra seconds.
+The chunks, possibly from different recordings, are decoded in batches
+of up to --max-duration seconds, while the audio of the next batch is
+read and its features are computed in a background thread. The results
+of each chunk are merged into its recording as soon as the chunk is
+decoded, and a recording is written to the output manifest as soon as
+its last chunk is merged. Only the current batches are kept in memory,
+so the memory usage does not depend on the duration of the recordings.
+
+In the overlap of two chunks, a token is usually decoded by both chunks.
+We look for a token decoded by both chunks at about the same time
+(within --overlap-tolerance seconds) and closest to the middle of the
+overlap, then keep the tokens up to it from the left chunk and the tokens
+after it from the right chunk. Unlike splitting the overlap at a fixed
+time, this does not duplicate or drop a token whose timestamp differs
+slightly between the two chunks. If there is no such token, the overlap
+is split at its middle as in ./merge_chunks.py.
+
+Usage:
+
+./long_file_recog/recognize_long_file.py \
+  --subset small \
+  --manifest-in-dir data/librilight/manifests \
+  --manifest-out-dir data/manifests \
+  --nn-model-filename long_file_recog/exp/jit_model.pt \
+  --bpe-model data/lang_bpe_500/bpe.model \
+  --chunk 30 \
+  --extra 2 \
+  --max-duration 600 \
+  --decoding-method greedy_search
+
+It writes data/manifests/librilight_cuts_small.jsonl.gz, which has the
+same format as the output of ./merge_chunks.py.
+"""
+
+import argparse
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import k2
+import numpy as np
+import sentencepiece as spm
+import soundfile as sf
+import torch
+from lhotse import (
+    CutSet,
+    Fbank,
+    FbankConfig,
+    MonoCut,
+    Recording,
+    SupervisionSegment,
+    load_manifest,
+    load_manifest_lazy,
+)
+from lhotse.supervision import AlignmentItem
+from lhotse.utils import LOG_EPSILON
+from recognize import decode_one_batch, get_params
+from torch.nn.utils.rnn import pad_sequence
+
+from icefall.utils import setup_logger
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--subset",
+        type=str,
+        default="small",
+        help="Subset to process. Possible values are 'small', 'medium', 'large'",
+    )
+
+    parser.add_argument(
+        "--manifest-in-dir",
+        type=Path,
+        default=Path("data/librilight/manifests"),
+        help="""Path to directory with librilight_recordings_{subset}.jsonl.gz
+        and librilight_supervisions_{subset}.jsonl.gz.""",
+    )
+
+    parser.add_argument(
+        "--manifest-out-dir",
+        type=Path,
+        default=Path("data/manifests"),
+        help="Path to directory to save the cuts with recognition results.",
+    )
+
+    parser.add_argument(
+        "--log-dir",
+        type=Path,
+        default=Path("long_file_recog/log"),
+        help="Path to directory to save logs.",
+    )
+
+    parser.add_argument(
+        "--nn-model-filename",
+        type=str,
+        required=True,
+        help="Path to the torchscript model cpu_jit.pt",
+    )
+
+    parser.add_argument(
+        "--bpe-model",
+        type=str,
+        default="data/lang_bpe_500/bpe.model",
+        help="Path to the BPE model",
+    )
+
+    parser.add_argument(
+        "--decoding-method",
+        type=str,
+        default="greedy_search",
+        help="""Possible values are:
+          - greedy_search
+          - modified_beam_search
+          - fast_beam_search
+        """,
+    )
+
+    parser.add_argument(
+        "--chunk",
+        type=float,
+        default=30.0,
+        help="""Duration (in seconds) of each chunk.""",
+    )
+
+    parser.add_argument(
+        "--extra",
+        type=float,
+        default=2.0,
+        help="""Extra duration (in seconds) at both sides.""",
+    )
+
+    parser.add_argument(
+        "--overlap-tolerance",
+        type=float,
+        default=0.2,
+        help="""Maximum difference (in seconds) between the timestamps of a
+        token decoded by two overlapping chunks to consider them the same
+        token.""",
+    )
+
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=600.0,
+        help="Maximum total duration (in seconds) of the chunks in a batch.",
+    )
+
+    return parser
+
+
+class Chunk:
+    """A chunk of a recording."""
+
+    def __init__(
+        self,
+        recording: Recording,
+        start: float,
+        samples: torch.Tensor,
+        is_last: bool,
+    ):
+        self.recording = recording
+        # Start time (in seconds) of the chunk within the recording
+        self.start = start
+        self.samples = samples
+        self.is_last = is_last
+
+    @property
+    def duration(self) -> float:
+        return self.samples.numel() / self.recording.sampling_rate
+
+
+def iter_chunks(recording: Recording, chunk: float, extra: float) -> Iterator[Chunk]:
+    """Read a recording sequentially and split it into chunks of `chunk`
+    seconds, where consecutive chunks overlap by `2 * extra` seconds.
+
+    The audio is read from disk only once. The overlap is kept in memory
+    and reused by the next chunk.
+    """
+    assert len(recording.sources) == 1, len(recording.sources)
+    assert recording.sources[0].type == "file", recording.sources[0].type
+
+    sampling_rate = recording.sampling_rate
+    chunk_samples = int(chunk * sampling_rate)
+    hop_samples = int((chunk - 2 * extra) * sampling_rate)
+    assert 0 < hop_samples <= chunk_samples, (chunk, extra)
+
+    start = 0
+    samples = np.zeros(0, dtype=np.float32)
+    with sf.SoundFile(recording.sources[0].source) as f:
+        assert f.samplerate == sampling_rate, (f.samplerate, sampling_rate)
+        while True:
+            new_samples = f.read(
+                chunk_samples - samples.size, dtype="float32", always_2d=True
+            )
+            # We use only the first channel
+            samples = np.concatenate([samples, new_samples[:, 0]])
+            is_last = f.tell() >= f.frames
+            yield Chunk(
+                recording=recording,
+                start=start / sampling_rate,
+                samples=torch.from_numpy(samples),
+                is_last=is_last,
+            )
+            if is_last:
+                break
+            samples = samples[hop_samples:]
+            start += hop_samples
+
+
+def iter_batches(
+    recordings: Iterator[Recording],
+    chunk: float,
+    extra: float,
+    max_duration: float,
+) -> Iterator[List[Chunk]]:
+    """Group the chunks of the given recordings, in order, into batches of
+    up to `max_duration` seconds."""
+    batch = []
+    duration = 0
+    for recording in recordings:
+        for c in iter_chunks(recording, chunk=chunk, extra=extra):
+            if batch and duration + c.duration > max_duration:
+                yield batch
+                batch = []
+                duration = 0
+            batch.append(c)
+            duration += c.duration
+    if batch:
+        yield batch
+
+
+def find_overlap_cut(
+    left: List[AlignmentItem],
+    right: List[AlignmentItem],
+    middle: float,
+    tolerance: float,
+) -> Tuple[int, int]:
+    """Decide where to switch from the left chunk to the right chunk in the
+    overlap of two chunks.
+
+    Args:
+      left:
+        Tokens decoded by the left chunk in the overlap, sorted by time.
+      right:
+        Tokens decoded by the right chunk in the overlap, sorted by time.
+      middle:
+        The middle of the overlap (in seconds).
+      tolerance:
+        Maximum time difference (in seconds) of the same token decoded by
+        the two chunks.
+    Returns:
+      Return a tuple (i, j), meaning that left[:i] and right[j:] are kept.
+    """
+    # Prefer tokens decoded at the same time by both chunks, then the one
+    # closest to the middle of the overlap
+    best = None
+    for i, a in enumerate(left):
+        for j, b in enumerate(right):
+            if a.symbol != b.symbol or abs(a.start - b.start) > tolerance:
+                continue
+            cost = (abs(a.start - b.start), abs(a.start - middle))
+            if best is None or cost < best[0]:
+                best = (cost, i, j)
+
+    if best is not None:
+        # Keep the matched token from the left chunk. Tokens from the right
+        # chunk that are not after it are dropped to keep the timestamps
+        # sorted.
+        i, j = best[1] + 1, best[2] + 1
+        while j < len(right) and right[j].start <= left[i - 1].start:
+            j += 1
+        return i, j
+
+    i = sum(1 for a in left if a.start < middle)
+    j = sum(1 for b in right if b.start < middle)
+    return i, j
+
+
+class OverlapMerger:
+    """Merge the tokens of the chunks of a recording incrementally.
+
+    The chunks have to be added in order. The tokens in the overlap with
+    the next chunk are kept pending until the next chunk is added.
+    """
+
+    def __init__(self, extra: float, tolerance: float):
+        self.extra = extra
+        self.tolerance = tolerance
+        self.alignment: List[AlignmentItem] = []
+        # Tokens of the last chunk in the overlap with the next chunk
+        self.pending: List[AlignmentItem] = []
+        # End time of the last chunk
+        self.last_end: Optional[float] = None
+
+    def add(self, chunk: Chunk, alignment: List[AlignmentItem]) -> None:
+        """
+        Args:
+          chunk:
+            The chunk.
+          alignment:
+            Tokens decoded from the chunk with timestamps relative to the
+            recording, sorted by time.
+        """
+        if self.last_end is not None:
+            assert chunk.start < self.last_end, (chunk.start, self.last_end)
+            overlap = [a for a in alignment if a.start < self.last_end]
+            i, j = find_overlap_cut(
+                left=self.pending,
+                right=overlap,
+                middle=(chunk.start + self.last_end) / 2,
+                tolerance=self.tolerance,
+            )
+            self.alignment.extend(self.pending[:i])
+            alignment = alignment[j:]
+
+        end = chunk.start + chunk.duration
+        if chunk.is_last:
+            self.alignment.extend(alignment)
+            self.pending = []
+        else:
+            next_start = end - 2 * self.extra
+            self.alignment.extend(a for a in alignment if a.start < next_start)
+            self.pending = [a for a in alignment if a.start >= next_start]
+        self.last_end = end
+
+
+def make_cut(
+    recording: Recording,
+    alignment: List[AlignmentItem],
+    supervision: SupervisionSegment,
+) -> MonoCut:
+    """Create a cut of the whole recording with the recognition results,
+    like ./merge_chunks.py does."""
+    new_sup = SupervisionSegment(
+        id=recording.id,
+        recording_id=recording.id,
+        start=0,
+        duration=recording.duration,
+        alignment={"symbol": alignment},
+        language=supervision.language,
+        speaker=supervision.speaker,
+    )
+
+    cut = MonoCut(
+        id=recording.id,
+        start=0,
+        duration=recording.duration,
+        channel=0,
+        recording=recording,
+        supervisions=[new_sup],
+    )
+    # Set a custom attribute to the cut
+    cut.text_path = supervision.book
+
+    return cut
+
+
+@torch.no_grad()
+def main():
+    args = get_parser().parse_args()
+
+    params = get_params()
+    params.update(vars(args))
+
+    setup_logger(f"{params.log_dir}/log-recognize-long-file")
+    logging.info("Decoding started")
+
+    assert params.decoding_method in (
+        "greedy_search",
+        "fast_beam_search",
+        "modified_beam_search",
+    ), params.decoding_method
+    assert params.extra > 0 and params.chunk > 2 * params.extra, (
+        params.chunk,
+        params.extra,
+    )
+
+    sp = spm.SentencePieceProcessor()
+    sp.load(params.bpe_model)
+
+    # <blk> is defined in local/train_bpe_model.py
+    params.blank_id = sp.piece_to_id("<blk>")
+    params.unk_id = sp.piece_to_id("<unk>")
+    params.vocab_size = sp.get_piece_size()
+
+    logging.info(f"{params}")
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+    logging.info(f"device: {device}")
+
+    logging.info("Loading jit model")
+    model = torch.jit.load(params.nn_model_filename)
+    model.to(device)
+    model.eval()
+
+    if params.decoding_method == "fast_beam_search":
+        decoding_graph = k2.trivial_graph(params.vocab_size - 1, device=device)
+    else:
+        decoding_graph = None
+
+    manifest_out = params.manifest_out_dir / f"librilight_cuts_{params.subset}.jsonl.gz"
+    if manifest_out.is_file():
+        logging.info(f"{manifest_out} already exists - skipping.")
+        return
+    params.manifest_out_dir.mkdir(parents=True, exist_ok=True)
+
+    # We will use the text path from supervisions
+    supervisions = load_manifest(
+        params.manifest_in_dir / f"librilight_supervisions_{params.subset}.jsonl.gz"
+    )
+    recordings = load_manifest_lazy(
+        params.manifest_in_dir / f"librilight_recordings_{params.subset}.jsonl.gz"
+    )
+
+    fbank = Fbank(FbankConfig(num_mel_bins=80, device=device))
+    batches = iter_batches(
+        recordings,
+        chunk=params.chunk,
+        extra=params.extra,
+        max_duration=params.max_duration,
+    )
+
+    def load_next_batch() -> Optional[Tuple[List[Chunk], dict]]:
+        chunks = next(batches, None)
+        if chunks is None:
+            return None
+        features = fbank.extract_batch(
+            [c.samples for c in chunks],
+            sampling_rate=chunks[0].recording.sampling_rate,
+        )
+        num_frames = torch.tensor([f.size(0) for f in features])
+        features = pad_sequence(features, batch_first=True, padding_value=LOG_EPSILON)
+        return chunks, {"inputs": features, "supervisions": {"num_frames": num_frames}}
+
+    cuts_writer = CutSet.open_writer(manifest_out, overwrite=True)
+    mergers: Dict[str, OverlapMerger] = {}
+    num_chunks = 0
+    num_recordings = 0
+    log_interval = 10
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Read the audio of the next batch while decoding the current one
+        future = executor.submit(load_next_batch)
+        for batch_idx in itertools.count():
+            loaded = future.result()
+            if loaded is None:
+                break
+            future = executor.submit(load_next_batch)
+            chunks, batch = loaded
+
+            hyps, timestamps, scores = decode_one_batch(
+                params=params,
+                model=model,
+                decoding_graph=decoding_graph,
+                batch=batch,
+            )
+
+            for c, symbol_list, time_list, score_list in zip(
+                chunks, hyps, timestamps, scores
+            ):
+                symbol_list = sp.id_to_piece(symbol_list)
+                alignment = [
+                    AlignmentItem(
+                        symbol=symbol, start=c.start + t, duration=None, score=score
+                    )
+                    for symbol, t, score in zip(symbol_list, time_list, score_list)
+                ]
+
+                rec_id = c.recording.id
+                if rec_id not in mergers:
+                    mergers[rec_id] = OverlapMerger(
+                        extra=params.extra, tolerance=params.overlap_tolerance
+                    )
+                mergers[rec_id].add(c, alignment)
+
+                if c.is_last:
+                    merger = mergers.pop(rec_id)
+                    cut = make_cut(c.recording, merger.alignment, supervisions[rec_id])
+                    cuts_writer.write(cut, flush=True)
+                    num_recordings += 1
+
+            num_chunks += len(chunks)
+            if batch_idx % log_interval == 0:
+                logging.info(
+                    f"Processed {num_chunks} chunks, {num_recordings} recordings"
+                )
+
+    cuts_writer.close()
+    assert len(mergers) == 0, list(mergers)
+    logging.info(f"{num_recordings} cuts saved to {manifest_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -54,6 +54,10 @@ class Stream(object):
         # Containing attention caches and convolution caches
         self.states: Optional[Tuple[torch.Tensor, torch.Tensor]] = None
 
+        # The slot in the StreamingStatePool holding the states of this
+        # stream. It is used only when the states are kept in a pool.
+        self.slot: int = -1
+
         # It uses different attributes for different decoding methods.
         self.context_size = params.context_size
         self.decoding_method = params.decoding_method
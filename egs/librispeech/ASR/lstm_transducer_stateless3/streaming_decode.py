@@ -70,7 +70,7 @@ from asr_datamodule import LibriSpeechAsrDataModule
 from beam_search import Hypothesis, HypothesisList, get_hyps_shape
 from kaldifeat import Fbank, FbankOptions
 from lhotse import CutSet
-from lstm import LOG_EPSILON, stack_states, unstack_states
+from lstm import LOG_EPSILON
 from stream import Stream
 from torch.nn.utils.rnn import pad_sequence
 from train import add_model_arguments, get_params, get_transducer_model
@@ -82,6 +82,7 @@ from icefall.checkpoint import (
     load_checkpoint,
 )
 from icefall.decode import one_best_decoding
+from icefall.streaming_state_pool import StreamingStatePool
 from icefall.utils import (
     AttributeDict,
     get_texts,
@@ -495,6 +496,7 @@ def decode_one_chunk(
     model: nn.Module,
     streams: List[Stream],
     params: AttributeDict,
+    state_pool: StreamingStatePool,
     decoding_graph: Optional[k2.Fsa] = None,
 ) -> List[int]:
     """
@@ -505,6 +507,9 @@ def decode_one_chunk(
         A list of Stream objects.
       params:
         It is returned by :func:`get_params`.
+      state_pool:
+        The pool keeping the lstm states. streams[i].slot is the slot of
+        the i-th stream in it.
       decoding_graph:
         The decoding graph. Can be either a `k2.trivial_graph` or LG, Used
         only when --decoding_method is fast_beam_search.
@@ -516,7 +521,7 @@ def decode_one_chunk(
 
     feature_list = []
     feature_len_list = []
-    state_list = []
+    slot_list = []
     num_processed_frames_list = []
 
     for stream in streams:
@@ -528,7 +533,7 @@ def decode_one_chunk(
         feature_len = feature.size(0)
         feature_list.append(feature)
         feature_len_list.append(feature_len)
-        state_list.append(stream.states)
+        slot_list.append(stream.slot)
 
     features = pad_sequence(
         feature_list, batch_first=True, padding_value=LOG_EPSILON
@@ -548,8 +553,9 @@ def decode_one_chunk(
             value=LOG_EPSILON,
         )
 
-    # Stack states of all streams
-    states = stack_states(state_list)
+    # Gather states of all streams
+    slots = torch.tensor(slot_list, device=device)
+    states = tuple(state_pool.gather(slots))
 
     encoder_out, encoder_out_lens, states = model.encoder(
         x=features,
@@ -591,9 +597,7 @@ def decode_one_chunk(
         raise ValueError(f"Unsupported decoding method: {params.decoding_method}")
 
     # Update cached states of each stream
-    state_list = unstack_states(states)
-    for i, s in enumerate(state_list):
-        streams[i].states = s
+    state_pool.scatter(slots, list(states))
 
     finished_streams = [i for i, stream in enumerate(streams) if stream.done]
     return finished_streams
@@ -654,6 +658,15 @@ def decode_dataset(
 
     fbank = create_streaming_feature_extractor()
 
+    # The states of all running streams are kept in preallocated tensors.
+    # A stream joining or leaving the batch only allocates or frees a slot.
+    state_pool = StreamingStatePool.from_init_states_func(
+        lambda batch_size: list(
+            model.encoder.get_init_states(batch_size=batch_size, device=device)
+        ),
+        max_streams=params.num_decode_streams,
+    )
+
     decode_results = []
     streams = []
     for num, cut in enumerate(cuts):
@@ -666,7 +679,7 @@ def decode_dataset(
             LOG_EPS=LOG_EPSILON,
         )
 
-        stream.states = model.encoder.get_init_states(device=device)
+        stream.slot = state_pool.allocate()
 
         audio: np.ndarray = cut.load_audio()
         # audio.shape: (1, num_samples)
@@ -694,6 +707,7 @@ def decode_dataset(
                 model=model,
                 streams=streams,
                 params=params,
+                state_pool=state_pool,
                 decoding_graph=decoding_graph,
             )
 
@@ -705,6 +719,7 @@ def decode_dataset(
                         sp.decode(streams[i].decoding_result()).split(),
                     )
                 )
+                state_pool.free(streams[i].slot)
                 del streams[i]
 
         if num % log_interval == 0:
@@ -715,6 +730,7 @@ def decode_dataset(
             model=model,
             streams=streams,
             params=params,
+            state_pool=state_pool,
             decoding_graph=decoding_graph,
         )
 
@@ -726,6 +742,7 @@ def decode_dataset(
                     sp.decode(streams[i].decoding_result()).split(),
                 )
             )
+            state_pool.free(streams[i].slot)
             del streams[i]
 
     if params.decoding_method == "greedy_search":
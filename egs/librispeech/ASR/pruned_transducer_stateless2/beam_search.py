@@ -17,7 +17,7 @@
 
 import math
 import warnings
-from dataclasses import dataclass, field
+from collections import OrderedDict
 from typing import Dict, List, Optional, Tuple, Union
 
 import k2
@@ -25,7 +25,15 @@ import sentencepiece as spm
 import torch
 from torch import nn
 
-from icefall import ContextGraph, ContextState, NgramLm, NgramLmStateCost
+from icefall import (
+    CompiledContextGraph,
+    CompiledNgramLm,
+    CompiledNgramLmStateCost,
+    ContextGraph,
+    ContextState,
+    NgramLm,
+    NgramLmStateCost,
+)
 from icefall.decode import Nbest, one_best_decoding
 from icefall.lm_wrapper import LmScorer
 from icefall.rnn_lm.model import RnnLmModel
@@ -552,6 +560,273 @@ def fast_beam_search(
     return lattice
 
 
+class DecoderOutCache(object):
+    """A bounded cache of the projected decoder output, keyed on the
+    decoder context, i.e., the last `context_size` tokens of a hypothesis.
+
+    For a stateless decoder, the decoder output depends only on the last
+    `context_size` tokens, which do not change for hypotheses extended with
+    blanks. Caching it saves most of the decoder forward passes
+    during the search.
+
+    The cached values are kept in a single preallocated tensor with one
+    row per entry. When the cache is full, the least recently used entry
+    is evicted.
+
+    Usage::
+
+        decoder_out_cache = DecoderOutCache(model, max_size=10000)
+        # decoder_out is of shape (num_hyps, 1, joiner_dim)
+        decoder_out = decoder_out_cache([[-1, 0], [3, 5], [-1, 0]])
+        logging.info(f"decoder_out_cache: {decoder_out_cache}")
+
+    Note:
+      The cache is valid only for a fixed model. Call :meth:`clear` if
+      the model parameters change.
+    """
+
+    def __init__(self, model: nn.Module, max_size: int = 10000) -> None:
+        """
+        Args:
+          model:
+            The transducer model. It must have attributes `decoder` and
+            `joiner`.
+          max_size:
+            The maximum number of decoder contexts to cache.
+        """
+        assert max_size > 0, max_size
+        self.model = model
+        self.max_size = max_size
+
+        # Map a decoder context to a row in self._decoder_out.
+        # Its order is the order of use, the most recently used is the last.
+        self._slots: "OrderedDict[Tuple[int, ...], int]" = OrderedDict()
+
+        # Allocated on the first call, since we don't know joiner_dim
+        # and the dtype of the decoder output in advance.
+        self._decoder_out: Optional[torch.Tensor] = None
+
+        # Number of rows in the queries
+        self.num_queries = 0
+
+        # Number of decoder contexts that are fed to the decoder
+        self.num_computed = 0
+
+    @property
+    def num_hits(self) -> int:
+        """Number of decoder outputs that are not computed by the decoder."""
+        return self.num_queries - self.num_computed
+
+    @property
+    def hit_rate(self) -> float:
+        return self.num_hits / max(self.num_queries, 1)
+
+    def clear(self) -> None:
+        """Remove all cached entries. The counters are kept."""
+        self._slots.clear()
+
+    def reset_stats(self) -> None:
+        self.num_queries = 0
+        self.num_computed = 0
+
+    def _compute(self, contexts: List[Tuple[int, ...]]) -> torch.Tensor:
+        device = next(self.model.parameters()).device
+        decoder_input = torch.tensor(contexts, device=device, dtype=torch.int64)
+        decoder_out = self.model.decoder(decoder_input, need_pad=False)
+        decoder_out = self.model.joiner.decoder_proj(decoder_out)
+        # decoder_out is of shape (len(contexts), 1, joiner_dim)
+        self.num_computed += len(contexts)
+        return decoder_out.squeeze(1)
+
+    def __call__(self, contexts: Union[List[List[int]], torch.Tensor]) -> torch.Tensor:
+        """Return the projected decoder output of the given contexts.
+
+        Args:
+          contexts:
+            A list of decoder contexts or a 2-D tensor of shape
+            (num_hyps, context_size).
+        Returns:
+          Return a tensor of shape (num_hyps, 1, joiner_dim), which is the
+          same as `model.joiner.decoder_proj(model.decoder(contexts))`.
+        """
+        if isinstance(contexts, torch.Tensor):
+            contexts = contexts.tolist()
+        keys = [tuple(c) for c in contexts]
+        self.num_queries += len(keys)
+
+        unique_keys = list(dict.fromkeys(keys))
+        if len(unique_keys) > self.max_size:
+            # The cache cannot hold them all, so skip it
+            ans = self._compute(unique_keys)
+            index = {k: i for i, k in enumerate(unique_keys)}
+            rows = torch.tensor([index[k] for k in keys], device=ans.device)
+            return ans.index_select(0, rows).unsqueeze(1)
+
+        missing = []
+        for k in unique_keys:
+            if k in self._slots:
+                self._slots.move_to_end(k)
+            else:
+                missing.append(k)
+
+        if missing:
+            decoder_out = self._compute(missing)
+            if self._decoder_out is None:
+                self._decoder_out = decoder_out.new_zeros(
+                    self.max_size, decoder_out.size(-1)
+                )
+
+            slots = []
+            for k in missing:
+                if len(self._slots) < self.max_size:
+                    slot = len(self._slots)
+                else:
+                    # Entries of the current query were just moved to
+                    # the end, so they are never evicted here.
+                    _, slot = self._slots.popitem(last=False)
+                self._slots[k] = slot
+                slots.append(slot)
+
+            slots = torch.tensor(slots, device=decoder_out.device)
+            self._decoder_out.index_copy_(
+                0, slots, decoder_out.to(self._decoder_out.dtype)
+            )
+
+        rows = torch.tensor(
+            [self._slots[k] for k in keys], device=self._decoder_out.device
+        )
+        return self._decoder_out.index_select(0, rows).unsqueeze(1)
+
+    def __str__(self) -> str:
+        return (
+            f"queries: {self.num_queries}, "
+            f"computed: {self.num_computed}, "
+            f"hits: {self.num_hits}, "
+            f"hit rate: {self.hit_rate:.4f}, "
+            f"size: {len(self._slots)}/{self.max_size}"
+        )
+
+
+class BlankFrameSkipper(object):
+    """Drop the encoder frames on which the CTC head of the model is
+    confident that the output is blank.
+
+    Most encoder frames produce only a blank, yet the transducer search
+    runs the joiner on each of them. If the model is trained with a CTC
+    head, i.e., `--use-ctc 1`, we can remove the frames whose CTC blank
+    probability is larger than `blank_threshold` before the search. The
+    remaining frames are moved to the front, so the result can be passed
+    to any search method that accepts `encoder_out_lens`.
+
+    Usage::
+
+        skipper = BlankFrameSkipper(model, blank_threshold=0.95)
+        encoder_out, encoder_out_lens, frame_indexes = skipper(
+            encoder_out, encoder_out_lens
+        )
+        hyp_tokens = greedy_search_batch(model, encoder_out, encoder_out_lens)
+        logging.info(f"blank frame skipper: {skipper}")
+    """
+
+    def __init__(
+        self, model: nn.Module, blank_threshold: float, blank_id: int = 0
+    ) -> None:
+        """
+        Args:
+          model:
+            The transducer model. It must have an attribute `ctc_output`
+            that maps the encoder output to log-probs.
+          blank_threshold:
+            Frames whose CTC blank probability is larger than it are
+            dropped. It must be in the range (0, 1].
+          blank_id:
+            The ID of the blank symbol.
+        """
+        assert 0 < blank_threshold <= 1, blank_threshold
+        assert (
+            getattr(model, "ctc_output", None) is not None
+        ), "The model has no CTC head. Please train it with --use-ctc 1"
+        self.model = model
+        self.blank_threshold = blank_threshold
+        self.log_blank_threshold = math.log(blank_threshold)
+        self.blank_id = blank_id
+
+        # Number of valid encoder frames in the input
+        self.num_frames = 0
+
+        # Number of encoder frames passed to the search
+        self.num_kept_frames = 0
+
+    @property
+    def skip_rate(self) -> float:
+        """Fraction of the encoder frames that are dropped."""
+        return 1 - self.num_kept_frames / max(self.num_frames, 1)
+
+    def reset_stats(self) -> None:
+        self.num_frames = 0
+        self.num_kept_frames = 0
+
+    def __call__(
+        self, encoder_out: torch.Tensor, encoder_out_lens: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Args:
+          encoder_out:
+            Output from the encoder, before `model.joiner.encoder_proj`.
+            Its shape is (N, T, C).
+          encoder_out_lens:
+            A 1-D tensor of shape (N,), containing number of valid frames in
+            encoder_out before padding.
+        Returns:
+          Return a tuple containing:
+            - The kept frames, moved to the front. Its shape is (N, T', C),
+              where T' is the maximum number of kept frames of an utterance.
+            - A 1-D tensor of shape (N,), the number of kept frames.
+            - A 2-D tensor of shape (N, T'). Entry [i, t] is the index in the
+              input of frame t of utterance i. It can be used to map the
+              timestamps of the search results back to the input frames.
+
+          At least one frame of each non-empty utterance, the one with the
+          smallest blank probability, is kept.
+        """
+        assert encoder_out.ndim == 3, encoder_out.shape
+        N, T, C = encoder_out.shape
+
+        # (N, T)
+        blank_log_probs = self.model.ctc_output(encoder_out)[:, :, self.blank_id]
+
+        t = torch.arange(T, device=encoder_out.device)
+        valid = t < encoder_out_lens.unsqueeze(1)
+        blank_log_probs = blank_log_probs.masked_fill(~valid, float("inf"))
+
+        keep = blank_log_probs <= self.log_blank_threshold
+        best = blank_log_probs.argmin(dim=1, keepdim=True)
+        keep.scatter_(1, best, keep.gather(1, best) | valid.gather(1, best))
+
+        kept_lens = keep.sum(dim=1)
+        max_len = max(int(kept_lens.max().item()), 1) if N > 0 else 1
+
+        # Kept frames come first, in their original order.
+        frame_indexes = torch.where(keep, t, t + T).argsort(dim=1)[:, :max_len]
+
+        encoder_out = torch.gather(
+            encoder_out, dim=1, index=frame_indexes.unsqueeze(2).expand(N, max_len, C)
+        )
+
+        self.num_frames += int(encoder_out_lens.sum().item())
+        self.num_kept_frames += int(kept_lens.sum().item())
+
+        return encoder_out, kept_lens, frame_indexes
+
+    def __str__(self) -> str:
+        return (
+            f"blank threshold: {self.blank_threshold}, "
+            f"frames: {self.num_frames}, "
+            f"kept: {self.num_kept_frames}, "
+            f"skip rate: {self.skip_rate:.4f}"
+        )
+
+
 def greedy_search(
     model: nn.Module,
     encoder_out: torch.Tensor,
@@ -662,6 +937,7 @@ def greedy_search_batch(
     encoder_out_lens: torch.Tensor,
     blank_penalty: float = 0,
     return_timestamps: bool = False,
+    decoder_out_cache: Optional[DecoderOutCache] = None,
 ) -> Union[List[List[int]], DecodingResults]:
     """Greedy search in batch mode. It hardcodes --max-sym-per-frame=1.
     Args:
@@ -674,6 +950,8 @@ def greedy_search_batch(
         encoder_out before padding.
       return_timestamps:
         Whether to return timestamps.
+      decoder_out_cache:
+        If not None, use it to compute the decoder output.
     Returns:
       If return_timestamps is False, return the decoded result.
       Else, return a DecodingResults object containing
@@ -708,14 +986,17 @@ def greedy_search_batch(
     # scores[n][i] is the logits on which hyp[n][i] is decoded
     scores = [[] for _ in range(N)]
 
-    decoder_input = torch.tensor(
-        hyps,
-        device=device,
-        dtype=torch.int64,
-    )  # (N, context_size)
+    if decoder_out_cache is not None:
+        decoder_out = decoder_out_cache(hyps)
+    else:
+        decoder_input = torch.tensor(
+            hyps,
+            device=device,
+            dtype=torch.int64,
+        )  # (N, context_size)
 
-    decoder_out = model.decoder(decoder_input, need_pad=False)
-    decoder_out = model.joiner.decoder_proj(decoder_out)
+        decoder_out = model.decoder(decoder_input, need_pad=False)
+        decoder_out = model.joiner.decoder_proj(decoder_out)
     # decoder_out: (N, 1, decoder_out_dim)
 
     encoder_out = model.joiner.encoder_proj(packed_encoder_out.data)
@@ -753,13 +1034,16 @@ def greedy_search_batch(
         if emitted:
             # update decoder output
             decoder_input = [h[-context_size:] for h in hyps[:batch_size]]
-            decoder_input = torch.tensor(
-                decoder_input,
-                device=device,
-                dtype=torch.int64,
-            )
-            decoder_out = model.decoder(decoder_input, need_pad=False)
-            decoder_out = model.joiner.decoder_proj(decoder_out)
+            if decoder_out_cache is not None:
+                decoder_out = decoder_out_cache(decoder_input)
+            else:
+                decoder_input = torch.tensor(
+                    decoder_input,
+                    device=device,
+                    dtype=torch.int64,
+                )
+                decoder_out = model.decoder(decoder_input, need_pad=False)
+                decoder_out = model.joiner.decoder_proj(decoder_out)
 
     sorted_ans = [h[context_size:] for h in hyps]
     ans = []
@@ -781,44 +1065,110 @@ def greedy_search_batch(
         )
 
 
-@dataclass
-class Hypothesis:
-    # The predicted tokens so far.
-    # Newly predicted tokens are appended to `ys`.
-    ys: List[int]
+# Parameters of the polynomial rolling hash of `Hypothesis.ys`
+_HASH_BASE = 1000003
+_HASH_MOD = (1 << 61) - 1
 
-    # The log prob of ys.
-    # It contains only one entry.
-    log_prob: torch.Tensor
 
-    ac_probs: Optional[List[float]] = None
+def _log_add(a: float, b: float) -> float:
+    """Return log(exp(a) + exp(b))."""
+    if a < b:
+        a, b = b, a
+    if b == float("-inf"):
+        return a
+    return a + math.log1p(math.exp(b - a))
 
-    # timestamp[i] is the frame index after subsampling
-    # on which ys[i] is decoded
-    timestamp: List[int] = field(default_factory=list)
 
-    # the lm score for next token given the current ys
-    lm_score: Optional[torch.Tensor] = None
+class Hypothesis(object):
+    """A hypothesis of the transducer beam search.
 
-    # the RNNLM states (h and c in LSTM)
-    state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None
+    Many hypotheses are created for each frame, so it uses __slots__.
+    Its key is a rolling hash of `ys`. A hypothesis that extends another one
+    by a token can be given `key=hyp.extend_key(token)`, which takes O(1)
+    time. Otherwise, the key is computed from `ys` on first use.
 
-    # N-gram LM state
-    state_cost: Optional[NgramLmStateCost] = None
+    Caution:
+      `ys` must not be changed after the hypothesis is created since its key
+      is not updated. It is thus safe to share `ys` and `timestamp` with the
+      hypothesis that is extended by a blank.
+    """
 
-    # Context graph state
-    context_state: Optional[ContextState] = None
+    __slots__ = (
+        "ys",
+        "log_prob",
+        "ac_probs",
+        "timestamp",
+        "lm_score",
+        "state",
+        "state_cost",
+        "context_state",
+        "num_tailing_blanks",
+        "_key",
+    )
 
-    num_tailing_blanks: int = 0
+    def __init__(
+        self,
+        ys: List[int],
+        log_prob: Union[float, torch.Tensor],
+        ac_probs: Optional[List[float]] = None,
+        timestamp: Optional[List[int]] = None,
+        lm_score: Optional[torch.Tensor] = None,
+        state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+        state_cost: Optional[Union[NgramLmStateCost, CompiledNgramLmStateCost]] = None,
+        context_state: Optional[Union[ContextState, int]] = None,
+        num_tailing_blanks: int = 0,
+        key: Optional[int] = None,
+    ) -> None:
+        # The predicted tokens so far.
+        self.ys = ys
+
+        # The log prob of ys. It is either a float or
+        # a tensor containing only one entry.
+        self.log_prob = log_prob
+
+        self.ac_probs = ac_probs
+
+        # timestamp[i] is the frame index after subsampling
+        # on which ys[i] is decoded
+        self.timestamp = [] if timestamp is None else timestamp
+
+        # the lm score for next token given the current ys
+        self.lm_score = lm_score
+
+        # the RNNLM states (h and c in LSTM)
+        self.state = state
+
+        # N-gram LM state
+        self.state_cost = state_cost
+
+        # Context graph state. It is an int if CompiledContextGraph is used.
+        self.context_state = context_state
+
+        self.num_tailing_blanks = num_tailing_blanks
+
+        self._key = key
 
     @property
-    def key(self) -> str:
-        """Return a string representation of self.ys"""
-        return "_".join(map(str, self.ys))
+    def key(self) -> int:
+        """Return a hash of self.ys"""
+        if self._key is None:
+            h = 0
+            for y in self.ys:
+                # y + 2 since the padded context contains -1
+                h = (h * _HASH_BASE + y + 2) % _HASH_MOD
+            self._key = h
+        return self._key
+
+    def extend_key(self, token: int) -> int:
+        """Return the key of `self.ys + [token]` in O(1) time."""
+        return (self.key * _HASH_BASE + token + 2) % _HASH_MOD
+
+    def __repr__(self) -> str:
+        return f"Hypothesis(ys={self.ys}, log_prob={self.log_prob})"
 
 
 class HypothesisList(object):
-    def __init__(self, data: Optional[Dict[str, Hypothesis]] = None) -> None:
+    def __init__(self, data: Optional[Dict[int, Hypothesis]] = None) -> None:
         """
         Args:
           data:
@@ -830,7 +1180,7 @@ class HypothesisList(object):
             self._data = data
 
     @property
-    def data(self) -> Dict[str, Hypothesis]:
+    def data(self) -> Dict[int, Hypothesis]:
         return self._data
 
     def add(self, hyp: Hypothesis) -> None:
@@ -844,11 +1194,13 @@ class HypothesisList(object):
             The hypothesis to be added.
         """
         key = hyp.key
-        if key in self:
-            old_hyp = self._data[key]  # shallow copy
+        old_hyp = self._data.get(key)  # shallow copy
+        if old_hyp is None:
+            self._data[key] = hyp
+        elif isinstance(old_hyp.log_prob, torch.Tensor):
             torch.logaddexp(old_hyp.log_prob, hyp.log_prob, out=old_hyp.log_prob)
         else:
-            self._data[key] = hyp
+            old_hyp.log_prob = _log_add(old_hyp.log_prob, float(hyp.log_prob))
 
     def get_most_probable(self, length_norm: bool = False) -> Hypothesis:
         """Get the most probable hypothesis, i.e., the one with
@@ -918,7 +1270,7 @@ class HypothesisList(object):
         ans = HypothesisList(dict(hyps))
         return ans
 
-    def __contains__(self, key: str):
+    def __contains__(self, key: int):
         return key in self._data
 
     def __iter__(self):
@@ -929,8 +1281,8 @@ class HypothesisList(object):
 
     def __str__(self) -> str:
         s = []
-        for key in self:
-            s.append(key)
+        for hyp in self:
+            s.append("_".join(map(str, hyp.ys)))
         return ", ".join(s)
 
 
@@ -1017,7 +1369,7 @@ def keywords_search(
         B[i].add(
             Hypothesis(
                 ys=[-1] * (context_size - 1) + [blank_id],
-                log_prob=torch.zeros(1, dtype=torch.float32, device=device),
+                log_prob=0.0,
                 context_state=keywords_graph.root,
                 timestamp=[],
                 ac_probs=[],
@@ -1046,8 +1398,8 @@ def keywords_search(
 
         B = [HypothesisList() for _ in range(batch_size)]
 
-        ys_log_probs = torch.cat(
-            [hyp.log_prob.reshape(1, 1) for hyps in A for hyp in hyps]
+        ys_log_probs = torch.tensor(
+            [[hyp.log_prob] for hyps in A for hyp in hyps], device=device
         )  # (num_hyps, 1)
 
         decoder_input = torch.tensor(
@@ -1106,21 +1458,21 @@ def keywords_search(
                 warnings.simplefilter("ignore")
                 topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
                 topk_token_indexes = (topk_indexes % vocab_size).tolist()
+            topk_indexes = topk_indexes.tolist()
+            topk_log_probs = topk_log_probs.tolist()
 
             for k in range(len(topk_hyp_indexes)):
                 hyp_idx = topk_hyp_indexes[k]
                 hyp = A[i][hyp_idx]
-                new_ys = hyp.ys[:]
                 new_token = topk_token_indexes[k]
-                new_timestamp = hyp.timestamp[:]
-                new_ac_probs = hyp.ac_probs[:]
                 context_score = 0
                 new_context_state = hyp.context_state
                 new_num_tailing_blanks = hyp.num_tailing_blanks + 1
                 if new_token not in (blank_id, unk_id):
-                    new_ys.append(new_token)
-                    new_timestamp.append(t)
-                    new_ac_probs.append(hyp_probs[topk_indexes[k]])
+                    new_ys = hyp.ys + [new_token]
+                    new_timestamp = hyp.timestamp + [t]
+                    new_ac_probs = hyp.ac_probs + [hyp_probs[topk_indexes[k]]]
+                    new_key = hyp.extend_key(new_token)
                     (
                         context_score,
                         new_context_state,
@@ -1129,6 +1481,13 @@ def keywords_search(
                     new_num_tailing_blanks = 0
                     if new_context_state.token == -1:  # root
                         new_ys[-context_size:] = [-1] * (context_size - 1) + [blank_id]
+                        new_key = None
+                else:
+                    # ys is not changed, so it is shared with hyp
+                    new_ys = hyp.ys
+                    new_timestamp = hyp.timestamp
+                    new_ac_probs = hyp.ac_probs
+                    new_key = hyp.key
 
                 new_log_prob = topk_log_probs[k] + context_score
 
@@ -1139,6 +1498,7 @@ def keywords_search(
                     ac_probs=new_ac_probs,
                     context_state=new_context_state,
                     num_tailing_blanks=new_num_tailing_blanks,
+                    key=new_key,
                 )
                 B[i].add(new_hyp)
 
@@ -1163,7 +1523,7 @@ def keywords_search(
                 B[i].add(
                     Hypothesis(
                         ys=[-1] * (context_size - 1) + [blank_id],
-                        log_prob=torch.zeros(1, dtype=torch.float32, device=device),
+                        log_prob=0.0,
                         context_state=keywords_graph.root,
                         timestamp=[],
                         ac_probs=[],
@@ -1194,15 +1554,82 @@ def keywords_search(
     return ans
 
 
+def _modified_beam_search_step_compiled(
+    A: List[List[Hypothesis]],
+    B: List[HypothesisList],
+    t: int,
+    ragged_log_probs: k2.RaggedTensor,
+    vocab_size: int,
+    beam: int,
+    context_graph: CompiledContextGraph,
+    blank_id: int,
+    unk_id: int,
+) -> None:
+    """One step of :func:`modified_beam_search` with a CompiledContextGraph.
+
+    The context states of all the expanded hypotheses are advanced with a
+    single call of :meth:`CompiledContextGraph.forward`. The new hypotheses
+    are added to `B` in place.
+    """
+    candidates = []
+    for i in range(len(B)):
+        topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
+            topk_token_indexes = (topk_indexes % vocab_size).tolist()
+
+        topk_log_probs = topk_log_probs.tolist()
+
+        for k in range(len(topk_hyp_indexes)):
+            hyp = A[i][topk_hyp_indexes[k]]
+            candidates.append((i, hyp, topk_token_indexes[k], topk_log_probs[k]))
+
+    emitted = [c for c in candidates if c[2] not in (blank_id, unk_id)]
+    context_scores, context_states, _ = context_graph.forward(
+        [hyp.context_state for _, hyp, _, _ in emitted],
+        [new_token for _, _, new_token, _ in emitted],
+    )
+    context_scores = context_scores.tolist()
+    context_states = context_states.tolist()
+
+    count = 0
+    for i, hyp, new_token, new_log_prob in candidates:
+        if new_token not in (blank_id, unk_id):
+            new_ys = hyp.ys + [new_token]
+            new_timestamp = hyp.timestamp + [t]
+            new_key = hyp.extend_key(new_token)
+            new_log_prob = new_log_prob + context_scores[count]
+            new_context_state = context_states[count]
+            count += 1
+        else:
+            new_ys = hyp.ys
+            new_timestamp = hyp.timestamp
+            new_key = hyp.key
+            new_context_state = hyp.context_state
+
+        B[i].add(
+            Hypothesis(
+                ys=new_ys,
+                log_prob=new_log_prob,
+                timestamp=new_timestamp,
+                context_state=new_context_state,
+                key=new_key,
+            )
+        )
+
+
 def modified_beam_search(
     model: nn.Module,
     encoder_out: torch.Tensor,
     encoder_out_lens: torch.Tensor,
-    context_graph: Optional[ContextGraph] = None,
+    context_graph: Optional[Union[ContextGraph, CompiledContextGraph]] = None,
     beam: int = 4,
     temperature: float = 1.0,
     blank_penalty: float = 0.0,
     return_timestamps: bool = False,
+    decoder_out_cache: Optional[DecoderOutCache] = None,
 ) -> Union[List[List[int]], DecodingResults]:
     """Beam search in batch mode with --max-sym-per-frame=1 being hardcoded.
 
@@ -1214,12 +1641,18 @@ def modified_beam_search(
       encoder_out_lens:
         A 1-D tensor of shape (N,), containing number of valid frames in
         encoder_out before padding.
+      context_graph:
+        If not None, it is used for context biasing. If it is a
+        CompiledContextGraph, the context states of all the hypotheses
+        of a frame are advanced at the same time.
       beam:
         Number of active paths during the beam search.
       temperature:
         Softmax temperature.
       return_timestamps:
         Whether to return timestamps.
+      decoder_out_cache:
+        If not None, use it to compute the decoder output.
     Returns:
       If return_timestamps is False, return the decoded result.
       Else, return a DecodingResults object containing
@@ -1250,7 +1683,7 @@ def modified_beam_search(
         B[i].add(
             Hypothesis(
                 ys=[-1] * (context_size - 1) + [blank_id],
-                log_prob=torch.zeros(1, dtype=torch.float32, device=device),
+                log_prob=0.0,
                 context_state=None if context_graph is None else context_graph.root,
                 timestamp=[],
             )
@@ -1277,18 +1710,23 @@ def modified_beam_search(
 
         B = [HypothesisList() for _ in range(batch_size)]
 
-        ys_log_probs = torch.cat(
-            [hyp.log_prob.reshape(1, 1) for hyps in A for hyp in hyps]
+        ys_log_probs = torch.tensor(
+            [[hyp.log_prob] for hyps in A for hyp in hyps], device=device
         )  # (num_hyps, 1)
 
-        decoder_input = torch.tensor(
-            [hyp.ys[-context_size:] for hyps in A for hyp in hyps],
-            device=device,
-            dtype=torch.int64,
-        )  # (num_hyps, context_size)
+        if decoder_out_cache is not None:
+            decoder_out = decoder_out_cache(
+                [hyp.ys[-context_size:] for hyps in A for hyp in hyps]
+            ).unsqueeze(1)
+        else:
+            decoder_input = torch.tensor(
+                [hyp.ys[-context_size:] for hyps in A for hyp in hyps],
+                device=device,
+                dtype=torch.int64,
+            )  # (num_hyps, context_size)
 
-        decoder_out = model.decoder(decoder_input, need_pad=False).unsqueeze(1)
-        decoder_out = model.joiner.decoder_proj(decoder_out)
+            decoder_out = model.decoder(decoder_input, need_pad=False).unsqueeze(1)
+            decoder_out = model.joiner.decoder_proj(decoder_out)
         # decoder_out is of shape (num_hyps, 1, 1, joiner_dim)
 
         # Note: For torch 1.7.1 and below, it requires a torch.int64 tensor
@@ -1324,6 +1762,20 @@ def modified_beam_search(
         )
         ragged_log_probs = k2.RaggedTensor(shape=log_probs_shape, value=log_probs)
 
+        if isinstance(context_graph, CompiledContextGraph):
+            _modified_beam_search_step_compiled(
+                A=A,
+                B=B,
+                t=t,
+                ragged_log_probs=ragged_log_probs,
+                vocab_size=vocab_size,
+                beam=beam,
+                context_graph=context_graph,
+                blank_id=blank_id,
+                unk_id=unk_id,
+            )
+            continue
+
         for i in range(batch_size):
             topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
 
@@ -1331,23 +1783,29 @@ def modified_beam_search(
                 warnings.simplefilter("ignore")
                 topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
                 topk_token_indexes = (topk_indexes % vocab_size).tolist()
+            topk_log_probs = topk_log_probs.tolist()
 
             for k in range(len(topk_hyp_indexes)):
                 hyp_idx = topk_hyp_indexes[k]
                 hyp = A[i][hyp_idx]
-                new_ys = hyp.ys[:]
                 new_token = topk_token_indexes[k]
-                new_timestamp = hyp.timestamp[:]
                 context_score = 0
                 new_context_state = None if context_graph is None else hyp.context_state
                 if new_token not in (blank_id, unk_id):
-                    new_ys.append(new_token)
-                    new_timestamp.append(t)
+                    new_ys = hyp.ys + [new_token]
+                    new_timestamp = hyp.timestamp + [t]
+                    new_key = hyp.extend_key(new_token)
                     if context_graph is not None:
                         (
                             context_score,
                             new_context_state,
+                            _,
                         ) = context_graph.forward_one_step(hyp.context_state, new_token)
+                else:
+                    # ys is not changed, so it is shared with hyp
+                    new_ys = hyp.ys
+                    new_timestamp = hyp.timestamp
+                    new_key = hyp.key
 
                 new_log_prob = topk_log_probs[k] + context_score
 
@@ -1356,6 +1814,7 @@ def modified_beam_search(
                     log_prob=new_log_prob,
                     timestamp=new_timestamp,
                     context_state=new_context_state,
+                    key=new_key,
                 )
                 B[i].add(new_hyp)
 
@@ -1363,7 +1822,27 @@ def modified_beam_search(
 
     # finalize context_state, if the matched contexts do not reach final state
     # we need to add the score on the corresponding backoff arc
-    if context_graph is not None:
+    if isinstance(context_graph, CompiledContextGraph):
+        context_scores, _ = context_graph.finalize(
+            [hyp.context_state for hyps in B for hyp in hyps]
+        )
+        context_scores = context_scores.tolist()
+        count = 0
+        finalized_B = [HypothesisList() for _ in range(len(B))]
+        for i, hyps in enumerate(B):
+            for hyp in list(hyps):
+                finalized_B[i].add(
+                    Hypothesis(
+                        ys=hyp.ys,
+                        log_prob=hyp.log_prob + context_scores[count],
+                        timestamp=hyp.timestamp,
+                        context_state=context_graph.root,
+                        key=hyp.key,
+                    )
+                )
+                count += 1
+        B = finalized_B
+    elif context_graph is not None:
         finalized_B = [HypothesisList() for _ in range(len(B))]
         for i, hyps in enumerate(B):
             for hyp in list(hyps):
@@ -1376,6 +1855,7 @@ def modified_beam_search(
                         log_prob=hyp.log_prob + context_score,
                         timestamp=hyp.timestamp,
                         context_state=new_context_state,
+                        key=hyp.key,
                     )
                 )
         B = finalized_B
@@ -1400,6 +1880,277 @@ def modified_beam_search(
         )
 
 
+def _merge_duplicate_hyps(
+    hashes: torch.Tensor,
+    scores: torch.Tensor,
+) -> torch.Tensor:
+    """Merge hypotheses of the same utterance that have identical token
+    sequences, i.e., identical hashes.
+
+    It is the tensor counterpart of :meth:`HypothesisList.add`. The
+    probability of a duplicated hypothesis is added (in log-space) to the
+    first one in the beam and its own score is set to -inf.
+
+    Args:
+      hashes:
+        A 2-D tensor of shape (N, beam) with dtype torch.int64.
+      scores:
+        A 2-D tensor of shape (N, beam). Hypotheses are assumed to be sorted
+        by score in descending order along dim 1.
+    Returns:
+      Return the merged scores with the same shape as `scores`.
+    """
+    beam = scores.size(1)
+    valid = scores != float("-inf")
+
+    # same[n][j][k] is True if the k-th hyp equals the j-th hyp
+    same = hashes.unsqueeze(2) == hashes.unsqueeze(1)
+    same &= valid.unsqueeze(1) & valid.unsqueeze(2)
+    # (N, beam, beam)
+
+    merged = torch.where(
+        same,
+        scores.unsqueeze(1).expand(-1, beam, -1),
+        torch.full_like(scores, float("-inf")).unsqueeze(1),
+    ).logsumexp(dim=2)
+    merged = torch.where(valid, merged, scores)
+
+    # A hyp is kept only if it is the first one among its duplicates
+    arange = torch.arange(beam, device=scores.device)
+    first = torch.where(same, arange, beam).min(dim=2).values
+    keep = first == arange
+
+    return torch.where(keep, merged, torch.full_like(merged, float("-inf")))
+
+
+def modified_beam_search_batched(
+    model: nn.Module,
+    encoder_out: torch.Tensor,
+    encoder_out_lens: torch.Tensor,
+    context_graph: Optional[CompiledContextGraph] = None,
+    beam: int = 4,
+    temperature: float = 1.0,
+    blank_penalty: float = 0.0,
+    return_timestamps: bool = False,
+) -> Union[List[List[int]], DecodingResults]:
+    """A fully tensorized version of :func:`modified_beam_search`.
+
+    Hypotheses are not kept as Python objects. Instead, all utterances of
+    the batch share fixed-shape tensors of shape (N, beam):
+
+      - the scores of the hypotheses
+      - the last `context_size` tokens, i.e., the decoder input
+      - a rolling hash of the token sequence, used to merge hypotheses
+        with identical token sequences
+      - the number of emitted tokens, used for length normalization
+      - the context states, if `context_graph` is given
+
+    For each frame, we save the back-pointers and the emitted tokens, which
+    are used to recover the token sequences and timestamps once the search
+    is done. A single `topk` over the (N, beam * vocab_size) scores replaces
+    the per-utterance `topk` of :func:`modified_beam_search`.
+
+    It produces the same results as :func:`modified_beam_search` (up to ties
+    and floating point round-off).
+
+    Args:
+      model:
+        The transducer model.
+      encoder_out:
+        Output from the encoder. Its shape is (N, T, C).
+      encoder_out_lens:
+        A 1-D tensor of shape (N,), containing number of valid frames in
+        encoder_out before padding.
+      context_graph:
+        If not None, it is used for context biasing. Note that only
+        CompiledContextGraph is supported.
+      beam:
+        Number of active paths during the beam search.
+      temperature:
+        Softmax temperature.
+      blank_penalty:
+        The score used to penalize blank probability.
+      return_timestamps:
+        Whether to return timestamps.
+    Returns:
+      If return_timestamps is False, return the decoded result.
+      Else, return a DecodingResults object containing
+      decoded result and corresponding timestamps.
+    """
+    assert encoder_out.ndim == 3, encoder_out.shape
+    assert encoder_out.size(0) >= 1, encoder_out.size(0)
+
+    packed_encoder_out = torch.nn.utils.rnn.pack_padded_sequence(
+        input=encoder_out,
+        lengths=encoder_out_lens.cpu(),
+        batch_first=True,
+        enforce_sorted=False,
+    )
+
+    blank_id = model.decoder.blank_id
+    unk_id = getattr(model, "unk_id", blank_id)
+    context_size = model.decoder.context_size
+    device = next(model.parameters()).device
+
+    batch_size_list = packed_encoder_out.batch_sizes.tolist()
+    N = encoder_out.size(0)
+    assert torch.all(encoder_out_lens > 0), encoder_out_lens
+    assert N == batch_size_list[0], (N, batch_size_list)
+
+    # Only the first hyp of each utterance is valid at the beginning
+    scores = torch.full((N, beam), float("-inf"), device=device)
+    scores[:, 0] = 0
+
+    contexts = torch.full((N, beam, context_size), -1, dtype=torch.int64, device=device)
+    contexts[:, :, -1] = blank_id
+
+    hashes = torch.zeros(N, beam, dtype=torch.int64, device=device)
+    num_tokens = torch.zeros(N, beam, dtype=torch.int64, device=device)
+
+    if context_graph is not None:
+        context_graph = context_graph.to(device)
+        context_states = torch.full(
+            (N, beam), context_graph.root, dtype=torch.int64, device=device
+        )
+
+    # back_pointers[t][n][k] is the index of the hyp at frame t-1 from
+    # which the k-th hyp of the n-th utterance at frame t is extended.
+    # tokens[t][n][k] is the token it emits at frame t, or -1 for blank.
+    back_pointers = []
+    tokens = []
+
+    encoder_out = model.joiner.encoder_proj(packed_encoder_out.data)
+
+    offset = 0
+    for t, batch_size in enumerate(batch_size_list):
+        start = offset
+        end = offset + batch_size
+        current_encoder_out = encoder_out.data[start:end]
+        offset = end
+
+        decoder_out = model.decoder(
+            contexts[:batch_size].reshape(-1, context_size), need_pad=False
+        )
+        decoder_out = model.joiner.decoder_proj(decoder_out)
+        # decoder_out is of shape (batch_size * beam, 1, joiner_dim)
+
+        current_encoder_out = current_encoder_out.repeat_interleave(beam, dim=0)
+        # (batch_size * beam, encoder_out_dim)
+
+        logits = model.joiner(
+            current_encoder_out.unsqueeze(1).unsqueeze(1),
+            decoder_out.unsqueeze(1),
+            project_input=False,
+        )  # (batch_size * beam, 1, 1, vocab_size)
+
+        logits = logits.squeeze(1).squeeze(1)  # (batch_size * beam, vocab_size)
+
+        if blank_penalty != 0:
+            logits[:, 0] -= blank_penalty
+
+        log_probs = (logits / temperature).log_softmax(dim=-1)
+        vocab_size = log_probs.size(-1)
+
+        log_probs = log_probs.reshape(batch_size, beam, vocab_size)
+        log_probs.add_(scores[:batch_size].unsqueeze(2))
+
+        topk_scores, topk_indexes = log_probs.reshape(batch_size, -1).topk(beam)
+        # (batch_size, beam)
+
+        topk_hyp_indexes = torch.div(topk_indexes, vocab_size, rounding_mode="floor")
+        topk_token_indexes = topk_indexes % vocab_size
+
+        emitted = (topk_token_indexes != blank_id) & (topk_token_indexes != unk_id)
+
+        new_contexts = torch.gather(
+            contexts[:batch_size],
+            dim=1,
+            index=topk_hyp_indexes.unsqueeze(2).expand(-1, -1, context_size),
+        )
+        new_contexts = torch.where(
+            emitted.unsqueeze(2),
+            torch.cat([new_contexts[:, :, 1:], topk_token_indexes.unsqueeze(2)], dim=2),
+            new_contexts,
+        )
+
+        new_hashes = torch.gather(hashes[:batch_size], dim=1, index=topk_hyp_indexes)
+        new_hashes = torch.where(
+            emitted, new_hashes * 1000003 + topk_token_indexes + 1, new_hashes
+        )
+
+        new_num_tokens = torch.gather(
+            num_tokens[:batch_size], dim=1, index=topk_hyp_indexes
+        )
+        new_num_tokens += emitted.to(new_num_tokens.dtype)
+
+        if context_graph is not None:
+            new_context_states = torch.gather(
+                context_states[:batch_size], dim=1, index=topk_hyp_indexes
+            )
+            # Only the emitted tokens advance the context states
+            context_scores, next_context_states, _ = context_graph.forward(
+                new_context_states[emitted], topk_token_indexes[emitted]
+            )
+            new_context_states[emitted] = next_context_states
+            topk_scores[emitted] += context_scores.to(topk_scores.dtype)
+            context_states[:batch_size] = new_context_states
+
+        scores[:batch_size] = _merge_duplicate_hyps(new_hashes, topk_scores)
+        contexts[:batch_size] = new_contexts
+        hashes[:batch_size] = new_hashes
+        num_tokens[:batch_size] = new_num_tokens
+
+        back_pointers.append(topk_hyp_indexes)
+        tokens.append(torch.where(emitted, topk_token_indexes, -1))
+
+    if context_graph is not None:
+        # If the matched contexts do not reach final states, we need to add
+        # the scores on the corresponding backoff arcs
+        context_scores, _ = context_graph.finalize(context_states.reshape(-1))
+        scores += context_scores.reshape(N, beam).to(scores.dtype)
+
+    # Length normalization, see HypothesisList.get_most_probable()
+    best_hyp_indexes = (scores / (num_tokens + context_size)).argmax(dim=1)
+
+    # Trace back from the last frame of each utterance
+    ans_tokens = []
+    for t in range(len(batch_size_list) - 1, -1, -1):
+        batch_size = batch_size_list[t]
+        current_hyp_indexes = best_hyp_indexes[:batch_size].unsqueeze(1)
+        ans_tokens.append(
+            torch.gather(tokens[t], dim=1, index=current_hyp_indexes).squeeze(1)
+        )
+        best_hyp_indexes[:batch_size] = torch.gather(
+            back_pointers[t], dim=1, index=current_hyp_indexes
+        ).squeeze(1)
+
+    ans_tokens.reverse()
+    ans_tokens = [a.tolist() for a in ans_tokens]
+
+    sorted_ans = [[] for _ in range(N)]
+    sorted_timestamps = [[] for _ in range(N)]
+    for t, frame_tokens in enumerate(ans_tokens):
+        for i, token in enumerate(frame_tokens):
+            if token != -1:
+                sorted_ans[i].append(token)
+                sorted_timestamps[i].append(t)
+
+    ans = []
+    ans_timestamps = []
+    unsorted_indices = packed_encoder_out.unsorted_indices.tolist()
+    for i in range(N):
+        ans.append(sorted_ans[unsorted_indices[i]])
+        ans_timestamps.append(sorted_timestamps[unsorted_indices[i]])
+
+    if not return_timestamps:
+        return ans
+    else:
+        return DecodingResults(
+            hyps=ans,
+            timestamps=ans_timestamps,
+        )
+
+
 def modified_beam_search_lm_rescore(
     model: nn.Module,
     encoder_out: torch.Tensor,
@@ -1946,6 +2697,7 @@ def beam_search(
     temperature: float = 1.0,
     blank_penalty: float = 0.0,
     return_timestamps: bool = False,
+    decoder_out_cache: Optional[DecoderOutCache] = None,
 ) -> Union[List[int], DecodingResults]:
     """
     It implements Algorithm 1 in https://arxiv.org/pdf/1211.3711.pdf
@@ -1963,6 +2715,10 @@ def beam_search(
         Softmax temperature.
       return_timestamps:
         Whether to return timestamps.
+      decoder_out_cache:
+        If not None, use it to compute the decoder output. Unlike the
+        per-utterance cache keyed on the whole hypothesis, it is keyed on
+        the decoder context and can be shared across utterances.
 
     Returns:
       If return_timestamps is False, return the decoded result.
@@ -2004,7 +2760,7 @@ def beam_search(
 
     sym_per_utt = 0
 
-    decoder_cache: Dict[str, torch.Tensor] = {}
+    decoder_cache: Dict[int, torch.Tensor] = {}
 
     while t < T and sym_per_utt < max_sym_per_utt:
         # fmt: off
@@ -2013,7 +2769,7 @@ def beam_search(
         A = B
         B = HypothesisList()
 
-        joint_cache: Dict[str, torch.Tensor] = {}
+        joint_cache: Dict[int, Tuple[float, List[float], List[int]]] = {}
 
         # TODO(fangjun): Implement prefix search to update the `log_prob`
         # of hypotheses in A
@@ -2024,7 +2780,9 @@ def beam_search(
 
             cached_key = y_star.key
 
-            if cached_key not in decoder_cache:
+            if decoder_out_cache is not None:
+                decoder_out = decoder_out_cache([y_star.ys[-context_size:]])
+            elif cached_key not in decoder_cache:
                 decoder_input = torch.tensor(
                     [y_star.ys[-context_size:]],
                     device=device,
@@ -2037,7 +2795,6 @@ def beam_search(
             else:
                 decoder_out = decoder_cache[cached_key]
 
-            cached_key += f"-t-{t}"
             if cached_key not in joint_cache:
                 logits = model.joiner(
                     current_encoder_out,
@@ -2053,26 +2810,29 @@ def beam_search(
                 # log_prob is (1, 1, 1, vocab_size)
                 log_prob = log_prob.squeeze()
                 # Now log_prob is (vocab_size,)
-                joint_cache[cached_key] = log_prob
-            else:
-                log_prob = joint_cache[cached_key]
+                values, indices = log_prob.topk(beam + 1)
+                joint_cache[cached_key] = (
+                    log_prob[blank_id].item(),
+                    values.tolist(),
+                    indices.tolist(),
+                )
+            skip_log_prob, values, indices = joint_cache[cached_key]
 
             # First, process the blank symbol
-            skip_log_prob = log_prob[blank_id]
             new_y_star_log_prob = y_star.log_prob + skip_log_prob
 
-            # ys[:] returns a copy of ys
+            # ys is not changed, so it is shared with y_star
             B.add(
                 Hypothesis(
-                    ys=y_star.ys[:],
+                    ys=y_star.ys,
                     log_prob=new_y_star_log_prob,
-                    timestamp=y_star.timestamp[:],
+                    timestamp=y_star.timestamp,
+                    key=y_star.key,
                 )
             )
 
             # Second, process other non-blank labels
-            values, indices = log_prob.topk(beam + 1)
-            for i, v in zip(indices.tolist(), values.tolist()):
+            for i, v in zip(indices, values):
                 if i in (blank_id, unk_id):
                     continue
                 new_ys = y_star.ys + [i]
@@ -2083,6 +2843,7 @@ def beam_search(
                         ys=new_ys,
                         log_prob=new_log_prob,
                         timestamp=new_timestamp,
+                        key=y_star.extend_key(i),
                     )
                 )
 
@@ -2462,7 +3223,7 @@ def modified_beam_search_ngram_rescoring(
     model: nn.Module,
     encoder_out: torch.Tensor,
     encoder_out_lens: torch.Tensor,
-    ngram_lm: NgramLm,
+    ngram_lm: Union[NgramLm, CompiledNgramLm],
     ngram_lm_scale: float,
     beam: int = 4,
     temperature: float = 1.0,
@@ -2512,7 +3273,11 @@ def modified_beam_search_ngram_rescoring(
             Hypothesis(
                 ys=[-1] * (context_size - 1) + [blank_id],
                 log_prob=torch.zeros(1, dtype=torch.float32, device=device),
-                state_cost=NgramLmStateCost(ngram_lm),
+                state_cost=(
+                    CompiledNgramLmStateCost(ngram_lm)
+                    if isinstance(ngram_lm, CompiledNgramLm)
+                    else NgramLmStateCost(ngram_lm)
+                ),
             )
         )
 
@@ -2626,7 +3391,7 @@ def modified_beam_search_LODR(
     model: nn.Module,
     encoder_out: torch.Tensor,
     encoder_out_lens: torch.Tensor,
-    LODR_lm: NgramLm,
+    LODR_lm: Union[NgramLm, CompiledNgramLm],
     LODR_lm_scale: float,
     LM: LmScorer,
     beam: int = 4,
@@ -2647,7 +3412,9 @@ def modified_beam_search_LODR(
             A 1-D tensor of shape (N,), containing the number of
             valid frames in encoder_out before padding.
         LODR_lm:
-            A low order n-gram LM, whose score will be subtracted during shallow fusion
+            A low order n-gram LM, whose score will be subtracted during shallow fusion.
+            If it is a CompiledNgramLm, the n-gram LM states of all hypotheses
+            are advanced at once for each frame.
         LODR_lm_scale:
             The scale of the LODR_lm
         LM:
@@ -2696,8 +3463,10 @@ def modified_beam_search_LODR(
                 log_prob=torch.zeros(1, dtype=torch.float32, device=device),
                 state=init_states,  # state of the NN LM
                 lm_score=init_score.reshape(-1),
-                state_cost=NgramLmStateCost(
-                    LODR_lm
+                state_cost=(
+                    CompiledNgramLmStateCost(LODR_lm)
+                    if isinstance(LODR_lm, CompiledNgramLm)
+                    else NgramLmStateCost(LODR_lm)
                 ),  # state of the source domain ngram
                 context_state=None if context_graph is None else context_graph.root,
             )
@@ -2775,6 +3544,9 @@ def modified_beam_search_LODR(
         token_list = []
         hs = []
         cs = []
+        # The n-gram LM states to advance and the tokens to advance them with
+        ngram_state_costs = []
+        ngram_tokens = []
         for i in range(batch_size):
             topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
 
@@ -2788,6 +3560,8 @@ def modified_beam_search_LODR(
 
                 new_token = topk_token_indexes[k]
                 if new_token not in (blank_id, unk_id):
+                    ngram_state_costs.append(hyp.state_cost)
+                    ngram_tokens.append(new_token)
                     if LM.lm_type == "rnn":
                         token_list.append([new_token])
                         # store the LSTM states
@@ -2824,6 +3598,15 @@ def modified_beam_search_LODR(
 
             scores, lm_states = LM.score_token(tokens_to_score, x_lens, state)
 
+        # advance the n-gram LM states in the same order as token_list
+        if isinstance(LODR_lm, CompiledNgramLm):
+            new_state_costs = LODR_lm.forward_one_step(ngram_state_costs, ngram_tokens)
+        else:
+            new_state_costs = [
+                sc.forward_one_step(token)
+                for sc, token in zip(ngram_state_costs, ngram_tokens)
+            ]
+
         count = 0  # index, used to locate score and lm states
         for i in range(batch_size):
             topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
@@ -2853,10 +3636,11 @@ def modified_beam_search_LODR(
                         (
                             context_score,
                             new_context_state,
+                            _,
                         ) = context_graph.forward_one_step(hyp.context_state, new_token)
 
                     ys.append(new_token)
-                    state_cost = hyp.state_cost.forward_one_step(new_token)
+                    state_cost = new_state_costs[count]
 
                     # calculate the score of the latest token
                     current_ngram_score = state_cost.lm_score - hyp.state_cost.lm_score
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Xiaomi Corporation
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the time and the peak memory usage of model averaging
+with and without the safetensors files saved by
+`./zipformer/train.py --save-safetensors 1`.
+
+It saves --num-checkpoints synthetic checkpoints of a model with about
+--num-params million parameters to --exp-dir. Like the checkpoints saved
+during training, each of them also contains `model_avg` and the optimizer
+state. Each averaging method runs in a separate process, which reports
+the increase of its peak anonymous resident memory during averaging,
+sampled from /proc/self/status. Pages of memory mapped files are not
+counted, since the kernel can drop them at any time. It works only on Linux.
+
+Usage:
+./zipformer/benchmark_average_checkpoints.py \
+    --exp-dir /tmp/benchmark-average \
+    --num-params 65 \
+    --num-checkpoints 10
+"""
+
+import argparse
+import logging
+import multiprocessing
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+import torch
+from torch import nn
+
+from icefall.checkpoint import (
+    average_checkpoints,
+    average_checkpoints_with_averaged_model,
+    save_checkpoint,
+)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--exp-dir",
+        type=str,
+        default="benchmark-average",
+        help="The directory to save the synthetic checkpoints",
+    )
+
+    parser.add_argument(
+        "--num-params",
+        type=float,
+        default=65,
+        help="Number of parameters of the model, in millions",
+    )
+
+    parser.add_argument(
+        "--num-checkpoints",
+        type=int,
+        default=10,
+        help="Number of checkpoints to average",
+    )
+
+    return parser
+
+
+def save_checkpoints(exp_dir: Path, num_params: float, num: int) -> List[Path]:
+    dim = 1024
+    num_layers = max(1, int(num_params * 1e6 / (dim * dim)))
+    model = nn.Sequential(*[nn.Linear(dim, dim) for _ in range(num_layers)])
+    model_avg = nn.Sequential(*[nn.Linear(dim, dim) for _ in range(num_layers)])
+    optimizer = torch.optim.Adam(model.parameters())
+    model(torch.rand(1, dim)).sum().backward()
+    optimizer.step()
+
+    num_params = sum(p.numel() for p in model.parameters())
+    logging.info(f"Number of model parameters: {num_params}")
+
+    filenames = []
+    for i in range(1, num + 1):
+        filename = exp_dir / f"epoch-{i}.pt"
+        params = {"batch_idx_train": 1000 * i, "average_period": 200}
+        save_checkpoint(
+            filename,
+            model=model,
+            model_avg=model_avg,
+            params=params,
+            optimizer=optimizer,
+            with_safetensors=True,
+        )
+        filenames.append(filename)
+    return filenames
+
+
+def get_anonymous_memory() -> float:
+    """Return the anonymous resident memory of this process in MB."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("RssAnon is not found in /proc/self/status")
+
+
+def run(method: str, filenames: List[Path], use_safetensors: bool, queue) -> None:
+    if not use_safetensors:
+        # Make the safetensors files older than the checkpoints so that
+        # they are ignored
+        for f in filenames:
+            f.touch()
+
+    start_memory = get_anonymous_memory()
+    max_memory = start_memory
+    done = threading.Event()
+
+    def monitor():
+        nonlocal max_memory
+        while not done.wait(0.01):
+            max_memory = max(max_memory, get_anonymous_memory())
+
+    monitor_thread = threading.Thread(target=monitor)
+    monitor_thread.start()
+
+    start = time.time()
+    if method == "average_checkpoints":
+        avg = average_checkpoints(filenames)
+    else:
+        avg = average_checkpoints_with_averaged_model(filenames[0], filenames[-1])
+    elapsed = time.time() - start
+
+    done.set()
+    monitor_thread.join()
+    max_memory = max(max_memory, get_anonymous_memory())
+
+    avg_size = sum(v.numel() * v.element_size() for v in avg.values()) / 1024**2
+    queue.put((elapsed, max_memory - start_memory, avg_size))
+
+
+def main():
+    args = get_parser().parse_args()
+    exp_dir = Path(args.exp_dir)
+    exp_dir.mkdir(parents=True, exist_ok=True)
+
+    filenames = save_checkpoints(exp_dir, args.num_params, args.num_checkpoints)
+    checkpoint_size = filenames[0].stat().st_size / 1024**2
+    logging.info(f"Size of each checkpoint: {checkpoint_size:.1f} MB")
+
+    # Use spawn so that the memory of this process is not counted
+    ctx = multiprocessing.get_context("spawn")
+    for method in ["average_checkpoints", "average_checkpoints_with_averaged_model"]:
+        for use_safetensors in [False, True]:
+            # Make the safetensors files up to date
+            for f in filenames:
+                f.with_suffix(".safetensors").touch()
+            queue = ctx.Queue()
+            p = ctx.Process(
+                target=run, args=(method, filenames, use_safetensors, queue)
+            )
+            p.start()
+            elapsed, max_memory, avg_size = queue.get()
+            p.join()
+            logging.info(
+                f"{method}, safetensors: {use_safetensors}, "
+                f"time: {elapsed:.2f} s, peak memory: {max_memory:.1f} MB, "
+                f"size of the averaged model: {avg_size:.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Xiaomi Corporation
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the throughput of modified_beam_search and
+modified_beam_search_batched for different batch sizes. Only the decoder
+and the joiner are used; the encoder output is random.
+
+If --decoder-out-cache-size is positive, it also benchmarks
+modified_beam_search with a DecoderOutCache and reports its hit rate.
+
+If --long-utterance-frames is given, it also decodes a single utterance
+of each given number of frames with modified_beam_search and reports the
+time per frame, which should not grow with the utterance length.
+
+Usage:
+(1) Use a randomly initialized decoder and joiner
+./zipformer/benchmark_beam_search.py \
+    --batch-sizes 8,16,32,64,128 \
+    --num-frames 250 \
+    --beam-size 4
+
+(2) Use the decoder and joiner from a checkpoint
+./zipformer/benchmark_beam_search.py \
+    --checkpoint ./zipformer/exp/epoch-30.pt \
+    --batch-sizes 8,16,32,64,128 \
+    --num-frames 250 \
+    --beam-size 4 \
+    --decoder-out-cache-size 10000
+
+(3) Check that the time per frame does not grow with the utterance length
+./zipformer/benchmark_beam_search.py \
+    --batch-sizes "" \
+    --long-utterance-frames 1000,2000,4000,8000,16000
+"""
+
+import argparse
+import logging
+import time
+from typing import Callable
+
+import torch
+from beam_search import (
+    DecoderOutCache,
+    modified_beam_search,
+    modified_beam_search_batched,
+)
+from torch import nn
+from train import (
+    _to_int_tuple,
+    add_model_arguments,
+    get_decoder_model,
+    get_joiner_model,
+    get_params,
+)
+
+from icefall.utils import str2bool
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default="",
+        help="""If not empty, load the decoder and joiner from this
+        checkpoint. Otherwise, they are randomly initialized.""",
+    )
+
+    parser.add_argument(
+        "--vocab-size",
+        type=int,
+        default=500,
+        help="Vocabulary size, including the blank",
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=2,
+        help="The context size in the decoder. 1 means bigram; 2 means tri-gram",
+    )
+
+    parser.add_argument(
+        "--batch-sizes",
+        type=str,
+        default="8,16,32,64,128",
+        help="Comma separated batch sizes to benchmark. Empty to skip it",
+    )
+
+    parser.add_argument(
+        "--num-frames",
+        type=int,
+        default=250,
+        help="Number of encoder output frames of each utterance",
+    )
+
+    parser.add_argument(
+        "--beam-size",
+        type=int,
+        default=4,
+        help="Number of active paths during the beam search",
+    )
+
+    parser.add_argument(
+        "--num-iters",
+        type=int,
+        default=3,
+        help="Number of runs for each batch size. The average time is reported",
+    )
+
+    parser.add_argument(
+        "--decoder-out-cache-size",
+        type=int,
+        default=0,
+        help="If positive, also benchmark modified_beam_search with a "
+        "decoder output cache of this size",
+    )
+
+    parser.add_argument(
+        "--long-utterance-frames",
+        type=str,
+        default="",
+        help="Comma separated numbers of frames of a single long utterance. "
+        "If not empty, report the decoding time per frame for each of them",
+    )
+
+    parser.add_argument(
+        "--check-results",
+        type=str2bool,
+        default=True,
+        help="Whether to check that both methods produce the same results",
+    )
+
+    add_model_arguments(parser)
+
+    return parser
+
+
+class Model(nn.Module):
+    """A Wrapper for decoder and joiner"""
+
+    def __init__(self, decoder: nn.Module, joiner: nn.Module) -> None:
+        super().__init__()
+        self.decoder = decoder
+        self.joiner = joiner
+
+
+def benchmark(
+    func: Callable,
+    num_iters: int,
+    device: torch.device,
+    **kwargs,
+):
+    """Return the results of the last run and the average time in seconds."""
+    elapsed = 0.0
+    for _ in range(num_iters):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.time()
+        ans = func(**kwargs)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        elapsed += time.time() - start
+    return ans, elapsed / num_iters
+
+
+@torch.no_grad()
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    params = get_params()
+    params.update(vars(args))
+    params.blank_id = 0
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+    logging.info(f"Device: {device}")
+
+    logging.info(params)
+
+    model = Model(
+        decoder=get_decoder_model(params),
+        joiner=get_joiner_model(params),
+    )
+    if params.checkpoint:
+        logging.info(f"Loading {params.checkpoint}")
+        checkpoint = torch.load(params.checkpoint, map_location="cpu")
+        model.load_state_dict(checkpoint["model"], strict=False)
+    model.to(device)
+    model.eval()
+
+    encoder_dim = max(_to_int_tuple(params.encoder_dim))
+    T = params.num_frames
+
+    logging.info(
+        f"beam size: {params.beam_size}, num frames per utterance: {T}, "
+        f"num iters: {params.num_iters}"
+    )
+    batch_sizes = _to_int_tuple(params.batch_sizes) if params.batch_sizes else ()
+    for N in batch_sizes:
+        encoder_out = torch.randn(N, T, encoder_dim, device=device)
+        encoder_out_lens = torch.randint(
+            low=T // 2, high=T + 1, size=(N,), device=device
+        )
+        encoder_out_lens[0] = T
+
+        kwargs = dict(
+            model=model,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+            beam=params.beam_size,
+            return_timestamps=True,
+        )
+        ref, ref_time = benchmark(
+            modified_beam_search, params.num_iters, device, **kwargs
+        )
+        hyp, hyp_time = benchmark(
+            modified_beam_search_batched, params.num_iters, device, **kwargs
+        )
+
+        num_frames = encoder_out_lens.sum().item()
+        logging.info(
+            f"batch size: {N:4d}, "
+            f"modified_beam_search: {num_frames / ref_time:9.1f} frames/s, "
+            f"modified_beam_search_batched: {num_frames / hyp_time:9.1f} frames/s, "
+            f"speedup: {ref_time / hyp_time:.2f}"
+        )
+
+        if params.check_results:
+            num_same = sum(
+                r == h and rt == ht
+                for r, h, rt, ht in zip(
+                    ref.hyps, hyp.hyps, ref.timestamps, hyp.timestamps
+                )
+            )
+            logging.info(f"{num_same}/{N} utterances have identical results")
+
+        if params.decoder_out_cache_size > 0:
+            decoder_out_cache = DecoderOutCache(
+                model, max_size=params.decoder_out_cache_size
+            )
+            _, cache_time = benchmark(
+                modified_beam_search,
+                params.num_iters,
+                device,
+                decoder_out_cache=decoder_out_cache,
+                **kwargs,
+            )
+            logging.info(
+                f"modified_beam_search with decoder output cache: "
+                f"{num_frames / cache_time:9.1f} frames/s, "
+                f"speedup: {ref_time / cache_time:.2f}, "
+                f"saved decoder forward passes per utterance: "
+                f"{decoder_out_cache.num_hits / (N * params.num_iters):.1f}, "
+                f"{decoder_out_cache}"
+            )
+
+    if params.long_utterance_frames:
+        long_utterance_frames = _to_int_tuple(params.long_utterance_frames)
+    else:
+        long_utterance_frames = ()
+    for T in long_utterance_frames:
+        encoder_out = torch.randn(1, T, encoder_dim, device=device)
+        encoder_out_lens = torch.tensor([T], device=device)
+        hyps, elapsed = benchmark(
+            modified_beam_search,
+            params.num_iters,
+            device,
+            model=model,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+            beam=params.beam_size,
+        )
+        logging.info(
+            f"num frames: {T:6d}, num tokens: {len(hyps[0]):6d}, "
+            f"modified_beam_search: {elapsed * 1000 / T:.3f} ms/frame"
+        )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+
+    main()
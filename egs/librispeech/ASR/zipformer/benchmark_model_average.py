@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Xiaomi Corporation
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the time of one update of the averaged model with
+update_averaged_model() and with ModelAverager, which is used by
+./zipformer/train.py. As in ./zipformer/train.py, the averaged model is a
+float64 copy of the model on CPU, or on the GPU if --model-avg-on-gpu is
+true.
+
+Usage (the large Zipformer):
+./zipformer/benchmark_model_average.py \
+    --num-encoder-layers 2,2,4,5,4,2 \
+    --feedforward-dim 512,768,1536,2048,1536,768 \
+    --encoder-dim 192,256,512,768,512,256 \
+    --encoder-unmasked-dim 192,192,256,320,256,192 \
+    --model-avg-on-gpu 0
+"""
+
+import argparse
+import copy
+import logging
+import time
+from typing import Callable
+
+import torch
+from train import add_model_arguments, get_model, get_params
+
+from icefall.checkpoint import ModelAverager, update_averaged_model
+from icefall.utils import AttributeDict, str2bool
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--vocab-size",
+        type=int,
+        default=500,
+        help="Vocabulary size, including the blank",
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=2,
+        help="The context size in the decoder. 1 means bigram; 2 means tri-gram",
+    )
+
+    parser.add_argument(
+        "--model-avg-on-gpu",
+        type=str2bool,
+        default=False,
+        help="Whether to keep the averaged model on the GPU",
+    )
+
+    parser.add_argument(
+        "--num-iters",
+        type=int,
+        default=10,
+        help="Number of updates. The average time is reported",
+    )
+
+    add_model_arguments(parser)
+
+    return parser
+
+
+def benchmark(
+    update: Callable[[AttributeDict], None],
+    params: AttributeDict,
+    device: torch.device,
+) -> float:
+    """Return the average time in seconds of one update."""
+    params.batch_idx_train = params.average_period
+    # Warm up
+    update(params)
+
+    elapsed = 0.0
+    for _ in range(params.num_iters):
+        params.batch_idx_train += params.average_period
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.time()
+        update(params)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        elapsed += time.time() - start
+    return elapsed / params.num_iters
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    params = get_params()
+    params.update(vars(args))
+    params.blank_id = 0
+    params.average_period = 200
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+    logging.info(f"Device: {device}")
+
+    model = get_model(params)
+    num_param = sum(p.numel() for p in model.parameters())
+    logging.info(f"Number of model parameters: {num_param}")
+
+    model_avg = copy.deepcopy(model).to(torch.float64)
+    model.to(device)
+    if params.model_avg_on_gpu:
+        model_avg.to(device)
+    logging.info(f"model_avg: {next(model_avg.parameters()).device}")
+
+    expected = copy.deepcopy(model_avg)
+
+    old_time = benchmark(
+        lambda p: update_averaged_model(p, model_cur=model, model_avg=expected),
+        params,
+        device,
+    )
+    model_averager = ModelAverager(model_cur=model, model_avg=model_avg)
+    new_time = benchmark(model_averager.update, params, device)
+
+    logging.info(
+        f"update_averaged_model: {old_time * 1000:.2f} ms, "
+        f"ModelAverager: {new_time * 1000:.2f} ms, "
+        f"speedup: {old_time / new_time:.2f}"
+    )
+
+    max_diff = max(
+        (a - b).abs().max().item()
+        for a, b in zip(model_avg.state_dict().values(), expected.state_dict().values())
+        if a.is_floating_point() and a.numel() > 0
+    )
+    logging.info(f"Max absolute difference of the averaged models: {max_diff}")
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+
+    main()
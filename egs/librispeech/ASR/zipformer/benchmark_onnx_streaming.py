@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Xiaomi Corporation
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script reports the real time factor (RTF) of
+BatchedOnnxStreamingModel from ./onnx_pretrained_streaming_batch.py
+on CPU for different numbers of concurrent streams.
+
+Each stream decodes the same audio. The features are computed before
+the timing starts, so only the encoder, the decoder and the joiner are
+timed. RTF is the decoding time divided by the total duration of the
+audio of all streams. With 1 stream, it decodes one stream at a time
+like ./onnx_pretrained-streaming.py.
+
+Usage:
+./zipformer/benchmark_onnx_streaming.py \
+  --encoder-model-filename $repo/exp/encoder-epoch-99-avg-1.onnx \
+  --decoder-model-filename $repo/exp/decoder-epoch-99-avg-1.onnx \
+  --joiner-model-filename $repo/exp/joiner-epoch-99-avg-1.onnx \
+  --num-streams 1,2,4,8,16 \
+  $repo/test_wavs/1089-134686-0001.wav
+"""
+
+import argparse
+import logging
+import time
+
+import torch
+from onnx_pretrained_streaming_batch import (
+    BatchedOnnxStreamingModel,
+    Stream,
+    read_sound_files,
+)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--encoder-model-filename",
+        type=str,
+        required=True,
+        help="Path to the encoder onnx model. ",
+    )
+
+    parser.add_argument(
+        "--decoder-model-filename",
+        type=str,
+        required=True,
+        help="Path to the decoder onnx model. ",
+    )
+
+    parser.add_argument(
+        "--joiner-model-filename",
+        type=str,
+        required=True,
+        help="Path to the joiner onnx model. ",
+    )
+
+    parser.add_argument(
+        "--num-streams",
+        type=str,
+        default="1,2,4,8,16",
+        help="Comma separated numbers of concurrent streams to benchmark",
+    )
+
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=1,
+        help="Number of threads of each onnxruntime session",
+    )
+
+    parser.add_argument(
+        "sound_file",
+        type=str,
+        help="The sound file decoded by every stream. "
+        "The sample rate has to be 16kHz.",
+    )
+
+    return parser
+
+
+@torch.no_grad()
+def main():
+    args = get_parser().parse_args()
+    logging.info(vars(args))
+
+    sample_rate = 16000
+    wave = read_sound_files([args.sound_file], expected_sample_rate=sample_rate)[0]
+    duration = wave.numel() / sample_rate
+    logging.info(f"Duration of {args.sound_file}: {duration:.2f} s")
+
+    baseline_rtf = None
+    for N in map(int, args.num_streams.split(",")):
+        model = BatchedOnnxStreamingModel(
+            encoder_model_filename=args.encoder_model_filename,
+            decoder_model_filename=args.decoder_model_filename,
+            joiner_model_filename=args.joiner_model_filename,
+            max_num_streams=N,
+            num_threads=args.num_threads,
+        )
+
+        streams = []
+        for _ in range(N):
+            stream = Stream(
+                context_size=model.context_size,
+                segment=model.segment,
+                offset=model.offset,
+            )
+            stream.accept_waveform(sample_rate, wave)
+            stream.finish_input(sample_rate)
+            model.add_stream(stream)
+            streams.append(stream)
+
+        start = time.time()
+        while not streams[0].done:
+            model.decode_chunk(streams)
+        elapsed = time.time() - start
+
+        rtf = elapsed / (N * duration)
+        if baseline_rtf is None:
+            baseline_rtf = rtf
+        logging.info(
+            f"num streams: {N:3d}, RTF: {rtf:.4f}, "
+            f"speedup over the first row: {baseline_rtf / rtf:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+
+    main()
@@ -0,0 +1,185 @@
+# Copyright    2024  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Decode a list of sound files in batches of similar durations.
+
+It is used by ./pretrained.py and ./jit_pretrained.py. The files are
+sorted by duration and grouped into batches whose padded duration does
+not exceed --max-duration, so little computation is wasted on padding
+and the memory usage is bounded by --max-duration instead of the number
+of files. The features of the next batches are computed in a thread pool
+while the model decodes the current batch.
+"""
+
+import argparse
+import logging
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Tuple
+
+import torch
+import torchaudio
+from torch.nn.utils.rnn import pad_sequence
+
+
+def add_bucketing_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--sound-file-list",
+        type=str,
+        default="",
+        help="""If not empty, a text file with one sound file per line.
+        They are decoded after the sound files given as positional
+        arguments.""",
+    )
+
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=0,
+        help="""Maximum padded duration in seconds of each batch. The sound
+        files are sorted by duration and decoded in batches. If it is not
+        positive, all sound files are decoded in a single batch.""",
+    )
+
+    parser.add_argument(
+        "--num-feature-threads",
+        type=int,
+        default=1,
+        help="""Number of threads that read sound files and compute features
+        of the next batches while the model decodes the current batch.""",
+    )
+
+
+def get_sound_files(sound_files: List[str], sound_file_list: str) -> List[str]:
+    """Return the sound files from the command line and the file list."""
+    ans = list(sound_files)
+    if sound_file_list:
+        with open(sound_file_list) as f:
+            ans += [line.strip() for line in f if line.strip()]
+    assert len(ans) > 0, "Please provide at least one sound file"
+    return ans
+
+
+def make_batches(durations: List[float], max_duration: float) -> List[List[int]]:
+    """Group files into batches of similar durations.
+
+    Args:
+      durations:
+        The duration of each file in seconds.
+      max_duration:
+        Maximum padded duration, i.e., the number of files in a batch
+        times the duration of the longest file in it. A file longer than
+        max_duration forms a batch by itself.
+    Returns:
+      Return the indexes of the files in each batch. The longest files come
+      first, so that running out of memory happens early, if it happens.
+    """
+    indexes = sorted(range(len(durations)), key=lambda i: -durations[i])
+    batches = []
+    batch = []
+    for i in indexes:
+        # The first file of a batch is the longest one
+        if batch and (len(batch) + 1) * durations[batch[0]] > max_duration:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def decode_sound_files(
+    filenames: List[str],
+    compute_features: Callable[[List[str]], List[torch.Tensor]],
+    decode_batch: Callable[[torch.Tensor, torch.Tensor], List[str]],
+    max_duration: float,
+    num_threads: int = 1,
+) -> Iterator[List[Tuple[str, str]]]:
+    """Decode the given sound files batch by batch.
+
+    Args:
+      filenames:
+        The sound files to decode.
+      compute_features:
+        A function that reads the given sound files and returns their
+        features, each of shape (T, C). It runs in a thread pool.
+      decode_batch:
+        A function that takes the padded features of shape (N, T, C) and
+        their lengths of shape (N,), and returns the decoded text of each
+        file.
+      max_duration:
+        Maximum padded duration in seconds of each batch. If it is not
+        positive, all files are decoded in a single batch in the given
+        order.
+      num_threads:
+        Number of threads to compute the features.
+    Yields:
+      Yield a list of (filename, text) for each batch as soon as it is
+      decoded.
+    """
+    if max_duration > 0:
+        durations = []
+        for f in filenames:
+            info = torchaudio.info(f)
+            durations.append(info.num_frames / info.sample_rate)
+        batches = make_batches(durations, max_duration)
+    else:
+        batches = [list(range(len(filenames)))]
+
+    logging.info(f"Decoding {len(filenames)} files in {len(batches)} batches")
+
+    def load(indexes: List[int]) -> Tuple[torch.Tensor, torch.Tensor]:
+        features = compute_features([filenames[i] for i in indexes])
+        feature_lengths = [f.size(0) for f in features]
+        features = pad_sequence(
+            features,
+            batch_first=True,
+            padding_value=math.log(1e-10),
+        )
+        feature_lengths = torch.tensor(feature_lengths, device=features.device)
+        return features, feature_lengths
+
+    with ThreadPoolExecutor(num_threads) as executor:
+        # Compute the features of at most num_threads + 1 batches ahead
+        futures = deque(
+            executor.submit(load, indexes) for indexes in batches[: num_threads + 1]
+        )
+        for i, indexes in enumerate(batches):
+            start = time.time()
+            features, feature_lengths = futures.popleft().result()
+            if i + num_threads + 1 < len(batches):
+                futures.append(executor.submit(load, batches[i + num_threads + 1]))
+
+            decode_start = time.time()
+            texts = decode_batch(features, feature_lengths)
+            end = time.time()
+
+            # Features are computed at 100 frames per second
+            num_frames = feature_lengths.sum().item()
+            padding = 1 - num_frames / feature_lengths.numel() / features.size(1)
+            logging.info(
+                f"Batch {i + 1}/{len(batches)}: {len(indexes)} files, "
+                f"{num_frames / 100:.1f} s of audio, "
+                f"padding {padding:.1%}, "
+                f"waiting for features {decode_start - start:.2f} s, "
+                f"decoding {end - decode_start:.2f} s "
+                f"({num_frames / 100 / (end - decode_start):.1f}x real time)"
+            )
+
+            yield [(filenames[idx], text) for idx, text in zip(indexes, texts)]
@@ -133,8 +133,8 @@ from icefall.checkpoint import (
 from icefall.context_graph import ContextGraph, ContextState
 from icefall.decode import (
     ctc_greedy_search,
-    ctc_prefix_beam_search,
     ctc_prefix_beam_search_attention_decoder_rescoring,
+    ctc_prefix_beam_search_batched,
     ctc_prefix_beam_search_shallow_fussion,
     get_lattice,
     nbest_decoding,
@@ -145,6 +145,7 @@ from icefall.decode import (
     rescore_with_n_best_list,
     rescore_with_whole_lattice,
 )
+from icefall.graph_cache import load_or_build_fsa
 from icefall.lexicon import Lexicon
 from icefall.lm_wrapper import LmScorer
 from icefall.ngram_lm import NgramLm, NgramLmStateCost
@@ -318,6 +319,17 @@ def get_parser():
         """,
     )
 
+    parser.add_argument(
+        "--graph-cache-dir",
+        type=str,
+        default="",
+        help="""If not empty, prepared decoding graphs, e.g., HLG and G, are
+        cached in this directory, so that later decoding jobs with the same
+        graphs and options load them with mmap instead of preparing them
+        again. Empty to disable the cache.
+        """,
+    )
+
     parser.add_argument(
         "--lm-dir",
         type=str,
@@ -368,6 +380,17 @@ def get_parser():
         """,
     )
 
+    parser.add_argument(
+        "--blank-threshold",
+        type=float,
+        default=1.0,
+        help="""Used only when --decoding-method is ctc-prefix-beam-search.
+        Frames whose blank probability is larger than it are assumed to emit
+        only blank and are skipped during the search, which speeds up decoding
+        of long utterances, e.g., 0.999. A value >= 1 disables it.
+        """,
+    )
+
     parser.add_argument(
         "--skip-scoring",
         type=str2bool,
@@ -375,6 +398,14 @@ def get_parser():
         help="""Skip scoring, but still save the ASR output (for eval sets).""",
     )
 
+    parser.add_argument(
+        "--num-scoring-jobs",
+        type=int,
+        default=1,
+        help="""Number of processes to align the references and the
+        hypotheses when computing WERs.""",
+    )
+
     add_model_arguments(parser)
 
     return parser
@@ -484,8 +515,14 @@ def decode_one_batch(
         return {key: hyps}
 
     if params.decoding_method == "ctc-prefix-beam-search":
-        token_ids = ctc_prefix_beam_search(
-            ctc_output=ctc_output, encoder_out_lens=encoder_out_lens
+        token_ids = ctc_prefix_beam_search_batched(
+            ctc_output=ctc_output,
+            encoder_out_lens=encoder_out_lens,
+            beam=params.beam,
+            blank_id=params.blank_id,
+            blank_threshold=(
+                params.blank_threshold if params.blank_threshold < 1 else None
+            ),
         )
         # hyps is a list of str, e.g., ['xxx yyy zzz', ...]
         hyps = bpe_model.decode(token_ids)
@@ -816,7 +853,11 @@ def save_wer_results(
         errs_filename = params.res_dir / f"errs-{test_set_name}-{params.suffix}.txt"
         with open(errs_filename, "w", encoding="utf8") as fd:
             wer = write_error_stats(
-                fd, f"{test_set_name}_{key}", results, enable_log=enable_log
+                fd,
+                f"{test_set_name}_{key}",
+                results,
+                enable_log=enable_log,
+                num_jobs=params.num_scoring_jobs,
             )
             test_set_wers[key] = wer
 
@@ -890,6 +931,11 @@ def main():
 
     if "prefix-beam-search" in params.decoding_method:
         params.suffix += f"_beam-{params.beam}"
+        if (
+            params.decoding_method == "ctc-prefix-beam-search"
+            and params.blank_threshold < 1
+        ):
+            params.suffix += f"_blank-threshold-{params.blank_threshold}"
         if params.decoding_method == "ctc-prefix-beam-search-shallow-fussion":
             if params.nnlm_scale != 0:
                 params.suffix += f"_nnlm-scale-{params.nnlm_scale}"
@@ -946,63 +992,99 @@ def main():
     else:
         H = None
         bpe_model = None
-        HLG = k2.Fsa.from_dict(
-            torch.load(f"{params.lang_dir}/HLG.pt", map_location=device)
-        )
-        assert HLG.requires_grad is False
 
-        HLG.scores *= params.hlg_scale
-        if not hasattr(HLG, "lm_scores"):
-            HLG.lm_scores = HLG.scores.clone()
+        def build_HLG() -> k2.Fsa:
+            HLG = k2.Fsa.from_dict(
+                torch.load(f"{params.lang_dir}/HLG.pt", map_location=device)
+            )
+            assert HLG.requires_grad is False
+
+            HLG.scores *= params.hlg_scale
+            if not hasattr(HLG, "lm_scores"):
+                HLG.lm_scores = HLG.scores.clone()
+            return HLG
+
+        HLG = load_or_build_fsa(
+            build_HLG,
+            name="HLG",
+            inputs=[params.lang_dir / "HLG.pt"],
+            cache_dir=params.graph_cache_dir,
+            options={"hlg_scale": params.hlg_scale},
+            device=device,
+        )
 
     if params.decoding_method in (
         "nbest-rescoring",
         "whole-lattice-rescoring",
         "attention-decoder-rescoring-with-ngram",
     ):
-        if not (params.lm_dir / "G_4_gram.pt").is_file():
-            logging.info("Loading G_4_gram.fst.txt")
-            logging.warning("It may take 8 minutes.")
-            with open(params.lm_dir / "G_4_gram.fst.txt") as f:
-                first_word_disambig_id = lexicon.word_table["#0"]
-
-                G = k2.Fsa.from_openfst(f.read(), acceptor=False)
-                # G.aux_labels is not needed in later computations, so
-                # remove it here.
-                del G.aux_labels
-                # CAUTION: The following line is crucial.
-                # Arcs entering the back-off state have label equal to #0.
-                # We have to change it to 0 here.
-                G.labels[G.labels >= first_word_disambig_id] = 0
-                # See https://github.com/k2-fsa/k2/issues/874
-                # for why we need to set G.properties to None
-                G.__dict__["_properties"] = None
-                G = k2.Fsa.from_fsas([G]).to(device)
-                G = k2.arc_sort(G)
-                # Save a dummy value so that it can be loaded in C++.
-                # See https://github.com/pytorch/pytorch/issues/67902
-                # for why we need to do this.
-                G.dummy = 1
-
-                torch.save(G.as_dict(), params.lm_dir / "G_4_gram.pt")
-        else:
-            logging.info("Loading pre-compiled G_4_gram.pt")
-            d = torch.load(params.lm_dir / "G_4_gram.pt", map_location=device)
-            G = k2.Fsa.from_dict(d)
-
-        if params.decoding_method in [
+        add_epsilon_self_loops = params.decoding_method in [
             "whole-lattice-rescoring",
             "attention-decoder-rescoring-with-ngram",
-        ]:
-            # Add epsilon self-loops to G as we will compose
-            # it with the whole lattice later
-            G = k2.add_epsilon_self_loops(G)
-            G = k2.arc_sort(G)
-            G = G.to(device)
-
-        # G.lm_scores is used to replace HLG.lm_scores during
-        # LM rescoring.
-        G.lm_scores = G.scores.clone()
+        ]
+
+        def build_G() -> k2.Fsa:
+            if not (params.lm_dir / "G_4_gram.pt").is_file():
+                logging.info("Loading G_4_gram.fst.txt")
+                logging.warning("It may take 8 minutes.")
+                with open(params.lm_dir / "G_4_gram.fst.txt") as f:
+                    first_word_disambig_id = lexicon.word_table["#0"]
+
+                    G = k2.Fsa.from_openfst(f.read(), acceptor=False)
+                    # G.aux_labels is not needed in later computations, so
+                    # remove it here.
+                    del G.aux_labels
+                    # CAUTION: The following line is crucial.
+                    # Arcs entering the back-off state have label equal to #0.
+                    # We have to change it to 0 here.
+                    G.labels[G.labels >= first_word_disambig_id] = 0
+                    # See https://github.com/k2-fsa/k2/issues/874
+                    # for why we need to set G.properties to None
+                    G.__dict__["_properties"] = None
+                    G = k2.Fsa.from_fsas([G]).to(device)
+                    G = k2.arc_sort(G)
+                    # Save a dummy value so that it can be loaded in C++.
+                    # See https://github.com/pytorch/pytorch/issues/67902
+                    # for why we need to do this.
+                    G.dummy = 1
+
+                    torch.save(G.as_dict(), params.lm_dir / "G_4_gram.pt")
+            else:
+                logging.info("Loading pre-compiled G_4_gram.pt")
+                d = torch.load(params.lm_dir / "G_4_gram.pt", map_location=device)
+                G = k2.Fsa.from_dict(d)
+
+            if add_epsilon_self_loops:
+                # Add epsilon self-loops to G as we will compose
+                # it with the whole lattice later
+                G = k2.add_epsilon_self_loops(G)
+                G = k2.arc_sort(G)
+                G = G.to(device)
+
+            # G.lm_scores is used to replace HLG.lm_scores during
+            # LM rescoring.
+            G.lm_scores = G.scores.clone()
+            return G
+
+        def get_G_inputs() -> List[Path]:
+            # build_G() saves G_4_gram.pt when it is missing, so this is
+            # called again after building G to cache it under the key
+            # computed from G_4_gram.pt
+            if (params.lm_dir / "G_4_gram.pt").is_file():
+                return [params.lm_dir / "G_4_gram.pt"]
+            return [
+                params.lm_dir / "G_4_gram.fst.txt",
+                params.lang_dir / "words.txt",
+            ]
+
+        G = load_or_build_fsa(
+            build_G,
+            name="G",
+            inputs=get_G_inputs,
+            cache_dir=params.graph_cache_dir,
+            options={"add_epsilon_self_loops": add_epsilon_self_loops},
+            device=device,
+        )
     else:
         G = None
 
@@ -44,7 +44,16 @@ Usage:
     --decoding-method modified_beam_search \
     --beam-size 4
 
-(4) fast beam search (one best)
+(4) modified beam search, fully tensorized
+./zipformer/decode.py \
+    --epoch 28 \
+    --avg 15 \
+    --exp-dir ./zipformer/exp \
+    --max-duration 600 \
+    --decoding-method modified_beam_search_batched \
+    --beam-size 4
+
+(5) fast beam search (one best)
 ./zipformer/decode.py \
     --epoch 28 \
     --avg 15 \
@@ -55,7 +64,7 @@ Usage:
     --max-contexts 8 \
     --max-states 64
 
-(5) fast beam search (nbest)
+(6) fast beam search (nbest)
 ./zipformer/decode.py \
     --epoch 28 \
     --avg 15 \
@@ -68,7 +77,7 @@ Usage:
     --num-paths 200 \
     --nbest-scale 0.5
 
-(6) fast beam search (nbest oracle WER)
+(7) fast beam search (nbest oracle WER)
 ./zipformer/decode.py \
     --epoch 28 \
     --avg 15 \
@@ -81,7 +90,7 @@ Usage:
     --num-paths 200 \
     --nbest-scale 0.5
 
-(7) fast beam search (with LG)
+(8) fast beam search (with LG)
 ./zipformer/decode.py \
     --epoch 28 \
     --avg 15 \
@@ -98,9 +107,10 @@ import argparse
 import logging
 import math
 import os
+import time
 from collections import defaultdict
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
 import k2
 import sentencepiece as spm
@@ -108,6 +118,8 @@ import torch
 import torch.nn as nn
 from asr_datamodule import LibriSpeechAsrDataModule
 from beam_search import (
+    BlankFrameSkipper,
+    DecoderOutCache,
     beam_search,
     fast_beam_search_nbest,
     fast_beam_search_nbest_LG,
@@ -116,6 +128,7 @@ from beam_search import (
     greedy_search,
     greedy_search_batch,
     modified_beam_search,
+    modified_beam_search_batched,
     modified_beam_search_lm_rescore,
     modified_beam_search_lm_rescore_LODR,
     modified_beam_search_lm_shallow_fusion,
@@ -124,13 +137,20 @@ from beam_search import (
 from lhotse import set_caching_enabled
 from train import add_model_arguments, get_model, get_params
 
-from icefall import ContextGraph, LmScorer, NgramLm
+from icefall import (
+    CompiledContextGraph,
+    CompiledNgramLm,
+    ContextGraph,
+    LmScorer,
+    NgramLm,
+)
 from icefall.checkpoint import (
     average_checkpoints,
     average_checkpoints_with_averaged_model,
     find_checkpoints,
     load_checkpoint,
 )
+from icefall.graph_cache import load_or_build_fsa
 from icefall.lexicon import Lexicon
 from icefall.utils import (
     AttributeDict,
@@ -208,6 +228,17 @@ def get_parser():
         help="The lang dir containing word table and LG graph",
     )
 
+    parser.add_argument(
+        "--graph-cache-dir",
+        type=str,
+        default="",
+        help="""If not empty, prepared decoding graphs, e.g., LG, are
+        cached in this directory, so that later decoding jobs with the same
+        graphs and options load them with mmap instead of preparing them
+        again. Empty to disable the cache.
+        """,
+    )
+
     parser.add_argument(
         "--decoding-method",
         type=str,
@@ -216,6 +247,7 @@ def get_parser():
           - greedy_search
           - beam_search
           - modified_beam_search
+          - modified_beam_search_batched
           - modified_beam_search_LODR
           - fast_beam_search
           - fast_beam_search_nbest
@@ -231,8 +263,8 @@ def get_parser():
         type=int,
         default=4,
         help="""An integer indicating how many candidates we will keep for each
-        frame. Used only when --decoding-method is beam_search or
-        modified_beam_search.""",
+        frame. Used only when --decoding-method is beam_search,
+        modified_beam_search or modified_beam_search_batched.""",
     )
 
     parser.add_argument(
@@ -349,6 +381,18 @@ def get_parser():
         help="ID of the backoff symbol in the ngram LM",
     )
 
+    parser.add_argument(
+        "--use-compiled-ngram-lm",
+        type=str2bool,
+        default=False,
+        help="""Used only when --decoding-method is modified_beam_search_LODR.
+        If True, compile the token level n-gram LM into arrays and save
+        it to exp_dir/{tokens_ngram}gram.compiled.bin, which is memory mapped
+        by later runs. It is recompiled if the FST is newer than it.
+        It gives the same results but is much faster.
+        """,
+    )
+
     parser.add_argument(
         "--context-score",
         type=float,
@@ -366,8 +410,45 @@ def get_parser():
         default="",
         help="""
         The path of the context biasing lists, one word/phrase each line
-        Used only when --decoding-method is modified_beam_search and
-        modified_beam_search_LODR.
+        Used only when --decoding-method is modified_beam_search,
+        modified_beam_search_batched and modified_beam_search_LODR.
+        """,
+    )
+
+    parser.add_argument(
+        "--compiled-context-graph",
+        type=str,
+        default="",
+        help="""
+        The path of a compiled context graph. If it exists, it is loaded
+        and --context-file is not used. Otherwise, the graph built from
+        --context-file is compiled and saved to it, so that a long list of
+        phrases is compiled only once.
+        Used only when --decoding-method is modified_beam_search or
+        modified_beam_search_batched. If it is empty, modified_beam_search
+        uses the uncompiled graph.
+        """,
+    )
+
+    parser.add_argument(
+        "--decoder-out-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache the decoder output of at most this many
+        decoder contexts and reuse them across frames and utterances.
+        Used only when --decoding-method is greedy_search, beam_search
+        or modified_beam_search. 0 to disable it.
+        """,
+    )
+
+    parser.add_argument(
+        "--blank-threshold",
+        type=float,
+        default=1.0,
+        help="""If less than 1, drop the encoder frames whose blank probability
+        from the CTC head is larger than it before the transducer search.
+        It requires a model trained with --use-ctc 1. The fraction of
+        dropped frames is logged. 1 to disable it.
         """,
     )
 
@@ -378,6 +459,14 @@ def get_parser():
         help="""Skip scoring, but still save the ASR output (for eval sets).""",
     )
 
+    parser.add_argument(
+        "--num-scoring-jobs",
+        type=int,
+        default=1,
+        help="""Number of processes to align the references and the
+        hypotheses when computing WERs.""",
+    )
+
     add_model_arguments(parser)
 
     return parser
@@ -390,10 +479,12 @@ def decode_one_batch(
     batch: dict,
     word_table: Optional[k2.SymbolTable] = None,
     decoding_graph: Optional[k2.Fsa] = None,
-    context_graph: Optional[ContextGraph] = None,
+    context_graph: Optional[Union[ContextGraph, CompiledContextGraph]] = None,
     LM: Optional[LmScorer] = None,
     ngram_lm=None,
     ngram_lm_scale: float = 0.0,
+    decoder_out_cache: Optional[DecoderOutCache] = None,
+    blank_frame_skipper: Optional[BlankFrameSkipper] = None,
 ) -> Dict[str, List[List[str]]]:
     """Decode one batch and return the result in a dict. The dict has the
     following format:
@@ -428,6 +519,13 @@ def decode_one_batch(
         A ngram language model
       ngram_lm_scale:
         The scale for the ngram language model.
+      decoder_out_cache:
+        If not None, it is used to compute the decoder output. Used only
+        when --decoding-method is greedy_search, beam_search or
+        modified_beam_search.
+      blank_frame_skipper:
+        If not None, it drops the encoder frames on which the CTC head
+        predicts blank with a high probability before the search.
     Returns:
       Return the decoding result. See above description for the format of
       the returned dict.
@@ -454,6 +552,11 @@ def decode_one_batch(
 
     encoder_out, encoder_out_lens = model.forward_encoder(feature, feature_lens)
 
+    if blank_frame_skipper is not None:
+        encoder_out, encoder_out_lens, _ = blank_frame_skipper(
+            encoder_out, encoder_out_lens
+        )
+
     hyps = []
 
     if params.decoding_method == "fast_beam_search":
@@ -516,6 +619,7 @@ def decode_one_batch(
             model=model,
             encoder_out=encoder_out,
             encoder_out_lens=encoder_out_lens,
+            decoder_out_cache=decoder_out_cache,
         )
         for hyp in sp.decode(hyp_tokens):
             hyps.append(hyp.split())
@@ -526,6 +630,17 @@ def decode_one_batch(
             encoder_out_lens=encoder_out_lens,
             beam=params.beam_size,
             context_graph=context_graph,
+            decoder_out_cache=decoder_out_cache,
+        )
+        for hyp in sp.decode(hyp_tokens):
+            hyps.append(hyp.split())
+    elif params.decoding_method == "modified_beam_search_batched":
+        hyp_tokens = modified_beam_search_batched(
+            model=model,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+            beam=params.beam_size,
+            context_graph=context_graph,
         )
         for hyp in sp.decode(hyp_tokens):
             hyps.append(hyp.split())
@@ -592,6 +707,7 @@ def decode_one_batch(
                     model=model,
                     encoder_out=encoder_out_i,
                     beam=params.beam_size,
+                    decoder_out_cache=decoder_out_cache,
                 )
             else:
                 raise ValueError(
@@ -642,10 +758,12 @@ def decode_dataset(
     sp: spm.SentencePieceProcessor,
     word_table: Optional[k2.SymbolTable] = None,
     decoding_graph: Optional[k2.Fsa] = None,
-    context_graph: Optional[ContextGraph] = None,
+    context_graph: Optional[Union[ContextGraph, CompiledContextGraph]] = None,
     LM: Optional[LmScorer] = None,
     ngram_lm=None,
     ngram_lm_scale: float = 0.0,
+    decoder_out_cache: Optional[DecoderOutCache] = None,
+    blank_frame_skipper: Optional[BlankFrameSkipper] = None,
 ) -> Dict[str, List[Tuple[str, List[str], List[str]]]]:
     """Decode dataset.
 
@@ -664,6 +782,12 @@ def decode_dataset(
         The decoding graph. Can be either a `k2.trivial_graph` or HLG, Used
         only when --decoding-method is fast_beam_search, fast_beam_search_nbest,
         fast_beam_search_nbest_oracle, and fast_beam_search_nbest_LG.
+      decoder_out_cache:
+        If not None, it is used to compute the decoder output and its
+        statistics are logged at the end.
+      blank_frame_skipper:
+        If not None, it is used to drop encoder frames before the search
+        and the fraction of dropped frames is logged at the end.
     Returns:
       Return a dict, whose key may be "greedy_search" if greedy search
       is used, or it may be "beam_7" if beam size of 7 is used.
@@ -683,6 +807,7 @@ def decode_dataset(
     else:
         log_interval = 20
 
+    start_time = time.time()
     results = defaultdict(list)
     for batch_idx, batch in enumerate(dl):
         texts = batch["supervisions"]["text"]
@@ -699,6 +824,8 @@ def decode_dataset(
             LM=LM,
             ngram_lm=ngram_lm,
             ngram_lm_scale=ngram_lm_scale,
+            decoder_out_cache=decoder_out_cache,
+            blank_frame_skipper=blank_frame_skipper,
         )
 
         for name, hyps in hyps_dict.items():
@@ -716,6 +843,21 @@ def decode_dataset(
             batch_str = f"{batch_idx}/{num_batches}"
 
             logging.info(f"batch {batch_str}, cuts processed until now is {num_cuts}")
+
+    if decoder_out_cache is not None:
+        logging.info(
+            f"Decoder output cache: {decoder_out_cache}. "
+            f"Saved decoder forward passes per utterance: "
+            f"{decoder_out_cache.num_hits / max(num_cuts, 1):.2f}"
+        )
+        decoder_out_cache.reset_stats()
+
+    if blank_frame_skipper is not None:
+        logging.info(f"Blank frame skipping: {blank_frame_skipper}")
+        blank_frame_skipper.reset_stats()
+
+    logging.info(f"Decoded {num_cuts} cuts in {time.time() - start_time:.2f} seconds")
+
     return results
 
 
@@ -752,7 +894,11 @@ def save_wer_results(
         errs_filename = params.res_dir / f"errs-{test_set_name}-{params.suffix}.txt"
         with open(errs_filename, "w", encoding="utf8") as fd:
             wer = write_error_stats(
-                fd, f"{test_set_name}-{key}", results, enable_log=True
+                fd,
+                f"{test_set_name}-{key}",
+                results,
+                enable_log=True,
+                num_jobs=params.num_scoring_jobs,
             )
             test_set_wers[key] = wer
 
@@ -797,6 +943,7 @@ def main():
         "fast_beam_search_nbest_LG",
         "fast_beam_search_nbest_oracle",
         "modified_beam_search",
+        "modified_beam_search_batched",
         "modified_beam_search_LODR",
         "modified_beam_search_lm_shallow_fusion",
         "modified_beam_search_lm_rescore",
@@ -804,7 +951,9 @@ def main():
     )
     params.res_dir = params.exp_dir / params.decoding_method
 
-    if os.path.exists(params.context_file):
+    if os.path.exists(params.context_file) or os.path.exists(
+        params.compiled_context_graph
+    ):
         params.has_contexts = True
     else:
         params.has_contexts = False
@@ -837,6 +986,7 @@ def main():
         params.suffix += f"__{params.decoding_method}__beam-size-{params.beam_size}"
         if params.decoding_method in (
             "modified_beam_search",
+            "modified_beam_search_batched",
             "modified_beam_search_LODR",
         ):
             if params.has_contexts:
@@ -853,6 +1003,9 @@ def main():
                 f"_LODR-{params.tokens_ngram}gram-scale-{params.ngram_lm_scale}"
             )
 
+    if params.blank_threshold < 1:
+        params.suffix += f"_blank-threshold-{params.blank_threshold}"
+
     if params.use_averaged_model:
         params.suffix += "_use-averaged-model"
 
@@ -993,14 +1146,38 @@ def main():
         ngram_lm_scale = None  # use a list to search
 
     elif params.decoding_method == "modified_beam_search_LODR":
-        lm_filename = f"{params.tokens_ngram}gram.fst.txt"
-        logging.info(f"Loading token level lm: {lm_filename}")
-        ngram_lm = NgramLm(
-            str(params.lang_dir / lm_filename),
-            backoff_id=params.backoff_id,
-            is_binary=False,
+        lm_filename = params.lang_dir / f"{params.tokens_ngram}gram.fst.txt"
+        compiled_lm_filename = (
+            params.exp_dir / f"{params.tokens_ngram}gram.compiled.bin"
         )
-        logging.info(f"num states: {ngram_lm.lm.num_states}")
+        if (
+            params.use_compiled_ngram_lm
+            and compiled_lm_filename.is_file()
+            and (
+                not lm_filename.is_file()
+                or compiled_lm_filename.stat().st_mtime >= lm_filename.stat().st_mtime
+            )
+        ):
+            logging.info(f"Loading compiled token level lm: {compiled_lm_filename}")
+            ngram_lm = CompiledNgramLm.load(compiled_lm_filename)
+            if ngram_lm.backoff_id != params.backoff_id:
+                raise ValueError(
+                    f"{compiled_lm_filename} uses backoff id {ngram_lm.backoff_id}, "
+                    f"but --backoff-id is {params.backoff_id}. Please remove it."
+                )
+            logging.info(f"num states: {ngram_lm.num_states}")
+        else:
+            logging.info(f"Loading token level lm: {lm_filename}")
+            ngram_lm = NgramLm(
+                str(lm_filename),
+                backoff_id=params.backoff_id,
+                is_binary=False,
+            )
+            logging.info(f"num states: {ngram_lm.lm.num_states}")
+            if params.use_compiled_ngram_lm:
+                ngram_lm = CompiledNgramLm.from_ngram_lm(ngram_lm)
+                ngram_lm.save(compiled_lm_filename)
+                logging.info(f"Saved compiled lm to {compiled_lm_filename}")
         ngram_lm_scale = params.ngram_lm_scale
     else:
         ngram_lm = None
@@ -1011,11 +1188,21 @@ def main():
             lexicon = Lexicon(params.lang_dir)
             word_table = lexicon.word_table
             lg_filename = params.lang_dir / "LG.pt"
-            logging.info(f"Loading {lg_filename}")
-            decoding_graph = k2.Fsa.from_dict(
-                torch.load(lg_filename, map_location=device)
+
+            def build_LG() -> k2.Fsa:
+                logging.info(f"Loading {lg_filename}")
+                LG = k2.Fsa.from_dict(torch.load(lg_filename, map_location=device))
+                LG.scores *= params.ngram_lm_scale
+                return LG
+
+            decoding_graph = load_or_build_fsa(
+                build_LG,
+                name="LG",
+                inputs=[lg_filename],
+                cache_dir=params.graph_cache_dir,
+                options={"ngram_lm_scale": params.ngram_lm_scale},
+                device=device,
             )
-            decoding_graph.scores *= params.ngram_lm_scale
         else:
             word_table = None
             decoding_graph = k2.trivial_graph(params.vocab_size - 1, device=device)
@@ -1023,13 +1210,56 @@ def main():
         decoding_graph = None
         word_table = None
 
-    if "modified_beam_search" in params.decoding_method:
+    if params.decoder_out_cache_size > 0 and params.decoding_method in (
+        "greedy_search",
+        "beam_search",
+        "modified_beam_search",
+    ):
+        decoder_out_cache = DecoderOutCache(
+            model, max_size=params.decoder_out_cache_size
+        )
+    else:
+        decoder_out_cache = None
+
+    if params.blank_threshold < 1:
+        assert params.use_ctc, "--blank-threshold requires --use-ctc 1"
+        blank_frame_skipper = BlankFrameSkipper(
+            model, blank_threshold=params.blank_threshold, blank_id=params.blank_id
+        )
+    else:
+        blank_frame_skipper = None
+
+    # modified_beam_search_batched supports only compiled context graphs
+    if params.decoding_method == "modified_beam_search_batched":
+        use_compiled_context_graph = True
+    elif params.decoding_method == "modified_beam_search":
+        use_compiled_context_graph = bool(params.compiled_context_graph)
+    else:
+        use_compiled_context_graph = False
+
+    if use_compiled_context_graph and os.path.exists(params.compiled_context_graph):
+        logging.info(f"Loading compiled context graph: {params.compiled_context_graph}")
+        context_graph = CompiledContextGraph.load(
+            params.compiled_context_graph, device=device
+        )
+    elif "modified_beam_search" in params.decoding_method:
         if os.path.exists(params.context_file):
             contexts = []
+            phrases = []
             for line in open(params.context_file).readlines():
-                contexts.append((sp.encode(line.strip()), 0.0))
+                contexts.append(sp.encode(line.strip()))
+                phrases.append(line.strip())
             context_graph = ContextGraph(params.context_score)
-            context_graph.build(contexts)
+            context_graph.build(token_ids=contexts, phrases=phrases)
+            if use_compiled_context_graph:
+                context_graph = CompiledContextGraph.from_context_graph(context_graph)
+                if params.compiled_context_graph:
+                    context_graph.save(params.compiled_context_graph)
+                    logging.info(
+                        "Saved compiled context graph to "
+                        f"{params.compiled_context_graph}"
+                    )
+                context_graph = context_graph.to(device)
         else:
             context_graph = None
     else:
@@ -1063,6 +1293,8 @@ def main():
             LM=LM,
             ngram_lm=ngram_lm,
             ngram_lm_scale=ngram_lm_scale,
+            decoder_out_cache=decoder_out_cache,
+            blank_frame_skipper=blank_frame_skipper,
         )
 
         save_asr_output(
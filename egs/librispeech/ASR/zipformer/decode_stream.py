@@ -19,6 +19,7 @@ import math
 from typing import List, Optional, Tuple
 
 import k2
+import kaldifeat
 import torch
 from beam_search import Hypothesis, HypothesisList
 
@@ -30,20 +31,27 @@ class DecodeStream(object):
         self,
         params: AttributeDict,
         cut_id: str,
-        initial_states: List[torch.Tensor],
+        initial_states: Optional[List[torch.Tensor]] = None,
         decoding_graph: Optional[k2.Fsa] = None,
         device: torch.device = torch.device("cpu"),
+        fbank_opts: Optional[kaldifeat.FbankOptions] = None,
     ) -> None:
         """
         Args:
           initial_states:
             Initial decode states of the model, e.g. the return value of
-            `get_init_state` in conformer.py
+            `get_init_state` in conformer.py. It is None if the states are
+            kept in a StreamingStatePool, see :attr:`slot`.
           decoding_graph:
             Decoding graph used for decoding, may be a TrivialGraph or a HLG.
             Used only when decoding_method is fast_beam_search.
           device:
             The device to run this stream.
+          fbank_opts:
+            If not None, the features are computed online from the samples
+            passed to :meth:`accept_waveform` and only the frames that are
+            not consumed yet are kept. Otherwise, the features of the whole
+            utterance are given by :meth:`set_features`.
         """
         if params.decoding_method == "fast_beam_search":
             assert decoding_graph is not None
@@ -55,8 +63,15 @@ class DecodeStream(object):
 
         self.states = initial_states
 
+        # The slot in the StreamingStatePool holding the states of this
+        # stream. It is used only when initial_states is None.
+        self.slot: int = -1
+
         # It contains a 2-D tensors representing the feature frames.
+        # If the features are computed online, it contains only the frames
+        # starting from frame `features_offset` of the utterance.
         self.features: torch.Tensor = None
+        self.features_offset: int = 0
 
         self.num_frames: int = 0
         # how many frames have been processed. (before subsampling).
@@ -78,6 +93,27 @@ class DecodeStream(object):
         # The ConvNeXt module needs (7 - 1) // 2 = 3 frames of right padding after subsampling
         self.pad_length = 7 + 2 * 3
 
+        self.device = device
+        self.online_fbank: Optional[kaldifeat.OnlineFbank] = None
+        # Set when all the samples of the utterance have been accepted
+        self.is_input_finished: bool = False
+        if fbank_opts is not None:
+            self.online_fbank = kaldifeat.OnlineFbank(fbank_opts)
+            self.feature_dim = fbank_opts.mel_opts.num_bins
+            # online_fbank keeps only the last max_feature_vectors frames if
+            # it is positive. We feed it with pieces of samples that are
+            # small enough so that no frame is dropped before it is fetched.
+            frame_opts = fbank_opts.frame_opts
+            self.max_piece_samples = -1
+            if frame_opts.max_feature_vectors > 0:
+                self.max_piece_samples = int(
+                    frame_opts.max_feature_vectors
+                    // 2
+                    * frame_opts.frame_shift_ms
+                    / 1000
+                    * frame_opts.samp_freq
+                )
+
         if params.decoding_method == "greedy_search":
             self.hyp = [-1] * (params.context_size - 1) + [params.blank_id]
         elif params.decoding_method == "modified_beam_search":
@@ -85,7 +121,7 @@ class DecodeStream(object):
             self.hyps.add(
                 Hypothesis(
                     ys=[-1] * (params.context_size - 1) + [params.blank_id],
-                    log_prob=torch.zeros(1, dtype=torch.float32, device=device),
+                    log_prob=0.0,
                 )
             )
         elif params.decoding_method == "fast_beam_search":
@@ -120,17 +156,99 @@ class DecodeStream(object):
         )
         self.num_frames = self.features.size(0)
 
+    def accept_waveform(self, sample_rate: float, waveform: torch.Tensor) -> None:
+        """Append samples of the current utterance and compute the features
+        of them incrementally.
+
+        Args:
+          sample_rate:
+            The sample rate of the samples.
+          waveform:
+            A 1-D float32 tensor containing the samples, normalized to [-1, 1].
+        """
+        assert self.online_fbank is not None, "Please pass fbank_opts"
+        assert not self.is_input_finished, self.cut_id
+
+        piece = self.max_piece_samples
+        if piece <= 0:
+            piece = max(waveform.numel(), 1)
+        for start in range(0, waveform.numel(), piece):
+            self.online_fbank.accept_waveform(
+                sampling_rate=sample_rate,
+                waveform=waveform[start : start + piece],  # noqa
+            )
+            self._fetch_features()
+
+    def input_finished(self, tail_pad_len: int = 0) -> None:
+        """Signal that all the samples of the current utterance have been
+        passed to :meth:`accept_waveform`. The remaining features are
+        computed and padded like in :meth:`set_features`.
+        """
+        assert self.online_fbank is not None, "Please pass fbank_opts"
+        self.online_fbank.input_finished()
+        self._fetch_features()
+        self.is_input_finished = True
+
+        if self.features is None:
+            self.features = torch.empty(0, self.feature_dim, device=self.device)
+        padding = self.pad_length + tail_pad_len
+        self.features = torch.nn.functional.pad(
+            self.features,
+            (0, 0, 0, padding),
+            mode="constant",
+            value=self.LOG_EPS,
+        )
+        self.num_frames += padding
+
+    def _fetch_features(self) -> None:
+        """Move the new frames of online_fbank to self.features."""
+        num_frames_ready = self.online_fbank.num_frames_ready
+        if num_frames_ready == self.num_frames:
+            return
+        frames = self.online_fbank.get_frames(
+            list(range(self.num_frames, num_frames_ready))
+        )
+        if self.features is None:
+            self.features = frames
+        else:
+            self.features = torch.cat([self.features, frames], dim=0)
+        self.num_frames = num_frames_ready
+
+    def is_ready(self, chunk_size: int) -> bool:
+        """Return True if the features for the next call of
+        :meth:`get_feature_frames` with the same chunk_size are available.
+        """
+        if self.done:
+            return False
+        if self.online_fbank is None or self.is_input_finished:
+            return True
+        return (
+            self.num_frames - self.num_processed_frames >= chunk_size + self.pad_length
+        )
+
     def get_feature_frames(self, chunk_size: int) -> Tuple[torch.Tensor, int]:
         """Consume chunk_size frames of features"""
         chunk_length = chunk_size + self.pad_length
 
         ret_length = min(self.num_frames - self.num_processed_frames, chunk_length)
 
-        ret_features = self.features[
-            self.num_processed_frames : self.num_processed_frames + ret_length  # noqa
-        ]
+        start = self.num_processed_frames - self.features_offset
+        ret_features = self.features[start : start + ret_length]  # noqa
 
         self.num_processed_frames += chunk_size
+
+        if self.online_fbank is not None:
+            assert self.is_input_finished or ret_length == chunk_length, (
+                "Please call get_feature_frames() only if is_ready() is True",
+                self.cut_id,
+            )
+            # Drop the consumed frames so that the number of kept frames is
+            # bounded by the chunk size plus the padding.
+            self.features = self.features[chunk_size:]
+            self.features_offset += chunk_size
+            if not self.is_input_finished:
+                return ret_features, ret_length
+
         if self.num_processed_frames >= self.num_frames:
             self._done = True
 
@@ -58,6 +58,11 @@ It will generate the following 3 files inside $repo/exp:
 
 See ./onnx_pretrained.py and ./onnx_check.py for how to
 use the exported ONNX models.
+
+With --static-int8 1, it also generates statically quantized int8 models,
+calibrated with the cuts from --calibration-cuts. See
+./onnx_check_quantized.py for how to compare their WER, size and RTF with
+those of the fp32 and dynamically quantized int8 models.
 """
 
 import argparse
@@ -159,6 +164,34 @@ def get_parser():
         help="Whether to export models in fp16",
     )
 
+    parser.add_argument(
+        "--static-int8",
+        type=str2bool,
+        default=False,
+        help="""Whether to also export statically quantized int8 models,
+        i.e., *.int8-static.onnx. They are calibrated with the cuts
+        from --calibration-cuts. See ./onnx_check_quantized.py for how to
+        compare them with the fp32 and the dynamically quantized models.
+        """,
+    )
+
+    parser.add_argument(
+        "--calibration-cuts",
+        type=str,
+        default="data/fbank/librispeech_cuts_dev-clean.jsonl.gz",
+        help="The cuts used for calibration if --static-int8 is true",
+    )
+
+    parser.add_argument(
+        "--num-calibration-batches",
+        type=int,
+        default=10,
+        help="""Number of batches from --calibration-cuts used for
+        calibration. The batch size is set by --max-duration, which, like
+        the other options of LibriSpeechAsrDataModule, is available only
+        if --static-int8 is true.""",
+    )
+
     add_model_arguments(parser)
 
     return parser
@@ -429,7 +462,15 @@ def export_joiner_model_onnx(
 
 @torch.no_grad()
 def main():
-    args = get_parser().parse_args()
+    parser = get_parser()
+    args, _ = parser.parse_known_args()
+    if args.static_int8:
+        # The data module and its dependencies are needed only for
+        # calibration, so they are not imported otherwise.
+        from asr_datamodule import LibriSpeechAsrDataModule
+
+        LibriSpeechAsrDataModule.add_arguments(parser)
+    args = parser.parse_args()
     args.exp_dir = Path(args.exp_dir)
 
     params = get_params()
@@ -639,6 +680,27 @@ def main():
         weight_type=QuantType.QInt8,
     )
 
+    if params.static_int8:
+        from asr_datamodule import LibriSpeechAsrDataModule
+        from lhotse import load_manifest_lazy
+        from onnx_quantize import export_static_int8_models
+
+        logging.info("Generate static int8 quantization models")
+        logging.info(f"Calibration cuts: {params.calibration_cuts}")
+
+        params.return_cuts = True
+        librispeech = LibriSpeechAsrDataModule(params)
+        calibration_cuts = load_manifest_lazy(params.calibration_cuts)
+        calibration_dl = librispeech.test_dataloaders(calibration_cuts)
+
+        export_static_int8_models(
+            encoder_filename=encoder_filename,
+            decoder_filename=decoder_filename,
+            joiner_filename=joiner_filename,
+            dl=calibration_dl,
+            num_batches=params.num_calibration_batches,
+        )
+
 
 if __name__ == "__main__":
     formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
@@ -33,18 +33,29 @@ Usage of this script:
   --tokens ./data/lang_bpe_500/tokens.txt \
   /path/to/foo.wav \
   /path/to/bar.wav
+
+To decode a large number of sound files, list them in a text file, one
+per line, and decode them in batches of at most 600 seconds of padded
+audio. The files are sorted by duration, the features of the next batch
+are computed while the current batch is decoded, and the results of each
+batch are printed as soon as it is decoded:
+
+./zipformer/jit_pretrained.py \
+  --nn-model-filename ./zipformer/exp/cpu_jit.pt \
+  --tokens ./data/lang_bpe_500/tokens.txt \
+  --sound-file-list /path/to/wav.list \
+  --max-duration 600
 """
 
 import argparse
 import logging
-import math
 from typing import List
 
 import k2
 import kaldifeat
 import torch
 import torchaudio
-from torch.nn.utils.rnn import pad_sequence
+from bucketed_decode import add_bucketing_arguments, decode_sound_files, get_sound_files
 
 
 def get_parser():
@@ -68,13 +79,15 @@ def get_parser():
     parser.add_argument(
         "sound_files",
         type=str,
-        nargs="+",
+        nargs="*",
         help="The input sound file(s) to transcribe. "
         "Supported formats are those supported by torchaudio.load(). "
         "For example, wav and flac are supported. "
         "The sample rate has to be 16kHz.",
     )
 
+    add_bucketing_arguments(parser)
+
     return parser
 
 
@@ -226,36 +239,15 @@ def main():
 
     fbank = kaldifeat.Fbank(opts)
 
-    logging.info(f"Reading sound files: {args.sound_files}")
-    waves = read_sound_files(
-        filenames=args.sound_files,
-    )
-    waves = [w.to(device) for w in waves]
-
-    logging.info("Decoding started")
-    features = fbank(waves)
-    feature_lengths = [f.size(0) for f in features]
-
-    features = pad_sequence(
-        features,
-        batch_first=True,
-        padding_value=math.log(1e-10),
-    )
-
-    feature_lengths = torch.tensor(feature_lengths, device=device)
-
-    encoder_out, encoder_out_lens = model.encoder(
-        features=features,
-        feature_lengths=feature_lengths,
-    )
-
-    hyps = greedy_search(
-        model=model,
-        encoder_out=encoder_out,
-        encoder_out_lens=encoder_out_lens,
-    )
+    sound_files = get_sound_files(args.sound_files, args.sound_file_list)
+    logging.info(f"Number of sound files: {len(sound_files)}")
 
-    s = "\n"
+    def compute_features(filenames: List[str]) -> List[torch.Tensor]:
+        waves = read_sound_files(
+            filenames=filenames,
+        )
+        waves = [w.to(device) for w in waves]
+        return fbank(waves)
 
     token_table = k2.SymbolTable.from_file(args.tokens)
 
@@ -265,11 +257,34 @@ def main():
             text += token_table[i]
         return text.replace("▁", " ").strip()
 
-    for filename, hyp in zip(args.sound_files, hyps):
-        words = token_ids_to_words(hyp)
-        s += f"{filename}:\n{words}\n"
+    def decode_batch(
+        features: torch.Tensor, feature_lengths: torch.Tensor
+    ) -> List[str]:
+        encoder_out, encoder_out_lens = model.encoder(
+            features=features,
+            feature_lengths=feature_lengths,
+        )
 
-    logging.info(s)
+        hyps = greedy_search(
+            model=model,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+        )
+        return [token_ids_to_words(hyp) for hyp in hyps]
+
+    logging.info("Decoding started")
+    # The results of each batch are printed as soon as it is decoded
+    for results in decode_sound_files(
+        filenames=sound_files,
+        compute_features=compute_features,
+        decode_batch=decode_batch,
+        max_duration=args.max_duration,
+        num_threads=args.num_feature_threads,
+    ):
+        s = "\n"
+        for filename, words in results:
+            s += f"{filename}:\n{words}\n"
+        logging.info(s)
 
     logging.info("Decoding Done")
 
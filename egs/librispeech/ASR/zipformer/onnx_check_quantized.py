@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Xiaomi Corporation
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the fp32 ONNX models exported by ./export-onnx.py
+with the quantized ones. For each variant, it decodes the test sets with
+greedy search as ./onnx_decode.py does and reports the model size, the
+WER, the WER difference from the first variant and the RTF.
+
+It exits with an error if the WER of any variant is worse than that of
+the first variant by more than --max-wer-delta on any test set.
+
+1. Export the models with static int8 quantization
+
+./zipformer/export-onnx.py \
+  --tokens $repo/data/lang_bpe_500/tokens.txt \
+  --use-averaged-model 0 \
+  --epoch 99 \
+  --avg 1 \
+  --exp-dir $repo/exp \
+  --static-int8 1 \
+  --calibration-cuts data/fbank/librispeech_cuts_dev-clean.jsonl.gz \
+  --num-calibration-batches 10
+
+It generates the following files inside $repo/exp, where {model} is
+encoder, decoder and joiner:
+
+  - {model}-epoch-99-avg-1.onnx, the fp32 models
+  - {model}-epoch-99-avg-1.int8.onnx, the dynamically quantized models
+  - {model}-epoch-99-avg-1.int8-static.onnx, the statically quantized models
+
+2. Run this file
+
+./zipformer/onnx_check_quantized.py \
+  --exp-dir $repo/exp \
+  --max-duration 600 \
+  --encoder-model-filename $repo/exp/encoder-epoch-99-avg-1.onnx \
+  --decoder-model-filename $repo/exp/decoder-epoch-99-avg-1.onnx \
+  --joiner-model-filename $repo/exp/joiner-epoch-99-avg-1.onnx \
+  --tokens $repo/data/lang_bpe_500/tokens.txt \
+  --variants fp32,int8,int8-static \
+  --test-sets test-clean,test-other
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import torch
+from asr_datamodule import LibriSpeechAsrDataModule
+from k2 import SymbolTable
+from onnx_decode import decode_dataset, save_results
+from onnx_pretrained import OnnxModel
+
+from icefall.utils import setup_logger
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--encoder-model-filename",
+        type=str,
+        required=True,
+        help="Path to the fp32 encoder onnx model. ",
+    )
+
+    parser.add_argument(
+        "--decoder-model-filename",
+        type=str,
+        required=True,
+        help="Path to the fp32 decoder onnx model. ",
+    )
+
+    parser.add_argument(
+        "--joiner-model-filename",
+        type=str,
+        required=True,
+        help="Path to the fp32 joiner onnx model. ",
+    )
+
+    parser.add_argument(
+        "--exp-dir",
+        type=str,
+        default="zipformer/exp",
+        help="The experiment dir",
+    )
+
+    parser.add_argument(
+        "--tokens",
+        type=str,
+        help="""Path to tokens.txt.""",
+    )
+
+    parser.add_argument(
+        "--variants",
+        type=str,
+        default="fp32,int8,int8-static",
+        help="""Comma separated variants to compare. fp32 uses the given
+        models. For other variants, e.g., int8, the suffix .onnx of the
+        given models is replaced with .int8.onnx. The first variant is
+        the reference.""",
+    )
+
+    parser.add_argument(
+        "--test-sets",
+        type=str,
+        default="test-clean,test-other",
+        help="Comma separated test sets, e.g., test-clean, dev-other",
+    )
+
+    parser.add_argument(
+        "--max-wer-delta",
+        type=float,
+        default=0.5,
+        help="""Maximum allowed absolute increase of the WER in percent
+        over the first variant.""",
+    )
+
+    return parser
+
+
+def get_model_filename(filename: str, variant: str) -> Path:
+    filename = Path(filename)
+    if variant == "fp32":
+        return filename
+    return filename.with_suffix(f".{variant}.onnx")
+
+
+@torch.no_grad()
+def main():
+    parser = get_parser()
+    LibriSpeechAsrDataModule.add_arguments(parser)
+    args = parser.parse_args()
+
+    res_dir = Path(args.exp_dir) / "onnx-check-quantized"
+
+    setup_logger(f"{res_dir}/log-check")
+    logging.info(vars(args))
+
+    token_table = SymbolTable.from_file(args.tokens)
+
+    # we need cut ids to display recognition results.
+    args.return_cuts = True
+    librispeech = LibriSpeechAsrDataModule(args)
+
+    test_sets = args.test_sets.split(",")
+    test_dl = {}
+    for test_set in test_sets:
+        cuts = getattr(librispeech, f"{test_set.replace('-', '_')}_cuts")()
+        test_dl[test_set] = librispeech.test_dataloaders(cuts)
+
+    # stats[variant] = (size in MB, {test_set: (WER, RTF)})
+    stats = {}
+    for variant in args.variants.split(","):
+        filenames = [
+            get_model_filename(f, variant)
+            for f in [
+                args.encoder_model_filename,
+                args.decoder_model_filename,
+                args.joiner_model_filename,
+            ]
+        ]
+        logging.info(f"Decoding with {variant}: {[str(f) for f in filenames]}")
+        size = sum(f.stat().st_size for f in filenames) / 1024**2
+
+        model = OnnxModel(*map(str, filenames))
+        (res_dir / variant).mkdir(parents=True, exist_ok=True)
+
+        results = {}
+        for test_set in test_sets:
+            start_time = time.time()
+            hyps, total_duration = decode_dataset(
+                dl=test_dl[test_set], model=model, token_table=token_table
+            )
+            rtf = (time.time() - start_time) / total_duration
+
+            wer = save_results(
+                res_dir=res_dir / variant, test_set_name=test_set, results=hyps
+            )
+            results[test_set] = (wer, rtf)
+        stats[variant] = (size, results)
+
+    ref_variant = next(iter(stats))
+    ref_size, ref_results = stats[ref_variant]
+
+    s = f"\nReference: {ref_variant}\n"
+    failed = []
+    for variant, (size, results) in stats.items():
+        s += f"{variant}: size {size:.1f} MB ({size / ref_size:.2f}x)"
+        for test_set, (wer, rtf) in results.items():
+            delta = wer - ref_results[test_set][0]
+            s += f", {test_set} WER {wer:.2f} ({delta:+.2f}) RTF {rtf:.3f}"
+            if delta > args.max_wer_delta:
+                failed.append(f"{variant} on {test_set}")
+        s += "\n"
+    logging.info(s)
+
+    with open(res_dir / "summary.txt", "w") as f:
+        print(s, file=f)
+
+    if failed:
+        logging.error(
+            f"The WER increases by more than {args.max_wer_delta} for: "
+            f"{', '.join(failed)}"
+        )
+        sys.exit(1)
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
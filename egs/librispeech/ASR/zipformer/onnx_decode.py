@@ -236,7 +236,12 @@ def save_results(
     res_dir: Path,
     test_set_name: str,
     results: List[Tuple[str, List[str], List[str]]],
-):
+) -> float:
+    """Save the transcripts and the error stats to res_dir.
+
+    Returns:
+      Return the WER in percent.
+    """
     recog_path = res_dir / f"recogs-{test_set_name}.txt"
     results = sorted(results)
     store_transcripts(filename=recog_path, texts=results)
@@ -258,6 +263,8 @@ def save_results(
     s = "\nFor {}, WER is {}:\n".format(test_set_name, wer)
     logging.info(s)
 
+    return wer
+
 
 @torch.no_grad()
 def main():
@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+# Copyright      2024  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script loads ONNX models exported by ./export-onnx-streaming.py
+and uses them to decode multiple waves concurrently.
+
+Unlike ./onnx_pretrained-streaming.py, which decodes a single stream,
+BatchedOnnxStreamingModel in this file decodes up to --max-num-streams
+streams together:
+
+  - The encoder runs once per chunk for all streams. The encoder states are
+    kept in preallocated buffers that are bound to the session with IO
+    binding, so they are never copied between chunks.
+  - Greedy search runs the joiner once per frame and the decoder at most
+    once per frame for all streams.
+
+Please see ./onnx_pretrained-streaming.py for how to export the models.
+
+Usage:
+
+./zipformer/onnx_pretrained_streaming_batch.py \
+  --encoder-model-filename $repo/exp/encoder-epoch-99-avg-1.onnx \
+  --decoder-model-filename $repo/exp/decoder-epoch-99-avg-1.onnx \
+  --joiner-model-filename $repo/exp/joiner-epoch-99-avg-1.onnx \
+  --tokens $repo/data/lang_bpe_500/tokens.txt \
+  --max-num-streams 3 \
+  $repo/test_wavs/1089-134686-0001.wav \
+  $repo/test_wavs/1221-135766-0001.wav \
+  $repo/test_wavs/1221-135766-0002.wav
+
+See also ./benchmark_onnx_streaming.py for the real time factor with
+different numbers of streams.
+"""
+
+import argparse
+import logging
+from typing import List, Optional
+
+import k2
+import numpy as np
+import onnxruntime as ort
+import torch
+import torchaudio
+from kaldifeat import FbankOptions, OnlineFbank, OnlineFeature
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--encoder-model-filename",
+        type=str,
+        required=True,
+        help="Path to the encoder onnx model. ",
+    )
+
+    parser.add_argument(
+        "--decoder-model-filename",
+        type=str,
+        required=True,
+        help="Path to the decoder onnx model. ",
+    )
+
+    parser.add_argument(
+        "--joiner-model-filename",
+        type=str,
+        required=True,
+        help="Path to the joiner onnx model. ",
+    )
+
+    parser.add_argument(
+        "--tokens",
+        type=str,
+        help="""Path to tokens.txt.""",
+    )
+
+    parser.add_argument(
+        "--max-num-streams",
+        type=int,
+        default=4,
+        help="Maximum number of streams that are decoded together",
+    )
+
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=1,
+        help="Number of threads of each onnxruntime session",
+    )
+
+    parser.add_argument(
+        "sound_files",
+        type=str,
+        nargs="+",
+        help="The input sound file(s) to transcribe. "
+        "Supported formats are those supported by torchaudio.load(). "
+        "For example, wav and flac are supported. "
+        "The sample rate has to be 16kHz.",
+    )
+
+    return parser
+
+
+def read_sound_files(
+    filenames: List[str], expected_sample_rate: float
+) -> List[torch.Tensor]:
+    """Read a list of sound files into a list 1-D float32 torch tensors.
+    Args:
+      filenames:
+        A list of sound filenames.
+      expected_sample_rate:
+        The expected sample rate of the sound files.
+    Returns:
+      Return a list of 1-D float32 torch tensors.
+    """
+    ans = []
+    for f in filenames:
+        wave, sample_rate = torchaudio.load(f)
+        assert (
+            sample_rate == expected_sample_rate
+        ), f"expected sample rate: {expected_sample_rate}. Given: {sample_rate}"
+        # We use only the first channel
+        ans.append(wave[0].contiguous())
+    return ans
+
+
+def create_streaming_feature_extractor() -> OnlineFeature:
+    """Create a CPU streaming feature extractor.
+
+    At present, we assume it returns a fbank feature extractor with
+    fixed options. In the future, we will support passing in the options
+    from outside.
+
+    Returns:
+      Return a CPU streaming feature extractor.
+    """
+    opts = FbankOptions()
+    opts.device = "cpu"
+    opts.frame_opts.dither = 0
+    opts.frame_opts.snip_edges = False
+    opts.frame_opts.samp_freq = 16000
+    opts.mel_opts.num_bins = 80
+    opts.mel_opts.high_freq = -400
+    return OnlineFbank(opts)
+
+
+class Stream:
+    """The features and the decoding result of one utterance."""
+
+    def __init__(
+        self,
+        context_size: int,
+        segment: int,
+        offset: int,
+        blank_id: int = 0,
+    ):
+        """
+        Args:
+          context_size:
+            The context size of the decoder model.
+          segment:
+            Number of frames of each chunk fed to the encoder.
+          offset:
+            Number of frames to move forward after each chunk.
+          blank_id:
+            ID of the blank token.
+        """
+        self.online_fbank = create_streaming_feature_extractor()
+        self.segment = segment
+        self.offset = offset
+        self.num_processed_frames = 0
+        self.input_finished = False
+
+        # The first context_size tokens are blanks
+        self.hyp = [blank_id] * context_size
+
+        # Index of this stream in the batch. It is set by
+        # BatchedOnnxStreamingModel.add_stream()
+        self.slot: Optional[int] = None
+
+    def accept_waveform(self, sample_rate: float, samples: torch.Tensor) -> None:
+        self.online_fbank.accept_waveform(sampling_rate=sample_rate, waveform=samples)
+
+    def finish_input(self, sample_rate: float) -> None:
+        """Signal that no more samples will be given."""
+        tail_padding = torch.zeros(int(0.3 * sample_rate), dtype=torch.float32)
+        self.accept_waveform(sample_rate, tail_padding)
+        self.online_fbank.input_finished()
+        self.input_finished = True
+
+    def is_ready(self) -> bool:
+        """Return True if there are enough frames for the next chunk."""
+        num_frames = self.online_fbank.num_frames_ready - self.num_processed_frames
+        return num_frames >= self.segment
+
+    @property
+    def done(self) -> bool:
+        """Return True if all frames that form a complete chunk are decoded.
+        Like ./onnx_pretrained-streaming.py, the remaining frames are dropped.
+        """
+        return self.input_finished and not self.is_ready()
+
+    def get_frames(self) -> torch.Tensor:
+        """Return the frames of the next chunk, of shape (segment, 80), and
+        move forward by offset frames."""
+        frames = [
+            self.online_fbank.get_frame(self.num_processed_frames + i)
+            for i in range(self.segment)
+        ]
+        self.num_processed_frames += self.offset
+        return torch.cat(frames, dim=0)
+
+
+# Map the type of an onnx tensor to a numpy dtype
+_ONNX_TO_NUMPY_DTYPE = {
+    "tensor(float)": np.float32,
+    "tensor(int64)": np.int64,
+}
+
+
+class BatchedOnnxStreamingModel:
+    """Decode up to max_num_streams streams together.
+
+    Each stream occupies a slot, i.e., an index along the batch axis, from
+    add_stream() to remove_stream(). The encoder and the joiner always run
+    with a batch of max_num_streams, so all their inputs, outputs and the
+    encoder states are allocated once and bound to the sessions with IO
+    binding.
+
+    The encoder states use two sets of buffers. One set is the input of a
+    chunk and the other set receives the output, which becomes the input of
+    the next chunk. Only the states of slots that are idle in a chunk are
+    copied back, since the encoder also updates them.
+    """
+
+    def __init__(
+        self,
+        encoder_model_filename: str,
+        decoder_model_filename: str,
+        joiner_model_filename: str,
+        max_num_streams: int,
+        num_threads: int = 1,
+    ):
+        session_opts = ort.SessionOptions()
+        session_opts.inter_op_num_threads = 1
+        session_opts.intra_op_num_threads = num_threads
+
+        self.session_opts = session_opts
+        self.max_num_streams = max_num_streams
+        self.blank_id = 0
+
+        # OrtValues created from numpy arrays share memory with them. Keep
+        # them alive as long as the bindings.
+        self._ortvalues = []
+
+        self.init_decoder(decoder_model_filename)
+        self.init_joiner(joiner_model_filename)
+        self.init_encoder(encoder_model_filename)
+
+        self.free_slots = list(range(max_num_streams - 1, -1, -1))
+
+    def _to_ortvalue(self, array: np.ndarray) -> ort.OrtValue:
+        ortvalue = ort.OrtValue.ortvalue_from_numpy(array)
+        self._ortvalues.append(ortvalue)
+        return ortvalue
+
+    def init_encoder(self, encoder_model_filename: str):
+        self.encoder = ort.InferenceSession(
+            encoder_model_filename,
+            sess_options=self.session_opts,
+            providers=["CPUExecutionProvider"],
+        )
+
+        encoder_meta = self.encoder.get_modelmeta().custom_metadata_map
+        logging.info(f"encoder_meta={encoder_meta}")
+
+        model_type = encoder_meta["model_type"]
+        assert model_type == "zipformer2", model_type
+
+        self.segment = int(encoder_meta["T"])
+        self.offset = int(encoder_meta["decode_chunk_len"])
+
+        N = self.max_num_streams
+
+        # Each entry contains (input name, batch axis, buffer A, buffer B)
+        self.states = []
+        for i in self.encoder.get_inputs():
+            # Only the batch axis has a symbolic size
+            batch_axis = [isinstance(d, str) for d in i.shape].index(True)
+            shape = [N if isinstance(d, str) else d for d in i.shape]
+            dtype = _ONNX_TO_NUMPY_DTYPE[i.type]
+            if i.name == "x":
+                self.x = np.zeros(shape, dtype=dtype)
+                continue
+            self.states.append(
+                (
+                    i.name,
+                    batch_axis,
+                    np.zeros(shape, dtype=dtype),
+                    np.zeros(shape, dtype=dtype),
+                )
+            )
+
+        # bindings[k] reads the states from buffer k and writes the new
+        # states to buffer 1 - k
+        x = self._to_ortvalue(self.x)
+        state_ortvalues = [
+            [self._to_ortvalue(buffers[k]) for _, _, *buffers in self.states]
+            for k in range(2)
+        ]
+        self.bindings = []
+        for k in range(2):
+            binding = self.encoder.io_binding()
+            binding.bind_ortvalue_input("x", x)
+            for (name, _, _, _), src, dst in zip(
+                self.states, state_ortvalues[k], state_ortvalues[1 - k]
+            ):
+                binding.bind_ortvalue_input(name, src)
+                binding.bind_ortvalue_output(f"new_{name}", dst)
+            self.bindings.append(binding)
+        self.current = 0
+
+        # Run it once to get the shape of encoder_out. Only encoder_out is
+        # bound as output, so the states are not changed.
+        binding = self.encoder.io_binding()
+        binding.bind_ortvalue_input("x", x)
+        for (name, _, _, _), src in zip(self.states, state_ortvalues[0]):
+            binding.bind_ortvalue_input(name, src)
+        binding.bind_output("encoder_out", "cpu")
+        self.encoder.run_with_iobinding(binding)
+        shape = binding.get_outputs()[0].shape()
+
+        self.encoder_out = np.zeros(shape, dtype=np.float32)
+        encoder_out = self._to_ortvalue(self.encoder_out)
+        for binding in self.bindings:
+            binding.bind_ortvalue_output("encoder_out", encoder_out)
+
+        logging.info(f"segment: {self.segment}, offset: {self.offset}")
+        logging.info(f"encoder_out: {shape}")
+
+    def init_decoder(self, decoder_model_filename: str):
+        self.decoder = ort.InferenceSession(
+            decoder_model_filename,
+            sess_options=self.session_opts,
+            providers=["CPUExecutionProvider"],
+        )
+
+        decoder_meta = self.decoder.get_modelmeta().custom_metadata_map
+        self.context_size = int(decoder_meta["context_size"])
+        self.vocab_size = int(decoder_meta["vocab_size"])
+
+        logging.info(f"context_size: {self.context_size}")
+        logging.info(f"vocab_size: {self.vocab_size}")
+
+        N = self.max_num_streams
+        self.decoder_input = np.full(
+            (N, self.context_size), self.blank_id, dtype=np.int64
+        )
+
+        self.decoder_binding = self.decoder.io_binding()
+        self.decoder_binding.bind_ortvalue_input(
+            self.decoder.get_inputs()[0].name, self._to_ortvalue(self.decoder_input)
+        )
+        # The shape of decoder_out is known after the joiner is loaded
+        self.decoder_out = None
+
+    def init_joiner(self, joiner_model_filename: str):
+        self.joiner = ort.InferenceSession(
+            joiner_model_filename,
+            sess_options=self.session_opts,
+            providers=["CPUExecutionProvider"],
+        )
+
+        joiner_meta = self.joiner.get_modelmeta().custom_metadata_map
+        self.joiner_dim = int(joiner_meta["joiner_dim"])
+
+        logging.info(f"joiner_dim: {self.joiner_dim}")
+
+        N = self.max_num_streams
+        self.joiner_encoder_out = np.zeros((N, self.joiner_dim), dtype=np.float32)
+        self.decoder_out = np.zeros((N, self.joiner_dim), dtype=np.float32)
+        self.logit = np.zeros((N, self.vocab_size), dtype=np.float32)
+
+        decoder_out = self._to_ortvalue(self.decoder_out)
+        self.decoder_binding.bind_ortvalue_output(
+            self.decoder.get_outputs()[0].name, decoder_out
+        )
+
+        self.joiner_binding = self.joiner.io_binding()
+        self.joiner_binding.bind_ortvalue_input(
+            self.joiner.get_inputs()[0].name,
+            self._to_ortvalue(self.joiner_encoder_out),
+        )
+        self.joiner_binding.bind_ortvalue_input(
+            self.joiner.get_inputs()[1].name, decoder_out
+        )
+        self.joiner_binding.bind_ortvalue_output(
+            self.joiner.get_outputs()[0].name, self._to_ortvalue(self.logit)
+        )
+
+        # decoder_out of blank contexts for all slots
+        self.decoder.run_with_iobinding(self.decoder_binding)
+
+    @property
+    def num_free_slots(self) -> int:
+        return len(self.free_slots)
+
+    def add_stream(self, stream: Stream) -> None:
+        """Assign a free slot to the stream and reset the states of the slot."""
+        assert self.free_slots, "There are no free slots"
+        assert stream.slot is None, stream.slot
+        slot = self.free_slots.pop()
+        stream.slot = slot
+
+        for _, batch_axis, *buffers in self.states:
+            buffers[self.current][(slice(None),) * batch_axis + (slot,)] = 0
+
+        self.decoder_input[slot] = stream.hyp[-self.context_size :]
+        self.decoder.run_with_iobinding(self.decoder_binding)
+
+    def remove_stream(self, stream: Stream) -> None:
+        """Free the slot of the stream."""
+        assert stream.slot is not None
+        self.free_slots.append(stream.slot)
+        stream.slot = None
+
+    def run_encoder(self, slots: List[int]) -> np.ndarray:
+        """Run the encoder on the chunk in self.x.
+
+        Args:
+          slots:
+            The slots with a chunk in self.x. The states of other slots
+            are not changed.
+        Returns:
+          Return a 3-D array of shape (max_num_streams, T', joiner_dim).
+          It is overwritten by the next call.
+        """
+        self.encoder.run_with_iobinding(self.bindings[self.current])
+
+        src = self.current
+        self.current = 1 - self.current
+
+        idle = sorted(set(range(self.max_num_streams)) - set(slots))
+        if idle:
+            for _, batch_axis, *buffers in self.states:
+                index = (slice(None),) * batch_axis + (idle,)
+                buffers[self.current][index] = buffers[src][index]
+
+        return self.encoder_out
+
+    def greedy_search(self, streams: List[Stream], encoder_out: np.ndarray) -> None:
+        """Greedy search in batch mode. It hardcodes --max-sym-per-frame=1.
+        The decoded tokens are appended to stream.hyp.
+
+        Args:
+          streams:
+            The streams that are decoded.
+          encoder_out:
+            A 3-D array of shape (max_num_streams, T', joiner_dim) returned
+            by run_encoder().
+        """
+        slots = [s.slot for s in streams]
+        for t in range(encoder_out.shape[1]):
+            np.copyto(self.joiner_encoder_out, encoder_out[:, t])
+            self.joiner.run_with_iobinding(self.joiner_binding)
+            tokens = self.logit[slots].argmax(axis=1).tolist()
+
+            emitted = False
+            for stream, y in zip(streams, tokens):
+                if y != self.blank_id:
+                    stream.hyp.append(y)
+                    self.decoder_input[stream.slot] = stream.hyp[-self.context_size :]
+                    emitted = True
+
+            if emitted:
+                # The outputs of other slots do not change since their
+                # inputs are the same
+                self.decoder.run_with_iobinding(self.decoder_binding)
+
+    def decode_chunk(self, streams: List[Stream]) -> None:
+        """Decode the next chunk of each given stream, which must be ready."""
+        for stream in streams:
+            self.x[stream.slot] = stream.get_frames().numpy()
+        encoder_out = self.run_encoder([s.slot for s in streams])
+        self.greedy_search(streams, encoder_out)
+
+
+@torch.no_grad()
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    logging.info(vars(args))
+
+    model = BatchedOnnxStreamingModel(
+        encoder_model_filename=args.encoder_model_filename,
+        decoder_model_filename=args.decoder_model_filename,
+        joiner_model_filename=args.joiner_model_filename,
+        max_num_streams=args.max_num_streams,
+        num_threads=args.num_threads,
+    )
+    token_table = k2.SymbolTable.from_file(args.tokens)
+
+    sample_rate = 16000
+
+    logging.info(f"Reading sound files: {args.sound_files}")
+    waves = read_sound_files(
+        filenames=args.sound_files,
+        expected_sample_rate=sample_rate,
+    )
+
+    # Simulate streams that arrive at the same time. If there are more
+    # sound files than slots, a new stream starts once a slot is freed.
+    pending = list(zip(args.sound_files, waves))
+    active = []
+    results = {}
+    chunk = int(0.2 * sample_rate)  # 0.2 second
+    while pending or active:
+        while pending and model.num_free_slots > 0:
+            filename, wave = pending.pop(0)
+            stream = Stream(
+                context_size=model.context_size,
+                segment=model.segment,
+                offset=model.offset,
+            )
+            model.add_stream(stream)
+            if wave.numel() == 0:
+                # Otherwise, finish_input() is never called for it
+                stream.finish_input(sample_rate)
+            active.append((filename, wave, stream))
+
+        for i, (filename, wave, stream) in enumerate(active):
+            if wave.numel() > 0:
+                stream.accept_waveform(sample_rate, wave[:chunk])
+                wave = wave[chunk:]
+                if wave.numel() == 0:
+                    stream.finish_input(sample_rate)
+                active[i] = (filename, wave, stream)
+
+        while True:
+            ready = [s for _, _, s in active if s.is_ready()]
+            if not ready:
+                break
+            model.decode_chunk(ready)
+
+        for filename, wave, stream in active:
+            if stream.done:
+                text = "".join(token_table[i] for i in stream.hyp[model.context_size :])
+                results[filename] = text.replace("▁", " ").strip()
+                model.remove_stream(stream)
+        active = [a for a in active if a[2].slot is not None]
+
+    for filename in args.sound_files:
+        logging.info(f"{filename}\n{results[filename]}")
+
+    logging.info("Decoding Done")
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
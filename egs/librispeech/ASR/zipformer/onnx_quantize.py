@@ -0,0 +1,229 @@
+# Copyright 2024 Xiaomi Corporation
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This file generates statically quantized int8 models from the fp32 ONNX
+models exported by ./export-onnx.py.
+
+Unlike the dynamically quantized models, i.e., *.int8.onnx, the
+quantization parameters of the activations are computed in advance from
+calibration data. The calibration data are the inputs of the encoder,
+the decoder and the joiner recorded while decoding some cuts with greedy
+search using the fp32 models.
+
+It is used by ./export-onnx.py with --static-int8 1. See
+./onnx_check_quantized.py for how to compare the WER, the model size and
+the RTF of the quantized models.
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from onnx_pretrained import OnnxModel, greedy_search
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+
+
+class RecordingOnnxModel(OnnxModel):
+    """An OnnxModel that records the inputs of the encoder, the decoder
+    and the joiner for calibration.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoder_inputs: List[Dict[str, np.ndarray]] = []
+        self.decoder_inputs: List[np.ndarray] = []
+        self.joiner_inputs: List[List[np.ndarray]] = []
+
+    def run_encoder(self, x: torch.Tensor, x_lens: torch.Tensor):
+        self.encoder_inputs.append(
+            {
+                self.encoder.get_inputs()[0].name: x.numpy(),
+                self.encoder.get_inputs()[1].name: x_lens.numpy(),
+            }
+        )
+        return super().run_encoder(x, x_lens)
+
+    def run_decoder(self, decoder_input: torch.Tensor) -> torch.Tensor:
+        self.decoder_inputs.append(decoder_input.numpy())
+        return super().run_decoder(decoder_input)
+
+    def run_joiner(
+        self, encoder_out: torch.Tensor, decoder_out: torch.Tensor
+    ) -> torch.Tensor:
+        self.joiner_inputs.append([encoder_out.numpy(), decoder_out.numpy()])
+        return super().run_joiner(encoder_out, decoder_out)
+
+
+class ListDataReader(CalibrationDataReader):
+    """A CalibrationDataReader that returns the given inputs one by one."""
+
+    def __init__(self, inputs: List[Dict[str, np.ndarray]]):
+        self.inputs = iter(inputs)
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        return next(self.inputs, None)
+
+
+def _merge_rows(
+    names: List[str], inputs: List[List[np.ndarray]], max_rows: int
+) -> List[Dict[str, np.ndarray]]:
+    """Concatenate 2-D inputs along the batch axis so that each run during
+    calibration processes up to max_rows rows.
+
+    Args:
+      names:
+        Names of the inputs of the model.
+      inputs:
+        inputs[i][k] is the k-th input of the i-th run. It is a 2-D array.
+      max_rows:
+        Maximum number of rows of each returned input.
+    Returns:
+      Return the inputs of each calibration run.
+    """
+    ans = []
+    for k, name in enumerate(names):
+        rows = np.concatenate([x[k] for x in inputs])
+        for i, start in enumerate(range(0, rows.shape[0], max_rows)):
+            if k == 0:
+                ans.append({})
+            ans[i][name] = rows[start : start + max_rows]
+    return ans
+
+
+def collect_calibration_data(
+    model: RecordingOnnxModel,
+    dl: torch.utils.data.DataLoader,
+    num_batches: int,
+) -> None:
+    """Decode the first num_batches batches from dl with greedy search, so
+    that the inputs of the models are recorded in `model`.
+    """
+    for batch_idx, batch in enumerate(dl):
+        if batch_idx >= num_batches:
+            break
+        feature = batch["inputs"]
+        assert feature.ndim == 3, feature.shape
+        feature_lens = batch["supervisions"]["num_frames"].to(dtype=torch.int64)
+
+        encoder_out, encoder_out_lens = model.run_encoder(
+            x=feature, x_lens=feature_lens
+        )
+        greedy_search(
+            model=model, encoder_out=encoder_out, encoder_out_lens=encoder_out_lens
+        )
+
+    logging.info(
+        f"Recorded {len(model.encoder_inputs)} encoder runs, "
+        f"{len(model.decoder_inputs)} decoder runs and "
+        f"{len(model.joiner_inputs)} joiner runs"
+    )
+
+
+def quantize_static_int8(
+    model_input: Path,
+    model_output: Path,
+    inputs: List[Dict[str, np.ndarray]],
+    op_types_to_quantize: List[str],
+) -> None:
+    """Quantize the weights to int8 and the activations to uint8 using the
+    min and max values of the activations over the given inputs.
+
+    The QDQ format is used, which onnxruntime fuses into int8 kernels on
+    CPU. MatMuls are quantized only if their weights are constant, like in
+    quantize_dynamic().
+    """
+    quantize_static(
+        model_input=model_input,
+        model_output=model_output,
+        calibration_data_reader=ListDataReader(inputs),
+        quant_format=QuantFormat.QDQ,
+        op_types_to_quantize=op_types_to_quantize,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.MinMax,
+        extra_options={"MatMulConstBOnly": True},
+    )
+
+
+def export_static_int8_models(
+    encoder_filename: Path,
+    decoder_filename: Path,
+    joiner_filename: Path,
+    dl: torch.utils.data.DataLoader,
+    num_batches: int,
+    max_rows: int = 2000,
+) -> None:
+    """Generate statically quantized int8 models from the given fp32 models.
+
+    The outputs replace the suffix .onnx of the inputs with
+    .int8-static.onnx.
+
+    Args:
+      encoder_filename:
+        The fp32 encoder model.
+      decoder_filename:
+        The fp32 decoder model.
+      joiner_filename:
+        The fp32 joiner model.
+      dl:
+        The dataloader of the calibration cuts.
+      num_batches:
+        Number of batches from dl used for calibration.
+      max_rows:
+        The decoder and joiner inputs are merged into runs of up to this
+        number of rows.
+    """
+    model = RecordingOnnxModel(
+        encoder_model_filename=str(encoder_filename),
+        decoder_model_filename=str(decoder_filename),
+        joiner_model_filename=str(joiner_filename),
+    )
+    collect_calibration_data(model, dl=dl, num_batches=num_batches)
+
+    decoder_inputs = _merge_rows(
+        names=[model.decoder.get_inputs()[0].name],
+        inputs=[[x] for x in model.decoder_inputs],
+        max_rows=max_rows,
+    )
+    joiner_inputs = _merge_rows(
+        names=[i.name for i in model.joiner.get_inputs()],
+        inputs=model.joiner_inputs,
+        max_rows=max_rows,
+    )
+
+    for filename, inputs, op_types in [
+        (encoder_filename, model.encoder_inputs, ["MatMul"]),
+        # nn.Linear on 2-D inputs is exported as Gemm
+        (decoder_filename, decoder_inputs, ["MatMul", "Gemm", "Gather"]),
+        (joiner_filename, joiner_inputs, ["MatMul", "Gemm"]),
+    ]:
+        output = filename.with_suffix(".int8-static.onnx")
+        logging.info(f"Quantizing {filename} to {output}")
+        quantize_static_int8(
+            model_input=filename,
+            model_output=output,
+            inputs=inputs,
+            op_types_to_quantize=op_types,
+        )
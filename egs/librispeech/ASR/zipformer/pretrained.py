@@ -102,6 +102,19 @@ Usage of this script:
   /path/to/bar.wav
 
 
+To decode a large number of sound files, list them in a text file, one
+per line, and decode them in batches of at most 600 seconds of padded
+audio. The files are sorted by duration, the features of the next batch
+are computed while the current batch is decoded, and the results of each
+batch are printed as soon as it is decoded:
+
+./zipformer/pretrained.py \
+  --checkpoint ./zipformer/exp/pretrained.pt \
+  --tokens ./data/lang_bpe_500/tokens.txt \
+  --method greedy_search \
+  --sound-file-list /path/to/wav.list \
+  --max-duration 600
+
 You can also use `./zipformer/exp/epoch-xx.pt`.
 
 Note: ./zipformer/exp/pretrained.pt is generated by ./zipformer/export.py
@@ -110,7 +123,6 @@ Note: ./zipformer/exp/pretrained.pt is generated by ./zipformer/export.py
 
 import argparse
 import logging
-import math
 from typing import List
 
 import k2
@@ -122,8 +134,8 @@ from beam_search import (
     greedy_search_batch,
     modified_beam_search,
 )
+from bucketed_decode import add_bucketing_arguments, decode_sound_files, get_sound_files
 from export import num_tokens
-from torch.nn.utils.rnn import pad_sequence
 from train import add_model_arguments, get_model, get_params
 
 
@@ -161,7 +173,7 @@ def get_parser():
     parser.add_argument(
         "sound_files",
         type=str,
-        nargs="+",
+        nargs="*",
         help="The input sound file(s) to transcribe. "
         "Supported formats are those supported by torchaudio.load(). "
         "For example, wav and flac are supported. "
@@ -225,6 +237,7 @@ def get_parser():
     )
 
     add_model_arguments(parser)
+    add_bucketing_arguments(parser)
 
     return parser
 
@@ -305,25 +318,15 @@ def main():
 
     fbank = kaldifeat.Fbank(opts)
 
-    logging.info(f"Reading sound files: {params.sound_files}")
-    waves = read_sound_files(
-        filenames=params.sound_files, expected_sample_rate=params.sample_rate
-    )
-    waves = [w.to(device) for w in waves]
-
-    logging.info("Decoding started")
-    features = fbank(waves)
-    feature_lengths = [f.size(0) for f in features]
-
-    features = pad_sequence(features, batch_first=True, padding_value=math.log(1e-10))
-    feature_lengths = torch.tensor(feature_lengths, device=device)
-
-    # model forward
-    encoder_out, encoder_out_lens = model.forward_encoder(features, feature_lengths)
+    sound_files = get_sound_files(params.sound_files, params.sound_file_list)
+    logging.info(f"Number of sound files: {len(sound_files)}")
 
-    hyps = []
-    msg = f"Using {params.method}"
-    logging.info(msg)
+    def compute_features(filenames: List[str]) -> List[torch.Tensor]:
+        waves = read_sound_files(
+            filenames=filenames, expected_sample_rate=params.sample_rate
+        )
+        waves = [w.to(device) for w in waves]
+        return fbank(waves)
 
     def token_ids_to_words(token_ids: List[int]) -> str:
         text = ""
@@ -333,42 +336,57 @@ def main():
 
     if params.method == "fast_beam_search":
         decoding_graph = k2.trivial_graph(params.vocab_size - 1, device=device)
-        hyp_tokens = fast_beam_search_one_best(
-            model=model,
-            decoding_graph=decoding_graph,
-            encoder_out=encoder_out,
-            encoder_out_lens=encoder_out_lens,
-            beam=params.beam,
-            max_contexts=params.max_contexts,
-            max_states=params.max_states,
-        )
-        for hyp in hyp_tokens:
-            hyps.append(token_ids_to_words(hyp))
-    elif params.method == "modified_beam_search":
-        hyp_tokens = modified_beam_search(
-            model=model,
-            encoder_out=encoder_out,
-            encoder_out_lens=encoder_out_lens,
-            beam=params.beam_size,
-        )
 
-        for hyp in hyp_tokens:
-            hyps.append(token_ids_to_words(hyp))
-    elif params.method == "greedy_search" and params.max_sym_per_frame == 1:
-        hyp_tokens = greedy_search_batch(
-            model=model,
-            encoder_out=encoder_out,
-            encoder_out_lens=encoder_out_lens,
-        )
-        for hyp in hyp_tokens:
-            hyps.append(token_ids_to_words(hyp))
-    else:
-        raise ValueError(f"Unsupported method: {params.method}")
-
-    s = "\n"
-    for filename, hyp in zip(params.sound_files, hyps):
-        s += f"{filename}:\n{hyp}\n\n"
-    logging.info(s)
+    def decode_batch(
+        features: torch.Tensor, feature_lengths: torch.Tensor
+    ) -> List[str]:
+        # model forward
+        encoder_out, encoder_out_lens = model.forward_encoder(features, feature_lengths)
+
+        if params.method == "fast_beam_search":
+            hyp_tokens = fast_beam_search_one_best(
+                model=model,
+                decoding_graph=decoding_graph,
+                encoder_out=encoder_out,
+                encoder_out_lens=encoder_out_lens,
+                beam=params.beam,
+                max_contexts=params.max_contexts,
+                max_states=params.max_states,
+            )
+        elif params.method == "modified_beam_search":
+            hyp_tokens = modified_beam_search(
+                model=model,
+                encoder_out=encoder_out,
+                encoder_out_lens=encoder_out_lens,
+                beam=params.beam_size,
+            )
+        elif params.method == "greedy_search" and params.max_sym_per_frame == 1:
+            hyp_tokens = greedy_search_batch(
+                model=model,
+                encoder_out=encoder_out,
+                encoder_out_lens=encoder_out_lens,
+            )
+        else:
+            raise ValueError(f"Unsupported method: {params.method}")
+
+        return [token_ids_to_words(hyp) for hyp in hyp_tokens]
+
+    msg = f"Using {params.method}"
+    logging.info(msg)
+
+    logging.info("Decoding started")
+    # The results of each batch are printed as soon as it is decoded
+    for results in decode_sound_files(
+        filenames=sound_files,
+        compute_features=compute_features,
+        decode_batch=decode_batch,
+        max_duration=params.max_duration,
+        num_threads=params.num_feature_threads,
+    ):
+        s = "\n"
+        for filename, hyp in results:
+            s += f"{filename}:\n{hyp}\n\n"
+        logging.info(s)
 
     logging.info("Decoding Done")
 
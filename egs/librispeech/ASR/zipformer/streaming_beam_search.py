@@ -15,12 +15,12 @@
 # limitations under the License.
 
 import warnings
-from typing import List
+from typing import List, Optional
 
 import k2
 import torch
 import torch.nn as nn
-from beam_search import Hypothesis, HypothesisList, get_hyps_shape
+from beam_search import DecoderOutCache, Hypothesis, HypothesisList, get_hyps_shape
 from decode_stream import DecodeStream
 
 from icefall.decode import one_best_decoding
@@ -32,6 +32,8 @@ def greedy_search(
     encoder_out: torch.Tensor,
     streams: List[DecodeStream],
     blank_penalty: float = 0.0,
+    decoder_out_cache: Optional[DecoderOutCache] = None,
+    encoder_out_lens: Optional[torch.Tensor] = None,
 ) -> None:
     """Greedy search in batch mode. It hardcodes --max-sym-per-frame=1.
 
@@ -42,6 +44,12 @@ def greedy_search(
         Output from the encoder. Its shape is (N, T, C), where N >= 1.
       streams:
         A list of Stream objects.
+      decoder_out_cache:
+        If not None, use it to compute the decoder output.
+      encoder_out_lens:
+        If not None, a 1-D tensor of shape (N,) containing the number of
+        valid frames of each stream in encoder_out. Frames after them are
+        ignored. If None, all frames are valid.
     """
     assert len(streams) == encoder_out.size(0)
     assert encoder_out.ndim == 3
@@ -50,15 +58,22 @@ def greedy_search(
     context_size = model.decoder.context_size
     device = model.device
     T = encoder_out.size(1)
+    if encoder_out_lens is not None:
+        encoder_out_lens = encoder_out_lens.tolist()
 
-    decoder_input = torch.tensor(
-        [stream.hyp[-context_size:] for stream in streams],
-        device=device,
-        dtype=torch.int64,
-    )
+    if decoder_out_cache is not None:
+        decoder_out = decoder_out_cache(
+            [stream.hyp[-context_size:] for stream in streams]
+        )
+    else:
+        decoder_input = torch.tensor(
+            [stream.hyp[-context_size:] for stream in streams],
+            device=device,
+            dtype=torch.int64,
+        )
+        decoder_out = model.decoder(decoder_input, need_pad=False)
+        decoder_out = model.joiner.decoder_proj(decoder_out)
     # decoder_out is of shape (N, 1, decoder_out_dim)
-    decoder_out = model.decoder(decoder_input, need_pad=False)
-    decoder_out = model.joiner.decoder_proj(decoder_out)
 
     for t in range(T):
         # current_encoder_out's shape: (batch_size, 1, encoder_out_dim)
@@ -79,21 +94,28 @@ def greedy_search(
         y = logits.argmax(dim=1).tolist()
         emitted = False
         for i, v in enumerate(y):
+            if encoder_out_lens is not None and t >= encoder_out_lens[i]:
+                continue
             if v != blank_id:
                 streams[i].hyp.append(v)
                 emitted = True
         if emitted:
             # update decoder output
-            decoder_input = torch.tensor(
-                [stream.hyp[-context_size:] for stream in streams],
-                device=device,
-                dtype=torch.int64,
-            )
-            decoder_out = model.decoder(
-                decoder_input,
-                need_pad=False,
-            )
-            decoder_out = model.joiner.decoder_proj(decoder_out)
+            if decoder_out_cache is not None:
+                decoder_out = decoder_out_cache(
+                    [stream.hyp[-context_size:] for stream in streams]
+                )
+            else:
+                decoder_input = torch.tensor(
+                    [stream.hyp[-context_size:] for stream in streams],
+                    device=device,
+                    dtype=torch.int64,
+                )
+                decoder_out = model.decoder(
+                    decoder_input,
+                    need_pad=False,
+                )
+                decoder_out = model.joiner.decoder_proj(decoder_out)
 
 
 def modified_beam_search(
@@ -102,6 +124,8 @@ def modified_beam_search(
     streams: List[DecodeStream],
     num_active_paths: int = 4,
     blank_penalty: float = 0.0,
+    decoder_out_cache: Optional[DecoderOutCache] = None,
+    encoder_out_lens: Optional[torch.Tensor] = None,
 ) -> None:
     """Beam search in batch mode with --max-sym-per-frame=1 being hardcoded.
 
@@ -115,6 +139,12 @@ def modified_beam_search(
         A list of stream objects.
       num_active_paths:
         Number of active paths during the beam search.
+      decoder_out_cache:
+        If not None, use it to compute the decoder output.
+      encoder_out_lens:
+        If not None, a 1-D tensor of shape (N,) containing the number of
+        valid frames of each stream in encoder_out. Frames after them are
+        ignored. If None, all frames are valid.
     """
     assert encoder_out.ndim == 3, encoder_out.shape
     assert len(streams) == encoder_out.size(0)
@@ -124,6 +154,8 @@ def modified_beam_search(
     device = next(model.parameters()).device
     batch_size = len(streams)
     T = encoder_out.size(1)
+    if encoder_out_lens is not None:
+        encoder_out_lens = encoder_out_lens.tolist()
 
     B = [stream.hyps for stream in streams]
 
@@ -133,21 +165,27 @@ def modified_beam_search(
 
         hyps_shape = get_hyps_shape(B).to(device)
 
+        prev_B = B
         A = [list(b) for b in B]
         B = [HypothesisList() for _ in range(batch_size)]
 
-        ys_log_probs = torch.stack(
-            [hyp.log_prob.reshape(1) for hyps in A for hyp in hyps], dim=0
+        ys_log_probs = torch.tensor(
+            [[hyp.log_prob] for hyps in A for hyp in hyps], device=device
         )  # (num_hyps, 1)
 
-        decoder_input = torch.tensor(
-            [hyp.ys[-context_size:] for hyps in A for hyp in hyps],
-            device=device,
-            dtype=torch.int64,
-        )  # (num_hyps, context_size)
+        if decoder_out_cache is not None:
+            decoder_out = decoder_out_cache(
+                [hyp.ys[-context_size:] for hyps in A for hyp in hyps]
+            ).unsqueeze(1)
+        else:
+            decoder_input = torch.tensor(
+                [hyp.ys[-context_size:] for hyps in A for hyp in hyps],
+                device=device,
+                dtype=torch.int64,
+            )  # (num_hyps, context_size)
 
-        decoder_out = model.decoder(decoder_input, need_pad=False).unsqueeze(1)
-        decoder_out = model.joiner.decoder_proj(decoder_out)
+            decoder_out = model.decoder(decoder_input, need_pad=False).unsqueeze(1)
+            decoder_out = model.joiner.decoder_proj(decoder_out)
         # decoder_out is of shape (num_hyps, 1, 1, decoder_output_dim)
 
         # Note: For torch 1.7.1 and below, it requires a torch.int64 tensor
@@ -181,24 +219,33 @@ def modified_beam_search(
         ragged_log_probs = k2.RaggedTensor(shape=log_probs_shape, value=log_probs)
 
         for i in range(batch_size):
+            if encoder_out_lens is not None and t >= encoder_out_lens[i]:
+                B[i] = prev_B[i]
+                continue
+
             topk_log_probs, topk_indexes = ragged_log_probs[i].topk(num_active_paths)
 
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
                 topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
                 topk_token_indexes = (topk_indexes % vocab_size).tolist()
+            topk_log_probs = topk_log_probs.tolist()
 
             for k in range(len(topk_hyp_indexes)):
                 hyp_idx = topk_hyp_indexes[k]
                 hyp = A[i][hyp_idx]
 
-                new_ys = hyp.ys[:]
                 new_token = topk_token_indexes[k]
                 if new_token != blank_id:
-                    new_ys.append(new_token)
+                    new_ys = hyp.ys + [new_token]
+                    new_key = hyp.extend_key(new_token)
+                else:
+                    # ys is not changed, so it is shared with hyp
+                    new_ys = hyp.ys
+                    new_key = hyp.key
 
                 new_log_prob = topk_log_probs[k]
-                new_hyp = Hypothesis(ys=new_ys, log_prob=new_log_prob)
+                new_hyp = Hypothesis(ys=new_ys, log_prob=new_log_prob, key=new_key)
                 B[i].add(new_hyp)
 
     for i in range(batch_size):
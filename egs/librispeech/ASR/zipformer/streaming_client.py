@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# Copyright 2024 Xiaomi Corporation
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A client for ./zipformer/streaming_server.py, which can also be used as a
+load generator to benchmark the server.
+
+It starts --num-clients concurrent clients. Each of them sends the given
+sound files one after another, --num-repeats times, in messages of
+--chunk-duration seconds. If --real-time is true, the audio is sent at the
+rate it would be captured by a microphone.
+
+At the end, it reports the real time factor and the percentiles of:
+  - the first-result latency, i.e., the time from sending the first samples
+    to receiving the first non-empty result
+  - the final latency, i.e., the time from sending the last samples to
+    receiving the final result
+
+Usage:
+./zipformer/streaming_client.py \
+  --server-addr localhost \
+  --server-port 6006 \
+  --num-clients 50 \
+  --real-time 1 \
+  /path/to/foo.wav \
+  /path/to/bar.wav
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import struct
+import time
+from typing import List, Optional
+
+import numpy as np
+import torchaudio
+
+from icefall.utils import str2bool
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--server-addr",
+        type=str,
+        default="localhost",
+        help="Address of the server",
+    )
+
+    parser.add_argument(
+        "--server-port",
+        type=int,
+        default=6006,
+        help="Port of the server",
+    )
+
+    parser.add_argument(
+        "--num-clients",
+        type=int,
+        default=1,
+        help="Number of concurrent clients",
+    )
+
+    parser.add_argument(
+        "--num-repeats",
+        type=int,
+        default=1,
+        help="Number of times each client sends all the sound files",
+    )
+
+    parser.add_argument(
+        "--chunk-duration",
+        type=float,
+        default=0.1,
+        help="Duration in seconds of the audio in each message",
+    )
+
+    parser.add_argument(
+        "--real-time",
+        type=str2bool,
+        default=True,
+        help="""If true, send the audio at the rate it is captured by a
+        microphone. Otherwise, send it as fast as possible.""",
+    )
+
+    parser.add_argument(
+        "--sample-rate",
+        type=int,
+        default=16000,
+        help="The sample rate expected by the server",
+    )
+
+    parser.add_argument(
+        "sound_files",
+        type=str,
+        nargs="+",
+        help="The input sound file(s) to transcribe. "
+        "Supported formats are those supported by torchaudio.load(). "
+        "For example, wav and flac are supported. ",
+    )
+
+    return parser
+
+
+def read_sound_files(
+    filenames: List[str], expected_sample_rate: float
+) -> List[np.ndarray]:
+    """Read a list of sound files into a list of 1-D float32 arrays."""
+    ans = []
+    for f in filenames:
+        wave, sample_rate = torchaudio.load(f)
+        assert (
+            sample_rate == expected_sample_rate
+        ), f"expected sample rate: {expected_sample_rate}. Given: {sample_rate}"
+        # We use only the first channel
+        ans.append(wave[0].numpy().astype(np.float32))
+    return ans
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    """Read a length-prefixed message."""
+    header = await reader.readexactly(4)
+    (length,) = struct.unpack("<I", header)
+    if length == 0:
+        return b""
+    return await reader.readexactly(length)
+
+
+def write_message(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    """Write a length-prefixed message."""
+    writer.write(struct.pack("<I", len(payload)) + payload)
+
+
+class Stats(object):
+    def __init__(self) -> None:
+        self.first_result_latencies = []
+        self.final_latencies = []
+        self.total_duration = 0.0
+
+    def log(self, elapsed: float) -> None:
+        logging.info(
+            f"Decoded {len(self.final_latencies)} utterances, "
+            f"{self.total_duration:.2f} seconds of audio in {elapsed:.2f} seconds. "
+            f"RTF: {elapsed / self.total_duration:.4f}"
+        )
+        for name, latencies in [
+            ("First-result latency", self.first_result_latencies),
+            ("Final latency", self.final_latencies),
+        ]:
+            if not latencies:
+                continue
+            latencies = np.array(latencies) * 1000
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            logging.info(
+                f"{name} (ms): p50 {p50:.1f}, p90 {p90:.1f}, p99 {p99:.1f}, "
+                f"max {latencies.max():.1f}"
+            )
+
+
+async def decode_one(
+    args: argparse.Namespace,
+    samples: np.ndarray,
+    stats: Stats,
+) -> str:
+    reader, writer = await asyncio.open_connection(args.server_addr, args.server_port)
+
+    chunk_length = int(args.chunk_duration * args.sample_rate)
+    start_time: Optional[float] = None
+    end_time: Optional[float] = None
+
+    async def send():
+        nonlocal start_time, end_time
+        start_time = time.time()
+        for start in range(0, len(samples), chunk_length):
+            chunk = samples[start : start + chunk_length]  # noqa
+            write_message(writer, chunk.tobytes())
+            await writer.drain()
+            if args.real_time:
+                # Sleep until the time the next chunk would be captured
+                next_time = start_time + (start + len(chunk)) / args.sample_rate
+                await asyncio.sleep(max(0.0, next_time - time.time()))
+        end_time = time.time()
+        write_message(writer, b"")
+        await writer.drain()
+
+    sender = asyncio.create_task(send())
+
+    text = ""
+    got_first_result = False
+    while True:
+        message = json.loads((await read_message(reader)).decode("utf-8"))
+        text = message["text"]
+        if text and not got_first_result:
+            got_first_result = True
+            stats.first_result_latencies.append(time.time() - start_time)
+        if message["final"]:
+            break
+
+    await sender
+    stats.final_latencies.append(time.time() - end_time)
+    stats.total_duration += len(samples) / args.sample_rate
+
+    writer.close()
+    return text
+
+
+async def run_client(
+    args: argparse.Namespace,
+    client_id: int,
+    waves: List[np.ndarray],
+    stats: Stats,
+) -> None:
+    for r in range(args.num_repeats):
+        for filename, samples in zip(args.sound_files, waves):
+            text = await decode_one(args, samples, stats)
+            if client_id == 0 and r == 0:
+                logging.info(f"{filename}: {text}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    waves = read_sound_files(args.sound_files, args.sample_rate)
+    stats = Stats()
+
+    start = time.time()
+    await asyncio.gather(
+        *[run_client(args, i, waves, stats) for i in range(args.num_clients)]
+    )
+    stats.log(time.time() - start)
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    logging.info(vars(args))
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
@@ -33,6 +33,7 @@ Usage:
 import argparse
 import logging
 import math
+import time
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
@@ -41,8 +42,9 @@ import numpy as np
 import sentencepiece as spm
 import torch
 from asr_datamodule import LibriSpeechAsrDataModule
+from beam_search import BlankFrameSkipper, DecoderOutCache
 from decode_stream import DecodeStream
-from kaldifeat import Fbank, FbankOptions
+from kaldifeat import FbankOptions
 from lhotse import CutSet, set_caching_enabled
 from streaming_beam_search import (
     fast_beam_search_one_best,
@@ -59,6 +61,7 @@ from icefall.checkpoint import (
     find_checkpoints,
     load_checkpoint,
 )
+from icefall.streaming_state_pool import StreamingStatePool
 from icefall.utils import (
     AttributeDict,
     make_pad_mask,
@@ -195,6 +198,29 @@ def get_parser():
         help="The number of streams that can be decoded parallel.",
     )
 
+    parser.add_argument(
+        "--decoder-out-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache the decoder output of at most this many
+        decoder contexts and reuse them across chunks and streams.
+        Used only when --decoding-method is greedy_search or
+        modified_beam_search. 0 to disable it.
+        """,
+    )
+
+    parser.add_argument(
+        "--blank-threshold",
+        type=float,
+        default=1.0,
+        help="""If less than 1, drop the encoder frames of each chunk whose
+        blank probability from the CTC head is larger than it before the
+        transducer search. It requires a model trained with --use-ctc 1.
+        Used only when --decoding-method is greedy_search or
+        modified_beam_search. 1 to disable it.
+        """,
+    )
+
     parser.add_argument(
         "--skip-scoring",
         type=str2bool,
@@ -436,6 +462,9 @@ def decode_one_chunk(
     params: AttributeDict,
     model: nn.Module,
     decode_streams: List[DecodeStream],
+    state_pool: StreamingStatePool,
+    decoder_out_cache: Optional[DecoderOutCache] = None,
+    blank_frame_skipper: Optional[BlankFrameSkipper] = None,
 ) -> List[int]:
     """Decode one chunk frames of features for each decode_streams and
     return the indexes of finished streams in a List.
@@ -447,6 +476,14 @@ def decode_one_chunk(
         The neural model.
       decode_streams:
         A List of DecodeStream, each belonging to a utterance.
+      state_pool:
+        The pool keeping the encoder states. decode_streams[i].slot is
+        the slot of the i-th stream in it.
+      decoder_out_cache:
+        If not None, it is used to compute the decoder output.
+      blank_frame_skipper:
+        If not None, it drops the encoder frames on which the CTC head
+        predicts blank with a high probability before the search.
     Returns:
       Return a List containing which DecodeStreams are finished.
     """
@@ -456,14 +493,14 @@ def decode_one_chunk(
 
     features = []
     feature_lens = []
-    states = []
+    slots = []
     processed_lens = []  # Used in fast-beam-search
 
     for stream in decode_streams:
         feat, feat_len = stream.get_feature_frames(chunk_size * 2)
         features.append(feat)
         feature_lens.append(feat_len)
-        states.append(stream.states)
+        slots.append(stream.slot)
         processed_lens.append(stream.done_frames)
 
     feature_lens = torch.tensor(feature_lens, device=device)
@@ -483,7 +520,8 @@ def decode_one_chunk(
             value=LOG_EPS,
         )
 
-    states = stack_states(states)
+    slots = torch.tensor(slots, device=device)
+    states = state_pool.gather(slots)
 
     encoder_out, encoder_out_lens, new_states = streaming_forward(
         features=features,
@@ -494,10 +532,24 @@ def decode_one_chunk(
         left_context_len=left_context_len,
     )
 
+    search_lens = None
+    if blank_frame_skipper is not None:
+        # The search runs on all the frames of the chunk, including those
+        # of the padded tail, so all of them are candidates for skipping.
+        # encoder_out_lens is kept for updating done_frames below.
+        num_frames = torch.full_like(encoder_out_lens, encoder_out.size(1))
+        encoder_out, search_lens, _ = blank_frame_skipper(encoder_out, num_frames)
+
     encoder_out = model.joiner.encoder_proj(encoder_out)
 
     if params.decoding_method == "greedy_search":
-        greedy_search(model=model, encoder_out=encoder_out, streams=decode_streams)
+        greedy_search(
+            model=model,
+            encoder_out=encoder_out,
+            streams=decode_streams,
+            decoder_out_cache=decoder_out_cache,
+            encoder_out_lens=search_lens,
+        )
     elif params.decoding_method == "fast_beam_search":
         processed_lens = torch.tensor(processed_lens, device=device)
         processed_lens = processed_lens + encoder_out_lens
@@ -516,15 +568,16 @@ def decode_one_chunk(
             streams=decode_streams,
             encoder_out=encoder_out,
             num_active_paths=params.num_active_paths,
+            decoder_out_cache=decoder_out_cache,
+            encoder_out_lens=search_lens,
         )
     else:
         raise ValueError(f"Unsupported decoding method: {params.decoding_method}")
 
-    states = unstack_states(new_states)
+    state_pool.scatter(slots, new_states)
 
     finished_streams = []
     for i in range(len(decode_streams)):
-        decode_streams[i].states = states[i]
         decode_streams[i].done_frames += encoder_out_lens[i]
         if decode_streams[i].done:
             finished_streams.append(i)
@@ -532,12 +585,70 @@ def decode_one_chunk(
     return finished_streams
 
 
+def accept_samples(
+    decode_streams: List[DecodeStream],
+    pending_samples: Dict[str, torch.Tensor],
+    chunk_size: int,
+    sample_rate: int = 16000,
+    start_times: Optional[Dict[str, float]] = None,
+) -> None:
+    """Pass the samples of each stream to it piece by piece, as if they were
+    captured by a microphone, until the features of its next chunk are
+    available or all of its samples are passed.
+
+    Args:
+      decode_streams:
+        A List of DecodeStream, each belonging to a utterance.
+      pending_samples:
+        The samples of each stream that have not been passed to it yet.
+        It is updated in-place.
+      chunk_size:
+        The number of feature frames consumed by each chunk, i.e., the
+        argument of :meth:`DecodeStream.get_feature_frames`.
+      sample_rate:
+        The sample rate of the samples.
+      start_times:
+        If not None, the time at which the first samples of a stream are
+        passed to it is recorded here, keyed by the stream id.
+    """
+    # Number of samples of chunk_size feature frames. The frame shift is 10ms.
+    piece = chunk_size * sample_rate // 100
+    for stream in decode_streams:
+        samples = pending_samples[stream.id]
+        while not stream.is_input_finished and not stream.is_ready(chunk_size):
+            if samples.numel() == 0:
+                stream.input_finished(tail_pad_len=30)
+                break
+            if start_times is not None and stream.id not in start_times:
+                start_times[stream.id] = time.time()
+            stream.accept_waveform(sample_rate, samples[:piece])
+            samples = samples[piece:]
+        pending_samples[stream.id] = samples
+
+
+def update_first_token_latencies(
+    decode_streams: List[DecodeStream],
+    start_times: Dict[str, float],
+    first_token_latencies: Dict[str, float],
+) -> None:
+    """Record the first-token latency of the streams that have got their
+    first non-empty result."""
+    now = time.time()
+    for stream in decode_streams:
+        if stream.id in first_token_latencies or stream.id not in start_times:
+            continue
+        if len(stream.decoding_result()) > 0:
+            first_token_latencies[stream.id] = now - start_times[stream.id]
+
+
 def decode_dataset(
     cuts: CutSet,
     params: AttributeDict,
     model: nn.Module,
     sp: spm.SentencePieceProcessor,
     decoding_graph: Optional[k2.Fsa] = None,
+    decoder_out_cache: Optional[DecoderOutCache] = None,
+    blank_frame_skipper: Optional[BlankFrameSkipper] = None,
 ) -> Dict[str, List[Tuple[List[str], List[str]]]]:
     """Decode dataset.
 
@@ -553,6 +664,17 @@ def decode_dataset(
       decoding_graph:
         The decoding graph. Can be either a `k2.trivial_graph` or HLG, Used
         only when --decoding_method is fast_beam_search.
+      decoder_out_cache:
+        If not None, it is used to compute the decoder output and its
+        statistics are logged at the end.
+      blank_frame_skipper:
+        If not None, it is used to drop encoder frames before the search
+        and the fraction of dropped frames is logged at the end.
+
+    The features are computed online while the samples of each utterance
+    are passed to its DecodeStream chunk by chunk. The first-token latency,
+    i.e., the time from passing the first samples of an utterance to getting
+    its first non-empty result, is logged at the end.
     Returns:
       Return a dict, whose key may be "greedy_search" if greedy search
       is used, or it may be "beam_7" if beam size of 7 is used.
@@ -568,22 +690,39 @@ def decode_dataset(
     opts.frame_opts.snip_edges = False
     opts.frame_opts.samp_freq = 16000
     opts.mel_opts.num_bins = 80
+    # DecodeStream fetches the frames as soon as they are computed, so the
+    # online fbank needs to keep only a few of them.
+    opts.frame_opts.max_feature_vectors = 100
 
     log_interval = 100
 
+    # The states of all running streams are kept in preallocated tensors.
+    # A stream joining or leaving the batch only allocates or frees a slot.
+    state_pool = StreamingStatePool.from_init_states_func(
+        lambda batch_size: get_init_states(
+            model=model, batch_size=batch_size, device=device
+        ),
+        max_streams=params.num_decode_streams,
+    )
+
+    start_time = time.time()
     decode_results = []
     # Contain decode streams currently running.
     decode_streams = []
+    # The samples of the running streams that are not passed to them yet
+    pending_samples = dict()
+    start_times = dict()
+    first_token_latencies = dict()
     for num, cut in enumerate(cuts):
         # each utterance has a DecodeStream.
-        initial_states = get_init_states(model=model, batch_size=1, device=device)
         decode_stream = DecodeStream(
             params=params,
             cut_id=cut.id,
-            initial_states=initial_states,
             decoding_graph=decoding_graph,
             device=device,
+            fbank_opts=opts,
         )
+        decode_stream.slot = state_pool.allocate()
 
         audio: np.ndarray = cut.load_audio()
         # audio.shape: (1, num_samples)
@@ -601,16 +740,28 @@ def decode_dataset(
 
         samples = torch.from_numpy(audio).squeeze(0)
 
-        fbank = Fbank(opts)
-        feature = fbank(samples.to(device))
-        decode_stream.set_features(feature, tail_pad_len=30)
+        pending_samples[decode_stream.id] = samples.to(device)
         decode_stream.ground_truth = cut.supervisions[0].text
 
         decode_streams.append(decode_stream)
 
         while len(decode_streams) >= params.num_decode_streams:
+            accept_samples(
+                decode_streams,
+                pending_samples,
+                chunk_size=int(params.chunk_size) * 2,
+                start_times=start_times,
+            )
             finished_streams = decode_one_chunk(
-                params=params, model=model, decode_streams=decode_streams
+                params=params,
+                model=model,
+                decode_streams=decode_streams,
+                state_pool=state_pool,
+                decoder_out_cache=decoder_out_cache,
+                blank_frame_skipper=blank_frame_skipper,
+            )
+            update_first_token_latencies(
+                decode_streams, start_times, first_token_latencies
             )
             for i in sorted(finished_streams, reverse=True):
                 decode_results.append(
@@ -620,6 +771,8 @@ def decode_dataset(
                         sp.decode(decode_streams[i].decoding_result()).split(),
                     )
                 )
+                state_pool.free(decode_streams[i].slot)
+                del pending_samples[decode_streams[i].id]
                 del decode_streams[i]
 
         if num % log_interval == 0:
@@ -627,9 +780,21 @@ def decode_dataset(
 
     # decode final chunks of last sequences
     while len(decode_streams):
+        accept_samples(
+            decode_streams,
+            pending_samples,
+            chunk_size=int(params.chunk_size) * 2,
+            start_times=start_times,
+        )
         finished_streams = decode_one_chunk(
-            params=params, model=model, decode_streams=decode_streams
+            params=params,
+            model=model,
+            decode_streams=decode_streams,
+            state_pool=state_pool,
+            decoder_out_cache=decoder_out_cache,
+            blank_frame_skipper=blank_frame_skipper,
         )
+        update_first_token_latencies(decode_streams, start_times, first_token_latencies)
         for i in sorted(finished_streams, reverse=True):
             decode_results.append(
                 (
@@ -638,8 +803,36 @@ def decode_dataset(
                     sp.decode(decode_streams[i].decoding_result()).split(),
                 )
             )
+            state_pool.free(decode_streams[i].slot)
+            del pending_samples[decode_streams[i].id]
             del decode_streams[i]
 
+    if first_token_latencies:
+        latencies = np.array(list(first_token_latencies.values())) * 1000
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        logging.info(
+            f"First-token latency (ms) of {len(latencies)} utterances: "
+            f"p50 {p50:.1f}, p90 {p90:.1f}, p99 {p99:.1f}, "
+            f"max {latencies.max():.1f}"
+        )
+
+    if decoder_out_cache is not None:
+        logging.info(
+            f"Decoder output cache: {decoder_out_cache}. "
+            f"Saved decoder forward passes per utterance: "
+            f"{decoder_out_cache.num_hits / max(len(decode_results), 1):.2f}"
+        )
+        decoder_out_cache.reset_stats()
+
+    if blank_frame_skipper is not None:
+        logging.info(f"Blank frame skipping: {blank_frame_skipper}")
+        blank_frame_skipper.reset_stats()
+
+    logging.info(
+        f"Decoded {len(decode_results)} cuts in "
+        f"{time.time() - start_time:.2f} seconds"
+    )
+
     if params.decoding_method == "greedy_search":
         key = "greedy_search"
     elif params.decoding_method == "fast_beam_search":
@@ -747,6 +940,9 @@ def main():
         params.suffix += f"_max-contexts-{params.max_contexts}"
         params.suffix += f"_max-states-{params.max_states}"
 
+    if params.blank_threshold < 1:
+        params.suffix += f"-blank-threshold-{params.blank_threshold}"
+
     if params.use_averaged_model:
         params.suffix += "-use-averaged-model"
 
@@ -860,6 +1056,26 @@ def main():
     if params.decoding_method == "fast_beam_search":
         decoding_graph = k2.trivial_graph(params.vocab_size - 1, device=device)
 
+    decoder_out_cache = None
+    if params.decoder_out_cache_size > 0 and params.decoding_method in (
+        "greedy_search",
+        "modified_beam_search",
+    ):
+        decoder_out_cache = DecoderOutCache(
+            model, max_size=params.decoder_out_cache_size
+        )
+
+    blank_frame_skipper = None
+    if params.blank_threshold < 1:
+        assert params.use_ctc, "--blank-threshold requires --use-ctc 1"
+        assert params.decoding_method in (
+            "greedy_search",
+            "modified_beam_search",
+        ), params.decoding_method
+        blank_frame_skipper = BlankFrameSkipper(
+            model, blank_threshold=params.blank_threshold, blank_id=params.blank_id
+        )
+
     num_param = sum([p.numel() for p in model.parameters()])
     logging.info(f"Number of model parameters: {num_param}")
 
@@ -878,6 +1094,8 @@ def main():
             model=model,
             sp=sp,
             decoding_graph=decoding_graph,
+            decoder_out_cache=decoder_out_cache,
+            blank_frame_skipper=blank_frame_skipper,
         )
 
 
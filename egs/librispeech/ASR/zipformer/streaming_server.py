@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+# Copyright 2024 Xiaomi Corporation
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A streaming ASR server with continuous batching for streaming zipformer.
+
+Clients connect over TCP and send audio incrementally. For every chunk, the
+server batches all the streams that have enough audio for a chunk, runs the
+encoder once for the whole batch and sends the partial results back. Streams
+join the next batch as soon as they have a chunk ready and leave as soon as
+they are finished, i.e., the server never waits for a full batch.
+
+The encoder states of all the streams are kept in a preallocated
+StreamingStatePool; each stream owns a slot in it.
+
+Protocol: every message is a 4-byte little-endian length followed by the
+payload. Clients send float32 samples in the range [-1, 1] at 16 kHz; an
+empty message means the end of the utterance. The server replies with UTF-8
+encoded JSON messages, e.g., {"text": "HELLO", "final": false}; the last
+one has "final": true, after which the connection is closed.
+
+Usage:
+./zipformer/streaming_server.py \
+  --checkpoint ./zipformer/exp/pretrained.pt \
+  --tokens ./data/lang_bpe_500/tokens.txt \
+  --causal 1 \
+  --chunk-size 16 \
+  --left-context-frames 128 \
+  --decoding-method greedy_search \
+  --port 6006
+
+See ./zipformer/streaming_client.py for a client, which can also be used
+to benchmark the server.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import k2
+import kaldifeat
+import numpy as np
+import torch
+from decode_stream import DecodeStream
+from export import num_tokens
+from streaming_beam_search import greedy_search, modified_beam_search
+from streaming_decode import get_init_states, streaming_forward
+from torch import nn
+from torch.nn.utils.rnn import pad_sequence
+from train import add_model_arguments, get_model, get_params
+
+from icefall.streaming_state_pool import StreamingStatePool
+from icefall.utils import AttributeDict
+
+LOG_EPS = math.log(1e-10)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        required=True,
+        help="Path to the checkpoint. "
+        "The checkpoint is assumed to be saved by "
+        "icefall.checkpoint.save_checkpoint().",
+    )
+
+    parser.add_argument(
+        "--tokens",
+        type=str,
+        help="""Path to tokens.txt.""",
+    )
+
+    parser.add_argument(
+        "--decoding-method",
+        type=str,
+        default="greedy_search",
+        help="""Supported decoding methods are:
+        greedy_search
+        modified_beam_search
+        """,
+    )
+
+    parser.add_argument(
+        "--num-active-paths",
+        type=int,
+        default=4,
+        help="""An interger indicating how many candidates we will keep for each
+        frame. Used only when --decoding-method is modified_beam_search.""",
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=2,
+        help="The context size in the decoder. 1 means bigram; 2 means tri-gram",
+    )
+
+    parser.add_argument(
+        "--sample-rate",
+        type=int,
+        default=16000,
+        help="The sample rate of the audio sent by the clients",
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=6006,
+        help="The port the server listens on",
+    )
+
+    parser.add_argument(
+        "--max-streams",
+        type=int,
+        default=200,
+        help="""Maximum number of streams decoded at the same time.
+        It is the number of slots in the state pool. Connections exceeding
+        it wait until a slot is freed.""",
+    )
+
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=64,
+        help="Maximum number of streams in a batch for a single chunk",
+    )
+
+    parser.add_argument(
+        "--log-interval",
+        type=float,
+        default=10,
+        help="Interval in seconds to log the latency statistics",
+    )
+
+    add_model_arguments(parser)
+
+    return parser
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    """Read a length-prefixed message."""
+    header = await reader.readexactly(4)
+    (length,) = struct.unpack("<I", header)
+    if length == 0:
+        return b""
+    return await reader.readexactly(length)
+
+
+def write_message(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    """Write a length-prefixed message."""
+    writer.write(struct.pack("<I", len(payload)) + payload)
+
+
+class Stream(object):
+    """A connection being decoded.
+
+    The features are computed incrementally by the DecodeStream while the
+    audio arrives, so the encoder can run as soon as a chunk of features is
+    available.
+    """
+
+    def __init__(
+        self,
+        params: AttributeDict,
+        stream_id: str,
+        fbank_opts: kaldifeat.FbankOptions,
+        writer: asyncio.StreamWriter,
+        device: torch.device = torch.device("cpu"),
+    ) -> None:
+        self.params = params
+        # The encoder states are kept in the state pool of the server
+        self.decode_stream = DecodeStream(
+            params=params,
+            cut_id=stream_id,
+            initial_states=None,
+            device=device,
+            fbank_opts=fbank_opts,
+        )
+        self.writer = writer
+
+        # The slot in the state pool
+        self.slot: int = -1
+
+        # Set when the client has sent all of its audio
+        self.input_finished: bool = False
+        self.done: bool = False
+
+        # The samples received from the client, with their arrival times,
+        # that are not passed to the DecodeStream yet. The model reads the
+        # DecodeStream in the executor thread, so they are passed to it by
+        # flush_input() in the event loop between two runs of the model.
+        self.pending_samples: List[Tuple[float, torch.Tensor]] = []
+        # The arrival time of the end of the input if it is not passed to
+        # the DecodeStream yet
+        self.pending_finish_time: Optional[float] = None
+
+        # The time at which the features of the next chunk became available.
+        # Used to compute the latency of each chunk.
+        self.ready_time: Optional[float] = None
+
+        self.last_text: str = ""
+
+    @property
+    def id(self) -> str:
+        return self.decode_stream.id
+
+    def accept_waveform(self, samples: torch.Tensor) -> None:
+        self.pending_samples.append((time.time(), samples))
+
+    def finish_input(self) -> None:
+        self.pending_finish_time = time.time()
+        self.input_finished = True
+
+    def flush_input(self, chunk_size: int) -> None:
+        """Pass the received samples to the DecodeStream. It must not be
+        called while the model is running.
+
+        If the features of the next chunk become available, the arrival time
+        of the samples that complete them is used as the ready time.
+        """
+        for arrival_time, samples in self.pending_samples:
+            self.decode_stream.accept_waveform(
+                sample_rate=self.params.sample_rate, waveform=samples
+            )
+            if self.ready_time is None and self.is_ready(chunk_size):
+                self.ready_time = arrival_time
+        self.pending_samples.clear()
+
+        if self.pending_finish_time is not None:
+            # The same as the tail padding in ./streaming_decode.py
+            self.decode_stream.input_finished(tail_pad_len=30)
+            if self.ready_time is None and self.is_ready(chunk_size):
+                self.ready_time = self.pending_finish_time
+            self.pending_finish_time = None
+
+    def is_ready(self, chunk_size: int) -> bool:
+        """Return True if the features of the next chunk are available."""
+        return not self.done and self.decode_stream.is_ready(chunk_size)
+
+    def update_ready_time(self, chunk_size: int) -> None:
+        if self.ready_time is None and self.is_ready(chunk_size):
+            self.ready_time = time.time()
+
+    def get_feature_frames(self, chunk_size: int) -> Tuple[torch.Tensor, int]:
+        """Consume chunk_size frames of features."""
+        features, feature_len = self.decode_stream.get_feature_frames(chunk_size)
+        self.done = self.decode_stream.done
+        return features, feature_len
+
+
+class StreamingServer(object):
+    def __init__(
+        self,
+        model: nn.Module,
+        params: AttributeDict,
+        token_table: k2.SymbolTable,
+    ) -> None:
+        self.model = model
+        self.params = params
+        self.token_table = token_table
+        self.device = model.device
+
+        self.chunk_size = int(params.chunk_size)
+        self.left_context_len = int(params.left_context_frames)
+        # Number of feature frames needed for a chunk
+        self.chunk_length = self.chunk_size * 2 + 7 + 2 * 3
+
+        self.fbank_opts = kaldifeat.FbankOptions()
+        self.fbank_opts.device = torch.device("cpu")
+        self.fbank_opts.frame_opts.dither = 0
+        self.fbank_opts.frame_opts.snip_edges = False
+        self.fbank_opts.frame_opts.samp_freq = params.sample_rate
+        self.fbank_opts.mel_opts.num_bins = params.feature_dim
+        # DecodeStream fetches the frames as soon as they are computed, so the
+        # online fbank needs to keep only a few of them.
+        self.fbank_opts.frame_opts.max_feature_vectors = 100
+
+        self.pool = StreamingStatePool.from_init_states_func(
+            lambda batch_size: get_init_states(
+                model=model, batch_size=batch_size, device=self.device
+            ),
+            max_streams=params.max_streams,
+        )
+
+        # All the connected streams that own a slot
+        self.streams: List[Stream] = []
+        self.num_connections = 0
+
+        # The model runs in a separate thread so that the event loop can
+        # keep receiving audio while a batch is being decoded.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # Statistics since the last log
+        self.chunk_latencies = deque()
+        self.batch_sizes = deque()
+        self.last_log_time = time.time()
+
+    async def run(self, port: int) -> None:
+        self.slot_semaphore = asyncio.Semaphore(self.params.max_streams)
+        self.new_data = asyncio.Event()
+
+        server = await asyncio.start_server(self.handle_connection, "0.0.0.0", port)
+        logging.info(f"Listening on port {port}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.decode_loop())
+
+    async def handle_connection(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        self.num_connections += 1
+        stream = Stream(
+            params=self.params,
+            stream_id=str(self.num_connections),
+            fbank_opts=self.fbank_opts,
+            writer=writer,
+            device=self.device,
+        )
+
+        # Wait until there is a free slot
+        await self.slot_semaphore.acquire()
+        stream.slot = self.pool.allocate()
+        self.streams.append(stream)
+        logging.debug(f"Stream {stream.id} joined. Slot: {stream.slot}")
+
+        try:
+            while not stream.input_finished:
+                payload = await read_message(reader)
+                if len(payload) == 0:
+                    stream.finish_input()
+                else:
+                    samples = torch.from_numpy(
+                        np.frombuffer(payload, dtype=np.float32).copy()
+                    )
+                    stream.accept_waveform(samples)
+                self.new_data.set()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logging.info(f"Stream {stream.id} disconnected")
+            # It is removed by decode_loop() since it may be in the batch
+            # that is being decoded.
+            stream.done = True
+            self.new_data.set()
+
+    async def _remove_stream(self, stream: Stream) -> None:
+        """Free the slot of a finished or disconnected stream and close its
+        connection."""
+        if stream in self.streams:
+            self.streams.remove(stream)
+            self.pool.free(stream.slot)
+            self.slot_semaphore.release()
+
+        stream.writer.close()
+        try:
+            await stream.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def decode_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            for s in [s for s in self.streams if s.done]:
+                await self._remove_stream(s)
+
+            # The model is not running now, so the DecodeStreams can be
+            # changed.
+            for s in self.streams:
+                s.flush_input(self.chunk_size * 2)
+
+            ready = [s for s in self.streams if s.is_ready(self.chunk_size * 2)]
+            if not ready:
+                self.new_data.clear()
+                await self.new_data.wait()
+                continue
+
+            # Serve the streams that have been waiting for the longest time
+            ready.sort(key=lambda s: s.ready_time)
+            batch = ready[: self.params.max_batch_size]
+
+            features = []
+            feature_lens = []
+            for s in batch:
+                feat, feat_len = s.get_feature_frames(self.chunk_size * 2)
+                features.append(feat)
+                feature_lens.append(feat_len)
+
+            await loop.run_in_executor(
+                self.executor, self.decode_one_chunk, batch, features, feature_lens
+            )
+
+            now = time.time()
+            for s in batch:
+                self.chunk_latencies.append(now - s.ready_time)
+                s.ready_time = None
+                s.update_ready_time(self.chunk_size * 2)
+                await self.send_result(s)
+            self.batch_sizes.append(len(batch))
+
+            if now - self.last_log_time > self.params.log_interval:
+                self.log_stats()
+
+    @torch.no_grad()
+    def decode_one_chunk(
+        self,
+        streams: List[Stream],
+        features: List[torch.Tensor],
+        feature_lens: List[int],
+    ) -> None:
+        """Run the encoder and the search for a batch of streams. It is the
+        counterpart of decode_one_chunk() in ./streaming_decode.py.
+        """
+        model = self.model
+        device = self.device
+
+        feature_lens = torch.tensor(feature_lens, device=device)
+        features = pad_sequence(features, batch_first=True, padding_value=LOG_EPS)
+        features = features.to(device)
+
+        # Make sure the length after encoder_embed is at least 1.
+        if features.size(1) < self.chunk_length:
+            pad_length = self.chunk_length - features.size(1)
+            feature_lens += pad_length
+            features = torch.nn.functional.pad(
+                features,
+                (0, 0, 0, pad_length),
+                mode="constant",
+                value=LOG_EPS,
+            )
+
+        slots = torch.tensor([s.slot for s in streams], device=device)
+        states = self.pool.gather(slots)
+
+        encoder_out, encoder_out_lens, new_states = streaming_forward(
+            features=features,
+            feature_lens=feature_lens,
+            model=model,
+            states=states,
+            chunk_size=self.chunk_size,
+            left_context_len=self.left_context_len,
+        )
+        self.pool.scatter(slots, new_states)
+
+        encoder_out = model.joiner.encoder_proj(encoder_out)
+
+        decode_streams = [s.decode_stream for s in streams]
+        if self.params.decoding_method == "greedy_search":
+            greedy_search(
+                model=model,
+                encoder_out=encoder_out,
+                streams=decode_streams,
+            )
+        elif self.params.decoding_method == "modified_beam_search":
+            modified_beam_search(
+                model=model,
+                streams=decode_streams,
+                encoder_out=encoder_out,
+                num_active_paths=self.params.num_active_paths,
+            )
+        else:
+            raise ValueError(
+                f"Unsupported decoding method: {self.params.decoding_method}"
+            )
+
+    def token_ids_to_words(self, token_ids: List[int]) -> str:
+        text = ""
+        for i in token_ids:
+            text += self.token_table[i]
+        return text.replace("▁", " ").strip()
+
+    async def send_result(self, stream: Stream) -> None:
+        text = self.token_ids_to_words(stream.decode_stream.decoding_result())
+        if text == stream.last_text and not stream.done:
+            return
+        stream.last_text = text
+
+        message = json.dumps({"text": text, "final": stream.done})
+        try:
+            write_message(stream.writer, message.encode("utf-8"))
+            await stream.writer.drain()
+        except ConnectionError:
+            stream.done = True
+
+        if stream.done:
+            logging.debug(f"Stream {stream.id} finished: {text}")
+            await self._remove_stream(stream)
+
+    def log_stats(self) -> None:
+        if self.chunk_latencies:
+            latencies = np.array(self.chunk_latencies) * 1000
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            logging.info(
+                f"Active streams: {len(self.streams)}, "
+                f"chunks: {len(latencies)}, "
+                f"average batch size: {np.mean(self.batch_sizes):.1f}, "
+                f"chunk latency (ms): p50 {p50:.1f}, p90 {p90:.1f}, "
+                f"p99 {p99:.1f}, max {latencies.max():.1f}"
+            )
+        self.chunk_latencies.clear()
+        self.batch_sizes.clear()
+        self.last_log_time = time.time()
+
+
+@torch.no_grad()
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    params = get_params()
+    params.update(vars(args))
+
+    token_table = k2.SymbolTable.from_file(params.tokens)
+    params.blank_id = token_table["<blk>"]
+    params.unk_id = token_table["<unk>"]
+    params.vocab_size = num_tokens(token_table) + 1
+
+    assert params.causal, "Please use a streaming model, i.e., --causal 1"
+    assert "," not in params.chunk_size, "chunk_size should be one value."
+    assert (
+        "," not in params.left_context_frames
+    ), "left_context_frames should be one value."
+    assert params.decoding_method in (
+        "greedy_search",
+        "modified_beam_search",
+    ), params.decoding_method
+
+    logging.info(f"{params}")
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+
+    logging.info(f"device: {device}")
+
+    logging.info("Creating model")
+    model = get_model(params)
+
+    checkpoint = torch.load(params.checkpoint, map_location="cpu")
+    model.load_state_dict(checkpoint["model"], strict=False)
+    model.to(device)
+    model.eval()
+    model.device = device
+
+    server = StreamingServer(model=model, params=params, token_table=token_table)
+    asyncio.run(server.run(params.port))
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
@@ -85,12 +85,14 @@ from torch.utils.tensorboard import SummaryWriter
 from zipformer import Zipformer2
 
 from icefall import diagnostics
-from icefall.checkpoint import load_checkpoint, remove_checkpoints
-from icefall.checkpoint import save_checkpoint as save_checkpoint_impl
 from icefall.checkpoint import (
-    save_checkpoint_with_global_batch_idx,
-    update_averaged_model,
+    AsyncCheckpointWriter,
+    ModelAverager,
+    load_checkpoint,
+    remove_checkpoints,
 )
+from icefall.checkpoint import save_checkpoint as save_checkpoint_impl
+from icefall.checkpoint import save_checkpoint_with_global_batch_idx
 from icefall.dist import cleanup_dist, setup_dist
 from icefall.env import get_env_info
 from icefall.err import raise_grad_scale_is_too_small_error
@@ -522,6 +524,29 @@ def get_parser():
         """,
     )
 
+    parser.add_argument(
+        "--save-safetensors",
+        type=str2bool,
+        default=False,
+        help="""If True, also save `model` and `model_avg` of each
+        checkpoint to a file with suffix `.safetensors`. Model averaging
+        in ./zipformer/decode.py and ./zipformer/export.py then memory maps
+        these files and processes the checkpoints tensor by tensor instead
+        of loading whole checkpoints into memory.
+        """,
+    )
+
+    parser.add_argument(
+        "--async-checkpoint",
+        type=str2bool,
+        default=False,
+        help="""If True, write checkpoints in a background thread. Training
+        is blocked only while the states are copied to CPU memory, which
+        needs extra CPU memory for a copy of the model, model_avg and the
+        optimizer states.
+        """,
+    )
+
     parser.add_argument(
         "--average-period",
         type=int,
@@ -535,6 +560,16 @@ def get_parser():
         """,
     )
 
+    parser.add_argument(
+        "--model-avg-on-gpu",
+        type=str2bool,
+        default=False,
+        help="""If True, keep `model_avg` on the GPU so that updating it does
+        not copy the model to CPU. It needs GPU memory for a float64 copy
+        of the model.
+        """,
+    )
+
     parser.add_argument(
         "--use-fp16",
         type=str2bool,
@@ -831,6 +866,7 @@ def save_checkpoint(
     sampler: Optional[CutSampler] = None,
     scaler: Optional[GradScaler] = None,
     rank: int = 0,
+    checkpoint_writer: Optional[AsyncCheckpointWriter] = None,
 ) -> None:
     """Save model, optimizer, scheduler and training stats to file.
 
@@ -847,6 +883,8 @@ def save_checkpoint(
        The sampler for the training dataset.
       scaler:
         The scaler used for mix precision training.
+      checkpoint_writer:
+        If not None, write the checkpoint in the background.
     """
     if rank != 0:
         return
@@ -861,15 +899,24 @@ def save_checkpoint(
         sampler=sampler,
         scaler=scaler,
         rank=rank,
+        with_safetensors=params.save_safetensors,
+        writer=checkpoint_writer,
     )
 
+    def copy_checkpoint(dst: Path):
+        if checkpoint_writer is not None:
+            # Copy it after it is written
+            checkpoint_writer.submit(copyfile, src=filename, dst=dst)
+        else:
+            copyfile(src=filename, dst=dst)
+
     if params.best_train_epoch == params.cur_epoch:
         best_train_filename = params.exp_dir / "best-train-loss.pt"
-        copyfile(src=filename, dst=best_train_filename)
+        copy_checkpoint(dst=best_train_filename)
 
     if params.best_valid_epoch == params.cur_epoch:
         best_valid_filename = params.exp_dir / "best-valid-loss.pt"
-        copyfile(src=filename, dst=best_valid_filename)
+        copy_checkpoint(dst=best_valid_filename)
 
 
 def compute_loss(
@@ -972,22 +1019,24 @@ def compute_loss(
 
     assert loss.requires_grad == is_training
 
+    # The values are kept on the device so that no synchronization with
+    # the GPU is needed until they are printed. See MetricsTracker.
     info = MetricsTracker()
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        info["frames"] = (feature_lens // params.subsampling_factor).sum().item()
+        info["frames"] = (feature_lens // params.subsampling_factor).sum()
 
     # Note: We use reduction=sum while computing the loss.
-    info["loss"] = loss.detach().cpu().item()
+    info["loss"] = loss.detach()
     if params.use_transducer:
-        info["simple_loss"] = simple_loss.detach().cpu().item()
-        info["pruned_loss"] = pruned_loss.detach().cpu().item()
+        info["simple_loss"] = simple_loss.detach()
+        info["pruned_loss"] = pruned_loss.detach()
     if params.use_ctc:
-        info["ctc_loss"] = ctc_loss.detach().cpu().item()
+        info["ctc_loss"] = ctc_loss.detach()
         if params.use_cr_ctc:
-            info["cr_loss"] = cr_loss.detach().cpu().item()
+            info["cr_loss"] = cr_loss.detach()
     if params.use_attention_decoder:
-        info["attn_decoder_loss"] = attention_decoder_loss.detach().cpu().item()
+        info["attn_decoder_loss"] = attention_decoder_loss.detach()
 
     return loss, info
 
@@ -1018,7 +1067,7 @@ def compute_validation_loss(
     if world_size > 1:
         tot_loss.reduce(loss.device)
 
-    loss_value = tot_loss["loss"] / tot_loss["frames"]
+    loss_value = float(tot_loss["loss"] / tot_loss["frames"])
     if loss_value < params.best_valid_loss:
         params.best_valid_epoch = params.cur_epoch
         params.best_valid_loss = loss_value
@@ -1040,6 +1089,7 @@ def train_one_epoch(
     tb_writer: Optional[SummaryWriter] = None,
     world_size: int = 1,
     rank: int = 0,
+    checkpoint_writer: Optional[AsyncCheckpointWriter] = None,
 ) -> None:
     """Train the model for one epoch.
 
@@ -1073,11 +1123,17 @@ def train_one_epoch(
       rank:
         The rank of the node in DDP training. If no DDP is used, it should
         be set to 0.
+      checkpoint_writer:
+        If not None, write checkpoints in the background.
     """
     model.train()
 
     tot_loss = MetricsTracker()
 
+    model_averager = None
+    if model_avg is not None:
+        model_averager = ModelAverager(model_cur=model, model_avg=model_avg)
+
     saved_bad_model = False
 
     def save_bad_model(suffix: str = ""):
@@ -1137,11 +1193,7 @@ def train_one_epoch(
             and params.batch_idx_train > 0
             and params.batch_idx_train % params.average_period == 0
         ):
-            update_averaged_model(
-                params=params,
-                model_cur=model,
-                model_avg=model_avg,
-            )
+            model_averager.update(params)
 
         if (
             params.batch_idx_train > 0
@@ -1158,11 +1210,14 @@ def train_one_epoch(
                 sampler=train_dl.sampler,
                 scaler=scaler,
                 rank=rank,
+                with_safetensors=params.save_safetensors,
+                writer=checkpoint_writer,
             )
             remove_checkpoints(
                 out_dir=params.exp_dir,
                 topk=params.keep_last_k,
                 rank=rank,
+                writer=checkpoint_writer,
             )
 
         if batch_idx % 100 == 0 and params.use_autocast:
@@ -1227,7 +1282,7 @@ def train_one_epoch(
                     tb_writer, "train/valid_", params.batch_idx_train
                 )
 
-    loss_value = tot_loss["loss"] / tot_loss["frames"]
+    loss_value = float(tot_loss["loss"] / tot_loss["frames"])
     params.train_loss = loss_value
     if params.train_loss < params.best_train_loss:
         params.best_train_epoch = params.cur_epoch
@@ -1325,6 +1380,9 @@ def run(rank, world_size, args):
     )
 
     model.to(device)
+    if model_avg is not None and params.model_avg_on_gpu:
+        model_avg.to(device)
+
     if world_size > 1:
         logging.info("Using DDP")
         model = DDP(model, device_ids=[rank], find_unused_parameters=True)
@@ -1443,6 +1501,10 @@ def run(rank, world_size, args):
         logging.info("Loading grad scaler state dict")
         scaler.load_state_dict(checkpoints["grad_scaler"])
 
+    checkpoint_writer = None
+    if params.async_checkpoint and rank == 0:
+        checkpoint_writer = AsyncCheckpointWriter()
+
     for epoch in range(params.start_epoch, params.num_epochs + 1):
         scheduler.step_epoch(epoch - 1)
         fix_random_seed(params.seed + epoch - 1)
@@ -1467,6 +1529,7 @@ def run(rank, world_size, args):
             tb_writer=tb_writer,
             world_size=world_size,
             rank=rank,
+            checkpoint_writer=checkpoint_writer,
         )
 
         if params.print_diagnostics:
@@ -1482,8 +1545,12 @@ def run(rank, world_size, args):
             sampler=train_dl.sampler,
             scaler=scaler,
             rank=rank,
+            checkpoint_writer=checkpoint_writer,
         )
 
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+
     logging.info("Done!")
 
     if world_size > 1:
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# Copyright      2024 The Chinese University of HK
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script reports the throughput of entropy coding the codes of Encodec:
+
+  - bit packing: BitPacker/BitUnpacker vs. pack_bits/unpack_bits in ./binary.py
+  - arithmetic coding: ArithmeticCoder/ArithmeticDecoder vs.
+    batched_arithmetic_encode/batched_arithmetic_decode in ./quantization/ac.py,
+    with one stream per --frames-per-stream frames of each codebook
+
+It uses random codes drawn from a skewed distribution of each codebook and
+checks that both implementations produce the same bytes and codes. Since the
+per-symbol implementations are slow, they only code the first
+--num-reference-frames frames.
+
+Usage:
+./encodec/benchmark_compress.py \
+    --duration 600 \
+    --num-codebooks 32
+"""
+
+
+import argparse
+import io
+import logging
+import time
+from typing import Callable
+
+import torch
+from binary import BitPacker, BitUnpacker, pack_bits, unpack_bits
+from compress import compress, decompress
+from quantization.ac import (
+    ArithmeticCoder,
+    ArithmeticDecoder,
+    batched_arithmetic_encode,
+    build_stable_quantized_cdf,
+)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=600,
+        help="Duration in seconds of the coded audio",
+    )
+
+    parser.add_argument(
+        "--frame-rate",
+        type=int,
+        default=75,
+        help="Number of frames per second, i.e., sampling_rate / prod(ratios)",
+    )
+
+    parser.add_argument(
+        "--num-codebooks",
+        type=int,
+        default=32,
+        help="Number of codebooks, e.g., 32 for 24 kbps",
+    )
+
+    parser.add_argument(
+        "--bins",
+        type=int,
+        default=1024,
+        help="Size of each codebook",
+    )
+
+    parser.add_argument(
+        "--frames-per-stream",
+        type=int,
+        default=1500,
+        help="Number of frames of each arithmetic coded stream, see ./compress.py",
+    )
+
+    parser.add_argument(
+        "--num-reference-frames",
+        type=int,
+        default=750,
+        help="Number of frames coded by the per-symbol implementations",
+    )
+
+    return parser
+
+
+def timeit(name: str, f: Callable, num_symbols: int, duration: float):
+    start = time.time()
+    ans = f()
+    elapsed = time.time() - start
+    logging.info(
+        f"{name}: {elapsed:.3f} s, "
+        f"{num_symbols / elapsed / 1e6:.3f} M symbols/s, "
+        f"{duration / elapsed:.1f}x real time"
+    )
+    return ans
+
+
+def bit_pack(codes: torch.Tensor, bits: int) -> bytes:
+    fo = io.BytesIO()
+    packer = BitPacker(bits, fo)
+    for value in codes.t().reshape(-1).tolist():
+        packer.push(value)
+    packer.flush()
+    return fo.getvalue()
+
+
+def bit_unpack(data: bytes, bits: int, num_values: int):
+    unpacker = BitUnpacker(bits, io.BytesIO(data))
+    return [unpacker.pull() for _ in range(num_values)]
+
+
+def arithmetic_encode(codes: torch.Tensor, quantized_cdf: torch.Tensor):
+    streams = []
+    for stream_codes, cdf in zip(codes, quantized_cdf):
+        fo = io.BytesIO()
+        coder = ArithmeticCoder(fo)
+        for value in stream_codes.tolist():
+            coder.push(value, cdf)
+        coder.flush()
+        streams.append(fo.getvalue())
+    return streams
+
+
+def arithmetic_decode(streams, quantized_cdf: torch.Tensor, num_frames: int):
+    codes = []
+    for stream, cdf in zip(streams, quantized_cdf):
+        decoder = ArithmeticDecoder(io.BytesIO(stream))
+        codes.append([decoder.pull(cdf) for _ in range(num_frames)])
+    return codes
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.info(vars(args))
+
+    bits = (args.bins - 1).bit_length()
+    num_frames = int(args.duration * args.frame_rate)
+    num_ref_frames = min(num_frames, args.num_reference_frames)
+    ref_duration = num_ref_frames / args.frame_rate
+
+    torch.manual_seed(20240101)
+    # The later codebooks of a residual VQ are usually closer to uniform.
+    temperature = torch.linspace(3, 1, args.num_codebooks).unsqueeze(1)
+    pdf = torch.softmax(torch.randn(args.num_codebooks, args.bins) * temperature, 1)
+    quantized_cdf = build_stable_quantized_cdf(pdf.double(), total_range_bits=24)
+    codes = torch.multinomial(pdf, num_frames, replacement=True)
+    ref_codes = codes[:, :num_ref_frames]
+    logging.info(
+        f"{args.num_codebooks} codebooks x {num_frames} frames, "
+        f"entropy {-(pdf * pdf.log2()).sum(1).mean():.2f} bits per symbol"
+    )
+
+    logging.info("Bit packing")
+    num_symbols = ref_codes.numel()
+    ref_packed = timeit(
+        "BitPacker", lambda: bit_pack(ref_codes, bits), num_symbols, ref_duration
+    )
+    packed = pack_bits(ref_codes.t().numpy(), bits)
+    assert packed == ref_packed
+    unpacked = timeit(
+        "BitUnpacker",
+        lambda: bit_unpack(packed, bits, num_symbols),
+        num_symbols,
+        ref_duration,
+    )
+    assert unpacked == ref_codes.t().reshape(-1).tolist()
+
+    num_symbols = codes.numel()
+    packed = timeit(
+        "pack_bits",
+        lambda: compress(codes, bits),
+        num_symbols,
+        args.duration,
+    )
+    decoded, _ = timeit(
+        "unpack_bits",
+        lambda: decompress(packed),
+        num_symbols,
+        args.duration,
+    )
+    assert torch.equal(decoded, codes)
+    logging.info(f"{len(packed) * 8 / num_symbols:.2f} bits per symbol")
+
+    logging.info("Arithmetic coding")
+    num_symbols = ref_codes.numel()
+    ref_streams = timeit(
+        "ArithmeticCoder",
+        lambda: arithmetic_encode(ref_codes, quantized_cdf),
+        num_symbols,
+        ref_duration,
+    )
+    ref_decoded = timeit(
+        "ArithmeticDecoder",
+        lambda: arithmetic_decode(ref_streams, quantized_cdf, num_ref_frames),
+        num_symbols,
+        ref_duration,
+    )
+    assert ref_decoded == ref_codes.tolist()
+    assert batched_arithmetic_encode(ref_codes, quantized_cdf) == ref_streams
+
+    num_symbols = codes.numel()
+    compressed = timeit(
+        "batched_arithmetic_encode",
+        lambda: compress(
+            codes,
+            bits,
+            quantized_cdf=quantized_cdf,
+            frames_per_stream=args.frames_per_stream,
+        ),
+        num_symbols,
+        args.duration,
+    )
+    decoded, _ = timeit(
+        "batched_arithmetic_decode",
+        lambda: decompress(compressed, quantized_cdf=quantized_cdf),
+        num_symbols,
+        args.duration,
+    )
+    assert torch.equal(decoded, codes)
+    logging.info(f"{len(compressed) * 8 / num_symbols:.2f} bits per symbol")
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+
+    main()
@@ -10,18 +10,23 @@ import json
 import struct
 from typing import IO, Any, List, Optional
 
+import numpy as np
+
 # format is `ECDC` magic code, followed by the header size as uint32.
-# Then an uint8 indicates the protocol version (0.)
+# Then an uint8 indicates the protocol version (0 or 1).
 # The header is then provided as json and should contain all required
 # informations for decoding. A raw stream of bytes is then provided
 # and should be interpretable using the json header.
+# Version 0 is the format of the original Encodec. Version 1 stores
+# several independent arithmetic coded streams, see `compress.py`.
 _encodec_header_struct = struct.Struct("!4sBI")
 _ENCODEC_MAGIC = b"ECDC"
+_ENCODEC_VERSIONS = (0, 1)
 
 
-def write_ecdc_header(fo: IO[bytes], metadata: Any):
+def write_ecdc_header(fo: IO[bytes], metadata: Any, version: int = 0):
+    assert version in _ENCODEC_VERSIONS, version
     meta_dumped = json.dumps(metadata).encode("utf-8")
-    version = 0
     header = _encodec_header_struct.pack(_ENCODEC_MAGIC, version, len(meta_dumped))
     fo.write(header)
     fo.write(meta_dumped)
@@ -42,15 +47,18 @@ def _read_exactly(fo: IO[bytes], size: int) -> bytes:
     return buf
 
 
-def read_ecdc_header(fo: IO[bytes]):
+def read_ecdc_header(fo: IO[bytes], return_version: bool = False):
     header_bytes = _read_exactly(fo, _encodec_header_struct.size)
     magic, version, meta_size = _encodec_header_struct.unpack(header_bytes)
     if magic != _ENCODEC_MAGIC:
         raise ValueError("File is not in ECDC format.")
-    if version != 0:
+    if version not in _ENCODEC_VERSIONS:
         raise ValueError("Version not supported.")
     meta_bytes = _read_exactly(fo, meta_size)
-    return json.loads(meta_bytes.decode("utf-8"))
+    metadata = json.loads(meta_bytes.decode("utf-8"))
+    if return_version:
+        return metadata, version
+    return metadata
 
 
 class BitPacker:
@@ -125,6 +133,45 @@ class BitUnpacker:
         return out
 
 
+def pack_bits(values: np.ndarray, bits: int) -> bytes:
+    """Vectorized version of `BitPacker`. The returned bytes are the same as
+    the ones written by pushing all the values to a `BitPacker` and flushing it.
+
+    Args:
+        values (np.ndarray): integers in `[0, 2 ** bits - 1]`, of any shape.
+            They are packed in row-major order.
+        bits (int): number of bits per value.
+    """
+    values = np.asarray(values, dtype=np.int64).reshape(-1, 1)
+    # The least significant bit comes first, see `BitPacker.push`
+    all_bits = (values >> np.arange(bits)) & 1
+    return np.packbits(all_bits.astype(np.uint8), bitorder="little").tobytes()
+
+
+def unpack_bits(data: bytes, bits: int, num_values: Optional[int] = None) -> np.ndarray:
+    """Vectorized version of `BitUnpacker`.
+
+    Args:
+        data (bytes): bytes written by `BitPacker` or `pack_bits`.
+        bits (int): number of bits per value.
+        num_values (int or None): number of values to decode. If None,
+            decode as many values as `BitUnpacker` would, which might
+            include "ghost" values coming from the flushing mechanism.
+    Returns:
+        A 1-D int64 array.
+    """
+    all_bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little")
+    if num_values is None:
+        num_values = len(all_bits) // bits
+    if num_values * bits > len(all_bits):
+        raise EOFError(
+            f"Impossible to read {num_values} values of {bits} bits "
+            f"from {len(data)} bytes."
+        )
+    all_bits = all_bits[: num_values * bits].reshape(num_values, bits)
+    return all_bits.astype(np.int64) @ (1 << np.arange(bits, dtype=np.int64))
+
+
 def test():
     import torch
 
@@ -156,6 +203,11 @@ def test():
         for idx, (a, b) in enumerate(zip(tokens, rebuilt)):
             assert a == b, (idx, a, b)
 
+        # The vectorized versions must be compatible with the ones above.
+        assert pack_bits(np.array(tokens), bits) == buf.getvalue()
+        assert unpack_bits(buf.getvalue(), bits).tolist() == rebuilt
+        assert unpack_bits(buf.getvalue(), bits, len(tokens)).tolist() == tokens
+
 
 if __name__ == "__main__":
     test()
@@ -0,0 +1,172 @@
+# Copyright      2024 The Chinese University of HK
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Write the codes of Encodec, i.e., the output of `Encodec.encode()` for
+a single utterance, to the `.ecdc` format of `binary.py` and read them back.
+
+There are two layouts:
+
+  - Without quantized CDFs, the codes are packed with `bits` bits each,
+    frame by frame, which is the version 0 format of the original Encodec
+    without language model.
+  - With quantized CDFs, e.g., the statistics of each codebook or the
+    predictions of a language model, each codebook is split into chunks of
+    `frames_per_stream` frames and each chunk is arithmetic coded as an
+    independent stream, which is the version 1 format. All the streams are
+    coded at once by `batched_arithmetic_encode()`, so more streams mean
+    fewer, larger vectorized steps, at the cost of a few bytes per stream.
+"""
+
+import io
+from typing import IO, Any, Dict, Optional, Tuple
+
+import torch
+from binary import pack_bits, read_ecdc_header, unpack_bits, write_ecdc_header
+from quantization.ac import batched_arithmetic_decode, batched_arithmetic_encode
+from torch import Tensor
+
+
+def _split_into_streams(x: Tensor, frames_per_stream: int) -> Tensor:
+    """Split a tensor of shape (num_codebooks, num_frames, ...) into
+    chunks of shape (num_codebooks * num_chunks, frames_per_stream, ...).
+    The last chunk is padded by repeating the last frame."""
+    num_codebooks, num_frames = x.shape[:2]
+    num_chunks = -(-num_frames // frames_per_stream)
+    padding = num_chunks * frames_per_stream - num_frames
+    if padding > 0:
+        x = torch.cat([x, x[:, -1:].expand(-1, padding, *x.shape[2:])], dim=1)
+    return x.reshape(num_codebooks * num_chunks, frames_per_stream, *x.shape[2:])
+
+
+def _split_cdf(
+    quantized_cdf: Tensor, num_codebooks: int, num_frames: int, frames_per_stream: int
+) -> Tensor:
+    """Return the CDF of each stream of `_split_into_streams()`."""
+    if quantized_cdf.ndim == 1:
+        return quantized_cdf
+    if quantized_cdf.ndim == 2:
+        num_chunks = -(-num_frames // frames_per_stream)
+        return quantized_cdf.repeat_interleave(num_chunks, dim=0)
+    return _split_into_streams(quantized_cdf, frames_per_stream)
+
+
+def compress_to_file(
+    codes: Tensor,
+    fo: IO[bytes],
+    bits: int,
+    quantized_cdf: Optional[Tensor] = None,
+    total_range_bits: int = 24,
+    frames_per_stream: int = 1500,
+    metadata: Optional[Dict[str, Any]] = None,
+):
+    """Write codes to a file-like object.
+
+    Args:
+      codes:
+        A tensor of shape (num_codebooks, num_frames).
+      fo:
+        The file-like object to write to.
+      bits:
+        Number of bits of each code, i.e., log2 of the codebook size.
+      quantized_cdf:
+        If None, the codes are packed with `bits` bits each. Otherwise,
+        they are arithmetic coded with it, see `batched_arithmetic_encode()`.
+        Its shape is (2**bits,), (num_codebooks, 2**bits) or
+        (num_codebooks, num_frames, 2**bits).
+      total_range_bits:
+        See `ArithmeticCoder`. Used only if quantized_cdf is not None.
+      frames_per_stream:
+        Number of frames of each arithmetic coded stream. Used only if
+        quantized_cdf is not None. A value not smaller than num_frames means
+        one stream per codebook.
+      metadata:
+        Extra key-value pairs saved in the header, e.g., the audio length.
+    """
+    assert codes.ndim == 2, codes.shape
+    num_codebooks, num_frames = codes.shape
+    metadata = dict(metadata or {})
+    metadata.update({"nc": num_codebooks, "nf": num_frames, "b": bits})
+
+    if quantized_cdf is None:
+        metadata["lm"] = False
+        write_ecdc_header(fo, metadata)
+        fo.write(pack_bits(codes.t().cpu().numpy(), bits))
+    else:
+        # Avoid padding when there are fewer frames
+        frames_per_stream = max(1, min(frames_per_stream, num_frames))
+        streams = batched_arithmetic_encode(
+            _split_into_streams(codes, frames_per_stream),
+            _split_cdf(quantized_cdf, num_codebooks, num_frames, frames_per_stream),
+            total_range_bits,
+        )
+        metadata["trb"] = total_range_bits
+        metadata["fs"] = frames_per_stream
+        metadata["sl"] = [len(s) for s in streams]
+        write_ecdc_header(fo, metadata, version=1)
+        for s in streams:
+            fo.write(s)
+    fo.flush()
+
+
+def decompress_from_file(
+    fo: IO[bytes], quantized_cdf: Optional[Tensor] = None
+) -> Tuple[Tensor, Dict[str, Any]]:
+    """Read codes written by `compress_to_file()`.
+
+    Args:
+      fo:
+        The file-like object to read from.
+      quantized_cdf:
+        **Exactly** the same CDF as the one given to `compress_to_file()`.
+        Used only if the codes are arithmetic coded.
+    Returns:
+      Return a tuple containing:
+        - codes, a tensor of shape (num_codebooks, num_frames)
+        - the metadata in the header
+    """
+    metadata, version = read_ecdc_header(fo, return_version=True)
+    num_codebooks, num_frames = metadata["nc"], metadata["nf"]
+
+    if version == 0:
+        codes = unpack_bits(fo.read(), metadata["b"], num_codebooks * num_frames)
+        codes = codes.reshape(num_frames, num_codebooks).T
+    else:
+        if quantized_cdf is None:
+            raise ValueError("The codes are arithmetic coded, please give the CDF.")
+        frames_per_stream = metadata["fs"]
+        streams = [fo.read(n) for n in metadata["sl"]]
+        codes = batched_arithmetic_decode(
+            streams,
+            _split_cdf(quantized_cdf, num_codebooks, num_frames, frames_per_stream),
+            frames_per_stream,
+            metadata["trb"],
+        )
+        codes = codes.reshape(num_codebooks, -1)[:, :num_frames]
+    return torch.from_numpy(codes.copy()), metadata
+
+
+def compress(codes: Tensor, bits: int, **kwargs) -> bytes:
+    """Same as `compress_to_file()`, but return the bytes."""
+    fo = io.BytesIO()
+    compress_to_file(codes, fo, bits, **kwargs)
+    return fo.getvalue()
+
+
+def decompress(
+    compressed: bytes, quantized_cdf: Optional[Tensor] = None
+) -> Tuple[Tensor, Dict[str, Any]]:
+    """Same as `decompress_from_file()`, but read from bytes."""
+    return decompress_from_file(io.BytesIO(compressed), quantized_cdf)
@@ -7,13 +7,13 @@
 import io
 import math
 import random
-from typing import IO, Any, List, Optional
+from typing import IO, Any, List, Optional, Union
 
+import numpy as np
 import torch
+from binary import BitPacker, BitUnpacker
 from torch import Tensor
 
-from ..binary import BitPacker, BitUnpacker
-
 
 def build_stable_quantized_cdf(
     pdf: Tensor,
@@ -27,7 +27,8 @@ def build_stable_quantized_cdf(
     to the PDF.
 
     Args:
-        pdf (Tensor): probability distribution, shape should be `[N]`.
+        pdf (Tensor): probability distribution, shape should be `[N]`, or `[..., N]`
+            to build one CDF per row.
         total_range_bits (int): see `ArithmeticCoder`, the typical range we expect
             during the coding process is `[0, 2 ** total_range_bits - 1]`.
         roundoff (float): will round the pdf up to that level to remove difference coming
@@ -42,7 +43,7 @@ def build_stable_quantized_cdf(
         pdf = (pdf / roundoff).floor() * roundoff
     # interpolate with uniform distribution to achieve desired minimum probability.
     total_range = 2**total_range_bits
-    cardinality = len(pdf)
+    cardinality = pdf.shape[-1]
     alpha = min_range * cardinality / total_range
     assert alpha <= 1, "you must reduce min_range"
     ranges = (((1 - alpha) * total_range) * pdf).floor().long()
@@ -51,10 +52,10 @@ def build_stable_quantized_cdf(
     if min_range < 2:
         raise ValueError("min_range must be at least 2.")
     if check:
-        assert quantized_cdf[-1] <= 2**total_range_bits, quantized_cdf[-1]
-        if (
-            (quantized_cdf[1:] - quantized_cdf[:-1]) < min_range
-        ).any() or quantized_cdf[0] < min_range:
+        last = quantized_cdf[..., -1]
+        assert (last <= 2**total_range_bits).all(), last
+        widths = quantized_cdf[..., 1:] - quantized_cdf[..., :-1]
+        if (widths < min_range).any() or (quantized_cdf[..., 0] < min_range).any():
             raise ValueError("You must increase your total_range_bits.")
     return quantized_cdf
 
@@ -279,6 +280,228 @@ class ArithmeticDecoder:
         return sym
 
 
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """Vectorized `int.bit_length` for non-negative int64 values."""
+    exponent = np.frexp(x)[1].astype(np.int64)
+    if x.max(initial=0) >= 2**53:
+        # Values just below a power of 2 might be rounded up to it.
+        exponent -= (exponent > 0) & ((1 << np.maximum(exponent - 1, 0)) > x)
+    return exponent
+
+
+def _num_rescale_bits(delta: np.ndarray, total_range_bits: int) -> np.ndarray:
+    """Return how many times the range width `delta` has to be doubled
+    so that it is at least `2 ** total_range_bits`."""
+    # Rounding errors of np.frexp only happen for values much larger than
+    # 2 ** total_range_bits, for which the result is 0 anyway.
+    return np.maximum(total_range_bits + 1 - np.frexp(delta)[1], 0).astype(np.int64)
+
+
+def _to_numpy(x: Union[Tensor, np.ndarray]) -> np.ndarray:
+    if isinstance(x, Tensor):
+        x = x.cpu().numpy()
+    return np.asarray(x, dtype=np.int64)
+
+
+def _broadcast_cdf(
+    quantized_cdf: Union[Tensor, np.ndarray], num_streams: int, num_steps: int
+) -> np.ndarray:
+    """Return a view of shape `[num_streams, num_steps, N]` of the given
+    quantized CDF of shape `[N]`, `[num_streams, N]` or `[num_streams, num_steps, N]`.
+    """
+    quantized_cdf = _to_numpy(quantized_cdf)
+    if quantized_cdf.ndim == 2:
+        quantized_cdf = quantized_cdf[:, None]
+    return np.broadcast_to(
+        quantized_cdf, (num_streams, num_steps, quantized_cdf.shape[-1])
+    )
+
+
+def _pack_msb_first(values: np.ndarray, num_bits: np.ndarray) -> bytes:
+    """Return the bytes written by pushing the `num_bits[i]` least significant
+    bits of each `values[i]`, most significant bit first, to a `BitPacker`
+    with `bits=1` and flushing it."""
+    total = num_bits.sum()
+    chunk = np.repeat(np.arange(len(num_bits)), num_bits)
+    pos = np.arange(total) - (np.cumsum(num_bits) - num_bits)[chunk]
+    bits = (values[chunk] >> (num_bits[chunk] - 1 - pos)) & 1
+    return np.packbits(bits.astype(np.uint8), bitorder="little").tobytes()
+
+
+def batched_arithmetic_encode(
+    symbols: Union[Tensor, np.ndarray],
+    quantized_cdf: Union[Tensor, np.ndarray],
+    total_range_bits: int = 24,
+) -> List[bytes]:
+    """Encode several independent streams of symbols at once. The loop over
+    the symbols of a stream is still sequential, but each step is vectorized
+    over the streams, e.g., over all the codebooks of an audio.
+
+    The bytes of each stream are exactly those written by an `ArithmeticCoder`
+    to which the symbols of the stream are pushed, so they can be decoded
+    by `ArithmeticDecoder` as well as by `batched_arithmetic_decode`.
+
+    Args:
+        symbols (Tensor or np.ndarray): symbols to encode, shape `[S, T]`
+            for `S` streams of `T` symbols.
+        quantized_cdf (Tensor or np.ndarray): use `build_stable_quantized_cdf`
+            to build this from your pdf estimate. Its shape is `[N]` to use
+            the same CDF everywhere, `[S, N]` to use one CDF per stream,
+            or `[S, T, N]` to use one CDF per symbol.
+        total_range_bits (int): see `ArithmeticCoder`.
+    Returns:
+        The encoded bytes of each stream.
+    """
+    assert total_range_bits <= 30
+    symbols = _to_numpy(symbols)
+    num_streams, num_steps = symbols.shape
+    quantized_cdf = _broadcast_cdf(quantized_cdf, num_streams, num_steps)
+
+    # The range of each symbol does not depend on the state of the coder
+    stream_idx = np.arange(num_streams)[:, None]
+    step_idx = np.arange(num_steps)[None, :]
+    range_high = quantized_cdf[stream_idx, step_idx, symbols] - 1
+    range_low = quantized_cdf[stream_idx, step_idx, np.maximum(symbols - 1, 0)]
+    range_low[symbols == 0] = 0
+
+    total_range = 2**total_range_bits
+    low = np.zeros(num_streams, dtype=np.int64)
+    high = np.zeros(num_streams, dtype=np.int64)
+    max_bit = np.full(num_streams, -1, dtype=np.int64)
+    # The common prefix flushed after each step, and the remaining bits
+    # flushed at the end.
+    values = np.empty((num_streams, num_steps + 1), dtype=np.int64)
+    num_bits = np.empty((num_streams, num_steps + 1), dtype=np.int64)
+    for t in range(num_steps):
+        # Double the range until it is at least total_range,
+        # see `ArithmeticCoder.push`.
+        k = _num_rescale_bits(high - low + 1, total_range_bits)
+        low <<= k
+        high = ((high + 1) << k) - 1
+        max_bit += k
+        assert (max_bit <= 61).all(), max_bit
+
+        # Same float computation as in `ArithmeticCoder.push`
+        scale = (high - low + 1) / total_range
+        high = low + np.floor(range_high[:, t] * scale).astype(np.int64)
+        low = low + np.ceil(range_low[:, t] * scale).astype(np.int64)
+
+        # Only the last `n` bits of low and high differ.
+        n = _bit_length(low ^ high)
+        values[:, t] = low >> n
+        num_bits[:, t] = max_bit + 1 - n
+        mask = (1 << n) - 1
+        low &= mask
+        high &= mask
+        max_bit = n - 1
+
+    values[:, -1] = low
+    num_bits[:, -1] = max_bit + 1
+    return [_pack_msb_first(v, n) for v, n in zip(values, num_bits)]
+
+
+def batched_arithmetic_decode(
+    streams: List[bytes],
+    quantized_cdf: Union[Tensor, np.ndarray],
+    num_symbols: int,
+    total_range_bits: int = 24,
+) -> np.ndarray:
+    """Decode several independent streams at once. This is the counterpart of
+    `batched_arithmetic_encode`, which also decodes the bytes written by
+    `ArithmeticCoder`. Instead of a binary search in Python, the symbols of
+    all the streams are found with a single `np.searchsorted`.
+
+    Args:
+        streams (list of bytes): the encoded bytes of each stream.
+        quantized_cdf (Tensor or np.ndarray): **exactly** the same CDF as
+            the one used at encoding time, see `batched_arithmetic_encode`.
+        num_symbols (int): number of symbols to decode from each stream.
+        total_range_bits (int): see `ArithmeticCoder`.
+    Returns:
+        The decoded symbols, shape `[S, num_symbols]`.
+    """
+    num_streams = len(streams)
+    quantized_cdf = _broadcast_cdf(quantized_cdf, num_streams, num_symbols)
+    cardinality = quantized_cdf.shape[-1]
+    total_range = 2**total_range_bits
+
+    # Reverse the bits of each byte so that the bits of a stream are in the
+    # order they were pushed, and bits can be read with shifts. At most
+    # total_range_bits <= 30 bits are read at each step, i.e., from 5 bytes.
+    # Valid streams never need more bits than they have, the zero padding is
+    # only there so that we never index out of bounds.
+    max_len = max([len(s) for s in streams], default=0) + 5
+    data = np.zeros((num_streams, max_len), dtype=np.int64)
+    for i, s in enumerate(streams):
+        b = np.unpackbits(np.frombuffer(s, dtype=np.uint8), bitorder="little")
+        data[i, : len(s)] = np.packbits(b)
+    # The 40 bits starting at each byte
+    windows = data[:, :-4] << 32
+    for i in range(1, 5):
+        windows |= data[:, i : max_len - 4 + i] << (32 - 8 * i)
+
+    stream_idx = np.arange(num_streams)
+    # With offsets of total_range between streams, all the CDFs of a step
+    # can be searched by a single np.searchsorted.
+    offsets = stream_idx * total_range
+    static = quantized_cdf.strides[1] == 0
+    if static:
+        flat_cdf = (quantized_cdf[:, 0] + offsets[:, None]).reshape(-1)
+        flat_cdf = flat_cdf.astype(np.float64)
+
+    low = np.zeros(num_streams, dtype=np.int64)
+    high = np.zeros(num_streams, dtype=np.int64)
+    current = np.zeros(num_streams, dtype=np.int64)
+    pos = np.zeros(num_streams, dtype=np.int64)
+    symbols = np.empty((num_streams, num_symbols), dtype=np.int64)
+    for t in range(num_symbols):
+        # Read new bits until the range is at least total_range,
+        # see `ArithmeticDecoder.pull`.
+        k = _num_rescale_bits(high - low + 1, total_range_bits)
+        window = windows[stream_idx, pos >> 3]
+        current = (current << k) | (window >> (40 - (pos & 7) - k)) & ((1 << k) - 1)
+        pos += k
+        low <<= k
+        high = ((high + 1) << k) - 1
+
+        cdf = quantized_cdf[:, t]
+        if not static:
+            flat_cdf = (cdf + offsets[:, None]).reshape(-1).astype(np.float64)
+
+        # The symbol is the number of symbols whose effective high is below
+        # current, i.e., roughly those with `cdf - 1 < (current - low) / scale`.
+        # Rounding errors are fixed below.
+        scale = (high - low + 1) / total_range
+        target = current - low
+        sym = np.searchsorted(flat_cdf, target / scale + 1 + offsets, side="right")
+        sym = np.clip(sym - stream_idx * cardinality, 1, cardinality - 1)
+
+        def effective_high(s):
+            return np.floor((cdf[stream_idx, s] - 1) * scale).astype(np.int64)
+
+        # The guess is only wrong because of rounding errors, i.e., it is off
+        # by at most one symbol.
+        sym -= effective_high(sym - 1) >= target
+        sym += (sym < cardinality - 1) & (effective_high(sym) < target)
+
+        range_low = np.where(sym > 0, cdf[stream_idx, np.maximum(sym - 1, 0)], 0)
+        effective_low = np.ceil(range_low * scale).astype(np.int64)
+        effective_high_ = effective_high(sym)
+        if ((target < effective_low) | (target > effective_high_)).any():
+            raise RuntimeError("Binary search failed")
+        symbols[:, t] = sym
+
+        high = low + effective_high_
+        low = low + effective_low
+        n = _bit_length(low ^ high)
+        mask = (1 << n) - 1
+        low &= mask
+        high &= mask
+        current &= mask
+
+    return symbols
+
+
 def test():
     torch.manual_seed(1234)
     random.seed(1234)
@@ -306,6 +529,32 @@ def test():
             assert decoded_symbol == symbol, idx
         assert decoder.pull(torch.zeros(1)) is None
 
+        # The batched versions must be compatible with the ones above.
+        q_cdf = build_stable_quantized_cdf(torch.stack(pdfs), encoder.total_range_bits)
+        streams = batched_arithmetic_encode(
+            torch.tensor([symbols, symbols[::-1]]), torch.stack([q_cdf, q_cdf.flip(0)])
+        )
+        assert streams[0] == fo.getvalue()
+        decoded = batched_arithmetic_decode(
+            streams, torch.stack([q_cdf, q_cdf.flip(0)]), steps
+        )
+        assert decoded.tolist() == [symbols, symbols[::-1]]
+
+    # One CDF per stream
+    pdf = torch.softmax(torch.randn(3, 1024) * 3, dim=1)
+    q_cdf = build_stable_quantized_cdf(pdf, 24)
+    symbols = torch.multinomial(pdf, 2000, replacement=True)
+    streams = batched_arithmetic_encode(symbols, q_cdf)
+    for stream, stream_symbols, stream_cdf in zip(streams, symbols, q_cdf):
+        fo = io.BytesIO()
+        encoder = ArithmeticCoder(fo)
+        for symbol in stream_symbols.tolist():
+            encoder.push(symbol, stream_cdf)
+        encoder.flush()
+        assert stream == fo.getvalue()
+    decoded = batched_arithmetic_decode(streams, q_cdf, symbols.shape[1])
+    assert decoded.tolist() == symbols.tolist()
+
 
 if __name__ == "__main__":
     test()
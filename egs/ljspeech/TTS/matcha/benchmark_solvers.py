@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Copyright         2024  Xiaomi Corp.
+
+"""
+This script compares the ODE solvers of the decoder, i.e., --solver in
+./inference.py and ./export_onnx.py, for different numbers of steps.
+
+For each solver and number of steps, it reports
+
+  - NFE: number of function evaluations, i.e., decoder runs
+  - RTF: real time factor of MatchaTTS.synthesise() without the vocoder
+  - MCD: mel cepstral distortion in dB against a reference that is
+    generated by the euler solver with --ref-steps steps from the same noise
+
+A smaller MCD means the solver is closer to the exact solution of the ODE.
+
+Usage:
+
+  ./matcha/benchmark_solvers.py \
+    --exp-dir ./matcha/exp \
+    --epoch 4000 \
+    --tokens ./data/tokens.txt \
+    --cmvn ./data/fbank/cmvn.json \
+    --num-steps 2,3,4,6
+"""
+
+import argparse
+import json
+import logging
+import math
+import time
+from pathlib import Path
+
+import torch
+from tokenizer import Tokenizer
+from train import get_model, get_params
+
+from icefall.checkpoint import load_checkpoint
+
+SENTENCES = [
+    "Printing, in the only sense with which we are at present concerned, "
+    "differs from most if not from all the arts and crafts represented "
+    "in the Exhibition.",
+    "The earliest book printed with movable types, the Gutenberg, "
+    "or forty-two line Bible of about 1455, has never been surpassed.",
+    "He was arrested at 10:30 p.m. on the 21st of November, 1963.",
+    "The quick brown fox jumps over the lazy dog.",
+]
+
+SOLVERS = ["euler", "midpoint", "heun", "multistep"]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--epoch",
+        type=int,
+        default=4000,
+        help="""It specifies the checkpoint to use for decoding.
+        Note: Epoch counts from 1.
+        """,
+    )
+
+    parser.add_argument(
+        "--exp-dir",
+        type=Path,
+        default="matcha/exp-new-3",
+        help="""The experiment dir.
+        It specifies the directory where all training related
+        files, e.g., checkpoints, log, etc, are saved
+        """,
+    )
+
+    parser.add_argument(
+        "--tokens",
+        type=Path,
+        default="data/tokens.txt",
+    )
+
+    parser.add_argument(
+        "--cmvn",
+        type=str,
+        default="data/fbank/cmvn.json",
+        help="""Path to vocabulary.""",
+    )
+
+    parser.add_argument(
+        "--num-steps",
+        type=str,
+        default="2,3,4,6",
+        help="Comma separated numbers of ODE solver steps",
+    )
+
+    parser.add_argument(
+        "--ref-steps",
+        type=int,
+        default=100,
+        help="Number of steps of the euler solver for the reference",
+    )
+
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=0.667,
+        help="Sampling temperature",
+    )
+
+    return parser
+
+
+def mel_cepstral_distortion(mel: torch.Tensor, ref: torch.Tensor) -> float:
+    """Return the mel cepstral distortion in dB between two log-mel
+    spectrograms, excluding the 0th coefficient.
+
+    Args:
+      mel:
+        A tensor of shape (feat_dim, num_frames).
+      ref:
+        A tensor of the same shape as mel.
+    """
+    n = mel.size(0)
+    k = torch.arange(n, dtype=torch.float32).unsqueeze(1)
+    i = torch.arange(n, dtype=torch.float32).unsqueeze(0)
+    # Orthonormal DCT-II
+    dct = torch.cos(math.pi / n * (i + 0.5) * k) * math.sqrt(2 / n)
+    dct[0] /= math.sqrt(2)
+
+    diff = (dct @ (mel - ref))[1:]
+    return (10 / math.log(10) * (2 * diff.pow(2).sum(dim=0)).sqrt()).mean().item()
+
+
+def synthesise(model, x, x_lengths, num_steps, solver, temperature):
+    # Use the same noise for all solvers
+    torch.manual_seed(20240101)
+    return model.synthesise(
+        x,
+        x_lengths,
+        n_timesteps=num_steps,
+        temperature=temperature,
+        solver=solver,
+    )["mel"][0]
+
+
+@torch.inference_mode()
+def main():
+    args = get_parser().parse_args()
+    params = get_params()
+    params.update(vars(args))
+
+    tokenizer = Tokenizer(params.tokens)
+    params.blank_id = tokenizer.pad_id
+    params.vocab_size = tokenizer.vocab_size
+    params.model_args.n_vocab = params.vocab_size
+
+    with open(params.cmvn) as f:
+        stats = json.load(f)
+        params.model_args.data_statistics.mel_mean = stats["fbank_mean"]
+        params.model_args.data_statistics.mel_std = stats["fbank_std"]
+    logging.info(vars(args))
+
+    model = get_model(params)
+    load_checkpoint(f"{params.exp_dir}/epoch-{params.epoch}.pt", model)
+    model.eval()
+
+    inputs = []
+    for text in SENTENCES:
+        x = tokenizer.texts_to_token_ids([text], add_sos=True, add_eos=True)
+        x = torch.tensor(x, dtype=torch.int64)
+        x_lengths = torch.tensor([x.shape[1]], dtype=torch.int64)
+        ref = synthesise(model, x, x_lengths, args.ref_steps, "euler", args.temperature)
+        inputs.append((x, x_lengths, ref))
+    duration = sum(ref.shape[1] for _, _, ref in inputs) * 256 / 22050
+
+    num_steps_list = list(map(int, args.num_steps.split(",")))
+    for solver in SOLVERS:
+        nfe_per_step = 2 if solver in ("midpoint", "heun") else 1
+        for num_steps in num_steps_list:
+            mcd = 0
+            elapsed = 0
+            for x, x_lengths, ref in inputs:
+                start = time.time()
+                mel = synthesise(
+                    model, x, x_lengths, num_steps, solver, args.temperature
+                )
+                elapsed += time.time() - start
+                mcd += mel_cepstral_distortion(mel, ref)
+            logging.info(
+                f"{solver}, {num_steps} steps: NFE {num_steps * nfe_per_step}, "
+                f"RTF {elapsed / duration:.3f}, "
+                f"MCD {mcd / len(inputs):.3f} dB"
+            )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    torch.set_num_threads(1)
+    torch.set_num_interop_threads(1)
+    main()
@@ -58,6 +58,15 @@ def get_parser():
         help="""Path to vocabulary.""",
     )
 
+    parser.add_argument(
+        "--solver",
+        type=str,
+        default="euler",
+        choices=["euler", "midpoint", "heun", "multistep"],
+        help="""ODE solver of the decoder. midpoint and heun run the decoder
+        twice per step. See ./benchmark_solvers.py""",
+    )
+
     return parser
 
 
@@ -84,10 +93,11 @@ def add_meta_data(filename: str, meta_data: Dict[str, Any]):
 
 
 class ModelWrapper(torch.nn.Module):
-    def __init__(self, model, num_steps: int = 5):
+    def __init__(self, model, num_steps: int = 5, solver: str = "euler"):
         super().__init__()
         self.model = model
         self.num_steps = num_steps
+        self.solver = solver
 
     def forward(
         self,
@@ -112,6 +122,7 @@ class ModelWrapper(torch.nn.Module):
             n_timesteps=self.num_steps,
             temperature=temperature,
             length_scale=length_scale,
+            solver=self.solver,
         )["mel"]
         # mel: (batch_size, feat_dim, num_frames)
 
@@ -146,7 +157,7 @@ def main():
 
     for num_steps in [2, 3, 4, 5, 6]:
         logging.info(f"num_steps: {num_steps}")
-        wrapper = ModelWrapper(model, num_steps=num_steps)
+        wrapper = ModelWrapper(model, num_steps=num_steps, solver=params.solver)
         wrapper.eval()
 
         # Use a large value so the rotary position embedding in the text
@@ -157,7 +168,10 @@ def main():
         length_scale = torch.tensor([1.0])
 
         opset_version = 14
-        filename = f"model-steps-{num_steps}.onnx"
+        if params.solver == "euler":
+            filename = f"model-steps-{num_steps}.onnx"
+        else:
+            filename = f"model-{params.solver}-steps-{num_steps}.onnx"
         torch.onnx.export(
             wrapper,
             (x, x_lengths, temperature, length_scale),
@@ -184,6 +198,7 @@ def main():
             "maintainer": "k2-fsa",
             "dataset": "LJ Speech",
             "num_ode_steps": num_steps,
+            "ode_solver": params.solver,
         }
         add_meta_data(filename=filename, meta_data=meta_data)
         print(meta_data)
@@ -56,6 +56,14 @@ def get_parser():
         default="data/tokens.txt",
     )
 
+    parser.add_argument(
+        "--phoneme-cache",
+        type=str,
+        default="",
+        help="""If not empty, a jsonl file that caches the phonemes of the
+        input texts across runs. See ./tokenizer.py""",
+    )
+
     parser.add_argument(
         "--cmvn",
         type=str,
@@ -63,6 +71,22 @@ def get_parser():
         help="""Path to vocabulary.""",
     )
 
+    parser.add_argument(
+        "--solver",
+        type=str,
+        default="euler",
+        choices=["euler", "midpoint", "heun", "multistep"],
+        help="""ODE solver of the decoder. midpoint and heun run the decoder
+        twice per step. See ./benchmark_solvers.py""",
+    )
+
+    parser.add_argument(
+        "--num-steps",
+        type=int,
+        default=2,
+        help="Number of ODE solver steps",
+    )
+
     parser.add_argument(
         "--input-text",
         type=str,
@@ -114,7 +138,14 @@ def process_text(text: str, tokenizer):
 
 
 def synthesise(
-    model, tokenizer, n_timesteps, text, length_scale, temperature, spks=None
+    model,
+    tokenizer,
+    n_timesteps,
+    text,
+    length_scale,
+    temperature,
+    spks=None,
+    solver=None,
 ):
     text_processed = process_text(text, tokenizer)
     start_t = dt.datetime.now()
@@ -125,6 +156,7 @@ def synthesise(
         temperature=temperature,
         spks=spks,
         length_scale=length_scale,
+        solver=solver,
     )
     # merge everything to one dict
     output.update({"start_t": start_t, **text_processed})
@@ -139,7 +171,7 @@ def main():
 
     params.update(vars(args))
 
-    tokenizer = Tokenizer(params.tokens)
+    tokenizer = Tokenizer(params.tokens, phoneme_cache=params.phoneme_cache)
     params.blank_id = tokenizer.pad_id
     params.vocab_size = tokenizer.vocab_size
     params.model_args.n_vocab = params.vocab_size
@@ -168,9 +200,6 @@ def main():
     vocoder = load_vocoder(params.vocoder)
     denoiser = Denoiser(vocoder, mode="zeros")
 
-    # Number of ODE Solver steps
-    n_timesteps = 2
-
     # Changes to the speaking rate
     length_scale = 1.0
 
@@ -180,10 +209,11 @@ def main():
     output = synthesise(
         model=model,
         tokenizer=tokenizer,
-        n_timesteps=n_timesteps,
+        n_timesteps=params.num_steps,
         text=params.input_text,
         length_scale=length_scale,
         temperature=temperature,
+        solver=params.solver,
     )
     output["waveform"] = to_waveform(output["mel"], vocoder, denoiser)
 
@@ -37,8 +37,17 @@ class Block1D(torch.nn.Module):
             nn.Mish(),
         )
 
-    def forward(self, x, mask):
-        output = self.block(x * mask)
+    def forward(self, x, mask, cache=None):
+        if cache is None:
+            output = self.block(x * mask)
+        else:
+            # The convolution of the remaining input channels is precomputed
+            # in cache, see Decoder.get_cache()
+            conv = self.block[0]
+            output = F.conv1d(
+                x * mask, conv.weight[:, : x.shape[1]], padding=conv.padding
+            )
+            output = self.block[1:](output + cache)
         return output * mask
 
 
@@ -54,11 +63,23 @@ class ResnetBlock1D(torch.nn.Module):
 
         self.res_conv = torch.nn.Conv1d(dim, dim_out, 1)
 
-    def forward(self, x, mask, time_emb):
-        h = self.block1(x, mask)
+    def forward(self, x, mask, time_emb, cache=None):
+        """
+        Args:
+            cache (Tuple[torch.Tensor, torch.Tensor], optional): the output of
+                block1 and res_conv for the input channels that are not in x,
+                see Decoder.get_cache()
+        """
+        if cache is None:
+            h = self.block1(x, mask)
+            res = self.res_conv(x * mask)
+        else:
+            h = self.block1(x, mask, cache[0])
+            res = F.conv1d(x * mask, self.res_conv.weight[:, : x.shape[1]])
+            res = res + cache[1]
         h += self.mlp(time_emb).unsqueeze(-1)
         h = self.block2(h, mask)
-        output = h + self.res_conv(x * mask)
+        output = h + res
         return output
 
 
@@ -376,7 +397,37 @@ class Decoder(nn.Module):
                 if m.bias is not None:
                     nn.init.constant_(m.bias, 0)
 
-    def forward(self, x, mask, mu, t, spks=None, cond=None):
+    def get_cache(self, mask, mu, spks=None):
+        """Compute the part of forward() that depends only on mu and spks.
+
+        mu and spks are concatenated to x before the first resnet block, so its
+        convolutions are split into one for x and one for mu and spks. The
+        latter does not change across the steps of the ODE solver.
+
+        Args:
+            mask (torch.Tensor): shape (batch_size, 1, time)
+            mu (torch.Tensor): shape (batch_size, n_feats, time)
+            spks (torch.Tensor, optional): shape: (batch_size, condition_channels).
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: the cache to pass to forward()
+        """
+        cond = mu
+        if spks is not None:
+            spks = repeat(spks, "b c -> b c t", t=mu.shape[-1])
+            cond = pack([cond, spks], "b * t")[0]
+
+        resnet = self.down_blocks[0][0]
+        # Number of input channels of x
+        n = self.in_channels - cond.shape[1]
+        conv = resnet.block1.block[0]
+        block1 = F.conv1d(
+            cond * mask, conv.weight[:, n:], conv.bias, padding=conv.padding
+        )
+        res = F.conv1d(cond * mask, resnet.res_conv.weight[:, n:], resnet.res_conv.bias)
+        return block1, res
+
+    def forward(self, x, mask, mu, t, spks=None, cond=None, cache=None):
         """Forward pass of the UNet1DConditional model.
 
         Args:
@@ -385,6 +436,8 @@ class Decoder(nn.Module):
             t (_type_): shape (batch_size)
             spks (_type_, optional): shape: (batch_size, condition_channels). Defaults to None.
             cond (_type_, optional): placeholder for future use. Defaults to None.
+            cache (_type_, optional): the return value of get_cache() for mu and
+                spks. If not None, mu and spks are not used. Defaults to None.
 
         Raises:
             ValueError: _description_
@@ -397,17 +450,18 @@ class Decoder(nn.Module):
         t = self.time_embeddings(t)
         t = self.time_mlp(t)
 
-        x = pack([x, mu], "b * t")[0]
+        if cache is None:
+            x = pack([x, mu], "b * t")[0]
 
-        if spks is not None:
-            spks = repeat(spks, "b c -> b c t", t=x.shape[-1])
-            x = pack([x, spks], "b * t")[0]
+            if spks is not None:
+                spks = repeat(spks, "b c -> b c t", t=x.shape[-1])
+                x = pack([x, spks], "b * t")[0]
 
         hiddens = []
         masks = [mask]
-        for resnet, transformer_blocks, downsample in self.down_blocks:
+        for i, (resnet, transformer_blocks, downsample) in enumerate(self.down_blocks):
             mask_down = masks[-1]
-            x = resnet(x, mask_down, t)
+            x = resnet(x, mask_down, t, cache=cache if i == 0 else None)
             x = rearrange(x, "b c t -> b t c")
             mask_down = rearrange(mask_down, "b 1 t -> b t")
             for transformer_block in transformer_blocks:
@@ -4,6 +4,9 @@ import torch
 import torch.nn.functional as F
 from matcha.models.components.decoder import Decoder
 
+# Valid values of cfm_params.solver. See BASECFM.solve_*()
+SOLVERS = ("euler", "midpoint", "heun", "multistep")
+
 
 class BASECFM(torch.nn.Module, ABC):
     def __init__(
@@ -26,7 +29,16 @@ class BASECFM(torch.nn.Module, ABC):
         self.estimator = None
 
     @torch.inference_mode()
-    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None):
+    def forward(
+        self,
+        mu,
+        mask,
+        n_timesteps,
+        temperature=1.0,
+        spks=None,
+        cond=None,
+        solver=None,
+    ):
         """Forward diffusion
 
         Args:
@@ -39,17 +51,41 @@ class BASECFM(torch.nn.Module, ABC):
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            solver (str, optional): ODE solver, one of SOLVERS.
+                Defaults to cfm_params.solver.
 
         Returns:
             sample: generated mel-spectrogram
                 shape: (batch_size, n_feats, mel_timesteps)
         """
+        solver = self.solver if solver is None else solver
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver: {solver}. Valid values are {SOLVERS}")
+
         z = torch.randn_like(mu) * temperature
         t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device)
-        return self.solve_euler(
+        return getattr(self, f"solve_{solver}")(
             z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond
         )
 
+    def get_velocity_fn(self, mu, mask, spks, cond):
+        """Return a function that maps (x, t) to the output of the estimator.
+
+        The computation that depends only on mu and spks is done once here
+        and reused in every step.
+        """
+        if hasattr(self.estimator, "get_cache"):
+            cache = self.estimator.get_cache(mask, mu, spks)
+        else:
+            cache = None
+
+        def velocity(x, t):
+            if cache is None:
+                return self.estimator(x, mask, mu, t, spks, cond)
+            return self.estimator(x, mask, mu, t, spks, cond, cache=cache)
+
+        return velocity
+
     def solve_euler(self, x, t_span, mu, mask, spks, cond):
         """
         Fixed euler solver for ODEs.
@@ -65,6 +101,7 @@ class BASECFM(torch.nn.Module, ABC):
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
         """
+        velocity = self.get_velocity_fn(mu, mask, spks, cond)
         t, _, dt = t_span[0], t_span[-1], t_span[1] - t_span[0]
 
         # I am storing this because I can later plot it by putting a debugger here and saving it to a file
@@ -72,7 +109,7 @@ class BASECFM(torch.nn.Module, ABC):
         sol = []
 
         for step in range(1, len(t_span)):
-            dphi_dt = self.estimator(x, mask, mu, t, spks, cond)
+            dphi_dt = velocity(x, t)
 
             x = x + dt * dphi_dt
             t = t + dt
@@ -82,6 +119,53 @@ class BASECFM(torch.nn.Module, ABC):
 
         return sol[-1]
 
+    def solve_midpoint(self, x, t_span, mu, mask, spks, cond):
+        """
+        Fixed midpoint solver for ODEs. It is second order and runs the
+        estimator twice per step. See solve_euler() for the arguments.
+        """
+        velocity = self.get_velocity_fn(mu, mask, spks, cond)
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            x_mid = x + dt / 2 * velocity(x, t)
+            x = x + dt * velocity(x_mid, t + dt / 2)
+        return x
+
+    def solve_heun(self, x, t_span, mu, mask, spks, cond):
+        """
+        Fixed Heun solver for ODEs. It is second order and runs the
+        estimator twice per step. See solve_euler() for the arguments.
+        """
+        velocity = self.get_velocity_fn(mu, mask, spks, cond)
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            dphi_dt = velocity(x, t)
+            x_pred = x + dt * dphi_dt
+            x = x + dt / 2 * (dphi_dt + velocity(x_pred, t + dt))
+        return x
+
+    def solve_multistep(self, x, t_span, mu, mask, spks, cond):
+        """
+        Second order multistep solver for ODEs, i.e., the Adams-Bashforth
+        method, which is what DPM-Solver++(2M) reduces to for flow matching.
+        It reuses the output of the estimator of the previous step, so it runs
+        the estimator once per step like solve_euler(). The first step is an
+        Euler step. See solve_euler() for the arguments.
+        """
+        velocity = self.get_velocity_fn(mu, mask, spks, cond)
+        prev = None
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            dphi_dt = velocity(x, t)
+            if prev is None:
+                x = x + dt * dphi_dt
+            else:
+                prev_dphi_dt, prev_dt = prev
+                r = dt / (2 * prev_dt)
+                x = x + dt * ((1 + r) * dphi_dt - r * prev_dphi_dt)
+            prev = (dphi_dt, dt)
+        return x
+
     def compute_loss(self, x1, mask, mu, spks=None, cond=None):
         """Computes diffusion loss
 
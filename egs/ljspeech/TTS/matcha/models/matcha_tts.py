@@ -31,6 +31,7 @@ class MatchaTTS(torch.nn.Module):  # 🍵
         scheduler=None,
         prior_loss=True,
         use_precomputed_durations=False,
+        maximum_path_impl="cython",
     ):
         super().__init__()
 
@@ -44,6 +45,15 @@ class MatchaTTS(torch.nn.Module):  # 🍵
         self.prior_loss = prior_loss
         self.use_precomputed_durations = use_precomputed_durations
 
+        # Monotonic alignment search, either on CPU with Cython, or on the
+        # device of the model with PyTorch. Both return the same alignment.
+        if maximum_path_impl == "cython":
+            self.maximum_path = monotonic_align.maximum_path
+        elif maximum_path_impl == "torch":
+            self.maximum_path = monotonic_align.maximum_path_torch
+        else:
+            raise ValueError(f"Unknown maximum_path_impl: {maximum_path_impl}")
+
         if n_spks > 1:
             self.spk_emb = torch.nn.Embedding(n_spks, spk_emb_dim)
 
@@ -74,7 +84,14 @@ class MatchaTTS(torch.nn.Module):  # 🍵
 
     @torch.inference_mode()
     def synthesise(
-        self, x, x_lengths, n_timesteps, temperature=1.0, spks=None, length_scale=1.0
+        self,
+        x,
+        x_lengths,
+        n_timesteps,
+        temperature=1.0,
+        spks=None,
+        length_scale=1.0,
+        solver=None,
     ):
         """
         Generates mel-spectrogram from text. Returns:
@@ -93,6 +110,9 @@ class MatchaTTS(torch.nn.Module):  # 🍵
                 shape: (batch_size,)
             length_scale (float, optional): controls speech pace.
                 Increase value to slow down generated speech and vice versa.
+            solver (str, optional): ODE solver of the decoder, one of
+                euler, midpoint, heun and multistep. midpoint and heun run the
+                decoder twice per step. Defaults to cfm_params.solver.
 
         Returns:
             dict: {
@@ -136,7 +156,9 @@ class MatchaTTS(torch.nn.Module):  # 🍵
         encoder_outputs = mu_y[:, :, :y_max_length]
 
         # Generate sample tracing the probability flow
-        decoder_outputs = self.decoder(mu_y, y_mask, n_timesteps, temperature, spks)
+        decoder_outputs = self.decoder(
+            mu_y, y_mask, n_timesteps, temperature, spks, solver=solver
+        )
         decoder_outputs = decoder_outputs[:, :, :y_max_length]
 
         t = (dt.datetime.now() - t).total_seconds()
@@ -207,7 +229,7 @@ class MatchaTTS(torch.nn.Module):  # 🍵
                 mu_square = torch.sum(factor * (mu_x**2), 1).unsqueeze(-1)
                 log_prior = y_square - y_mu_double + mu_square + const
 
-                attn = monotonic_align.maximum_path(log_prior, attn_mask.squeeze(1))
+                attn = self.maximum_path(log_prior, attn_mask.squeeze(1))
                 attn = attn.detach()  # b, t_text, T_mel
 
         # Compute loss between predicted log-scaled durations and those obtained from MAS
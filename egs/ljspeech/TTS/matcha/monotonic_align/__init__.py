@@ -2,7 +2,13 @@
 # https://github.com/shivammehta25/Matcha-TTS/blob/main/matcha/utils/monotonic_align/__init__.py
 import numpy as np
 import torch
-from matcha.monotonic_align.core import maximum_path_c
+from matcha.monotonic_align.torch_impl import maximum_path_torch as _maximum_path_torch
+
+try:
+    from matcha.monotonic_align.core import maximum_path_c
+except ImportError:
+    # It is not needed by maximum_path_torch()
+    maximum_path_c = None
 
 
 def maximum_path(value, mask):
@@ -10,6 +16,10 @@ def maximum_path(value, mask):
     value: [b, t_x, t_y]
     mask: [b, t_x, t_y]
     """
+    assert maximum_path_c is not None, (
+        "Please run `python setup.py build_ext --inplace` in "
+        "matcha/monotonic_align or use maximum_path_torch()"
+    )
     value = value * mask
     device = value.device
     dtype = value.dtype
@@ -21,3 +31,15 @@ def maximum_path(value, mask):
     t_y_max = mask.sum(2)[:, 0].astype(np.int32)
     maximum_path_c(path, value, t_x_max, t_y_max)
     return torch.from_numpy(path).to(device=device, dtype=dtype)
+
+
+def maximum_path_torch(value, mask):
+    """PyTorch version that runs on the device of the input and returns the
+    same path as maximum_path().
+    value: [b, t_x, t_y]
+    mask: [b, t_x, t_y]
+    """
+    value = value * mask
+    # It uses [b, t_y, t_x] as in VITS
+    path = _maximum_path_torch(value.transpose(1, 2), mask.transpose(1, 2))
+    return path.transpose(1, 2).contiguous()
@@ -0,0 +1 @@
+../../vits/monotonic_align/torch_impl.py
\ No newline at end of file
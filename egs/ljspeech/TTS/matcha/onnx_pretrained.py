@@ -31,6 +31,14 @@ def get_parser():
         help="Path to the tokens.txt",
     )
 
+    parser.add_argument(
+        "--phoneme-cache",
+        type=str,
+        default="",
+        help="""If not empty, a jsonl file that caches the phonemes of the
+        input texts across runs. See ./tokenizer.py""",
+    )
+
     parser.add_argument(
         "--vocoder",
         type=str,
@@ -97,13 +105,14 @@ class OnnxModel:
     def __init__(
         self,
         filename: str,
+        phoneme_cache: str = "",
     ):
         session_opts = ort.SessionOptions()
         session_opts.inter_op_num_threads = 1
         session_opts.intra_op_num_threads = 2
 
         self.session_opts = session_opts
-        self.tokenizer = Tokenizer("./data/tokens.txt")
+        self.tokenizer = Tokenizer("./data/tokens.txt", phoneme_cache=phoneme_cache)
         self.model = ort.InferenceSession(
             filename,
             sess_options=self.session_opts,
@@ -147,7 +156,7 @@ def main():
     params = get_parser().parse_args()
     logging.info(vars(params))
 
-    model = OnnxModel(params.acoustic_model)
+    model = OnnxModel(params.acoustic_model, phoneme_cache=params.phoneme_cache)
     vocoder = OnnxHifiGANModel(params.vocoder)
     text = params.input_text
     x = model.tokenizer.texts_to_token_ids([text], add_sos=True, add_eos=True)
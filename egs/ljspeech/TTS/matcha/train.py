@@ -124,6 +124,18 @@ def get_parser():
         help="Whether to use half precision training.",
     )
 
+    parser.add_argument(
+        "--maximum-path-impl",
+        type=str,
+        default="cython",
+        choices=["cython", "torch"],
+        help="""Implementation of monotonic alignment search. cython runs
+        it on CPU with monotonic_align/core.pyx, which has to be built first.
+        torch runs it on the device of the model without copying the data
+        to CPU, and gives the same alignment.
+        """,
+    )
+
     return parser
 
 
@@ -175,6 +187,7 @@ def _get_model_params() -> AttributeDict:
             "out_size": None,  # or use 172
             "prior_loss": True,
             "use_precomputed_durations": False,
+            "maximum_path_impl": "cython",
             "data_statistics": get_data_statistics(),
             "encoder": AttributeDict(
                 {
@@ -610,6 +623,7 @@ def run(rank, world_size, args):
     params.pad_id = tokenizer.pad_id
     params.vocab_size = tokenizer.vocab_size
     params.model_args.n_vocab = params.vocab_size
+    params.model_args.maximum_path_impl = params.maximum_path_impl
 
     with open(params.cmvn) as f:
         stats = json.load(f)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Copyright    2024  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the two implementations of monotonic alignment search
+selected by --maximum-path-impl in ./train.py:
+
+  - cython: monotonic_align/core.pyx, which copies the input to CPU
+  - torch: monotonic_align/torch_impl.py, which runs on the device of the input
+
+It checks that they return the same alignment and reports the time of
+maximum_path() alone and of a generator training step, i.e., the forward
+and backward pass of the generator, with random inputs on GPU if
+available.
+
+Usage:
+
+  cd vits/monotonic_align
+  python setup.py build_ext --inplace
+  cd ../../
+
+  ./vits/benchmark_maximum_path.py --batch-size 32 --model-type high
+"""
+
+import argparse
+import logging
+import time
+from typing import Callable
+
+import torch
+from monotonic_align import maximum_path, maximum_path_torch
+from train import get_model, get_params
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="Number of utterances in a batch",
+    )
+
+    parser.add_argument(
+        "--max-frames",
+        type=int,
+        default=800,
+        help="Maximum number of frames of an utterance",
+    )
+
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=300,
+        help="Maximum number of tokens of an utterance",
+    )
+
+    parser.add_argument(
+        "--num-iters",
+        type=int,
+        default=10,
+        help="Number of timed iterations",
+    )
+
+    parser.add_argument(
+        "--model-type",
+        type=str,
+        default="high",
+        choices=["low", "medium", "high"],
+        help="Model size of the generator training step",
+    )
+
+    return parser
+
+
+def get_random_batch(args, device: torch.device):
+    """Return random tokens and features with lengths."""
+    B = args.batch_size
+    text_lengths = torch.randint(args.max_tokens // 2, args.max_tokens + 1, (B,))
+    # The frames per token ratio is about 3 for LJSpeech with blanks
+    feats_lengths = (text_lengths * 3).clamp(max=args.max_frames)
+    text_lengths[0] = args.max_tokens
+    feats_lengths[0] = args.max_frames
+
+    text = torch.randint(1, 100, (B, args.max_tokens))
+    feats = torch.randn(B, args.max_frames, 513)
+    speech = torch.randn(B, args.max_frames * 256)
+    return (
+        text.to(device),
+        text_lengths.to(device),
+        feats.to(device),
+        feats_lengths.to(device),
+        speech.to(device),
+        (feats_lengths * 256).to(device),
+    )
+
+
+def timeit(f: Callable[[], None], num_iters: int, device: torch.device) -> float:
+    """Return the average time in seconds of f() after one warmup run."""
+    f()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.time()
+    for _ in range(num_iters):
+        f()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.time() - start) / num_iters
+
+
+def benchmark_maximum_path(args, device: torch.device):
+    _, text_lengths, _, feats_lengths, _, _ = get_random_batch(args, device)
+    x_mask = torch.arange(args.max_tokens, device=device) < text_lengths.unsqueeze(1)
+    y_mask = torch.arange(args.max_frames, device=device) < feats_lengths.unsqueeze(1)
+    # (B, T_feats, T_text)
+    attn_mask = (y_mask.unsqueeze(-1) & x_mask.unsqueeze(1)).float()
+    neg_x_ent = torch.randn(
+        args.batch_size, args.max_frames, args.max_tokens, device=device
+    )
+
+    path = maximum_path(neg_x_ent, attn_mask)
+    path_torch = maximum_path_torch(neg_x_ent, attn_mask)
+    assert torch.equal(path, path_torch), "The alignments differ"
+
+    for name, f in [("cython", maximum_path), ("torch", maximum_path_torch)]:
+        t = timeit(lambda: f(neg_x_ent, attn_mask), args.num_iters, device)
+        logging.info(f"maximum_path, {name}: {t * 1000:.1f} ms")
+
+
+def benchmark_training_step(args, device: torch.device):
+    batch = get_random_batch(args, device)
+
+    losses = {}
+    for impl in ["cython", "torch"]:
+        params = get_params()
+        params.vocab_size = 100
+        params.model_type = args.model_type
+        params.maximum_path_impl = impl
+
+        torch.manual_seed(20240101)
+        model = get_model(params).to(device)
+        model.train()
+        # Otherwise the generator outputs are reused by the next step
+        model.cache_generator_outputs = False
+
+        def step():
+            # The same random segments are used by both implementations
+            torch.manual_seed(20240102)
+            loss, _ = model(
+                text=batch[0],
+                text_lengths=batch[1],
+                feats=batch[2],
+                feats_lengths=batch[3],
+                speech=batch[4],
+                speech_lengths=batch[5],
+                forward_generator=True,
+            )
+            model.zero_grad()
+            loss.backward()
+            losses[impl] = loss.item()
+
+        t = timeit(step, args.num_iters, device)
+        logging.info(f"generator training step, {impl}: {t * 1000:.1f} ms")
+
+    logging.info(f"Losses: {losses}")
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.info(vars(args))
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+    logging.info(f"device: {device}")
+
+    torch.manual_seed(20240101)
+    benchmark_maximum_path(args, device)
+    benchmark_training_step(args, device)
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Copyright    2024  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares VITSGenerator.inference() with
+VITSGenerator.inference_streaming() in ./generator.py. For inputs of
+different lengths, it reports the time until the first audio chunk is
+available, the real time factor (RTF) and, on GPU, the peak memory.
+
+It uses a randomly initialized model and a fixed duration for each token,
+so that the number of frames only depends on the number of tokens.
+
+Usage:
+
+  ./vits/benchmark_streaming.py --model-type high --chunk-size 32
+
+See also ./test_onnx.py for the streaming ONNX models.
+"""
+
+import argparse
+import logging
+import time
+
+import torch
+from train import get_model, get_params
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--model-type",
+        type=str,
+        default="high",
+        choices=["low", "medium", "high"],
+        help="Model size",
+    )
+
+    parser.add_argument(
+        "--num-tokens",
+        type=str,
+        default="50,200,800",
+        help="Comma separated numbers of tokens of the inputs",
+    )
+
+    parser.add_argument(
+        "--frames-per-token",
+        type=int,
+        default=4,
+        help="Duration of each token in frames",
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=32,
+        help="Number of frames of each chunk",
+    )
+
+    return parser
+
+
+def synchronize(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def benchmark(generator, text, text_lengths, dur, chunk_size: int, device):
+    """Return the time to the first audio, the total time, the number of
+    samples and the peak memory in MB of inference() if chunk_size is 0
+    or inference_streaming() otherwise."""
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+
+    synchronize(device)
+    start = time.time()
+    if chunk_size == 0:
+        wav, _, _ = generator.inference(text, text_lengths, dur=dur)
+        synchronize(device)
+        first = time.time() - start
+        num_samples = wav.size(1)
+    else:
+        first = None
+        num_samples = 0
+        for wav, _ in generator.inference_streaming(
+            text, text_lengths, dur=dur, chunk_size=chunk_size
+        ):
+            synchronize(device)
+            if first is None:
+                first = time.time() - start
+            num_samples += wav.size(1)
+    total = time.time() - start
+
+    memory = 0
+    if device.type == "cuda":
+        memory = torch.cuda.max_memory_allocated(device) / 1024 / 1024
+    return first, total, num_samples, memory
+
+
+@torch.no_grad()
+def main():
+    args = get_parser().parse_args()
+    logging.info(vars(args))
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+    logging.info(f"device: {device}")
+
+    params = get_params()
+    params.vocab_size = 100
+    params.model_type = args.model_type
+
+    torch.manual_seed(20240101)
+    model = get_model(params).to(device)
+    model.eval()
+    generator = model.generator
+    logging.info(f"context size: {generator.context_size} frames")
+
+    num_tokens_list = list(map(int, args.num_tokens.split(",")))
+    for i, num_tokens in enumerate([num_tokens_list[0]] + num_tokens_list):
+        text = torch.randint(1, params.vocab_size, (1, num_tokens), device=device)
+        text_lengths = torch.tensor([num_tokens], device=device)
+        dur = torch.full(
+            (1, 1, num_tokens),
+            args.frames_per_token,
+            dtype=torch.float32,
+            device=device,
+        )
+        for name, chunk_size in [("non-streaming", 0), ("streaming", args.chunk_size)]:
+            first, total, num_samples, memory = benchmark(
+                generator, text, text_lengths, dur, chunk_size, device
+            )
+            if i == 0:
+                # warmup
+                continue
+            duration = num_samples / model.sampling_rate
+            logging.info(
+                f"{num_tokens} tokens ({duration:.2f} s), {name}: "
+                f"first audio after {first:.3f} s, "
+                f"RTF {total / duration:.3f}"
+                + (f", peak memory {memory:.0f} MB" if device.type == "cuda" else "")
+            )
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# Copyright    2024  Xiaomi Corp.
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script reports the latency of Tokenizer.texts_to_token_ids() in
+./tokenizer.py for short and long inputs:
+
+  - no cache: every text is normalized and phonemized
+  - process pool: the texts are phonemized by --num-jobs processes
+  - memory cache: the texts have been converted by the same tokenizer
+  - disk cache: a new tokenizer loads the phonemes from --phoneme-cache
+
+It also checks that all of them return the same token ids.
+
+Usage:
+
+  ./vits/benchmark_tokenizer.py --tokens data/tokens.txt --num-jobs 4
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from typing import Callable, List
+
+from tokenizer import Tokenizer
+
+SENTENCES = [
+    "Printing, in the only sense with which we are at present concerned, "
+    "differs from most if not from all the arts and crafts represented "
+    "in the Exhibition.",
+    "The earliest book printed with movable types, the Gutenberg, "
+    "or forty-two line Bible of about 1455, has never been surpassed.",
+    "Dr. Smith paid $5 on Jan. 3rd for 2 books.",
+    "Hello, world!",
+    "He was arrested at 10:30 p.m. on the 21st of November, 1963.",
+    "It is a far, far better thing that I do, than I have ever done.",
+    "Ask not what your country can do for you; "
+    "ask what you can do for your country.",
+    "The quick brown fox jumps over the lazy dog.",
+]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--tokens",
+        type=str,
+        default="data/tokens.txt",
+        help="""Path to vocabulary.""",
+    )
+
+    parser.add_argument(
+        "--num-texts",
+        type=int,
+        default=200,
+        help="Number of distinct texts of each kind",
+    )
+
+    parser.add_argument(
+        "--num-jobs",
+        type=int,
+        default=4,
+        help="Number of processes of the process pool",
+    )
+
+    return parser
+
+
+def get_texts(num_texts: int, num_sentences: int) -> List[str]:
+    """Return distinct texts, each with num_sentences sentences."""
+    texts = []
+    for i in range(num_texts):
+        sentences = [SENTENCES[(i + k) % len(SENTENCES)] for k in range(num_sentences)]
+        # Make each text distinct
+        sentences[0] = f"Chapter {i + 1}. " + sentences[0]
+        texts.append(" ".join(sentences))
+    return texts
+
+
+def benchmark(name: str, f: Callable[[], List[List[int]]], num_texts: int):
+    start = time.time()
+    ans = f()
+    elapsed = time.time() - start
+    logging.info(
+        f"{name}: {elapsed:.3f} s, {elapsed / num_texts * 1000:.3f} ms per text"
+    )
+    return ans
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.info(vars(args))
+
+    for kind, num_sentences in [("short", 1), ("long", 8)]:
+        texts = get_texts(args.num_texts, num_sentences)
+        num_words = sum(len(t.split()) for t in texts) / len(texts)
+        logging.info(f"{kind} inputs: {num_words:.1f} words per text")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            phoneme_cache = os.path.join(tmp_dir, "phonemes.jsonl")
+
+            tokenizer = Tokenizer(args.tokens, phoneme_cache=phoneme_cache)
+            expected = benchmark(
+                "no cache",
+                lambda: [tokenizer.texts_to_token_ids([t])[0] for t in texts],
+                len(texts),
+            )
+
+            ans = benchmark(
+                "memory cache",
+                lambda: [tokenizer.texts_to_token_ids([t])[0] for t in texts],
+                len(texts),
+            )
+            assert ans == expected
+
+            tokenizer = Tokenizer(args.tokens, phoneme_cache=phoneme_cache)
+            ans = benchmark(
+                "disk cache",
+                lambda: [tokenizer.texts_to_token_ids([t])[0] for t in texts],
+                len(texts),
+            )
+            assert ans == expected
+
+        tokenizer = Tokenizer(args.tokens, num_jobs=args.num_jobs)
+        # Start the worker processes
+        tokenizer.texts_to_token_ids(SENTENCES)
+        ans = benchmark(
+            f"process pool ({args.num_jobs} jobs)",
+            lambda: tokenizer.texts_to_token_ids(texts),
+            len(texts),
+        )
+        assert ans == expected
+
+
+if __name__ == "__main__":
+    formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    logging.basicConfig(format=formatter, level=logging.INFO)
+
+    main()
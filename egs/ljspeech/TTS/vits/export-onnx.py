@@ -25,8 +25,14 @@ Export the model to ONNX:
   --exp-dir vits/exp \
   --tokens data/tokens.txt
 
-It will generate one file inside vits/exp:
+It will generate three files inside vits/exp:
   - vits-epoch-1000.onnx
+  - vits-epoch-1000-streaming-encoder.onnx
+  - vits-epoch-1000-streaming-decoder.onnx
+
+The last two are for streaming synthesis: the encoder converts tokens to
+the latent of the whole utterance and the decoder converts chunks of the
+latent to audio. See ./test_onnx.py --streaming.
 
 See ./test_onnx.py for how to use the exported ONNX models.
 """
@@ -154,6 +160,84 @@ class OnnxModel(nn.Module):
         return audio
 
 
+class OnnxStreamingEncoder(nn.Module):
+    """A wrapper for the text encoder and the duration predictor of VITS."""
+
+    def __init__(self, model: nn.Module):
+        """
+        Args:
+          model:
+            A VITS generator.
+        """
+        super().__init__()
+        self.model = model
+
+    def forward(
+        self,
+        tokens: torch.Tensor,
+        tokens_lens: torch.Tensor,
+        noise_scale: float = 0.667,
+        alpha: float = 1.0,
+        noise_scale_dur: float = 0.8,
+    ) -> torch.Tensor:
+        """Please see the help information of VITS.inference_streaming
+
+        Args:
+          tokens:
+            Input text token indexes (1, T_text)
+          tokens_lens:
+            Number of tokens of shape (1,)
+          noise_scale (float):
+            Noise scale parameter for flow.
+          noise_scale_dur (float):
+            Noise scale parameter for duration predictor.
+          alpha (float):
+            Alpha parameter to control the speed of generated speech.
+
+        Returns:
+          Return the latent sampled from the prior, (1, H, T_feats)
+        """
+        x, m_p, logs_p, x_mask, g = self.model.generator.encode_text(
+            tokens, tokens_lens
+        )
+        z_p, _, _, _ = self.model.generator.sample_prior(
+            x,
+            m_p,
+            logs_p,
+            x_mask,
+            g=g,
+            noise_scale=noise_scale,
+            noise_scale_dur=noise_scale_dur,
+            alpha=alpha,
+        )
+        return z_p
+
+
+class OnnxStreamingDecoder(nn.Module):
+    """A wrapper for the flow and the decoder of VITS."""
+
+    def __init__(self, model: nn.Module):
+        """
+        Args:
+          model:
+            A VITS generator.
+        """
+        super().__init__()
+        self.model = model
+
+    def forward(self, z_p: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+          z_p:
+            A chunk of the latent with context on both sides, (1, H, T)
+
+        Returns:
+          Return the audio of the chunk, (1, T * upsample_factor)
+        """
+        y_mask = torch.ones_like(z_p[:, :1])
+        return self.model.generator.decode(z_p, y_mask)
+
+
 def export_model_onnx(
     model: nn.Module,
     model_filename: str,
@@ -227,6 +311,103 @@ def export_model_onnx(
     add_meta_data(filename=model_filename, meta_data=meta_data)
 
 
+def export_streaming_model_onnx(
+    model: nn.Module,
+    encoder_filename: str,
+    decoder_filename: str,
+    vocab_size: int,
+    opset_version: int = 11,
+) -> None:
+    """Export the given generator model to two ONNX models for streaming
+    synthesis.
+
+    The encoder has the same inputs as the model exported by
+    :func:`export_model_onnx` and it has one output:
+
+        - z_p, a tensor of shape (1, H, T_feats); dtype is torch.float32
+
+    The decoder has one input:
+
+        - z_p, a tensor of shape (1, H, T); dtype is torch.float32
+
+    and it has one output:
+
+        - audio, a tensor of shape (1, T * upsample_factor); dtype is
+          torch.float32
+
+    The decoder needs context_size frames of context on each side of a chunk
+    to give the same audio as the non-streaming model. context_size and
+    upsample_factor are saved in the meta data of the decoder.
+
+    Args:
+      model:
+        The VITS model.
+      encoder_filename:
+        The filename to save the exported ONNX encoder.
+      decoder_filename:
+        The filename to save the exported ONNX decoder.
+      vocab_size:
+        Number of tokens used in training.
+      opset_version:
+        The opset version to use.
+    """
+    tokens = torch.randint(low=0, high=vocab_size, size=(1, 13), dtype=torch.int64)
+    tokens_lens = torch.tensor([tokens.shape[1]], dtype=torch.int64)
+    noise_scale = torch.tensor([1], dtype=torch.float32)
+    noise_scale_dur = torch.tensor([1], dtype=torch.float32)
+    alpha = torch.tensor([1], dtype=torch.float32)
+
+    torch.onnx.export(
+        OnnxStreamingEncoder(model),
+        (tokens, tokens_lens, noise_scale, alpha, noise_scale_dur),
+        encoder_filename,
+        verbose=False,
+        opset_version=opset_version,
+        input_names=[
+            "tokens",
+            "tokens_lens",
+            "noise_scale",
+            "alpha",
+            "noise_scale_dur",
+        ],
+        output_names=["z_p"],
+        dynamic_axes={
+            "tokens": {0: "N", 1: "T"},
+            "tokens_lens": {0: "N"},
+            "z_p": {0: "N", 2: "T"},
+        },
+    )
+
+    generator = model.generator
+    z_p = torch.randn(1, generator.decoder.input_conv.in_channels, 100)
+    torch.onnx.export(
+        OnnxStreamingDecoder(model),
+        (z_p,),
+        decoder_filename,
+        verbose=False,
+        opset_version=opset_version,
+        input_names=["z_p"],
+        output_names=["audio"],
+        dynamic_axes={
+            "z_p": {0: "N", 2: "T"},
+            "audio": {0: "N", 1: "T"},
+        },
+    )
+
+    meta_data = {
+        "model_type": "vits-streaming",
+        "version": "1",
+        "comment": "icefall",
+        "sample_rate": model.sampling_rate,
+        "context_size": generator.context_size,
+        "upsample_factor": generator.upsample_factor,
+    }
+    logging.info(f"meta_data: {meta_data}")
+
+    add_meta_data(filename=encoder_filename, meta_data=meta_data)
+    add_meta_data(filename=decoder_filename, meta_data=meta_data)
+
+
 @torch.no_grad()
 def main():
     args = get_parser().parse_args()
@@ -268,6 +449,18 @@ def main():
     )
     logging.info(f"Exported generator to {model_filename}")
 
+    logging.info("Exporting streaming encoder and decoder")
+    encoder_filename = params.exp_dir / f"vits-{suffix}-streaming-encoder.onnx"
+    decoder_filename = params.exp_dir / f"vits-{suffix}-streaming-decoder.onnx"
+    export_streaming_model_onnx(
+        model.model,
+        encoder_filename,
+        decoder_filename,
+        params.vocab_size,
+        opset_version=opset_version,
+    )
+    logging.info(f"Exported streaming model to {encoder_filename}, {decoder_filename}")
+
 
 if __name__ == "__main__":
     formatter = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
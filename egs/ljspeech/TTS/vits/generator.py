@@ -11,7 +11,7 @@ This code is based on https://github.com/jaywalnut310/vits.
 
 
 import math
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 
 import numpy as np
 import torch
@@ -70,6 +70,7 @@ class VITSGenerator(torch.nn.Module):
         stochastic_duration_predictor_dropout_rate: float = 0.5,
         stochastic_duration_predictor_flows: int = 4,
         stochastic_duration_predictor_dds_conv_layers: int = 3,
+        maximum_path_impl: str = "cython",
     ):
         """Initialize VITS generator module.
 
@@ -127,6 +128,9 @@ class VITSGenerator(torch.nn.Module):
                 duration predictor.
             stochastic_duration_predictor_dds_conv_layers (int): Number of DDS conv
                 layers in stochastic duration predictor.
+            maximum_path_impl (str): Implementation of monotonic alignment search,
+                "cython" to run it on CPU with Cython (or numba if Cython is not
+                built), or "torch" to run it on the device of the model.
 
         """
         super().__init__()
@@ -204,9 +208,14 @@ class VITSGenerator(torch.nn.Module):
             self.lang_emb = torch.nn.Embedding(langs, global_channels)
 
         # delayed import
-        from monotonic_align import maximum_path
+        from monotonic_align import maximum_path, maximum_path_torch
 
-        self.maximum_path = maximum_path
+        if maximum_path_impl == "cython":
+            self.maximum_path = maximum_path
+        elif maximum_path_impl == "torch":
+            self.maximum_path = maximum_path_torch
+        else:
+            raise ValueError(f"Unknown maximum_path_impl: {maximum_path_impl}")
 
     def forward(
         self,
@@ -400,27 +409,9 @@ class VITSGenerator(torch.nn.Module):
             Tensor: Duration tensor (B, T_text).
 
         """
-        # encoder
-        x, m_p, logs_p, x_mask = self.text_encoder(text, text_lengths)
-        x_mask = x_mask.to(x.dtype)
-        g = None
-        if self.spks is not None:
-            # (B, global_channels, 1)
-            g = self.global_emb(sids.view(-1)).unsqueeze(-1)
-        if self.spk_embed_dim is not None:
-            # (B, global_channels, 1)
-            g_ = self.spemb_proj(F.normalize(spembs.unsqueeze(0))).unsqueeze(-1)
-            if g is None:
-                g = g_
-            else:
-                g = g + g_
-        if self.langs is not None:
-            # (B, global_channels, 1)
-            g_ = self.lang_emb(lids.view(-1)).unsqueeze(-1)
-            if g is None:
-                g = g_
-            else:
-                g = g + g_
+        x, m_p, logs_p, x_mask, g = self.encode_text(
+            text, text_lengths, sids=sids, spembs=spembs, lids=lids
+        )
 
         if use_teacher_forcing:
             # forward posterior encoder
@@ -467,42 +458,223 @@ class VITSGenerator(torch.nn.Module):
             # forward decoder with random segments
             wav = self.decoder(z * y_mask, g=g)
         else:
-            # duration
-            if dur is None:
-                logw = self.duration_predictor(
-                    x,
-                    x_mask,
-                    g=g,
-                    inverse=True,
-                    noise_scale=noise_scale_dur,
-                )
-                w = torch.exp(logw) * x_mask * alpha
-                dur = torch.ceil(w)
-            y_lengths = torch.clamp_min(torch.sum(dur, [1, 2]), 1).long()
-            y_mask = (~make_pad_mask(y_lengths)).unsqueeze(1).to(text.device)
-            y_mask = y_mask.to(x.dtype)
-            attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
-            attn = self._generate_path(dur, attn_mask)
-
-            # expand the length to match with the feature sequence
-            # (B, T_feats, T_text) x (B, T_text, H) -> (B, H, T_feats)
-            m_p = torch.matmul(
-                attn.squeeze(1),
-                m_p.transpose(1, 2),
-            ).transpose(1, 2)
-            # (B, T_feats, T_text) x (B, T_text, H) -> (B, H, T_feats)
-            logs_p = torch.matmul(
-                attn.squeeze(1),
-                logs_p.transpose(1, 2),
-            ).transpose(1, 2)
+            z_p, y_mask, attn, dur = self.sample_prior(
+                x,
+                m_p,
+                logs_p,
+                x_mask,
+                g=g,
+                dur=dur,
+                noise_scale=noise_scale,
+                noise_scale_dur=noise_scale_dur,
+                alpha=alpha,
+            )
 
             # decoder
-            z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
             z = self.flow(z_p, y_mask, g=g, inverse=True)
             wav = self.decoder((z * y_mask)[:, :, :max_len], g=g)
 
         return wav.squeeze(1), attn.squeeze(1), dur.squeeze(1)
 
+    def inference_streaming(
+        self,
+        text: torch.Tensor,
+        text_lengths: torch.Tensor,
+        sids: Optional[torch.Tensor] = None,
+        spembs: Optional[torch.Tensor] = None,
+        lids: Optional[torch.Tensor] = None,
+        dur: Optional[torch.Tensor] = None,
+        noise_scale: float = 0.667,
+        noise_scale_dur: float = 0.8,
+        alpha: float = 1.0,
+        chunk_size: int = 32,
+        context_size: Optional[int] = None,
+    ) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        """Run inference and generate the waveform chunk by chunk.
+
+        The text encoder and the duration predictor run on the whole input.
+        The flow and the decoder then run on chunk_size frames of the latent
+        at a time, plus context_size frames on each side, so the first chunk
+        is available before the whole waveform is generated and the memory of
+        the decoder does not grow with the length of the input.
+
+        Args:
+            text (Tensor): Input text index tensor (B, T_text,).
+            text_lengths (Tensor): Text length tensor (B,).
+            sids (Optional[Tensor]): Speaker index tensor (B,) or (B, 1).
+            spembs (Optional[Tensor]): Speaker embedding tensor (B, spk_embed_dim).
+            lids (Optional[Tensor]): Language index tensor (B,) or (B, 1).
+            dur (Optional[Tensor]): Ground-truth duration (B, T_text,). If provided,
+                skip the prediction of durations.
+            noise_scale (float): Noise scale parameter for flow.
+            noise_scale_dur (float): Noise scale parameter for duration predictor.
+            alpha (float): Alpha parameter to control the speed of generated speech.
+            chunk_size (int): Number of frames of each chunk.
+            context_size (Optional[int]): Number of frames of context on each side
+                of a chunk. If None, it uses the receptive field of the flow and
+                the decoder, and the result is the same as that of inference()
+                up to rounding errors. A smaller value runs faster.
+
+        Yields:
+            Tensor: Generated waveform chunk (B, chunk_size * upsample_factor).
+                The last one may be shorter.
+            Tensor: Number of valid samples of each utterance in the chunk (B,).
+
+        """
+        x, m_p, logs_p, x_mask, g = self.encode_text(
+            text, text_lengths, sids=sids, spembs=spembs, lids=lids
+        )
+        z_p, y_mask, _, _ = self.sample_prior(
+            x,
+            m_p,
+            logs_p,
+            x_mask,
+            g=g,
+            dur=dur,
+            noise_scale=noise_scale,
+            noise_scale_dur=noise_scale_dur,
+            alpha=alpha,
+        )
+        if context_size is None:
+            context_size = self.context_size
+
+        y_lengths = y_mask.sum([1, 2]).long()
+        T_feats = z_p.size(2)
+        for start in range(0, T_feats, chunk_size):
+            end = min(start + chunk_size, T_feats)
+            left = max(start - context_size, 0)
+            right = min(end + context_size, T_feats)
+
+            wav = self.decode(z_p[:, :, left:right], y_mask[:, :, left:right], g=g)
+            # remove the context
+            offset = (start - left) * self.upsample_factor
+            wav = wav[:, offset : offset + (end - start) * self.upsample_factor]
+            wav_lengths = (y_lengths - start).clamp(min=0, max=end - start)
+            yield wav, wav_lengths * self.upsample_factor
+
+    def decode(
+        self,
+        z_p: torch.Tensor,
+        y_mask: torch.Tensor,
+        g: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Generate the waveform from the latent sampled from the prior.
+
+        Args:
+            z_p (Tensor): Latent tensor (B, H, T_feats).
+            y_mask (Tensor): Feature mask tensor (B, 1, T_feats).
+            g (Optional[Tensor]): Global conditioning tensor (B, global_channels, 1).
+
+        Returns:
+            Tensor: Generated waveform tensor (B, T_feats * upsample_factor).
+
+        """
+        z = self.flow(z_p, y_mask, g=g, inverse=True)
+        wav = self.decoder(z * y_mask, g=g)
+        return wav.squeeze(1)
+
+    @property
+    def context_size(self) -> int:
+        """Return the number of frames of the latent on each side that a frame
+        of the waveform depends on in decode()."""
+        return self.flow.context_size + self.decoder.context_size
+
+    def encode_text(
+        self,
+        text: torch.Tensor,
+        text_lengths: torch.Tensor,
+        sids: Optional[torch.Tensor] = None,
+        spembs: Optional[torch.Tensor] = None,
+        lids: Optional[torch.Tensor] = None,
+    ) -> Tuple[
+        torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, Optional[torch.Tensor]
+    ]:
+        """Run the text encoder and compute the global conditioning for inference.
+
+        Returns:
+            Tensor: Text encoder hidden representation (B, H, T_text).
+            Tensor: Text encoder projected mean (B, H, T_text).
+            Tensor: Text encoder projected scale (B, H, T_text).
+            Tensor: Text mask tensor (B, 1, T_text).
+            Optional[Tensor]: Global conditioning tensor (B, global_channels, 1).
+
+        """
+        # encoder
+        x, m_p, logs_p, x_mask = self.text_encoder(text, text_lengths)
+        x_mask = x_mask.to(x.dtype)
+        g = None
+        if self.spks is not None:
+            # (B, global_channels, 1)
+            g = self.global_emb(sids.view(-1)).unsqueeze(-1)
+        if self.spk_embed_dim is not None:
+            # (B, global_channels, 1)
+            g_ = self.spemb_proj(F.normalize(spembs.unsqueeze(0))).unsqueeze(-1)
+            if g is None:
+                g = g_
+            else:
+                g = g + g_
+        if self.langs is not None:
+            # (B, global_channels, 1)
+            g_ = self.lang_emb(lids.view(-1)).unsqueeze(-1)
+            if g is None:
+                g = g_
+            else:
+                g = g + g_
+        return x, m_p, logs_p, x_mask, g
+
+    def sample_prior(
+        self,
+        x: torch.Tensor,
+        m_p: torch.Tensor,
+        logs_p: torch.Tensor,
+        x_mask: torch.Tensor,
+        g: Optional[torch.Tensor] = None,
+        dur: Optional[torch.Tensor] = None,
+        noise_scale: float = 0.667,
+        noise_scale_dur: float = 0.8,
+        alpha: float = 1.0,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Predict the durations and sample the latent from the expanded prior.
+
+        Returns:
+            Tensor: Latent tensor (B, H, T_feats).
+            Tensor: Feature mask tensor (B, 1, T_feats).
+            Tensor: Monotonic attention weight tensor (B, 1, T_feats, T_text).
+            Tensor: Duration tensor (B, 1, T_text).
+
+        """
+        # duration
+        if dur is None:
+            logw = self.duration_predictor(
+                x,
+                x_mask,
+                g=g,
+                inverse=True,
+                noise_scale=noise_scale_dur,
+            )
+            w = torch.exp(logw) * x_mask * alpha
+            dur = torch.ceil(w)
+        y_lengths = torch.clamp_min(torch.sum(dur, [1, 2]), 1).long()
+        y_mask = (~make_pad_mask(y_lengths)).unsqueeze(1).to(x.device)
+        y_mask = y_mask.to(x.dtype)
+        attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
+        attn = self._generate_path(dur, attn_mask)
+
+        # expand the length to match with the feature sequence
+        # (B, T_feats, T_text) x (B, T_text, H) -> (B, H, T_feats)
+        m_p = torch.matmul(
+            attn.squeeze(1),
+            m_p.transpose(1, 2),
+        ).transpose(1, 2)
+        # (B, T_feats, T_text) x (B, T_text, H) -> (B, H, T_feats)
+        logs_p = torch.matmul(
+            attn.squeeze(1),
+            logs_p.transpose(1, 2),
+        ).transpose(1, 2)
+
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+        return z_p, y_mask, attn, dur
+
     def _generate_path(self, dur: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
         """Generate path a.k.a. monotonic attention.
 
@@ -11,6 +11,7 @@ This code is modified from https://github.com/kan-bayashi/ParallelWaveGAN.
 
 import copy
 import logging
+import math
 from typing import Any, Dict, List, Optional
 
 import numpy as np
@@ -216,6 +217,24 @@ class HiFiGANGenerator(torch.nn.Module):
         c = self.forward(c.transpose(1, 0).unsqueeze(0), g=g)
         return c.squeeze(0).transpose(1, 0)
 
+    @property
+    def context_size(self) -> int:
+        """Return the number of input frames on each side that an output
+        sample depends on, i.e., half of the receptive field."""
+        # Number of output samples of the current layer per input frame
+        rate = 1
+        context = (self.input_conv.kernel_size[0] - 1) // 2
+        for i in range(self.num_upsamples):
+            upsample = self.upsamples[i][1]
+            kernel_size, stride = upsample.kernel_size[0], upsample.stride[0]
+            context += math.ceil(kernel_size / stride / 2) / rate
+            rate *= stride
+            blocks = self.blocks[i * self.num_blocks : (i + 1) * self.num_blocks]
+            context += max(block.context_size for block in blocks) / rate
+        output_conv = self.output_conv[1]
+        context += (output_conv.kernel_size[0] - 1) // 2 / rate
+        return math.ceil(context)
+
 
 class ResidualBlock(torch.nn.Module):
     """Residual block module in HiFiGAN."""
@@ -301,6 +320,17 @@ class ResidualBlock(torch.nn.Module):
             x = xt + x
         return x
 
+    @property
+    def context_size(self) -> int:
+        """Return the number of input samples on each side that an output
+        sample depends on, i.e., half of the receptive field."""
+        convs = list(self.convs1)
+        if self.use_additional_convs:
+            convs += list(self.convs2)
+        return sum(
+            (conv[1].kernel_size[0] - 1) // 2 * conv[1].dilation[0] for conv in convs
+        )
+
 
 class HiFiGANPeriodDiscriminator(torch.nn.Module):
     """HiFiGAN period discriminator module."""
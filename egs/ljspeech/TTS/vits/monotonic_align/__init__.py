@@ -11,22 +11,17 @@ import warnings
 import numpy as np
 import torch
 
-try:
-    from numba import njit, prange
-except ModuleNotFoundError as ex:
-    raise RuntimeError(f"{ex}/nPlease run\n  pip install numba")
+from .torch_impl import maximum_path_torch
 
 try:
     from .core import maximum_path_c
 
     is_cython_avalable = True
 except ImportError:
+    # Neither the Cython nor the numba version is needed by
+    # maximum_path_torch(), so numba is imported only when maximum_path()
+    # falls back to it.
     is_cython_avalable = False
-    warnings.warn(
-        "Cython version is not available. Fallback to 'EXPERIMETAL' numba version. "
-        "If you want to use the cython version, please build it as follows: "
-        "`cd espnet2/gan_tts/vits/monotonic_align; python setup.py build_ext --inplace`"
-    )
 
 
 def maximum_path(neg_x_ent: torch.Tensor, attn_mask: torch.Tensor) -> torch.Tensor:
@@ -48,38 +43,13 @@ def maximum_path(neg_x_ent: torch.Tensor, attn_mask: torch.Tensor) -> torch.Tens
     if is_cython_avalable:
         maximum_path_c(path, neg_x_ent, t_t_max, t_s_max)
     else:
+        warnings.warn(
+            "Cython version is not available. Fallback to 'EXPERIMETAL' numba "
+            "version. If you want to use the cython version, please build it as "
+            "follows: `cd vits/monotonic_align; python setup.py build_ext --inplace`"
+        )
+        from .numba_impl import maximum_path_numba
+
         maximum_path_numba(path, neg_x_ent, t_t_max, t_s_max)
 
     return torch.from_numpy(path).to(device=device, dtype=dtype)
-
-
-@njit
-def maximum_path_each_numba(path, value, t_y, t_x, max_neg_val=-np.inf):
-    """Calculate a single maximum path with numba."""
-    index = t_x - 1
-    for y in range(t_y):
-        for x in range(max(0, t_x + y - t_y), min(t_x, y + 1)):
-            if x == y:
-                v_cur = max_neg_val
-            else:
-                v_cur = value[y - 1, x]
-            if x == 0:
-                if y == 0:
-                    v_prev = 0.0
-                else:
-                    v_prev = max_neg_val
-            else:
-                v_prev = value[y - 1, x - 1]
-            value[y, x] += max(v_prev, v_cur)
-
-    for y in range(t_y - 1, -1, -1):
-        path[y, index] = 1
-        if index != 0 and (index == y or value[y - 1, index] < value[y - 1, index - 1]):
-            index = index - 1
-
-
-@njit(parallel=True)
-def maximum_path_numba(paths, values, t_ys, t_xs):
-    """Calculate batch maximum path with numba."""
-    for i in prange(paths.shape[0]):
-        maximum_path_each_numba(paths[i], values[i], t_ys[i], t_xs[i])
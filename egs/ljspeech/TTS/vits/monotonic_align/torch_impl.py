@@ -0,0 +1,71 @@
+"""Maximum path calculation module in PyTorch.
+
+It computes the same path as the Cython version in core.pyx, but runs on
+the device of the input in batch mode, so the input does not need to be
+copied to the CPU.
+
+"""
+
+import torch
+
+
+@torch.no_grad()
+def maximum_path_torch(
+    neg_x_ent: torch.Tensor, attn_mask: torch.Tensor, max_neg_val: float = -1e9
+) -> torch.Tensor:
+    """Calculate maximum path.
+
+    The dynamic programming runs over T_feats. Each step only depends on
+    the previous one and is computed for all the utterances and text
+    positions at once.
+
+    Args:
+        neg_x_ent (Tensor): Negative X entropy tensor (B, T_feats, T_text).
+        attn_mask (Tensor): Attention mask (B, T_feats, T_text).
+        max_neg_val (float): Value of the unreachable positions, which is
+            the same as in the Cython version.
+
+    Returns:
+        Tensor: Maximum path tensor (B, T_feats, T_text).
+
+    """
+    device, dtype = neg_x_ent.device, neg_x_ent.dtype
+    B, T_feats, T_text = neg_x_ent.shape
+    value = neg_x_ent.float()
+    t_ys = attn_mask.sum(1)[:, 0].long()  # (B,), number of frames
+    t_xs = attn_mask.sum(2)[:, 0].long()  # (B,), number of tokens
+
+    y = torch.arange(T_feats, device=device).view(1, -1, 1)
+    x = torch.arange(T_text, device=device).view(1, 1, -1)
+    t_y = t_ys.view(-1, 1, 1)
+    t_x = t_xs.view(-1, 1, 1)
+    # Positions (y, x) visited by the Cython version, i.e.,
+    # max(0, t_x + y - t_y) <= x < min(t_x, y + 1)
+    visited = (x >= t_x + y - t_y) & (x < t_x) & (x <= y)
+
+    # acc[:, y + 1, x + 1] is the accumulated value of position (y, x).
+    # Row 0 and column 0 are for y - 1 and x - 1 at the borders.
+    acc = torch.full(
+        (B, T_feats + 1, T_text + 1), max_neg_val, dtype=torch.float32, device=device
+    )
+    acc[:, 0, 0] = 0
+    neg = torch.tensor(max_neg_val, dtype=torch.float32, device=device)
+    for i in range(T_feats):
+        prev = acc[:, i]
+        cur = value[:, i] + torch.maximum(prev[:, :-1], prev[:, 1:])
+        acc[:, i + 1, 1:] = torch.where(visited[:, i], cur, neg)
+
+    # move[:, y, x] is True if the path goes from (y - 1, x - 1) to (y, x)
+    # when it goes back from (y, x)
+    move = (acc[:, :-1, 1:] < acc[:, :-1, :-1]) | (x == y)
+    move &= (x != 0) & (y < t_y)
+
+    index = (t_xs - 1).clamp(min=0)
+    indexes = torch.empty(B, T_feats, dtype=torch.int64, device=device)
+    for i in range(T_feats - 1, -1, -1):
+        indexes[:, i] = index
+        index = index - move[:, i].gather(1, index.unsqueeze(1)).squeeze(1).long()
+
+    path = torch.nn.functional.one_hot(indexes, num_classes=T_text)
+    path *= (y < t_y) & (t_x > 0)
+    return path.to(dtype=dtype)
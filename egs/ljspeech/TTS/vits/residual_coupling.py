@@ -107,6 +107,16 @@ class ResidualAffineCouplingBlock(torch.nn.Module):
                 x = flow(x, x_mask, g=g, inverse=inverse)
         return x
 
+    @property
+    def context_size(self) -> int:
+        """Return the number of input frames on each side that an output
+        frame depends on, i.e., half of the receptive field."""
+        return sum(
+            (flow.encoder.receptive_field_size - 1) // 2
+            for flow in self.flows
+            if isinstance(flow, ResidualAffineCouplingLayer)
+        )
+
 
 class ResidualAffineCouplingLayer(torch.nn.Module):
     """Residual affine coupling layer."""
@@ -23,11 +23,20 @@ Use the onnx model to generate a wav:
 ./vits/test_onnx.py \
   --model-filename vits/exp/vits-epoch-1000.onnx \
   --tokens data/tokens.txt
+
+Use the streaming onnx models to generate a wav chunk by chunk:
+./vits/test_onnx.py \
+  --encoder-filename vits/exp/vits-epoch-1000-streaming-encoder.onnx \
+  --decoder-filename vits/exp/vits-epoch-1000-streaming-decoder.onnx \
+  --tokens data/tokens.txt \
+  --chunk-size 32
 """
 
 
 import argparse
 import logging
+import time
+from typing import Iterator
 
 import onnxruntime as ort
 import torch
@@ -43,10 +52,32 @@ def get_parser():
     parser.add_argument(
         "--model-filename",
         type=str,
-        required=True,
+        default="",
         help="Path to the onnx model.",
     )
 
+    parser.add_argument(
+        "--encoder-filename",
+        type=str,
+        default="",
+        help="""Path to the streaming onnx encoder. If not empty,
+        --decoder-filename is also required and --model-filename is ignored.""",
+    )
+
+    parser.add_argument(
+        "--decoder-filename",
+        type=str,
+        default="",
+        help="Path to the streaming onnx decoder.",
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=32,
+        help="Number of frames of each chunk for the streaming onnx models.",
+    )
+
     parser.add_argument(
         "--tokens",
         type=str,
@@ -54,6 +85,14 @@ def get_parser():
         help="""Path to vocabulary.""",
     )
 
+    parser.add_argument(
+        "--phoneme-cache",
+        type=str,
+        default="",
+        help="""If not empty, a jsonl file that caches the phonemes of the
+        input texts across runs. See ./tokenizer.py""",
+    )
+
     parser.add_argument(
         "--text",
         type=str,
@@ -116,14 +155,86 @@ class OnnxModel:
         return torch.from_numpy(out)
 
 
+class OnnxStreamingModel:
+    def __init__(self, encoder_filename: str, decoder_filename: str):
+        session_opts = ort.SessionOptions()
+        session_opts.inter_op_num_threads = 1
+        session_opts.intra_op_num_threads = 1
+
+        self.session_opts = session_opts
+
+        self.encoder = ort.InferenceSession(
+            encoder_filename,
+            sess_options=self.session_opts,
+            providers=["CPUExecutionProvider"],
+        )
+        self.decoder = ort.InferenceSession(
+            decoder_filename,
+            sess_options=self.session_opts,
+            providers=["CPUExecutionProvider"],
+        )
+
+        metadata = self.decoder.get_modelmeta().custom_metadata_map
+        logging.info(f"{metadata}")
+        self.sample_rate = int(metadata["sample_rate"])
+        self.context_size = int(metadata["context_size"])
+        self.upsample_factor = int(metadata["upsample_factor"])
+
+    def __call__(
+        self, tokens: torch.Tensor, tokens_lens: torch.Tensor, chunk_size: int
+    ) -> Iterator[torch.Tensor]:
+        """
+        Args:
+          tokens:
+            A 1-D tensor of shape (1, T)
+          chunk_size:
+            Number of frames of each chunk.
+        Yields:
+            A tensor of shape (1, chunk_size * upsample_factor). The last one
+            may be shorter.
+        """
+        noise_scale = torch.tensor([0.667], dtype=torch.float32)
+        noise_scale_dur = torch.tensor([0.8], dtype=torch.float32)
+        alpha = torch.tensor([1.0], dtype=torch.float32)
+
+        z_p = self.encoder.run(
+            [
+                self.encoder.get_outputs()[0].name,
+            ],
+            {
+                self.encoder.get_inputs()[0].name: tokens.numpy(),
+                self.encoder.get_inputs()[1].name: tokens_lens.numpy(),
+                self.encoder.get_inputs()[2].name: noise_scale.numpy(),
+                self.encoder.get_inputs()[3].name: alpha.numpy(),
+                self.encoder.get_inputs()[4].name: noise_scale_dur.numpy(),
+            },
+        )[0]
+
+        # See VITSGenerator.inference_streaming() in ./generator.py
+        T_feats = z_p.shape[2]
+        for start in range(0, T_feats, chunk_size):
+            end = min(start + chunk_size, T_feats)
+            left = max(start - self.context_size, 0)
+            right = min(end + self.context_size, T_feats)
+
+            out = self.decoder.run(
+                [
+                    self.decoder.get_outputs()[0].name,
+                ],
+                {
+                    self.decoder.get_inputs()[0].name: z_p[:, :, left:right],
+                },
+            )[0]
+            offset = (start - left) * self.upsample_factor
+            out = out[:, offset : offset + (end - start) * self.upsample_factor]
+            yield torch.from_numpy(out)
+
+
 def main():
     args = get_parser().parse_args()
     logging.info(vars(args))
 
-    tokenizer = Tokenizer(args.tokens)
-
-    logging.info("About to create onnx model")
-    model = OnnxModel(args.model_filename)
+    tokenizer = Tokenizer(args.tokens, phoneme_cache=args.phoneme_cache)
 
     text = args.text
     tokens = tokenizer.texts_to_token_ids(
@@ -131,7 +242,29 @@ def main():
     )
     tokens = torch.tensor(tokens)  # (1, T)
     tokens_lens = torch.tensor([tokens.shape[1]], dtype=torch.int64)  # (1, T)
-    audio = model(tokens, tokens_lens)  # (1, T')
+
+    if args.encoder_filename:
+        assert args.decoder_filename, "Please provide --decoder-filename"
+        logging.info("About to create streaming onnx model")
+        model = OnnxStreamingModel(args.encoder_filename, args.decoder_filename)
+
+        start = time.time()
+        chunks = []
+        for chunk in model(tokens, tokens_lens, chunk_size=args.chunk_size):
+            if not chunks:
+                logging.info(f"First chunk after {time.time() - start:.3f} s")
+            chunks.append(chunk)
+        audio = torch.cat(chunks, dim=1)  # (1, T')
+    else:
+        logging.info("About to create onnx model")
+        model = OnnxModel(args.model_filename)
+
+        start = time.time()
+        audio = model(tokens, tokens_lens)  # (1, T')
+
+    elapsed = time.time() - start
+    rtf = elapsed * model.sample_rate / audio.shape[1]
+    logging.info(f"Elapsed {elapsed:.3f} s, RTF {rtf:.3f}")
 
     output_filename = args.output_filename
     torchaudio.save(output_filename, audio, sample_rate=model.sample_rate)
@@ -14,8 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import logging
-from typing import Dict, List
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 import tacotron_cleaner.cleaners
 
@@ -30,11 +33,33 @@ except Exception as ex:
 from utils import intersperse
 
 
+def phonemize(text: str, lang: str = "en-us") -> List[str]:
+    """Convert a normalized text to a list of phonemes.
+
+    It is a module level function so that it can run in worker processes.
+    """
+    tokens_list = phonemize_espeak(text, lang)
+    tokens = []
+    for t in tokens_list:
+        tokens.extend(t)
+    return tokens
+
+
 class Tokenizer(object):
-    def __init__(self, tokens: str):
+    def __init__(
+        self,
+        tokens: str,
+        phoneme_cache: Optional[str] = None,
+        num_jobs: int = 1,
+    ):
         """
         Args:
             tokens: the file that maps tokens to ids
+            phoneme_cache: if not empty, a jsonl file that caches the phonemes
+              of normalized texts across runs. It is created if it does not
+              exist and new texts are appended to it.
+            num_jobs: number of processes to phonemize the texts that are
+              not in the cache.
         """
         # Parse token file
         self.token2id: Dict[str, int] = {}
@@ -58,6 +83,54 @@ class Tokenizer(object):
 
         self.vocab_size = len(self.token2id)
 
+        self.phoneme_cache = phoneme_cache
+        self.num_jobs = num_jobs
+        self.executor = None
+
+        # (lang, normalized text) -> phonemes
+        self.text2phonemes: Dict[Tuple[str, str], List[str]] = {}
+        # (lang, text) -> token ids without blanks, sos and eos
+        self.text2token_ids: Dict[Tuple[str, str], List[int]] = {}
+
+        if phoneme_cache and os.path.isfile(phoneme_cache):
+            with open(phoneme_cache, "r", encoding="utf-8") as f:
+                for line in f:
+                    d = json.loads(line)
+                    self.text2phonemes[(d["lang"], d["text"])] = d["phonemes"]
+            logging.info(f"Loaded {len(self.text2phonemes)} texts from {phoneme_cache}")
+
+    def phonemize(self, texts: List[str], lang: str = "en-us") -> List[List[str]]:
+        """Phonemize normalized texts, using the cache if possible.
+
+        Texts that are not in the cache are phonemized in a process pool
+        if num_jobs > 1 and added to the cache.
+        """
+        missing = list(
+            dict.fromkeys(t for t in texts if (lang, t) not in self.text2phonemes)
+        )
+        if len(missing) > 1 and self.num_jobs > 1:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.num_jobs)
+            chunksize = max(1, len(missing) // (4 * self.num_jobs))
+            phonemes_list = list(
+                self.executor.map(
+                    phonemize, missing, [lang] * len(missing), chunksize=chunksize
+                )
+            )
+        else:
+            phonemes_list = [phonemize(t, lang) for t in missing]
+
+        for text, phonemes in zip(missing, phonemes_list):
+            self.text2phonemes[(lang, text)] = phonemes
+
+        if missing and self.phoneme_cache:
+            with open(self.phoneme_cache, "a", encoding="utf-8") as f:
+                for text, phonemes in zip(missing, phonemes_list):
+                    d = {"lang": lang, "text": text, "phonemes": phonemes}
+                    f.write(json.dumps(d, ensure_ascii=False) + "\n")
+
+        return [self.text2phonemes[(lang, t)] for t in texts]
+
     def texts_to_token_ids(
         self,
         texts: List[str],
@@ -79,26 +152,33 @@ class Tokenizer(object):
           lang:
             Language argument passed to phonemize_espeak().
 
+        The token ids of each text are cached, so converting the same text
+        again only costs a dict lookup.
+
         Returns:
           Return a list of token id list [utterance][token_id]
         """
-        token_ids_list = []
-
-        for text in texts:
+        missing = list(
+            dict.fromkeys(t for t in texts if (lang, t) not in self.text2token_ids)
+        )
+        if missing:
             # Text normalization
-            text = tacotron_cleaner.cleaners.custom_english_cleaners(text)
+            normalized = [
+                tacotron_cleaner.cleaners.custom_english_cleaners(t) for t in missing
+            ]
             # Convert to phonemes
-            tokens_list = phonemize_espeak(text, lang)
-            tokens = []
-            for t in tokens_list:
-                tokens.extend(t)
+            tokens_list = self.phonemize(normalized, lang)
+            token_ids_list = self.tokens_to_token_ids(
+                tokens_list, intersperse_blank=False
+            )
+            for text, token_ids in zip(missing, token_ids_list):
+                self.text2token_ids[(lang, text)] = token_ids
 
-            token_ids = []
-            for t in tokens:
-                if t not in self.token2id:
-                    logging.warning(f"Skip OOV {t}")
-                    continue
-                token_ids.append(self.token2id[t])
+        token_ids_list = []
+
+        for text in texts:
+            # Copy it so that the cache is not changed by the caller
+            token_ids = list(self.text2token_ids[(lang, text)])
 
             if intersperse_blank:
                 token_ids = intersperse(token_ids, self.pad_id)
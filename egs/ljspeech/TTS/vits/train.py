@@ -163,6 +163,19 @@ def get_parser():
         """,
     )
 
+    parser.add_argument(
+        "--maximum-path-impl",
+        type=str,
+        default="cython",
+        choices=["cython", "torch"],
+        help="""Implementation of monotonic alignment search. cython runs
+        it on CPU with monotonic_align/core.pyx, which has to be built first,
+        or with numba if it is not built. torch runs it on the device of the
+        model without copying the data to CPU, and gives the same alignment.
+        See ./benchmark_maximum_path.py.
+        """,
+    )
+
     return parser
 
 
@@ -221,6 +234,7 @@ def get_params() -> AttributeDict:
             "lambda_feat_match": 2.0,  # loss scaling coefficient for feat match loss
             "lambda_dur": 1.0,  # loss scaling coefficient for duration loss
             "lambda_kl": 1.0,  # loss scaling coefficient for KL divergence loss
+            "maximum_path_impl": "cython",
         }
     )
 
@@ -286,6 +300,7 @@ def get_model(params: AttributeDict) -> nn.Module:
         lambda_feat_match=params.lambda_feat_match,
         lambda_dur=params.lambda_dur,
         lambda_kl=params.lambda_kl,
+        maximum_path_impl=params.maximum_path_impl,
     )
     return model
 
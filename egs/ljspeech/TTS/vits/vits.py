@@ -6,7 +6,7 @@
 """VITS module for GAN-TTS task."""
 
 import copy
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 import torch
 import torch.nn as nn
@@ -183,6 +183,7 @@ class VITS(nn.Module):
         lambda_dur: float = 1.0,
         lambda_kl: float = 1.0,
         cache_generator_outputs: bool = True,
+        maximum_path_impl: str = "cython",
     ):
         """Initialize VITS module.
 
@@ -210,6 +211,8 @@ class VITS(nn.Module):
             lambda_dur (float): Loss scaling coefficient for duration loss.
             lambda_kl (float): Loss scaling coefficient for KL divergence loss.
             cache_generator_outputs (bool): Whether to cache generator outputs.
+            maximum_path_impl (str): Implementation of monotonic alignment search
+                in the generator, "cython" or "torch".
 
         """
         super().__init__()
@@ -239,7 +242,11 @@ class VITS(nn.Module):
             #   The idim and odim is automatically decided from input data,
             #   where idim represents #vocabularies and odim represents
             #   the input acoustic feature dimension.
-            generator_params.update(vocabs=vocab_size, aux_channels=feature_dim)
+            generator_params.update(
+                vocabs=vocab_size,
+                aux_channels=feature_dim,
+                maximum_path_impl=maximum_path_impl,
+            )
         self.generator = generator_class(
             **generator_params,
         )
@@ -656,3 +663,44 @@ class VITS(nn.Module):
             max_len=max_len,
         )
         return wav, att_w, dur
+
+    def inference_streaming(
+        self,
+        text: torch.Tensor,
+        text_lengths: torch.Tensor,
+        sids: Optional[torch.Tensor] = None,
+        noise_scale: float = 0.667,
+        noise_scale_dur: float = 0.8,
+        alpha: float = 1.0,
+        chunk_size: int = 32,
+        context_size: Optional[int] = None,
+    ) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        """Run inference for one batch and generate the waveform chunk by chunk.
+
+        Args:
+            text (Tensor): Input text index tensor (B, T_text).
+            text_lengths (Tensor): Input text index tensor (B,).
+            sids (Tensor): Speaker index tensor (B,).
+            noise_scale (float): Noise scale value for flow.
+            noise_scale_dur (float): Noise scale value for duration predictor.
+            alpha (float): Alpha parameter to control the speed of generated speech.
+            chunk_size (int): Number of frames of each chunk.
+            context_size (Optional[int]): Number of frames of context on each side
+                of a chunk. If None, it uses the receptive field of the flow and the
+                decoder, so the concatenated chunks are the same as the output
+                of inference_batch().
+
+        Yields:
+            * wav (Tensor): Generated waveform chunk (B, T_chunk).
+            * wav_lengths (Tensor): Number of valid samples in the chunk (B,).
+        """
+        return self.generator.inference_streaming(
+            text=text,
+            text_lengths=text_lengths,
+            sids=sids,
+            noise_scale=noise_scale,
+            noise_scale_dur=noise_scale_dur,
+            alpha=alpha,
+            chunk_size=chunk_size,
+            context_size=context_size,
+        )
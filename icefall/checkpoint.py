@@ -16,12 +16,18 @@
 # limitations under the License.
 
 
+import copy
 import glob
+import json
 import logging
+import mmap
 import os
 import re
+import struct
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import torch
 import torch.nn as nn
@@ -35,6 +41,336 @@ from torch.optim import Optimizer
 # our class LRScheduler.
 LRSchedulerType = object
 
+# Names of dtypes in the safetensors format
+_SAFETENSORS_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+
+
+def save_safetensors(
+    filename: Union[str, Path],
+    tensors: Dict[str, Tensor],
+    metadata: Optional[Dict[str, str]] = None,
+) -> None:
+    """Save tensors to a file in the safetensors format, i.e., an 8-byte
+    header size, a JSON header with the dtype, shape and byte range of each
+    tensor, and then the raw data of all tensors.
+
+    Tensors that are the same tensor as a previous one, e.g., tied weights,
+    are saved only once. The names of these aliases are kept in the
+    metadata, and :func:`load_safetensors` restores them.
+
+    Args:
+      filename:
+        The filename to save.
+      tensors:
+        The tensors to save.
+      metadata:
+        Optional metadata to save in the header. Its values must be strings.
+    """
+    header = {}
+    aliases = {}
+    unique = []
+    # Map (data_ptr, dtype, shape, stride) of a tensor to its name
+    seen: Dict[Tuple, str] = {}
+    for name, t in tensors.items():
+        assert t.dtype in _SAFETENSORS_DTYPES, (name, t.dtype)
+        key = (t.data_ptr(), t.dtype, tuple(t.shape), t.stride())
+        if t.numel() > 0 and key in seen:
+            aliases[name] = seen[key]
+            continue
+        seen[key] = name
+        unique.append((name, t))
+
+    # Save larger elements first so that every tensor is aligned in the file
+    unique.sort(key=lambda x: -x[1].element_size())
+
+    offset = 0
+    for name, t in unique:
+        size = t.numel() * t.element_size()
+        header[name] = {
+            "dtype": _SAFETENSORS_DTYPES[t.dtype],
+            "shape": list(t.shape),
+            "data_offsets": [offset, offset + size],
+        }
+        offset += size
+
+    metadata = dict(metadata) if metadata else {}
+    if aliases:
+        metadata["__aliases__"] = json.dumps(aliases)
+    if metadata:
+        header["__metadata__"] = metadata
+
+    header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # Pad the header so that the data starts at a multiple of 8 bytes
+    header += b" " * (-len(header) % 8)
+
+    # Write to a temporary file first so that a partially written file
+    # is never used. Include the pid so that concurrent writers, e.g.,
+    # decoding jobs sharing a graph cache, do not clobber each other.
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for _, t in unique:
+            t = t.detach().contiguous().cpu()
+            if t.dtype == torch.bfloat16:
+                # numpy does not support bfloat16
+                t = t.view(torch.int16)
+            f.write(t.numpy().tobytes())
+    os.replace(tmp_filename, filename)
+
+
+def load_safetensors(
+    filename: Union[str, Path],
+) -> Tuple[Dict[str, Tensor], Dict[str, str]]:
+    """Load a file saved by :func:`save_safetensors`.
+
+    The file is memory mapped and no tensor data is read here. Each tensor
+    is read from disk only when it is used, so the tensors can be
+    processed one by one without loading the whole file into memory.
+
+    Caution:
+      Changes to the returned tensors are not written to the file.
+
+    Args:
+      filename:
+        The filename to load.
+    Returns:
+      Return a tuple containing the tensors and the metadata.
+    """
+    dtypes = {v: k for k, v in _SAFETENSORS_DTYPES.items()}
+    with open(filename, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size).decode("utf-8"))
+        # ACCESS_COPY returns a writable buffer, which torch.frombuffer
+        # prefers, without changing the file.
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    metadata = header.pop("__metadata__", {})
+    aliases = json.loads(metadata.pop("__aliases__", "{}"))
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = dtypes[info["dtype"]]
+        begin, end = info["data_offsets"]
+        if end == begin:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        t = torch.frombuffer(
+            buf,
+            dtype=dtype,
+            # torch.dtype.itemsize requires torch >= 2.1
+            count=(end - begin) // torch.empty((), dtype=dtype).element_size(),
+            offset=8 + header_size + begin,
+        )
+        tensors[name] = t.reshape(info["shape"])
+
+    for name, target in aliases.items():
+        tensors[name] = tensors[target]
+
+    return tensors, metadata
+
+
+def _safetensors_filename(filename: Union[str, Path]) -> Path:
+    """Return the filename of the safetensors file saved along with a
+    checkpoint by :func:`save_checkpoint`."""
+    return Path(filename).with_suffix(".safetensors")
+
+
+def _load_model_tensors(
+    filename: Union[str, Path], key: str
+) -> Optional[Tuple[Dict[str, Tensor], Dict[str, str]]]:
+    """Load `checkpoint[key]` of a checkpoint, e.g., "model" or "model_avg",
+    from the safetensors file saved along with it.
+
+    Returns:
+      Return a tuple containing the memory mapped state dict and the
+      metadata. Return None if there is no such file, if it is older
+      than the checkpoint, or if it does not contain `key`.
+    """
+    st_filename = _safetensors_filename(filename)
+    if not st_filename.is_file():
+        return None
+    if st_filename.stat().st_mtime < Path(filename).stat().st_mtime:
+        return None
+
+    tensors, metadata = load_safetensors(st_filename)
+    prefix = f"{key}/"
+    state_dict = {
+        k[len(prefix) :]: v for k, v in tensors.items() if k.startswith(prefix)
+    }
+    if not state_dict:
+        return None
+    return state_dict, metadata
+
+
+def _write_checkpoint(
+    checkpoint: Dict[str, Any],
+    filename: Union[str, Path],
+    with_safetensors: bool = False,
+) -> None:
+    """Write a checkpoint returned by :func:`save_checkpoint` to disk.
+
+    It is written to a temporary file first, which is renamed to `filename`
+    once complete, so a partially written checkpoint is never used.
+    """
+    tmp_filename = f"{filename}.tmp"
+    torch.save(checkpoint, tmp_filename)
+    os.replace(tmp_filename, filename)
+
+    if with_safetensors:
+        tensors = {f"model/{k}": v for k, v in checkpoint["model"].items()}
+        if checkpoint.get("model_avg") is not None:
+            for k, v in checkpoint["model_avg"].items():
+                tensors[f"model_avg/{k}"] = v
+
+        metadata = {}
+        for k in ("batch_idx_train", "average_period"):
+            if k in checkpoint:
+                metadata[k] = str(checkpoint[k])
+
+        save_safetensors(_safetensors_filename(filename), tensors, metadata)
+
+
+class AsyncCheckpointWriter(object):
+    """Write checkpoints in a background thread so that training is blocked
+    only while the states are copied to CPU memory.
+
+    Checkpoints and other tasks, e.g., removing old checkpoints, run one at a
+    time in the order they are submitted. The tensors are copied to CPU
+    buffers, pinned for GPU tensors, which are reused by later checkpoints,
+    so saving a checkpoint waits for the previous one to be written.
+
+    Usage::
+
+        writer = AsyncCheckpointWriter()
+        save_checkpoint(filename, model, ..., writer=writer)
+        remove_checkpoints(out_dir, topk, writer=writer)
+        ...
+        writer.close()  # Wait for all pending writes
+    """
+
+    def __init__(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures: List[Future] = []
+        self._last_save: Optional[Future] = None
+        # CPU buffers of tensors, keyed by their path in the checkpoint
+        self._buffers: Dict[str, Tensor] = {}
+
+    def submit(self, func: Callable, *args, **kwargs) -> None:
+        """Run `func(*args, **kwargs)` in the background thread after all
+        previously submitted tasks are done."""
+        self._check_errors()
+        self._futures.append(self._executor.submit(func, *args, **kwargs))
+
+    def save(
+        self,
+        checkpoint: Dict[str, Any],
+        filename: Union[str, Path],
+        with_safetensors: bool = False,
+    ) -> None:
+        """Copy the checkpoint to CPU memory and write it in the background.
+
+        Args:
+          checkpoint:
+            A dict that can be saved by `torch.save()`.
+          filename:
+            The checkpoint filename.
+          with_safetensors:
+            See :func:`save_checkpoint`.
+        """
+        start = time.time()
+        if self._last_save is not None:
+            # Its buffers are to be overwritten
+            self._last_save.result()
+        wait_time = time.time() - start
+
+        snapshot = self._snapshot(checkpoint, path="", memo=dict())
+        stall_time = time.time() - start
+
+        def write():
+            write_start = time.time()
+            _write_checkpoint(snapshot, filename, with_safetensors)
+            logging.info(
+                f"Saved checkpoint to {filename} in the background in "
+                f"{time.time() - write_start:.3f} seconds"
+            )
+
+        self.submit(write)
+        self._last_save = self._futures[-1]
+
+        logging.info(
+            f"Training was blocked for {stall_time:.3f} seconds to save "
+            f"{filename}, including {wait_time:.3f} seconds waiting for "
+            "the previous checkpoint"
+        )
+
+    def wait(self) -> None:
+        """Wait for all submitted tasks. Exceptions raised by them are
+        re-raised here."""
+        futures, self._futures = self._futures, []
+        for f in futures:
+            f.result()
+
+    def close(self) -> None:
+        """Wait for all submitted tasks and stop the background thread."""
+        self.wait()
+        self._executor.shutdown()
+
+    def _check_errors(self) -> None:
+        """Re-raise the exceptions of finished tasks."""
+        pending = []
+        for f in self._futures:
+            if f.done():
+                f.result()
+            else:
+                pending.append(f)
+        self._futures = pending
+
+    def _snapshot(self, obj: Any, path: str, memo: Dict[Tuple, Tensor]) -> Any:
+        """Return a copy of `obj` whose tensors are on CPU and are not
+        changed by training. Tensors shared in `obj` are shared in the copy.
+        """
+        if isinstance(obj, Tensor):
+            # state_dict() returns a new tensor for each name of a shared
+            # parameter, so compare their memory instead of their ids
+            key = (obj.device, obj.data_ptr(), obj.dtype, obj.shape, obj.stride())
+            if obj.numel() > 0 and key in memo:
+                return memo[key]
+
+            obj = obj.detach()
+            buf = self._buffers.get(path)
+            if buf is None or buf.shape != obj.shape or buf.dtype != obj.dtype:
+                buf = torch.empty(
+                    obj.shape, dtype=obj.dtype, device="cpu", pin_memory=obj.is_cuda
+                )
+                self._buffers[path] = buf
+            buf.copy_(obj)
+
+            memo[key] = buf
+            return buf
+        elif isinstance(obj, dict):
+            ans = copy.copy(obj)
+            for k, v in obj.items():
+                ans[k] = self._snapshot(v, f"{path}/{k}", memo)
+            return ans
+        elif type(obj) in (list, tuple):
+            return type(obj)(
+                self._snapshot(v, f"{path}/{i}", memo) for i, v in enumerate(obj)
+            )
+        else:
+            return copy.deepcopy(obj)
+
 
 def save_checkpoint(
     filename: Path,
@@ -46,6 +382,8 @@ def save_checkpoint(
     scaler: Optional[GradScaler] = None,
     sampler: Optional[CutSampler] = None,
     rank: int = 0,
+    with_safetensors: bool = False,
+    writer: Optional[AsyncCheckpointWriter] = None,
 ) -> None:
     """Save training information to a file.
 
@@ -66,6 +404,14 @@ def save_checkpoint(
         The GradScaler to be saved. We only save its `state_dict()`.
       rank:
         Used in DDP. We save checkpoint only for the node whose rank is 0.
+      with_safetensors:
+        If True, also save `model` and `model_avg` to a safetensors file
+        with suffix `.safetensors`. :func:`average_checkpoints` and
+        :func:`average_checkpoints_with_averaged_model` use it, if present,
+        to average models without loading whole checkpoints into memory.
+      writer:
+        If not None, the checkpoint is written in the background by it
+        and this function returns once the states are copied to CPU.
     Returns:
       Return None.
     """
@@ -93,7 +439,10 @@ def save_checkpoint(
             assert k not in checkpoint, k
             checkpoint[k] = v
 
-    torch.save(checkpoint, filename)
+    if writer is not None:
+        writer.save(checkpoint, filename, with_safetensors=with_safetensors)
+    else:
+        _write_checkpoint(checkpoint, filename, with_safetensors=with_safetensors)
 
 
 def load_checkpoint(
@@ -163,6 +512,13 @@ def average_checkpoints(
     """
     n = len(filenames)
 
+    state_dicts = [_load_model_tensors(f, "model") for f in filenames]
+    if all(s is not None for s in state_dicts):
+        # The safetensors files are memory mapped, so only the average
+        # is kept in memory.
+        logging.info("Averaging checkpoints with their safetensors files")
+        return _average_state_dicts([s[0] for s in state_dicts], device=device)
+
     avg = torch.load(filenames[0], map_location=device)["model"]
 
     # Identify shared parameters. Two parameters are said to be shared
@@ -191,6 +547,40 @@ def average_checkpoints(
     return avg
 
 
+def _average_state_dicts(
+    state_dicts: List[Dict[str, Tensor]], device: torch.device
+) -> Dict[str, Tensor]:
+    """Average state dicts one by one. See :func:`average_checkpoints`.
+
+    Tensors that are the same object, e.g., aliases returned by
+    :func:`load_safetensors`, are averaged only once.
+    """
+    n = len(state_dicts)
+
+    avg = dict()
+    uniqued: Dict[int, str] = dict()
+    for k, v in state_dicts[0].items():
+        if id(v) in uniqued:
+            avg[k] = avg[uniqued[id(v)]]
+            continue
+        uniqued[id(v)] = k
+        avg[k] = v.to(device=device, copy=True)
+
+    uniqued_names = list(uniqued.values())
+
+    for state_dict in state_dicts[1:]:
+        for k in uniqued_names:
+            avg[k] += state_dict[k].to(device)
+
+    for k in uniqued_names:
+        if avg[k].is_floating_point():
+            avg[k] /= n
+        else:
+            avg[k] //= n
+
+    return avg
+
+
 def save_checkpoint_with_global_batch_idx(
     out_dir: Path,
     global_batch_idx: int,
@@ -202,6 +592,8 @@ def save_checkpoint_with_global_batch_idx(
     scaler: Optional[GradScaler] = None,
     sampler: Optional[CutSampler] = None,
     rank: int = 0,
+    with_safetensors: bool = False,
+    writer: Optional[AsyncCheckpointWriter] = None,
 ):
     """Save training info after processing given number of batches.
 
@@ -233,6 +625,12 @@ def save_checkpoint_with_global_batch_idx(
       rank:
         The rank ID used in DDP training of the current node. Set it to 0
         if DDP is not used.
+      with_safetensors:
+        If True, also save the models to a safetensors file.
+        See :func:`save_checkpoint`.
+      writer:
+        If not None, write the checkpoint in the background.
+        See :func:`save_checkpoint`.
     """
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -247,6 +645,8 @@ def save_checkpoint_with_global_batch_idx(
         scaler=scaler,
         sampler=sampler,
         rank=rank,
+        with_safetensors=with_safetensors,
+        writer=writer,
     )
 
 
@@ -317,6 +717,7 @@ def remove_checkpoints(
     out_dir: Path,
     topk: int,
     rank: int = 0,
+    writer: Optional[AsyncCheckpointWriter] = None,
 ):
     """Remove checkpoints from the given directory.
 
@@ -333,10 +734,17 @@ def remove_checkpoints(
       rank:
         If using DDP for training, it is the rank of the current node.
         Use 0 if no DDP is used for training.
+      writer:
+        If not None, remove the checkpoints in the background after the
+        checkpoints being written by it are complete.
     """
     assert topk >= 1, topk
     if rank != 0:
         return
+
+    if writer is not None:
+        writer.submit(remove_checkpoints, out_dir=out_dir, topk=topk)
+        return
     checkpoints = find_checkpoints(out_dir)
 
     if len(checkpoints) == 0:
@@ -349,6 +757,9 @@ def remove_checkpoints(
     to_remove = checkpoints[topk:]
     for c in to_remove:
         os.remove(c)
+        st_filename = _safetensors_filename(c)
+        if st_filename.is_file():
+            os.remove(st_filename)
 
 
 def update_averaged_model(
@@ -385,6 +796,161 @@ def update_averaged_model(
     )
 
 
+class ModelAverager(object):
+    """Update the averaged model like :func:`update_averaged_model`.
+
+    The tensors to average are found only once, and each update runs two
+    multi-tensor kernels per chunk of tensors (see :func:`_split_by_bytes`)
+    instead of a loop over the state dict. If `model_avg` and `model_cur`
+    are on different devices, the tensors of `model_cur` are copied with
+    one transfer per dtype and chunk.
+
+    Unlike :func:`update_averaged_model`, `model_cur * weight` is computed
+    in the dtype of `model_avg` without a temporary tensor, so the results
+    may differ from it in the last bits.
+
+    Usage::
+
+        model_averager = ModelAverager(model, model_avg)
+        for batch in train_dl:
+            ...
+            if params.batch_idx_train % params.average_period == 0:
+                model_averager.update(params)
+    """
+
+    def __init__(self, model_cur: Union[nn.Module, DDP], model_avg: nn.Module):
+        """
+        Args:
+          model_cur:
+            The current model.
+          model_avg:
+            The averaged model to be updated. It has the same structure as
+            `model_cur` but may be on a different device or of a
+            different dtype.
+        """
+        if isinstance(model_cur, DDP):
+            model_cur = model_cur.module
+
+        # Keep (module, attribute name) pairs instead of tensors, as
+        # e.g. model_avg.to() replaces the tensors.
+        self.cur_slots = []
+        self.avg_slots = []
+
+        # Identify shared parameters. Two parameters are said to be shared
+        # if they have the same data_ptr
+        uniqued = set()
+        for k, v in model_avg.state_dict().items():
+            if v.data_ptr() in uniqued or not torch.is_floating_point(v):
+                continue
+            uniqued.add(v.data_ptr())
+
+            module_name, _, name = k.rpartition(".")
+            self.avg_slots.append((model_avg.get_submodule(module_name), name))
+            self.cur_slots.append((model_cur.get_submodule(module_name), name))
+
+    @torch.no_grad()
+    def update(self, params: Dict[str, Any]) -> None:
+        """Update the averaged model:
+        model_avg = model_cur * (average_period / batch_idx_train)
+          + model_avg * ((batch_idx_train - average_period) / batch_idx_train)
+
+        Args:
+          params:
+            User defined parameters containing `average_period` and
+            `batch_idx_train`.
+        """
+        if not self.avg_slots:
+            return
+
+        weight_cur = params.average_period / params.batch_idx_train
+        weight_avg = 1 - weight_cur
+
+        avg = [getattr(m, name) for m, name in self.avg_slots]
+        cur = [getattr(m, name) for m, name in self.cur_slots]
+        for s in _split_by_bytes(cur):
+            avg_chunk = avg[s]
+            cur_chunk = _to_device(cur[s], avg[0].device)
+            torch._foreach_mul_(avg_chunk, weight_avg)
+            torch._foreach_add_(avg_chunk, cur_chunk, alpha=weight_cur)
+
+
+# The averaging functions below process the tensors in chunks of at most
+# this many bytes, which bounds the size of their temporary tensors.
+_AVERAGE_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def _split_by_bytes(
+    tensors: List[Tensor], max_bytes: int = _AVERAGE_CHUNK_BYTES
+) -> List[slice]:
+    """Split a list of tensors into consecutive slices. Each slice holds at
+    most `max_bytes` bytes, unless it contains only one tensor.
+    """
+    ans = []
+    start = 0
+    num_bytes = 0
+    for i, t in enumerate(tensors):
+        n = t.numel() * t.element_size()
+        if i > start and num_bytes + n > max_bytes:
+            ans.append(slice(start, i))
+            start = i
+            num_bytes = 0
+        num_bytes += n
+    if start < len(tensors):
+        ans.append(slice(start, len(tensors)))
+    return ans
+
+
+def _to_device(tensors: List[Tensor], device: torch.device) -> List[Tensor]:
+    """Move a list of tensors to the given device.
+
+    Tensors not on `device` are concatenated per dtype so that each dtype
+    needs only one copy. Pass a chunk from :func:`_split_by_bytes` to bound
+    the size of the concatenated tensor.
+    """
+    device = torch.device(device)
+    ans = list(tensors)
+    groups: Dict[torch.dtype, List[int]] = dict()
+    for i, t in enumerate(tensors):
+        if t.device != device:
+            groups.setdefault(t.dtype, []).append(i)
+
+    for indexes in groups.values():
+        flat = torch.cat([tensors[i].detach().reshape(-1) for i in indexes])
+        flat = flat.to(device)
+        chunks = flat.split([tensors[i].numel() for i in indexes])
+        for i, c in zip(indexes, chunks):
+            ans[i] = c.view(tensors[i].shape)
+    return ans
+
+
+def _average_tensors(
+    tensors_1: List[Tensor],
+    tensors_2: List[Tensor],
+    weight_1: float,
+    weight_2: float,
+    scaling_factor: float = 1.0,
+    max_bytes: int = _AVERAGE_CHUNK_BYTES,
+) -> None:
+    """tensors_1 = (tensors_1 * weight_1 + tensors_2 * weight_2) * scaling_factor
+
+    It is an in-place operation on tensors_1. The tensors in tensors_2 are
+    moved to the device of tensors_1 if needed. It gives the same results
+    as doing it tensor by tensor.
+
+    The tensors are processed in chunks of at most `max_bytes` bytes of
+    tensors_2, so the copies of tensors_2 and `tensors_2 * weight_2` never
+    hold more than one chunk.
+    """
+    device = tensors_1[0].device
+    for s in _split_by_bytes(tensors_2, max_bytes):
+        chunk_1 = tensors_1[s]
+        chunk_2 = _to_device(tensors_2[s], device)
+        torch._foreach_mul_(chunk_1, weight_1)
+        torch._foreach_add_(chunk_1, torch._foreach_mul(chunk_2, weight_2))
+        if scaling_factor != 1.0:
+            torch._foreach_mul_(chunk_1, scaling_factor)
+
+
 def average_checkpoints_with_averaged_model(
     filename_start: str,
     filename_end: str,
@@ -421,22 +987,48 @@ def average_checkpoints_with_averaged_model(
       device:
         Move checkpoints to this device before averaging.
     """
-    state_dict_start = torch.load(filename_start, map_location=device)
-    state_dict_end = torch.load(filename_end, map_location=device)
+    start = _load_model_tensors(filename_start, "model_avg")
+    end = _load_model_tensors(filename_end, "model_avg")
+    keys = ("batch_idx_train", "average_period")
+    if (
+        start is not None
+        and end is not None
+        and all(k in start[1] and k in end[1] for k in keys)
+    ):
+        # The safetensors files are memory mapped, so only the average
+        # is kept in memory.
+        logging.info("Averaging checkpoints with their safetensors files")
+        model_start, metadata_start = start
+        model_end, metadata_end = end
+
+        average_period = int(metadata_start["average_period"])
+        batch_idx_train_start = int(metadata_start["batch_idx_train"])
+        batch_idx_train_end = int(metadata_end["batch_idx_train"])
+
+        # Tensors that are the same object remain so after copying
+        copies: Dict[int, Tensor] = dict()
+        for k, v in model_end.items():
+            if id(v) not in copies:
+                copies[id(v)] = v.to(device=device, copy=True)
+        model_end = {k: copies[id(v)] for k, v in model_end.items()}
+    else:
+        state_dict_start = torch.load(filename_start, map_location=device)
+        state_dict_end = torch.load(filename_end, map_location=device)
 
-    average_period = state_dict_start["average_period"]
+        average_period = state_dict_start["average_period"]
+        batch_idx_train_start = state_dict_start["batch_idx_train"]
+        batch_idx_train_end = state_dict_end["batch_idx_train"]
+
+        model_end = state_dict_end["model_avg"]
+        model_start = state_dict_start["model_avg"]
 
-    batch_idx_train_start = state_dict_start["batch_idx_train"]
     batch_idx_train_start = (batch_idx_train_start // average_period) * average_period
-    batch_idx_train_end = state_dict_end["batch_idx_train"]
     batch_idx_train_end = (batch_idx_train_end // average_period) * average_period
     interval = batch_idx_train_end - batch_idx_train_start
     assert interval > 0, interval
     weight_end = batch_idx_train_end / interval
     weight_start = 1 - weight_end
 
-    model_end = state_dict_end["model_avg"]
-    model_start = state_dict_start["model_avg"]
     avg = model_end
 
     # scale the weight to avoid overflow
@@ -472,10 +1064,12 @@ def average_state_dict(
             continue
         uniqued[v_data_ptr] = k
 
-    uniqued_names = list(uniqued.values())
-    for k in uniqued_names:
-        v = state_dict_1[k]
-        if torch.is_floating_point(v):
-            v *= weight_1
-            v += state_dict_2[k].to(device=state_dict_1[k].device) * weight_2
-            v *= scaling_factor
+    uniqued_names = [
+        k for k in uniqued.values() if torch.is_floating_point(state_dict_1[k])
+    ]
+    if not uniqued_names:
+        return
+
+    v1 = [state_dict_1[k] for k in uniqued_names]
+    v2 = [state_dict_2[k] for k in uniqued_names]
+    _average_tensors(v1, v2, weight_1, weight_2, scaling_factor)
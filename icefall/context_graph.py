@@ -16,9 +16,13 @@
 
 import os
 import shutil
+import tempfile
 from collections import deque
+from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Union
 
+import torch
+
 
 class ContextState:
     """The state in ContextGraph"""
@@ -480,6 +484,290 @@ class ContextGraph:
         return dot
 
 
+class CompiledContextGraph:
+    """A ContextGraph compiled into flat tensors.
+
+    :class:`ContextGraph` keeps the trie as linked :class:`ContextState`
+    objects and is walked one token of one hypothesis at a time. This class
+    keeps the same graph in tensors so that all the active hypotheses can
+    be advanced with a few tensor operations:
+
+      - `arc_keys`, sorted, `state * token_stride + token` of each trie arc,
+        and `arc_next_states`, the destination state of each arc.
+      - `fail`, the fail arc of each state.
+      - `token_score`, `node_score`, `output_score`, `is_end` and `output`
+        of each state, see :class:`ContextState`.
+
+    States are integers; the root is always 0. The results are the same
+    as the ones of :class:`ContextGraph`. Only what contextual biasing needs
+    is compiled; keywords spotting, i.e., `keywords_search`, still uses
+    :class:`ContextGraph`.
+
+    The tensors can be saved to a file with :meth:`save`, so a large list
+    of phrases has to be compiled only once, and loaded by :meth:`load`.
+    """
+
+    VERSION = 2
+
+    _TENSOR_NAMES = (
+        "arc_keys",
+        "arc_next_states",
+        "fail",
+        "token_score",
+        "node_score",
+        "output_score",
+        "is_end",
+        "output",
+    )
+
+    def __init__(
+        self,
+        arc_keys: torch.Tensor,
+        arc_next_states: torch.Tensor,
+        fail: torch.Tensor,
+        token_score: torch.Tensor,
+        node_score: torch.Tensor,
+        output_score: torch.Tensor,
+        is_end: torch.Tensor,
+        output: torch.Tensor,
+        token_stride: int,
+        phrases: List[str],
+    ):
+        """
+        Args:
+          arc_keys:
+            A 1-D torch.int64 tensor, sorted in ascending order. Each entry
+            is `state * token_stride + token` of an arc of the trie.
+          arc_next_states:
+            A 1-D torch.int64 tensor, the destination state of each arc.
+          fail:
+            A 1-D torch.int64 tensor of shape (num_states,), the destination
+            state of the fail arc of each state.
+          token_score:
+            A 1-D torch.float64 tensor of shape (num_states,).
+          node_score:
+            A 1-D torch.float64 tensor of shape (num_states,).
+          output_score:
+            A 1-D torch.float64 tensor of shape (num_states,).
+          is_end:
+            A 1-D torch.bool tensor of shape (num_states,).
+          output:
+            A 1-D torch.int64 tensor of shape (num_states,), the output
+            state of each state, -1 if there is no output state.
+          token_stride:
+            Larger than all the tokens in the graph.
+          phrases:
+            The phrase of each state, "" for non-end states.
+        """
+        self.arc_keys = arc_keys
+        self.arc_next_states = arc_next_states
+        self.fail = fail
+        self.token_score = token_score
+        self.node_score = node_score
+        self.output_score = output_score
+        self.is_end = is_end
+        self.output = output
+        self.token_stride = token_stride
+        self.phrases = phrases
+        self.root = 0
+
+    @property
+    def num_states(self) -> int:
+        return self.fail.numel()
+
+    @property
+    def device(self) -> torch.device:
+        return self.fail.device
+
+    def to(self, device: Union[str, torch.device]) -> "CompiledContextGraph":
+        """Return a copy of this graph with all tensors on the given device."""
+        tensors = {name: getattr(self, name).to(device) for name in self._TENSOR_NAMES}
+        return CompiledContextGraph(
+            token_stride=self.token_stride, phrases=self.phrases, **tensors
+        )
+
+    @classmethod
+    def from_context_graph(cls, context_graph: ContextGraph) -> "CompiledContextGraph":
+        """Compile a ContextGraph. It must have been built, i.e.,
+        :meth:`ContextGraph.build` has been called.
+        """
+        nodes = [context_graph.root]
+        queue = deque([context_graph.root])
+        while queue:
+            current_node = queue.popleft()
+            for node in current_node.next.values():
+                nodes.append(node)
+                queue.append(node)
+
+        num_states = len(nodes)
+        # Renumber the states so that they are in [0, num_states)
+        ids = {id(node): i for i, node in enumerate(nodes)}
+
+        src_states = []
+        tokens = []
+        dst_states = []
+        for i, node in enumerate(nodes):
+            for token, next_node in node.next.items():
+                src_states.append(i)
+                tokens.append(token)
+                dst_states.append(ids[id(next_node)])
+
+        token_stride = max(tokens, default=0) + 1
+        arc_keys = torch.tensor(src_states, dtype=torch.int64) * token_stride
+        arc_keys += torch.tensor(tokens, dtype=torch.int64)
+        arc_keys, order = arc_keys.sort()
+        arc_next_states = torch.tensor(dst_states, dtype=torch.int64)[order]
+
+        return cls(
+            arc_keys=arc_keys,
+            arc_next_states=arc_next_states,
+            fail=torch.tensor([ids[id(n.fail)] for n in nodes], dtype=torch.int64),
+            token_score=torch.tensor(
+                [n.token_score for n in nodes], dtype=torch.float64
+            ),
+            node_score=torch.tensor([n.node_score for n in nodes], dtype=torch.float64),
+            output_score=torch.tensor(
+                [n.output_score for n in nodes], dtype=torch.float64
+            ),
+            is_end=torch.tensor([n.is_end for n in nodes], dtype=torch.bool),
+            output=torch.tensor(
+                [-1 if n.output is None else ids[id(n.output)] for n in nodes],
+                dtype=torch.int64,
+            ),
+            token_stride=token_stride,
+            phrases=[n.phrase for n in nodes],
+        )
+
+    def save(self, filename: Union[str, Path]) -> None:
+        """Save the graph to a file, which can be loaded by :meth:`load`."""
+        d = {name: getattr(self, name).cpu() for name in self._TENSOR_NAMES}
+        d["version"] = self.VERSION
+        d["token_stride"] = self.token_stride
+        d["phrases"] = self.phrases
+        torch.save(d, filename)
+
+    @classmethod
+    def load(
+        cls,
+        filename: Union[str, Path],
+        device: Union[str, torch.device] = "cpu",
+    ) -> "CompiledContextGraph":
+        """Load a graph saved by :meth:`save`."""
+        d = torch.load(filename, map_location=device, weights_only=True)
+        if d.get("version") != cls.VERSION:
+            raise ValueError(
+                f"{filename} has version {d.get('version')}, "
+                f"expected {cls.VERSION}. Please re-generate it."
+            )
+        return cls(
+            token_stride=d["token_stride"],
+            phrases=d["phrases"],
+            **{name: d[name] for name in cls._TENSOR_NAMES},
+        )
+
+    def _lookup(
+        self, states: torch.Tensor, tokens: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Look up the arc with the given token leaving each given state.
+
+        Returns:
+          Return a tuple with two tensors:
+            - A bool tensor, True if the arc exists.
+            - The destination states of the arcs. Valid only if the arc exists.
+        """
+        if self.arc_keys.numel() == 0:
+            return torch.zeros_like(states, dtype=torch.bool), states
+
+        keys = states * self.token_stride + tokens
+        index = torch.searchsorted(self.arc_keys, keys)
+        index = index.clamp_(max=self.arc_keys.numel() - 1)
+        # Tokens not in the graph would otherwise alias arcs of other states
+        found = (self.arc_keys[index] == keys) & (tokens < self.token_stride)
+        return found, self.arc_next_states[index]
+
+    def forward(
+        self,
+        states: Union[List[int], torch.Tensor],
+        tokens: Union[List[int], torch.Tensor],
+        strict_mode: bool = True,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Search the graph with the given states and tokens.
+
+        It is the batched version of :meth:`ContextGraph.forward_one_step`.
+        The fail arcs of all the states that do not match their tokens are
+        followed at the same time, so the number of iterations is bounded by
+        the length of the longest phrase.
+
+        Args:
+          states:
+            A 1-D tensor (or a list) containing the states to start.
+          tokens:
+            A 1-D tensor (or a list) with the same shape as `states`.
+          strict_mode:
+            See :meth:`ContextGraph.forward_one_step`.
+        Returns:
+          Return a tuple of three 1-D tensors:
+            - The boosting scores, with dtype torch.float64.
+            - The next states.
+            - The matched states, -1 if no phrase is matched.
+        """
+        states = torch.as_tensor(states, dtype=torch.int64, device=self.device)
+        tokens = torch.as_tensor(tokens, dtype=torch.int64, device=self.device)
+        assert states.shape == tokens.shape, (states.shape, tokens.shape)
+
+        # token matched
+        matched, next_states = self._lookup(states, tokens)
+
+        # token not matched, trace along the fail arcs until it matches
+        # the token or reaching the root
+        cur = self.fail[states]
+        pending = ~matched
+        while True:
+            found, found_states = self._lookup(cur, tokens)
+            pending &= ~found & (cur != self.root)
+            if not pending.any():
+                break
+            cur = torch.where(pending, self.fail[cur], cur)
+
+        nodes = torch.where(found, found_states, cur)
+        nodes = torch.where(matched, next_states, nodes)
+        scores = torch.where(
+            matched,
+            self.token_score[nodes],
+            # The score of the fail path
+            self.node_score[nodes] - self.node_score[states],
+        )
+
+        # The matched state with the longest phrase, if any
+        matched_states = torch.where(self.is_end[nodes], nodes, self.output[nodes])
+        if not strict_mode:
+            # output_score != 0 means at least one phrase matched
+            reset = self.output_score[nodes] != 0
+            matched_node_score = self.node_score[matched_states.clamp(min=0)]
+            scores = torch.where(
+                reset,
+                scores + matched_node_score - self.node_score[nodes],
+                scores + self.output_score[nodes],
+            )
+            nodes = torch.where(reset, torch.zeros_like(nodes), nodes)
+        else:
+            scores = scores + self.output_score[nodes]
+
+        return scores, nodes, matched_states
+
+    def finalize(
+        self, states: Union[List[int], torch.Tensor]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """The batched version of :meth:`ContextGraph.finalize`.
+
+        Returns:
+          Return a tuple of the scores of the implicit fail arcs to the
+          root and the next states, which are always the root.
+        """
+        states = torch.as_tensor(states, dtype=torch.int64, device=self.device)
+        return -self.node_score[states], torch.zeros_like(states)
+
+
 def _test(queries, score, strict_mode):
     contexts_str = [
         "S",
@@ -533,6 +821,32 @@ def _test(queries, score, strict_mode):
             query,
         )
 
+    # The compiled graph advances all the queries at the same time
+    compiled_graph = CompiledContextGraph.from_context_graph(context_graph)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = f"{tmp_dir}/context_graph_{score}.pt"
+        compiled_graph.save(filename)
+        compiled_graph = CompiledContextGraph.load(filename)
+
+    queries_list = list(queries.keys())
+    max_len = max(len(q) for q in queries_list)
+    total_scores = torch.zeros(len(queries_list), dtype=torch.float64)
+    states = torch.zeros(len(queries_list), dtype=torch.int64)
+    for i in range(max_len):
+        # Queries shorter than max_len are padded with a token not in the graph
+        tokens = [ord(q[i]) if i < len(q) else ord("#") for q in queries_list]
+        scores, states, _ = compiled_graph.forward(states, tokens, strict_mode)
+        total_scores += scores
+    scores, states = compiled_graph.finalize(states)
+    assert torch.all(states == compiled_graph.root), states
+    total_scores += scores
+    for query, total_score in zip(queries_list, total_scores.tolist()):
+        assert round(total_score, 2) == queries[query], (
+            total_score,
+            queries[query],
+            query,
+        )
+
 
 if __name__ == "__main__":
     # test default score
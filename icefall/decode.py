@@ -16,6 +16,7 @@
 # limitations under the License.
 
 import logging
+import math
 from dataclasses import dataclass, field
 from multiprocessing.pool import Pool
 from typing import Dict, List, Optional, Tuple, Union
@@ -1923,6 +1924,330 @@ def ctc_prefix_beam_search(
         return [hyp.ys for hyp in best_hyps]
 
 
+def _merge_duplicate_prefixes(
+    hashes: torch.Tensor,
+    log_prob_blank: torch.Tensor,
+    log_prob_non_blank: torch.Tensor,
+    valid: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Merge the candidate prefixes of the same utterance that have identical
+    token sequences, i.e., identical hashes.
+
+    It is the tensor counterpart of :meth:`HypothesisList.add`. The
+    probabilities of duplicated prefixes are added (in log-space) to the
+    first one, i.e., the one with the smallest index, and the duplicates are
+    marked as invalid.
+
+    Args:
+      hashes:
+        A 2-D tensor of shape (N, M) with dtype torch.int64.
+      log_prob_blank:
+        A 2-D tensor of shape (N, M).
+      log_prob_non_blank:
+        A 2-D tensor of shape (N, M).
+      valid:
+        A 2-D bool tensor of shape (N, M). Invalid candidates are ignored.
+    Returns:
+      Return a tuple (log_prob_blank, log_prob_non_blank), both of shape
+      (N, M). The entries of invalid and duplicated candidates are -inf.
+    """
+    M = hashes.size(1)
+    # same[n][i][j] is True if the j-th candidate equals the i-th candidate
+    same = hashes.unsqueeze(2) == hashes.unsqueeze(1)
+    same &= valid.unsqueeze(1) & valid.unsqueeze(2)
+    # (N, M, M)
+
+    neg_inf = torch.full_like(log_prob_blank, float("-inf")).unsqueeze(1)
+    merged_blank = torch.where(
+        same, log_prob_blank.unsqueeze(1).expand(-1, M, -1), neg_inf
+    ).logsumexp(dim=2)
+    merged_non_blank = torch.where(
+        same, log_prob_non_blank.unsqueeze(1).expand(-1, M, -1), neg_inf
+    ).logsumexp(dim=2)
+
+    # A candidate is kept only if it is the first one among its duplicates
+    arange = torch.arange(M, device=hashes.device)
+    first = torch.where(same, arange, M).min(dim=2).values
+    keep = valid & (first == arange)
+
+    neg_inf = neg_inf.squeeze(1)
+    return (
+        torch.where(keep, merged_blank, neg_inf),
+        torch.where(keep, merged_non_blank, neg_inf),
+    )
+
+
+def ctc_prefix_beam_search_batched(
+    ctc_output: torch.Tensor,
+    encoder_out_lens: torch.Tensor,
+    beam: int = 4,
+    blank_id: int = 0,
+    blank_threshold: Optional[float] = None,
+    return_nbest: Optional[bool] = False,
+) -> Union[List[List[int]], List[HypothesisList]]:
+    """A tensorized version of :func:`ctc_prefix_beam_search`.
+
+    Instead of decoding each utterance in a worker process with Python
+    objects, the prefixes of all utterances are kept in tensors of shape
+    (N, beam) on the device of `ctc_output`:
+
+      - the log probs of the prefixes ending with blank and non-blank
+      - the last token of each prefix
+      - a rolling hash of each prefix, used to merge identical prefixes
+
+    For each frame, we save the back-pointers and the appended tokens, which
+    are used to recover the prefixes once the search is done.
+
+    Without `blank_threshold`, it produces the same results as
+    :func:`ctc_prefix_beam_search` (up to ties and floating point round-off).
+
+    Args:
+      ctc_output:
+        The output of ctc head (log probability), the shape is (B, T, V)
+      encoder_out_lens:
+        The lengths (frames) of sequences after subsampling, the shape is (B,)
+      beam:
+        The number of hypothesis to be kept at each step.
+      blank_id:
+        The id of blank in the vocabulary.
+      blank_threshold:
+        If not None, frames whose blank probability is larger than it
+        (e.g., 0.999) are assumed to emit only blank. They do not change the
+        order of the prefixes, so they are skipped in the search and their
+        blank log probs are added to all prefixes at once. Since most frames
+        of CTC models are blank-dominant, the number of search steps is
+        then proportional to the number of non-blank frames.
+      return_nbest:
+        If true, return a list of HypothesisList, return a list of list of decoded token ids otherwise.
+    """
+    N, T, _ = ctc_output.shape
+    device = ctc_output.device
+    encoder_out_lens = encoder_out_lens.to(device)
+
+    topk_values, topk_indexes = ctc_output.topk(beam)  # (B, T, beam)
+
+    frame_indexes = torch.arange(T, device=device)
+    valid_frames = frame_indexes.unsqueeze(0) < encoder_out_lens.unsqueeze(1)
+    # (B, T)
+
+    if blank_threshold is not None:
+        blank_log_probs = ctc_output[:, :, blank_id]
+        skipped = valid_frames & (blank_log_probs > math.log(blank_threshold))
+        kept = valid_frames & ~skipped
+
+        # Sum of the blank log probs and number of the skipped frames so far.
+        # float64 is used to avoid accumulating round-off errors.
+        cum_blank = torch.where(
+            skipped,
+            blank_log_probs.to(torch.float64),
+            torch.zeros_like(blank_log_probs, dtype=torch.float64),
+        ).cumsum(dim=1)
+        cum_skipped = skipped.to(torch.int64).cumsum(dim=1)
+    else:
+        kept = valid_frames
+
+    # Move the kept frames of each utterance to the front
+    num_kept = kept.sum(dim=1)
+    kept_frame_indexes = torch.where(kept, frame_indexes, frame_indexes + T).argsort(
+        dim=1
+    )
+    num_steps = num_kept.max().item() if N > 0 else 0
+    kept_frame_indexes = kept_frame_indexes[:, :num_steps]
+    topk_values = torch.gather(
+        topk_values, 1, kept_frame_indexes.unsqueeze(2).expand(-1, -1, beam)
+    )
+    topk_indexes = torch.gather(
+        topk_indexes, 1, kept_frame_indexes.unsqueeze(2).expand(-1, -1, beam)
+    )
+
+    if blank_threshold is not None:
+        # skipped_blank[n][t] and num_skipped[n][t] are for the frames skipped
+        # between the (t-1)-th and the t-th kept frames of utterance n.
+        kept_cum_blank = torch.gather(cum_blank, 1, kept_frame_indexes)
+        kept_cum_skipped = torch.gather(cum_skipped, 1, kept_frame_indexes)
+        skipped_blank = kept_cum_blank - torch.nn.functional.pad(
+            kept_cum_blank[:, :-1], (1, 0)
+        )
+        num_skipped = kept_cum_skipped - torch.nn.functional.pad(
+            kept_cum_skipped[:, :-1], (1, 0)
+        )
+
+        # For the frames skipped after the last kept frame
+        last = (encoder_out_lens - 1).clamp(min=0).unsqueeze(1)
+        last_kept = (num_kept - 1).clamp(min=0).unsqueeze(1)
+        has_kept = (num_kept > 0).unsqueeze(1)
+        zero = torch.zeros(N, 1, dtype=torch.float64, device=device)
+        tail_blank = torch.gather(cum_blank, 1, last) - torch.where(
+            has_kept, torch.gather(kept_cum_blank, 1, last_kept), zero
+        )
+        tail_skipped = torch.gather(cum_skipped, 1, last) - torch.where(
+            has_kept, torch.gather(kept_cum_skipped, 1, last_kept), zero.long()
+        )
+        tail_skipped = tail_skipped * (encoder_out_lens > 0).unsqueeze(1)
+
+    dtype = ctc_output.dtype
+    neg_inf = float("-inf")
+    # Only the first prefix of each utterance, i.e., the empty one, is
+    # valid at the beginning
+    log_prob_blank = torch.full((N, beam), neg_inf, dtype=dtype, device=device)
+    log_prob_blank[:, 0] = 0
+    log_prob_non_blank = torch.full((N, beam), neg_inf, dtype=dtype, device=device)
+    last_tokens = torch.full((N, beam), -1, dtype=torch.int64, device=device)
+    hashes = torch.zeros(N, beam, dtype=torch.int64, device=device)
+
+    # back_pointers[t][n][k] is the index of the prefix at step t-1 from
+    # which the k-th prefix of the n-th utterance at step t is extended.
+    # tokens[t][n][k] is the token appended at step t, or -1 if the prefix
+    # does not change.
+    back_pointers = []
+    tokens = []
+
+    arange = torch.arange(beam, device=device)
+    for t in range(num_steps):
+        active = (num_kept > t).unsqueeze(1)  # (B, 1)
+
+        if blank_threshold is not None:
+            # The skipped frames turn all prefixes into prefixes ending
+            # with blank
+            collapse = active & (num_skipped[:, t] > 0).unsqueeze(1)
+            log_prob_blank = torch.where(
+                collapse,
+                torch.logaddexp(log_prob_blank, log_prob_non_blank)
+                + skipped_blank[:, t : t + 1].to(dtype),
+                log_prob_blank,
+            )
+            log_prob_non_blank = torch.where(
+                collapse,
+                torch.full_like(log_prob_non_blank, neg_inf),
+                log_prob_non_blank,
+            )
+
+        log_prob = torch.logaddexp(log_prob_blank, log_prob_non_blank)
+        valid = log_prob != neg_inf  # (B, beam)
+
+        # Candidates are indexed by (prefix k, token c, stay/extend), which is
+        # the insertion order in _step_worker()
+        values = topk_values[:, t].unsqueeze(1)  # (B, 1, beam)
+        indexes = topk_indexes[:, t].unsqueeze(1)  # (B, 1, beam)
+        is_blank = indexes == blank_id  # (B, 1, beam)
+        is_last = indexes == last_tokens.unsqueeze(2)  # (B, beam, beam)
+        inf = torch.full_like(is_last, neg_inf, dtype=dtype)
+
+        # Case 0: *a + ε => *a, *aε + ε => *a
+        # Case 1: *a + a => *a
+        stay_blank = torch.where(is_blank, log_prob.unsqueeze(2) + values, inf)
+        stay_non_blank = torch.where(
+            is_last, log_prob_non_blank.unsqueeze(2) + values, inf
+        )
+        stay_valid = valid.unsqueeze(2) & (is_blank | is_last)
+
+        # Case 2: *aε + a => *aa
+        # Case 3: *a + b => *ab, *aε + b => *ab
+        extend_non_blank = torch.where(
+            is_last,
+            log_prob_blank.unsqueeze(2) + values,
+            log_prob.unsqueeze(2) + values,
+        )
+        extend_valid = valid.unsqueeze(2) & ~is_blank
+
+        cand_blank = torch.stack([stay_blank, inf], dim=3).reshape(N, -1)
+        cand_non_blank = torch.stack([stay_non_blank, extend_non_blank], dim=3)
+        cand_non_blank = cand_non_blank.reshape(N, -1)
+        cand_valid = torch.stack([stay_valid, extend_valid], dim=3).reshape(N, -1)
+        cand_valid &= torch.logaddexp(cand_blank, cand_non_blank) != neg_inf
+
+        expanded_hashes = hashes.unsqueeze(2).expand(-1, -1, beam)
+        cand_hashes = torch.stack(
+            [expanded_hashes, expanded_hashes * 1000003 + indexes + 1], dim=3
+        ).reshape(N, -1)
+        expanded_tokens = indexes.expand(N, beam, -1)
+        cand_tokens = torch.stack(
+            [torch.full_like(expanded_tokens, -1), expanded_tokens], dim=3
+        ).reshape(N, -1)
+        cand_last_tokens = torch.stack(
+            [last_tokens.unsqueeze(2).expand(-1, -1, beam), expanded_tokens], dim=3
+        ).reshape(N, -1)
+        cand_back_pointers = arange.reshape(1, beam, 1, 1).expand(N, -1, beam, 2)
+        cand_back_pointers = cand_back_pointers.reshape(N, -1)
+
+        cand_blank, cand_non_blank = _merge_duplicate_prefixes(
+            hashes=cand_hashes,
+            log_prob_blank=cand_blank,
+            log_prob_non_blank=cand_non_blank,
+            valid=cand_valid,
+        )
+
+        # A stable sort keeps the insertion order for ties, like
+        # HypothesisList.topk()
+        cand_scores = torch.logaddexp(cand_blank, cand_non_blank)
+        best = torch.sort(cand_scores, dim=1, descending=True, stable=True)[1]
+        best = best[:, :beam]
+
+        # The prefixes of finished utterances do not change
+        new_back_pointers = torch.where(
+            active, torch.gather(cand_back_pointers, 1, best), arange
+        )
+        tokens.append(torch.where(active, torch.gather(cand_tokens, 1, best), -1))
+        back_pointers.append(new_back_pointers)
+
+        log_prob_blank = torch.where(
+            active, torch.gather(cand_blank, 1, best), log_prob_blank
+        )
+        log_prob_non_blank = torch.where(
+            active, torch.gather(cand_non_blank, 1, best), log_prob_non_blank
+        )
+        last_tokens = torch.where(
+            active, torch.gather(cand_last_tokens, 1, best), last_tokens
+        )
+        hashes = torch.where(active, torch.gather(cand_hashes, 1, best), hashes)
+
+    if blank_threshold is not None:
+        collapse = tail_skipped > 0
+        log_prob_blank = torch.where(
+            collapse,
+            torch.logaddexp(log_prob_blank, log_prob_non_blank) + tail_blank.to(dtype),
+            log_prob_blank,
+        )
+        log_prob_non_blank = torch.where(
+            collapse, torch.full_like(log_prob_non_blank, neg_inf), log_prob_non_blank
+        )
+
+    # Trace back the prefixes. They are sorted by score in descending order.
+    ys = [[[] for _ in range(beam)] for _ in range(N)]
+    if num_steps > 0:
+        back_pointers = torch.stack(back_pointers).cpu()
+        tokens = torch.stack(tokens).cpu()
+        current = torch.arange(beam).unsqueeze(0).expand(N, -1)
+        ans_tokens = []
+        for t in range(num_steps - 1, -1, -1):
+            ans_tokens.append(torch.gather(tokens[t], 1, current))
+            current = torch.gather(back_pointers[t], 1, current)
+        ans_tokens = torch.stack(ans_tokens[::-1], dim=2).tolist()
+        ys = [[[i for i in y if i != -1] for y in utt] for utt in ans_tokens]
+
+    if not return_nbest:
+        return [utt[0] for utt in ys]
+
+    log_prob_blank = log_prob_blank.cpu().float()
+    log_prob_non_blank = log_prob_non_blank.cpu().float()
+    valid = torch.logaddexp(log_prob_blank, log_prob_non_blank) != neg_inf
+    ans = []
+    for n in range(N):
+        hyps = HypothesisList()
+        for k in range(beam):
+            if not valid[n, k]:
+                continue
+            hyps.add(
+                Hypothesis(
+                    ys=ys[n][k],
+                    log_prob_blank=log_prob_blank[n, k].reshape(1),
+                    log_prob_non_blank=log_prob_non_blank[n, k].reshape(1),
+                )
+            )
+        ans.append(hyps)
+    return ans
+
+
 def ctc_prefix_beam_search_shallow_fussion(
     ctc_output: torch.Tensor,
     encoder_out_lens: torch.Tensor,
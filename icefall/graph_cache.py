@@ -0,0 +1,186 @@
+# Copyright    2024  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A cache for decoding graphs, e.g., HLG, LG and G.
+
+Preparing a decoding graph, e.g., loading G_4_gram.pt and adding epsilon
+self-loops to it for whole-lattice rescoring, can take minutes. This module
+saves the prepared graph, i.e., after arc sorting, scaling of the scores
+and so on, in the safetensors format. Loading it later only memory maps
+the file, so repeated decoding jobs and multiple decoding processes can
+share the prepared graph without preparing it again.
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import k2
+import torch
+
+from icefall.checkpoint import load_safetensors, save_safetensors
+
+
+def save_fsa(filename: Union[str, Path], fsa: k2.Fsa) -> None:
+    """Save an Fsa or an FsaVec in the safetensors format.
+
+    Unlike `torch.save(fsa.as_dict(), filename)`, the properties of the
+    Fsa are also saved, so they are not recomputed after loading.
+
+    Args:
+      filename:
+        The filename to save to.
+      fsa:
+        The Fsa to save. Its ragged tensor attributes, e.g., aux_labels of
+        LG, must have two axes. Its non-tensor attributes must be JSON
+        serializable.
+    """
+    fsa = fsa.to("cpu")
+    tensors = {}
+    ragged = []
+    attrs = {}
+    for name, value in fsa.as_dict().items():
+        if isinstance(value, torch.Tensor):
+            tensors[name] = value
+        elif isinstance(value, k2.RaggedTensor):
+            assert value.num_axes == 2, (name, value.num_axes)
+            tensors[f"{name}.row_splits"] = value.shape.row_splits(1)
+            tensors[f"{name}.values"] = value.values
+            ragged.append(name)
+        else:
+            attrs[name] = value
+
+    metadata = {
+        "properties": str(fsa.properties),
+        "ragged": json.dumps(ragged),
+        "attrs": json.dumps(attrs),
+    }
+    save_safetensors(filename, tensors, metadata)
+
+
+def load_fsa(
+    filename: Union[str, Path],
+    device: Union[str, torch.device] = "cpu",
+) -> k2.Fsa:
+    """Load an Fsa saved by :func:`save_fsa`.
+
+    Args:
+      filename:
+        The filename to load from.
+      device:
+        The device of the returned Fsa. If it is the CPU, the tensors of
+        the returned Fsa are backed by the memory mapped file.
+    Returns:
+      Return the loaded Fsa.
+    """
+    tensors, metadata = load_safetensors(filename)
+
+    d = {}
+    for name in json.loads(metadata["ragged"]):
+        values = tensors.pop(f"{name}.values")
+        shape = k2.ragged.create_ragged_shape2(
+            row_splits=tensors.pop(f"{name}.row_splits"),
+            cached_tot_size=values.numel(),
+        )
+        d[name] = k2.RaggedTensor(shape, values)
+    d.update(tensors)
+    d.update(json.loads(metadata["attrs"]))
+
+    fsa = k2.Fsa(
+        d.pop("arcs"),
+        aux_labels=d.pop("aux_labels", None),
+        properties=int(metadata["properties"]),
+    )
+    for name, value in d.items():
+        setattr(fsa, name, value)
+
+    return fsa.to(device)
+
+
+def _get_cache_key(
+    inputs: List[Union[str, Path]],
+    options: Optional[Dict[str, Any]],
+) -> str:
+    """Return a key computed from the path, size and modification time of
+    each input file and the given options. Hashing the content instead
+    would take too long for a large G.
+    """
+    h = hashlib.sha256()
+    for f in inputs:
+        f = Path(f).resolve()
+        stat = f.stat()
+        h.update(f"{f}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    h.update(json.dumps(options or {}, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def load_or_build_fsa(
+    build: Callable[[], k2.Fsa],
+    name: str,
+    inputs: Union[List[Union[str, Path]], Callable[[], List[Union[str, Path]]]],
+    cache_dir: Optional[Union[str, Path]] = None,
+    options: Optional[Dict[str, Any]] = None,
+    device: Union[str, torch.device] = "cpu",
+) -> k2.Fsa:
+    """Return a prepared decoding graph from the cache. If it is not in the
+    cache, build it with `build()` and save it to the cache.
+
+    Args:
+      build:
+        A function that builds the prepared decoding graph.
+      name:
+        Name of the decoding graph, e.g., HLG. It is used in the filename
+        of the cached graph.
+      inputs:
+        Files from which `build()` builds the graph. The cached graph is
+        invalidated if any of them is changed. It can also be a function
+        returning the files, which is called again after `build()`. Use
+        it if `build()` creates the files that later runs read, e.g.,
+        G_4_gram.pt from G_4_gram.fst.txt, so that the graph is cached
+        under the key that later runs look up.
+      cache_dir:
+        The directory of the cache. If it is None or empty, the cache is
+        disabled and it returns `build()`.
+      options:
+        Options that affect the result of `build()`, e.g., the scale of
+        the scores. They must be JSON serializable.
+      device:
+        The device of the returned Fsa.
+    Returns:
+      Return the prepared decoding graph.
+    """
+    if not cache_dir:
+        return build().to(device)
+
+    get_inputs = inputs if callable(inputs) else lambda: inputs
+
+    key = _get_cache_key(get_inputs(), options)
+    filename = Path(cache_dir) / f"{name}-{key}.safetensors"
+    if filename.is_file():
+        logging.info(f"Loading cached {name} from {filename}")
+        return load_fsa(filename, device=device)
+
+    fsa = build()
+    if callable(inputs):
+        key = _get_cache_key(get_inputs(), options)
+        filename = Path(cache_dir) / f"{name}-{key}.safetensors"
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    save_fsa(filename, fsa)
+    logging.info(f"Saved {name} to {filename}")
+    return fsa.to(device)
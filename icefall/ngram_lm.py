@@ -15,7 +15,10 @@
 # limitations under the License.
 
 from collections import defaultdict
-from typing import List, Optional, Tuple
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
 
 from icefall.utils import is_module_available
 
@@ -169,3 +172,371 @@ class NgramLmStateCost:
             return float("-inf")
 
         return -1 * min(self.state_cost.values())
+
+
+class CompiledNgramLm:
+    """An array-based version of :class:`NgramLm`.
+
+    The arcs of all states are kept in flat arrays sorted by
+    (state, ilabel), so that arcs can be looked up for many
+    (state, label) pairs at once with `np.searchsorted`. The states reachable
+    from each state via backoff arcs, i.e., the return value of
+    :meth:`NgramLm._process_backoff_arcs` plus the state itself, are
+    precomputed and kept in CSR format.
+
+    It gives the same results as :class:`NgramLm` and
+    :class:`NgramLmStateCost`, but it is much faster, especially when
+    many hypotheses are advanced at once with :meth:`forward_one_step`.
+
+    Usage::
+
+        ngram_lm = NgramLm("2gram.fst.txt", backoff_id=500, is_binary=False)
+        compiled_lm = CompiledNgramLm.from_ngram_lm(ngram_lm)
+        compiled_lm.save("2gram.compiled.bin")
+
+        # Arrays are memory mapped, so loading is almost free
+        compiled_lm = CompiledNgramLm.load("2gram.compiled.bin")
+        state_cost = CompiledNgramLmStateCost(compiled_lm)
+        state_costs = compiled_lm.forward_one_step(
+            [state_cost, state_cost], labels=[3, 5]
+        )
+    """
+
+    # Bump it if the file format is changed
+    VERSION = 1
+
+    _ARRAY_NAMES = (
+        "arc_keys",
+        "arc_next_states",
+        "arc_weights",
+        "closure_offsets",
+        "closure_states",
+        "closure_costs",
+    )
+
+    # Arrays in the saved file start at multiples of it
+    _ALIGNMENT = 64
+
+    def __init__(
+        self,
+        backoff_id: int,
+        num_states: int,
+        label_stride: int,
+        arc_keys: np.ndarray,
+        arc_next_states: np.ndarray,
+        arc_weights: np.ndarray,
+        closure_offsets: np.ndarray,
+        closure_states: np.ndarray,
+        closure_costs: np.ndarray,
+    ):
+        """
+        Args:
+          backoff_id:
+            ID of the backoff symbol.
+          num_states:
+            Number of states in the LM.
+          label_stride:
+            It is larger than the largest ilabel. The key of an arc is
+            `state * label_stride + ilabel`.
+          arc_keys:
+            A 1-D np.int64 array containing the keys of all arcs, sorted.
+          arc_next_states:
+            A 1-D np.int32 array. arc_next_states[i] is the destination
+            state of the arc with key arc_keys[i].
+          arc_weights:
+            A 1-D np.float32 array. arc_weights[i] is the cost of the arc with
+            key arc_keys[i].
+          closure_offsets:
+            A 1-D np.int64 array of shape (num_states + 1,).
+            closure_states[closure_offsets[s]:closure_offsets[s+1]] are
+            the states reachable from state `s` via zero or more backoff arcs.
+          closure_states:
+            A 1-D np.int32 array. See `closure_offsets`.
+          closure_costs:
+            A 1-D np.float64 array. closure_costs[i] is the total cost of the
+            backoff arcs to reach closure_states[i].
+        """
+        self.backoff_id = backoff_id
+        self.num_states = num_states
+        self.label_stride = label_stride
+        self.arc_keys = arc_keys
+        self.arc_next_states = arc_next_states
+        self.arc_weights = arc_weights
+        self.closure_offsets = closure_offsets
+        self.closure_states = closure_states
+        self.closure_costs = closure_costs
+
+    @classmethod
+    def from_ngram_lm(cls, ngram_lm: NgramLm) -> "CompiledNgramLm":
+        """Compile an :class:`NgramLm`."""
+        import kaldifst
+
+        lm = ngram_lm.lm
+        assert lm.start == 0, lm.start
+        num_states = lm.num_states
+
+        states = []
+        ilabels = []
+        next_states = []
+        weights = []
+        for state in range(num_states):
+            arc_iter = kaldifst.ArcIterator(lm, state)
+            while not arc_iter.done:
+                arc = arc_iter.value
+                states.append(state)
+                ilabels.append(arc.ilabel)
+                next_states.append(arc.nextstate)
+                weights.append(arc.weight.value)
+                arc_iter.next()
+
+        label_stride = max(ilabels + [ngram_lm.backoff_id]) + 1
+
+        arc_keys = np.array(states, dtype=np.int64) * label_stride + np.array(
+            ilabels, dtype=np.int64
+        )
+        # The LM is arc sorted by ilabel, so it is a no-op in most cases
+        order = np.argsort(arc_keys, kind="stable")
+        arc_keys = arc_keys[order]
+        arc_next_states = np.array(next_states, dtype=np.int32)[order]
+        arc_weights = np.array(weights, dtype=np.float32)[order]
+
+        closure_offsets = [0]
+        closure_states = []
+        closure_costs = []
+        for state in range(num_states):
+            closure_states.append(state)
+            closure_costs.append(0.0)
+            for s, c in ngram_lm._process_backoff_arcs(state=state, cost=0):
+                closure_states.append(s)
+                closure_costs.append(c)
+            closure_offsets.append(len(closure_states))
+
+        return cls(
+            backoff_id=ngram_lm.backoff_id,
+            num_states=num_states,
+            label_stride=label_stride,
+            arc_keys=arc_keys,
+            arc_next_states=arc_next_states,
+            arc_weights=arc_weights,
+            closure_offsets=np.array(closure_offsets, dtype=np.int64),
+            closure_states=np.array(closure_states, dtype=np.int32),
+            closure_costs=np.array(closure_costs, dtype=np.float64),
+        )
+
+    def save(self, filename: Union[str, Path]) -> None:
+        """Save the arrays to a single file that can be memory mapped by
+        :meth:`load`. The file is a sequence of `.npy` records, the first of
+        which contains the metadata.
+        """
+        meta = np.array(
+            [self.VERSION, self.backoff_id, self.num_states, self.label_stride],
+            dtype=np.int64,
+        )
+        with open(filename, "wb") as f:
+            for a in [meta] + [getattr(self, name) for name in self._ARRAY_NAMES]:
+                np.lib.format.write_array(f, np.ascontiguousarray(a))
+                pad = -f.tell() % self._ALIGNMENT
+                f.write(b"\0" * pad)
+
+    @classmethod
+    def load(cls, filename: Union[str, Path], mmap: bool = True) -> "CompiledNgramLm":
+        """Load a file saved by :meth:`save`.
+
+        Args:
+          filename:
+            The file to load.
+          mmap:
+            True to memory map the arrays instead of reading them. Pages are
+            shared by all processes that load the same file.
+        """
+        arrays = []
+        with open(filename, "rb") as f:
+            for _ in range(len(cls._ARRAY_NAMES) + 1):
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    header = np.lib.format.read_array_header_1_0(f)
+                else:
+                    header = np.lib.format.read_array_header_2_0(f)
+                shape, fortran_order, dtype = header
+                assert not fortran_order, filename
+
+                offset = f.tell()
+                count = int(np.prod(shape))
+                if mmap and count > 0:
+                    a = np.memmap(
+                        filename, dtype=dtype, mode="r", offset=offset, shape=shape
+                    )
+                else:
+                    a = np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+                arrays.append(a)
+
+                end = offset + count * dtype.itemsize
+                f.seek(end + (-end % cls._ALIGNMENT))
+
+        meta = arrays[0]
+        version, backoff_id, num_states, label_stride = [int(i) for i in meta]
+        if version != cls.VERSION:
+            raise ValueError(
+                f"{filename} has version {version}, but we expect {cls.VERSION}. "
+                "Please re-compile it."
+            )
+
+        return cls(
+            backoff_id=backoff_id,
+            num_states=num_states,
+            label_stride=label_stride,
+            **dict(zip(cls._ARRAY_NAMES, arrays[1:])),
+        )
+
+    def _lookup(
+        self, states: np.ndarray, labels: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Look up the arc with the given label leaving each given state.
+
+        Returns:
+          Return a tuple with two arrays:
+            - A bool array, True if the arc exists.
+            - The indexes of the arcs. Valid only if the arc exists.
+        """
+        keys = states.astype(np.int64) * self.label_stride + labels
+        index = np.searchsorted(self.arc_keys, keys)
+        index = np.minimum(index, len(self.arc_keys) - 1)
+        # Labels not in the LM would otherwise alias arcs of other states
+        found = (self.arc_keys[index] == keys) & (labels < self.label_stride)
+        return found, index
+
+    def get_next_state_and_cost(
+        self,
+        state: int,
+        label: int,
+    ) -> Tuple[List[int], List[float]]:
+        """Same as :meth:`NgramLm.get_next_state_and_cost`."""
+        begin = self.closure_offsets[state]
+        end = self.closure_offsets[state + 1]
+        states = self.closure_states[begin:end]
+        costs = self.closure_costs[begin:end]
+
+        found, index = self._lookup(states, np.full(len(states), label))
+        index = index[found]
+        next_states = self.arc_next_states[index]
+        next_costs = costs[found] + self.arc_weights[index]
+
+        # NgramLm.get_next_state_and_cost() ignores arcs entering state 0
+        keep = next_states != 0
+        return next_states[keep].tolist(), next_costs[keep].tolist()
+
+    def forward_one_step(
+        self,
+        state_costs: List["CompiledNgramLmStateCost"],
+        labels: List[int],
+    ) -> List["CompiledNgramLmStateCost"]:
+        """Advance many hypotheses by one token at once.
+
+        It is equivalent to
+        `[sc.forward_one_step(label) for sc, label in zip(state_costs, labels)]`
+        but all the computation is done with vectorized NumPy operations.
+
+        Args:
+          state_costs:
+            The LM states of the hypotheses.
+          labels:
+            labels[i] is the token appended to the i-th hypothesis.
+        Returns:
+          Return the new LM states of the hypotheses.
+        """
+        assert len(state_costs) == len(labels), (len(state_costs), len(labels))
+        num_hyps = len(state_costs)
+        if num_hyps == 0:
+            return []
+
+        sizes = np.array([len(sc.states) for sc in state_costs], dtype=np.int64)
+        states = np.concatenate([sc.states for sc in state_costs])
+        costs = np.concatenate([sc.costs for sc in state_costs])
+        hyp_ids = np.repeat(np.arange(num_hyps), sizes)
+        labels = np.asarray(labels, dtype=np.int64)
+
+        # Expand each state with the states reachable via backoff arcs
+        begin = self.closure_offsets[states]
+        num_reachable = self.closure_offsets[states + 1] - begin
+        tot = int(num_reachable.sum())
+        start = np.cumsum(num_reachable) - num_reachable
+        index = np.arange(tot) + np.repeat(begin - start, num_reachable)
+
+        src_states = self.closure_states[index]
+        src_closure_costs = self.closure_costs[index]
+        src_costs = np.repeat(costs, num_reachable)
+        src_hyp_ids = np.repeat(hyp_ids, num_reachable)
+
+        found, index = self._lookup(src_states, labels[src_hyp_ids])
+        index = index[found]
+        next_states = self.arc_next_states[index]
+        # The same order of additions as in NgramLmStateCost.forward_one_step()
+        next_costs = src_costs[found] + (
+            src_closure_costs[found] + self.arc_weights[index]
+        )
+        next_hyp_ids = src_hyp_ids[found]
+
+        # NgramLm.get_next_state_and_cost() ignores arcs entering state 0
+        keep = next_states != 0
+        next_states = next_states[keep]
+        next_costs = next_costs[keep]
+        next_hyp_ids = next_hyp_ids[keep]
+
+        # Keep the minimum cost for each (hyp, state) pair
+        order = np.lexsort((next_states, next_hyp_ids))
+        next_states = next_states[order]
+        next_costs = next_costs[order]
+        next_hyp_ids = next_hyp_ids[order]
+
+        if len(order) > 0:
+            is_first = np.ones(len(order), dtype=bool)
+            is_first[1:] = (next_states[1:] != next_states[:-1]) | (
+                next_hyp_ids[1:] != next_hyp_ids[:-1]
+            )
+            first = np.flatnonzero(is_first)
+            next_costs = np.minimum.reduceat(next_costs, first)
+            next_states = next_states[first]
+            next_hyp_ids = next_hyp_ids[first]
+
+        splits = np.cumsum(np.bincount(next_hyp_ids, minlength=num_hyps))[:-1]
+        return [
+            CompiledNgramLmStateCost(self, states=s, costs=c)
+            for s, c in zip(np.split(next_states, splits), np.split(next_costs, splits))
+        ]
+
+
+class CompiledNgramLmStateCost:
+    """The counterpart of :class:`NgramLmStateCost` for
+    :class:`CompiledNgramLm`. The states and their costs are kept in
+    two arrays, sorted by state.
+    """
+
+    def __init__(
+        self,
+        ngram_lm: CompiledNgramLm,
+        states: Optional[np.ndarray] = None,
+        costs: Optional[np.ndarray] = None,
+    ):
+        self.ngram_lm = ngram_lm
+        if states is not None:
+            assert costs is not None
+            self.states = states
+            self.costs = costs
+        else:
+            # At the very beginning, we are at the start state with cost 0
+            self.states = np.zeros(1, dtype=np.int32)
+            self.costs = np.zeros(1, dtype=np.float64)
+
+    def forward_one_step(self, label: int) -> "CompiledNgramLmStateCost":
+        return self.ngram_lm.forward_one_step([self], [label])[0]
+
+    @property
+    def state_cost(self) -> Dict[int, float]:
+        return dict(zip(self.states.tolist(), self.costs.tolist()))
+
+    @property
+    def lm_score(self) -> float:
+        if len(self.costs) == 0:
+            return float("-inf")
+
+        return -1 * float(self.costs.min())
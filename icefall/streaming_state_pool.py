@@ -0,0 +1,168 @@
+# Copyright    2024  Xiaomi Corp.
+#
+# See ../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Callable, List, Union
+
+import torch
+
+
+class StreamingStatePool(object):
+    """Keep the streaming states of many streams in preallocated tensors.
+
+    A streaming model keeps its states in a list of tensors, each of which
+    has a batch dimension. Instead of keeping one list of tensors per stream
+    and stacking/unstacking them for every chunk, the pool allocates each
+    state tensor once for `max_streams` streams. Each stream owns a slot,
+    i.e., an index into the batch dimension.
+
+    Usage::
+
+        pool = StreamingStatePool.from_init_states_func(
+            lambda batch_size: get_init_states(model, batch_size, device),
+            max_streams=100,
+        )
+        slot = pool.allocate()  # when a stream arrives
+
+        # For each chunk
+        slots = torch.tensor(slots_of_active_streams, device=device)
+        states = pool.gather(slots)
+        ... = model.streaming_forward(..., states)
+        pool.scatter(slots, new_states)
+
+        pool.free(slot)  # when the stream is done
+    """
+
+    def __init__(
+        self,
+        init_states: List[torch.Tensor],
+        batch_dims: List[int],
+        max_streams: int,
+    ) -> None:
+        """
+        Args:
+          init_states:
+            The initial states of a single stream, i.e., the batch size of
+            each tensor is 1.
+          batch_dims:
+            batch_dims[i] is the batch dimension of init_states[i].
+          max_streams:
+            Maximum number of streams that can be kept in the pool.
+        """
+        assert len(init_states) == len(batch_dims), (
+            len(init_states),
+            len(batch_dims),
+        )
+        assert max_streams > 0, max_streams
+
+        for s, dim in zip(init_states, batch_dims):
+            assert s.size(dim) == 1, (s.shape, dim)
+
+        self.batch_dims = batch_dims
+        self.max_streams = max_streams
+        self.init_states = [s.detach().clone() for s in init_states]
+
+        self.states = []
+        for s, dim in zip(self.init_states, batch_dims):
+            sizes = [-1] * s.ndim
+            sizes[dim] = max_streams
+            self.states.append(s.expand(*sizes).contiguous())
+
+        # Allocate the slots with smaller indexes first
+        self._free_slots = list(range(max_streams - 1, -1, -1))
+
+    @classmethod
+    def from_init_states_func(
+        cls,
+        get_init_states: Callable[[int], List[torch.Tensor]],
+        max_streams: int,
+    ) -> "StreamingStatePool":
+        """Create a pool from a function returning the initial states
+        for a given batch size. The batch dimension of each state is found by
+        comparing the states of batch size 1 and 2.
+        """
+        states1 = get_init_states(1)
+        states2 = get_init_states(2)
+        assert len(states1) == len(states2), (len(states1), len(states2))
+
+        batch_dims = []
+        for s1, s2 in zip(states1, states2):
+            dims = [i for i, (a, b) in enumerate(zip(s1.shape, s2.shape)) if a != b]
+            assert len(dims) == 1, (s1.shape, s2.shape)
+            batch_dims.append(dims[0])
+
+        return cls(init_states=states1, batch_dims=batch_dims, max_streams=max_streams)
+
+    @property
+    def device(self) -> torch.device:
+        return self.states[0].device
+
+    @property
+    def num_free_slots(self) -> int:
+        return len(self._free_slots)
+
+    @property
+    def num_active_slots(self) -> int:
+        return self.max_streams - len(self._free_slots)
+
+    def allocate(self) -> int:
+        """Allocate a slot for a new stream and reset its states to the
+        initial states.
+
+        Returns:
+          Return the index of the allocated slot.
+        """
+        if not self._free_slots:
+            raise RuntimeError(f"All {self.max_streams} slots are in use")
+
+        slot = self._free_slots.pop()
+        for s, init, dim in zip(self.states, self.init_states, self.batch_dims):
+            s.narrow(dim, slot, 1).copy_(init)
+        return slot
+
+    def free(self, slot: int) -> None:
+        """Return the slot of a finished stream to the pool."""
+        assert 0 <= slot < self.max_streams, (slot, self.max_streams)
+        assert slot not in self._free_slots, slot
+        self._free_slots.append(slot)
+
+    def gather(self, slots: Union[List[int], torch.Tensor]) -> List[torch.Tensor]:
+        """Return the states of the given slots, stacked in the given order.
+
+        Args:
+          slots:
+            The slots of the streams in a batch.
+        Returns:
+          Return a list of tensors, which can be passed to the model as the
+          states of the batch.
+        """
+        slots = torch.as_tensor(slots, dtype=torch.int64, device=self.device)
+        return [
+            s.index_select(dim, slots) for s, dim in zip(self.states, self.batch_dims)
+        ]
+
+    def scatter(
+        self,
+        slots: Union[List[int], torch.Tensor],
+        states: List[torch.Tensor],
+    ) -> None:
+        """Write the states of a batch back to the given slots.
+
+        It is the inverse of :meth:`gather`.
+        """
+        assert len(states) == len(self.states), (len(states), len(self.states))
+        slots = torch.as_tensor(slots, dtype=torch.int64, device=self.device)
+        for s, new_s, dim in zip(self.states, states, self.batch_dims):
+            s.index_copy_(dim, slots, new_s.to(s.dtype))
@@ -30,6 +30,8 @@ from collections import defaultdict
 from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
+from functools import partial
+from multiprocessing.pool import Pool
 from pathlib import Path
 from shutil import copyfile
 from typing import Dict, Iterable, List, Optional, TextIO, Tuple, Union
@@ -584,6 +586,81 @@ def store_transcripts_and_timestamps(
                 print(f"{cut_id}:\ttimestamp_hyp={s}", file=f)
 
 
+def _align_for_error_stats(
+    ref_hyp: Tuple[Tuple[str, ...], Tuple[str, ...]],
+    sclite_mode: bool = False,
+) -> Tuple[List[Tuple[str, str]], str]:
+    """Align a reference and a hypothesis for :func:`write_error_stats`.
+
+    Returns:
+      Return a tuple containing the alignment used to count the errors and
+      the aligned text printed in PER-UTT DETAILS.
+    """
+    ERR = "*"
+    ref, hyp = ref_hyp
+    ali = kaldialign.align(ref, hyp, ERR, sclite_mode=sclite_mode)
+
+    # PER-UTT DETAILS uses the default mode
+    if sclite_mode:
+        details_ali = kaldialign.align(ref, hyp, ERR)
+    else:
+        details_ali = ali
+
+    # Combine successive errors, e.g., (A->*) (B->C) becomes (A B->C)
+    details = []
+    ref_words = []
+    hyp_words = []
+    for ref_word, hyp_word in details_ali + [(None, None)]:
+        if ref_word != hyp_word:
+            ref_words.append(ref_word)
+            hyp_words.append(hyp_word)
+            continue
+
+        if ref_words:
+            ref_words = [w for w in ref_words if w != ERR]
+            hyp_words = [w for w in hyp_words if w != ERR]
+            ref_words = " ".join(ref_words) if ref_words else ERR
+            hyp_words = " ".join(hyp_words) if hyp_words else ERR
+            if ref_words == hyp_words:
+                details.append(ref_words)
+            else:
+                details.append(f"({ref_words}->{hyp_words})")
+            ref_words = []
+            hyp_words = []
+
+        if ref_word is not None and ref_word != ERR:
+            details.append(ref_word)
+
+    details = " ".join(details)
+    return ali, details
+
+
+def _align_results(
+    results: List[Tuple[str, List[str], List[str]]],
+    sclite_mode: bool,
+    num_jobs: int,
+) -> List[Tuple[List[Tuple[str, str]], str]]:
+    """Return the output of :func:`_align_for_error_stats` for each result.
+
+    Each distinct (ref, hyp) pair is aligned only once. The alignments are
+    computed with `num_jobs` processes if `num_jobs` is larger than 1.
+    """
+    keys = [(tuple(ref), tuple(hyp)) for _, ref, hyp, *_ in results]
+
+    # dict.fromkeys() removes duplicates and keeps the order
+    unique = list(dict.fromkeys(keys))
+    align = partial(_align_for_error_stats, sclite_mode=sclite_mode)
+    if num_jobs > 1 and len(unique) > 1:
+        chunksize = max(1, len(unique) // (num_jobs * 4))
+        with Pool(num_jobs) as pool:
+            outputs = pool.map(align, unique, chunksize=chunksize)
+    else:
+        outputs = list(map(align, unique))
+
+    computed = dict(zip(unique, outputs))
+    return [computed[k] for k in keys]
+
+
 def write_error_stats(
     f: TextIO,
     test_set_name: str,
@@ -591,6 +668,7 @@ def write_error_stats(
     enable_log: bool = True,
     compute_CER: bool = False,
     sclite_mode: bool = False,
+    num_jobs: int = 1,
 ) -> float:
     """Write statistics based on predicted results and reference transcripts.
 
@@ -623,6 +701,8 @@ def write_error_stats(
       enable_log:
         If True, also print detailed WER to the console.
         Otherwise, it is written only to the given file.
+      num_jobs:
+        Number of processes to align the references and predicted results.
     Returns:
       Return None.
     """
@@ -643,8 +723,9 @@ def write_error_stats(
             hyp = list("".join(hyp))
             results[i] = (cut_id, ref, hyp)
 
-    for cut_id, ref, hyp in results:
-        ali = kaldialign.align(ref, hyp, ERR, sclite_mode=sclite_mode)
+    alignments = _align_results(results, sclite_mode=sclite_mode, num_jobs=num_jobs)
+
+    for ali, _ in alignments:
         for ref_word, hyp_word in ali:
             if ref_word == ERR:
                 ins[hyp_word] += 1
@@ -688,42 +769,8 @@ def write_error_stats(
 
     print("", file=f)
     print("PER-UTT DETAILS: corr or (ref->hyp)  ", file=f)
-    for cut_id, ref, hyp in results:
-        ali = kaldialign.align(ref, hyp, ERR)
-        combine_successive_errors = True
-        if combine_successive_errors:
-            ali = [[[x], [y]] for x, y in ali]
-            for i in range(len(ali) - 1):
-                if ali[i][0] != ali[i][1] and ali[i + 1][0] != ali[i + 1][1]:
-                    ali[i + 1][0] = ali[i][0] + ali[i + 1][0]
-                    ali[i + 1][1] = ali[i][1] + ali[i + 1][1]
-                    ali[i] = [[], []]
-            ali = [
-                [
-                    list(filter(lambda a: a != ERR, x)),
-                    list(filter(lambda a: a != ERR, y)),
-                ]
-                for x, y in ali
-            ]
-            ali = list(filter(lambda x: x != [[], []], ali))
-            ali = [
-                [
-                    ERR if x == [] else " ".join(x),
-                    ERR if y == [] else " ".join(y),
-                ]
-                for x, y in ali
-            ]
-
-        print(
-            f"{cut_id}:\t"
-            + " ".join(
-                (
-                    ref_word if ref_word == hyp_word else f"({ref_word}->{hyp_word})"
-                    for ref_word, hyp_word in ali
-                )
-            ),
-            file=f,
-        )
+    for (cut_id, *_), (_, details) in zip(results, alignments):
+        print(f"{cut_id}:\t{details}", file=f)
 
     print("", file=f)
     print("SUBSTITUTIONS: count ref -> hyp", file=f)
@@ -1160,6 +1207,12 @@ def write_surt_error_stats(
 
 
 class MetricsTracker(collections.defaultdict):
+    """Values can be Python numbers or 0-D tensors. Tensors, e.g., losses
+    on the GPU, are accumulated on their device and are copied to CPU only
+    when the values are used, e.g., in :meth:`__str__` or :meth:`reduce`,
+    so that recording metrics does not synchronize with the GPU.
+    """
+
     def __init__(self):
         # Passing the type 'int' to the base-class constructor
         # makes undefined items default to int() which is zero.
@@ -1172,7 +1225,10 @@ class MetricsTracker(collections.defaultdict):
         for k, v in self.items():
             ans[k] = v
         for k, v in other.items():
-            if v - v == 0:
+            if isinstance(v, torch.Tensor):
+                # Skip inf and nan without copying v to CPU
+                ans[k] = ans[k] + torch.where(torch.isfinite(v), v, v.new_zeros(()))
+            elif v - v == 0:
                 ans[k] = ans[k] + v
         return ans
 
@@ -1197,10 +1253,10 @@ class MetricsTracker(collections.defaultdict):
                     ans_utterances += ", "
                 else:
                     raise ValueError(f"Unexpected key: {k}")
-        frames = "%.2f" % self["frames"]
+        frames = "%.2f" % float(self["frames"])
         ans_frames += "over " + str(frames) + " frames. "
         if ans_utterances != "":
-            utterances = "%.2f" % self["utterances"]
+            utterances = "%.2f" % float(self["utterances"])
             ans_utterances += "over " + str(utterances) + " utterances."
 
         return ans_frames + ans_utterances
@@ -1210,10 +1266,11 @@ class MetricsTracker(collections.defaultdict):
         Returns a list of pairs, like:
           [('ctc_loss', 0.1), ('att_loss', 0.07)]
         """
-        num_frames = self["frames"] if "frames" in self else 1
-        num_utterances = self["utterances"] if "utterances" in self else 1
+        values = self.to_float()
+        num_frames = values["frames"] if "frames" in values else 1
+        num_utterances = values["utterances"] if "utterances" in values else 1
         ans = []
-        for k, v in self.items():
+        for k, v in values.items():
             if k == "frames" or k == "utterances":
                 continue
             norm_value = (
@@ -1222,13 +1279,29 @@ class MetricsTracker(collections.defaultdict):
             ans.append((k, norm_value))
         return ans
 
+    def to_float(self) -> Dict[str, float]:
+        """Return the values as Python floats. All tensor values are copied
+        to CPU at once."""
+        ans = {k: v for k, v in self.items() if not isinstance(v, torch.Tensor)}
+        tensor_keys = [k for k, v in self.items() if isinstance(v, torch.Tensor)]
+        if tensor_keys:
+            device = self[tensor_keys[0]].device
+            values = torch.stack(
+                [self[k].to(device=device, dtype=torch.float64) for k in tensor_keys]
+            )
+            ans.update(zip(tensor_keys, values.tolist()))
+        # Keep the order of the keys
+        return {k: float(ans[k]) for k in self.keys()}
+
     def reduce(self, device):
         """
         Reduce using torch.distributed, which I believe ensures that
         all processes get the total.
         """
         keys = sorted(self.keys())
-        s = torch.tensor([float(self[k]) for k in keys], device=device)
+        s = torch.stack(
+            [torch.as_tensor(self[k], dtype=torch.float32, device=device) for k in keys]
+        )
         dist.all_reduce(s, op=dist.ReduceOp.SUM)
         for k, v in zip(keys, s.cpu().tolist()):
             self[k] = v
@@ -16,11 +16,28 @@
 # limitations under the License.
 
 
+import copy
+
 import pytest
 import torch
 import torch.nn as nn
 
-from icefall.checkpoint import average_checkpoints, load_checkpoint, save_checkpoint
+from icefall.checkpoint import (
+    AsyncCheckpointWriter,
+    ModelAverager,
+    _average_tensors,
+    _split_by_bytes,
+    average_checkpoints,
+    average_checkpoints_with_averaged_model,
+    load_checkpoint,
+    load_safetensors,
+    remove_checkpoints,
+    save_checkpoint,
+    save_checkpoint_with_global_batch_idx,
+    save_safetensors,
+    update_averaged_model,
+)
+from icefall.utils import AttributeDict
 
 
 @pytest.fixture
@@ -61,3 +78,154 @@ def test_average_checkpoints(checkpoints1, checkpoints2):
     state_dict = average_checkpoints([checkpoints1, checkpoints2])
     assert torch.allclose(state_dict["p1"], torch.Tensor([30, 25.0]))
     assert torch.allclose(state_dict["p2"], torch.tensor([5, 51]))
+
+
+def test_save_load_safetensors(tmp_path):
+    f = tmp_path / "f.safetensors"
+    w = torch.rand(3, 4)
+    tensors = {
+        "w": w,
+        "tied_w": w,
+        "b": torch.rand(4, dtype=torch.float64),
+        "h": torch.rand(5).to(torch.bfloat16),
+        "i": torch.tensor([1, 2, 3], dtype=torch.int32),
+        "m": torch.tensor([True, False]),
+        "e": torch.empty(0, 2),
+    }
+    save_safetensors(f, tensors, metadata={"batch_idx_train": "10"})
+    loaded, metadata = load_safetensors(f)
+
+    assert metadata == {"batch_idx_train": "10"}
+    assert loaded.keys() == tensors.keys()
+    for k, v in tensors.items():
+        assert loaded[k].dtype == v.dtype, k
+        assert torch.equal(loaded[k], v), k
+    assert loaded["tied_w"] is loaded["w"]
+
+
+def _save_checkpoints(tmp_path):
+    filenames = []
+    for i in range(3):
+        f = tmp_path / f"epoch-{i}.pt"
+        m = nn.Module()
+        m.p1 = nn.Parameter(torch.rand(2, 3))
+        m.register_buffer("p2", torch.randint(0, 100, (4,)))
+        m_avg = nn.Module()
+        m_avg.p1 = nn.Parameter(torch.rand(2, 3))
+        m_avg.register_buffer("p2", torch.randint(0, 100, (4,)))
+        params = {"batch_idx_train": 100 * (i + 1), "average_period": 10}
+        save_checkpoint(
+            f,
+            m,
+            model_avg=m_avg,
+            params=params,
+            with_safetensors=True,
+        )
+        filenames.append(f)
+    return filenames
+
+
+def test_average_checkpoints_with_safetensors(tmp_path):
+    torch.manual_seed(20240101)
+    filenames = _save_checkpoints(tmp_path)
+    for f in filenames:
+        assert f.with_suffix(".safetensors").is_file()
+
+    avg = average_checkpoints(filenames)
+    avg_model = average_checkpoints_with_averaged_model(filenames[0], filenames[-1])
+
+    # Remove the safetensors files so that the checkpoints are used
+    for f in filenames:
+        f.with_suffix(".safetensors").unlink()
+
+    expected = average_checkpoints(filenames)
+    expected_model = average_checkpoints_with_averaged_model(
+        filenames[0], filenames[-1]
+    )
+
+    for k in expected:
+        assert torch.equal(avg[k], expected[k]), k
+        assert torch.equal(avg_model[k], expected_model[k]), k
+
+
+def test_async_checkpoint_writer(tmp_path):
+    m = nn.Module()
+    m.p1 = nn.Parameter(torch.rand(3))
+    m.p2 = m.p1
+    optimizer = torch.optim.Adam(m.parameters())
+    m.p1.sum().backward()
+    optimizer.step()
+
+    writer = AsyncCheckpointWriter()
+    expected = []
+    for i in range(1, 5):
+        with torch.no_grad():
+            m.p1.fill_(i)
+        expected.append(m.p1.clone())
+        save_checkpoint_with_global_batch_idx(
+            tmp_path,
+            global_batch_idx=i,
+            model=m,
+            params={"batch_idx_train": i},
+            optimizer=optimizer,
+            writer=writer,
+        )
+        remove_checkpoints(tmp_path, topk=2, writer=writer)
+    writer.close()
+
+    assert sorted(f.name for f in tmp_path.iterdir()) == [
+        "checkpoint-3.pt",
+        "checkpoint-4.pt",
+    ]
+    for i in (3, 4):
+        checkpoint = torch.load(tmp_path / f"checkpoint-{i}.pt")
+        assert checkpoint["batch_idx_train"] == i
+        assert torch.equal(checkpoint["model"]["p1"], expected[i - 1])
+        assert checkpoint["model"]["p1"] is checkpoint["model"]["p2"]
+        assert checkpoint["optimizer"]["state"].keys() == {0}
+
+
+def test_model_averager():
+    torch.manual_seed(20240101)
+    model = nn.Sequential(nn.Linear(3, 4), nn.BatchNorm1d(4), nn.Linear(4, 3))
+    model.tied = model[0]
+    model_avg = copy.deepcopy(model).to(torch.float64)
+    expected = copy.deepcopy(model_avg)
+
+    model_averager = ModelAverager(model_cur=model, model_avg=model_avg)
+    params = AttributeDict({"average_period": 2, "batch_idx_train": 0})
+    for i in range(5):
+        if i == 3:
+            # It should still update model_avg after its tensors are replaced
+            model_avg.to(torch.float32)
+            expected.to(torch.float32)
+
+        with torch.no_grad():
+            for p in model.parameters():
+                p.add_(torch.rand_like(p))
+        params.batch_idx_train += params.average_period
+
+        model_averager.update(params)
+        update_averaged_model(params, model_cur=model, model_avg=expected)
+
+    for k, v in expected.state_dict().items():
+        assert torch.allclose(model_avg.state_dict()[k], v), k
+
+
+def test_average_tensors_in_chunks():
+    torch.manual_seed(20240101)
+    tensors_1 = [torch.rand(n, dtype=torch.float64) for n in (3, 10, 1, 7, 20)]
+    tensors_2 = [t.float() + 1 for t in tensors_1]
+    expected = [(t1 * 0.9 + t2 * 0.1) * 2 for t1, t2 in zip(tensors_1, tensors_2)]
+
+    # 40 bytes of float32 tensors per chunk
+    assert _split_by_bytes(tensors_2, max_bytes=40) == [
+        slice(0, 1),
+        slice(1, 2),
+        slice(2, 4),
+        slice(4, 5),
+    ]
+
+    _average_tensors(tensors_1, tensors_2, 0.9, 0.1, 2, max_bytes=40)
+    for t, e in zip(tensors_1, expected):
+        assert torch.equal(t, e)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Copyright    2024  Xiaomi Corp.
+#
+# See ../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from multiprocessing.pool import Pool
+
+import torch
+
+from icefall.decode import ctc_prefix_beam_search, ctc_prefix_beam_search_batched
+
+
+def get_ctc_output(N: int = 5, T: int = 50, V: int = 10) -> torch.Tensor:
+    torch.manual_seed(20240101)
+    logits = torch.randn(N, T, V) * 3
+    # Make about half of the frames blank-dominant
+    logits[:, ::2, 0] += 10
+    return logits.log_softmax(dim=-1)
+
+
+def test_ctc_prefix_beam_search_batched():
+    ctc_output = get_ctc_output()
+    encoder_out_lens = torch.tensor([50, 30, 1, 45, 0])
+
+    with Pool(2) as pool:
+        expected = ctc_prefix_beam_search(
+            ctc_output=ctc_output,
+            encoder_out_lens=encoder_out_lens,
+            beam=4,
+            process_pool=pool,
+            return_nbest=True,
+        )
+    hyps = ctc_prefix_beam_search_batched(
+        ctc_output=ctc_output,
+        encoder_out_lens=encoder_out_lens,
+        beam=4,
+        return_nbest=True,
+    )
+
+    assert len(hyps) == len(expected)
+    for h, e in zip(hyps, expected):
+        assert len(h) == len(e), (len(h), len(e))
+        for a, b in zip(h, e):
+            assert a.ys == b.ys, (a.ys, b.ys)
+            assert torch.allclose(a.log_prob, b.log_prob, atol=1e-4)
+
+    best = ctc_prefix_beam_search_batched(
+        ctc_output=ctc_output, encoder_out_lens=encoder_out_lens, beam=4
+    )
+    assert best == [list(h)[0].ys for h in expected]
+
+
+def test_ctc_prefix_beam_search_batched_blank_threshold():
+    ctc_output = get_ctc_output()
+    encoder_out_lens = torch.tensor([50, 30, 1, 45, 0])
+
+    expected = ctc_prefix_beam_search_batched(
+        ctc_output=ctc_output, encoder_out_lens=encoder_out_lens, beam=4
+    )
+
+    # A threshold of 1 never skips a frame
+    hyps = ctc_prefix_beam_search_batched(
+        ctc_output=ctc_output,
+        encoder_out_lens=encoder_out_lens,
+        beam=4,
+        blank_threshold=1.0,
+    )
+    assert hyps == expected
+
+    # Only the blank-dominant frames are skipped, whose other tokens have
+    # negligible probabilities
+    hyps = ctc_prefix_beam_search_batched(
+        ctc_output=ctc_output,
+        encoder_out_lens=encoder_out_lens,
+        beam=4,
+        blank_threshold=0.99,
+    )
+    assert hyps == expected
+
+
+def main():
+    test_ctc_prefix_beam_search_batched()
+    test_ctc_prefix_beam_search_batched_blank_threshold()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Copyright    2024  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import k2
+import torch
+
+from icefall.graph_cache import load_fsa, load_or_build_fsa, save_fsa
+
+
+def _get_fsa() -> k2.Fsa:
+    s = """
+        0 1 1 0.1
+        0 2 2 0.2
+        1 3 -1 0.3
+        2 3 -1 0.4
+        3
+    """
+    fsa = k2.arc_sort(k2.Fsa.from_str(s))
+    fsa.aux_labels = k2.RaggedTensor([[1, 2], [], [0], [0]])
+    fsa.lm_scores = fsa.scores.clone()
+    fsa.dummy = 1
+    return fsa
+
+
+def test_save_load_fsa(tmp_path):
+    fsa = _get_fsa()
+    filename = tmp_path / "fsa.safetensors"
+    save_fsa(filename, fsa)
+    loaded = load_fsa(filename)
+
+    assert str(loaded) == str(fsa)
+    assert loaded.properties == fsa.properties
+    assert torch.equal(loaded.scores, fsa.scores)
+    assert torch.equal(loaded.lm_scores, fsa.lm_scores)
+    assert loaded.aux_labels == fsa.aux_labels
+    assert loaded.dummy == 1
+
+
+def test_load_or_build_fsa(tmp_path):
+    graph = tmp_path / "graph.txt"
+    graph.write_text("graph")
+    cache_dir = tmp_path / "cache"
+
+    num_builds = 0
+
+    def build():
+        nonlocal num_builds
+        num_builds += 1
+        return _get_fsa()
+
+    kwargs = dict(name="G", inputs=[graph], cache_dir=cache_dir)
+    fsa = load_or_build_fsa(build, options={"scale": 1.0}, **kwargs)
+    assert num_builds == 1
+
+    cached = load_or_build_fsa(build, options={"scale": 1.0}, **kwargs)
+    assert num_builds == 1
+    assert str(cached) == str(fsa)
+
+    # Different options use a different entry in the cache
+    load_or_build_fsa(build, options={"scale": 0.5}, **kwargs)
+    assert num_builds == 2
+    assert len(list(cache_dir.glob("G-*.safetensors"))) == 2
+
+    # The cache is disabled
+    load_or_build_fsa(build, name="G", inputs=[graph], cache_dir="")
+    assert num_builds == 3
+
+
+def test_load_or_build_fsa_with_generated_input(tmp_path):
+    # Like G_4_gram.pt, which is saved when G is built from G_4_gram.fst.txt
+    fst_txt = tmp_path / "G.fst.txt"
+    fst_txt.write_text("G")
+    fst_pt = tmp_path / "G.pt"
+    cache_dir = tmp_path / "cache"
+
+    num_builds = 0
+
+    def build():
+        nonlocal num_builds
+        num_builds += 1
+        fst_pt.write_text("G")
+        return _get_fsa()
+
+    def get_inputs():
+        return [fst_pt] if fst_pt.is_file() else [fst_txt]
+
+    kwargs = dict(name="G", inputs=get_inputs, cache_dir=cache_dir)
+    load_or_build_fsa(build, **kwargs)
+    assert num_builds == 1
+
+    # It is cached under the key of G.pt, so it is not built again
+    load_or_build_fsa(build, **kwargs)
+    assert num_builds == 1
+    assert len(list(cache_dir.glob("G-*.safetensors"))) == 1
@@ -24,10 +24,10 @@ if not is_module_available("kaldifst"):
 
 import kaldifst
 
-from icefall import NgramLm, NgramLmStateCost
+from icefall import CompiledNgramLm, CompiledNgramLmStateCost, NgramLm, NgramLmStateCost
 
 
-def generate_fst(filename: str):
+def generate_fst(filename: str, draw: bool = True):
     s = """
 3	5	1	1	3.00464
 3	0	3	0	5.75646
@@ -44,6 +44,8 @@ def generate_fst(filename: str):
 """
     fst = kaldifst.compile(s=s, acceptor=False)
     fst.write(filename)
+    if not draw:
+        return
     fst_dot = kaldifst.draw(fst, acceptor=False, portrait=True)
     source = graphviz.Source(fst_dot)
     source.render(outfile=f"{filename}.svg")
@@ -69,6 +71,46 @@ def main():
     s2 = s1.forward_one_step(2)
     print(s2.state_cost)
 
+    check_compiled_ngram_lm(ngram_lm, "test.compiled.bin")
+
+
+def check_compiled_ngram_lm(ngram_lm: NgramLm, filename: str):
+    compiled = CompiledNgramLm.from_ngram_lm(ngram_lm)
+    compiled.save(filename)
+
+    for lm in [compiled, CompiledNgramLm.load(filename)]:
+        for state in range(ngram_lm.lm.num_states):
+            for label in [1, 2, 3, 4, 5]:
+                assert ngram_lm.get_next_state_and_cost(
+                    state=state, label=label
+                ) == lm.get_next_state_and_cost(state=state, label=label)
+
+        labels = [1, 2, 2, 1, 5]
+        state_cost = NgramLmStateCost(ngram_lm)
+        compiled_state_cost = CompiledNgramLmStateCost(lm)
+        for label in labels:
+            state_cost = state_cost.forward_one_step(label)
+            compiled_state_cost = compiled_state_cost.forward_one_step(label)
+            assert state_cost.state_cost == compiled_state_cost.state_cost
+            assert state_cost.lm_score == compiled_state_cost.lm_score
+
+        # Advance several hypotheses at once
+        state_costs = [CompiledNgramLmStateCost(lm)]
+        for label in labels:
+            state_costs = state_costs + state_costs
+            next_labels = [label, label % 5 + 1] * (len(state_costs) // 2)
+            batched = lm.forward_one_step(state_costs, next_labels)
+            for sc, label, b in zip(state_costs, next_labels, batched):
+                assert sc.forward_one_step(label).state_cost == b.state_cost
+            state_costs = batched[:4]
+
+
+def test_compiled_ngram_lm(tmp_path):
+    filename = str(tmp_path / "test.fst")
+    generate_fst(filename, draw=False)
+    ngram_lm = NgramLm(filename, backoff_id=3, is_binary=True)
+    check_compiled_ngram_lm(ngram_lm, str(tmp_path / "test.compiled.bin"))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Copyright      2024  Xiaomi Corp.
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+import torch
+
+from icefall.streaming_state_pool import StreamingStatePool
+
+
+def get_init_states(batch_size: int):
+    return [
+        torch.zeros(3, batch_size, 4),
+        torch.ones(batch_size, 2),
+        torch.zeros(batch_size, dtype=torch.int32),
+    ]
+
+
+def test_streaming_state_pool():
+    pool = StreamingStatePool.from_init_states_func(get_init_states, max_streams=4)
+    assert pool.batch_dims == [1, 0, 0]
+    assert pool.num_free_slots == 4
+
+    a = pool.allocate()
+    b = pool.allocate()
+    assert (a, b) == (0, 1)
+
+    states = pool.gather([b, a])
+    assert states[0].shape == (3, 2, 4)
+    assert states[1].shape == (2, 2)
+    new_states = [states[0] + 1, states[1] * 2, states[2] + 3]
+    pool.scatter([b, a], new_states)
+
+    for dst, src in zip(pool.gather([a, b]), new_states):
+        assert torch.equal(dst, src.flip(dims=[0 if src.ndim < 3 else 1]))
+
+    # A freed slot is reset when it is allocated again
+    pool.free(a)
+    assert pool.num_active_slots == 1
+    c = pool.allocate()
+    assert c == a
+    for dst, src in zip(pool.gather([c]), get_init_states(1)):
+        assert torch.equal(dst, src)
+
+    # The states of other slots are untouched
+    assert torch.equal(pool.gather([b])[2], torch.tensor([3], dtype=torch.int32))
+
+    pool.allocate()
+    pool.allocate()
+    with pytest.raises(RuntimeError):
+        pool.allocate()
@@ -16,18 +16,23 @@
 # limitations under the License.
 
 
+import io
+
 import k2
 import pytest
 import torch
+import torch.distributed as dist
 
 from icefall.env import get_env_info
 from icefall.utils import (
     AttributeDict,
+    MetricsTracker,
     add_eos,
     add_sos,
     encode_supervisions,
     get_texts,
     make_pad_mask,
+    write_error_stats,
 )
 
 
@@ -163,3 +168,68 @@ def test_add_eos():
         [[1, 2, eos_id], [3, eos_id], [eos_id], [5, 8, 9, eos_id]]
     )
     assert str(ragged_eos) == str(expected)
+
+
+def test_write_error_stats():
+    results = [
+        ("a", "THE CAT SAT ON THE MAT".split(), "THE CAT SAT THE HAT".split()),
+        ("b", "HELLO WORLD".split(), "HELLO BIG WORLD".split()),
+        ("c", "GOOD".split(), "GOOD".split()),
+        ("d", "A B C".split(), "X C".split()),
+    ]
+
+    outputs = []
+    for num_jobs in (1, 2, 2):
+        f = io.StringIO()
+        wer = write_error_stats(
+            f, "test", list(results), enable_log=False, num_jobs=num_jobs
+        )
+        assert wer == 41.67
+        outputs.append(f.getvalue())
+
+    assert outputs[0] == outputs[1] == outputs[2]
+    assert "Errors: 1 insertions, 2 deletions, 2 substitutions" in outputs[0]
+    assert "a:\tTHE CAT SAT (ON->*) THE (MAT->HAT)" in outputs[0]
+    assert "b:\tHELLO (*->BIG) WORLD" in outputs[0]
+    # Successive errors are combined
+    assert "d:\t(A B->X) C" in outputs[0]
+
+
+def test_metrics_tracker_with_tensors():
+    expected = MetricsTracker()
+    tot = MetricsTracker()
+    for loss, frames in [(2.0, 10), (float("inf"), 20), (4.0, 30)]:
+        info = MetricsTracker()
+        info["frames"] = frames
+        info["loss"] = loss
+        expected = expected * 0.5 + info
+
+        info = MetricsTracker()
+        info["frames"] = torch.tensor(frames)
+        info["loss"] = torch.tensor(loss)
+        tot = tot * 0.5 + info
+
+    assert isinstance(tot["loss"], torch.Tensor)
+    assert tot.to_float() == pytest.approx(dict(expected))
+    assert tot.norm_items() == pytest.approx(expected.norm_items())
+    assert str(tot) == str(expected)
+
+
+def test_metrics_tracker_reduce(tmp_path):
+    dist.init_process_group(
+        "gloo",
+        init_method=f"file://{tmp_path}/shared_file",
+        world_size=1,
+        rank=0,
+    )
+    try:
+        tracker = MetricsTracker()
+        tracker["frames"] = torch.tensor(30)
+        tracker["loss"] = torch.tensor(6.5)
+        tracker["utterances"] = 3
+        tracker.reduce(torch.device("cpu"))
+    finally:
+        dist.destroy_process_group()
+
+    assert tracker == {"frames": 30.0, "loss": 6.5, "utterances": 3.0}
+    assert all(isinstance(v, float) for v in tracker.values())